@@ -4,7 +4,6 @@ Main application file
 """
 
 from flask import Flask, render_template, request, jsonify, redirect, url_for, session, g
-from git import Repo
 import datetime
 import logging
 import json
@@ -13,13 +12,15 @@ import sys
 import sqlite3
 from werkzeug.utils import secure_filename
 
-from utils import auth, notifications, mikrotik_utils, ip_monitoring
+import config
+from utils import auth, notifications, mikrotik_utils, ip_monitoring, http_cache, metrics, profiling, json_provider
 
 # Khởi tạo Flask app
 app = Flask(__name__)
 app.config.from_object('config')
 
-# Thiết lập logging
+# Thiết lập logging (thư mục log cần có trước khi mở file handler)
+os.makedirs(os.path.dirname(app.config['LOG_FILE']), exist_ok=True)
 logging.basicConfig(
     level=getattr(logging, app.config['LOG_LEVEL']),
     format=app.config['LOG_FORMAT'],
@@ -39,8 +40,43 @@ app.config['UPLOAD_FOLDER'] = os.path.join(app.config['BASE_DIR'], 'uploads')
 # Khởi tạo secret key
 app.secret_key = app.config['SECRET_KEY']
 
-# Tạo thư mục uploads nếu chưa tồn tại
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+# Bộ mã hóa JSON nhanh cho jsonify (orjson nếu có)
+json_provider.init_app(app)
+
+# Nén response JSON và hỗ trợ ETag / 304 Not Modified
+http_cache.init_app(app)
+
+# Đo độ trễ request cho endpoint metrics
+metrics.init_app(app)
+
+# Profiling theo yêu cầu cho N request kế tiếp
+profiling.init_app(app, config.PROFILE_DIR)
+
+# Trạng thái khởi tạo một lần (thư mục, cơ sở dữ liệu)
+_initialized = False
+
+def init_app():
+    """Khởi tạo thư mục và cơ sở dữ liệu, chỉ chạy một lần"""
+    global _initialized
+    if _initialized:
+        return
+    
+    config.ensure_directories()
+    ip_monitoring.init_database()
+    _initialized = True
+    logger.info("Đã khởi tạo ứng dụng")
+
+@app.before_request
+def ensure_initialized():
+    """Khởi tạo trễ ở request đầu tiên nếu chưa chạy bước init"""
+    if not _initialized:
+        init_app()
+
+@app.cli.command('init')
+def init_command():
+    """Khởi tạo thư mục và cơ sở dữ liệu"""
+    init_app()
+    print('Đã khởi tạo thư mục và cơ sở dữ liệu')
 
 @app.route('/')
 @auth.login_required
@@ -301,6 +337,29 @@ def api_search_ip():
         logger.error(f"Lỗi khi tìm kiếm IP: {str(e)}")
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Endpoint metrics cho Prometheus"""
+    # Cho phép bảo vệ endpoint bằng bearer token riêng cho Prometheus
+    token = app.config.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    return app.response_class(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/api/admin/profile', methods=['GET', 'POST'])
+@auth.admin_required
+def api_admin_profile():
+    """API bật cProfile cho N request kế tiếp và xem danh sách profile"""
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or request.form
+        try:
+            profiling.profiler.arm(int(data.get('requests', 10)))
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': 'Số request không hợp lệ'}), 400
+    
+    return jsonify({'success': True, 'data': profiling.profiler.status()})
+
 # Route cho xác thực
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -376,7 +435,7 @@ def reset_password(token):
 def check_authentication():
     """Kiểm tra xác thực cho mọi request"""
     # Danh sách các routes không yêu cầu xác thực
-    public_routes = ['/login', '/logout', '/forgot-password', '/static', '/favicon.ico']
+    public_routes = ['/login', '/logout', '/forgot-password', '/static', '/favicon.ico', '/metrics']
     
     # Cho phép truy cập các routes công khai
     for route in public_routes:
@@ -413,4 +472,5 @@ def internal_server_error(e):
     return render_template('errors/500.html', error_info=error_info, debug=app.debug), 500
 
 if __name__ == '__main__':
+    init_app()
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
@@ -34,6 +34,12 @@ SMTP_USERNAME = os.getenv('SMTP_USERNAME')
 SMTP_PASSWORD = os.getenv('SMTP_PASSWORD')
 DEFAULT_ADMIN_EMAIL = os.getenv('DEFAULT_ADMIN_EMAIL', 'admin@example.com')
 
+# Cấu hình metrics Prometheus (để trống để không yêu cầu token)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+# Thư mục lưu file cProfile khi bật profiling theo request
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles'))
+
 # Cấu hình cơ sở dữ liệu
 DB_PATH = os.path.join(os.path.dirname(__file__), 'data', 'ip_monitoring.db')
 
@@ -61,6 +67,8 @@ CACHE_TYPE = 'filesystem'
 CACHE_DIR = os.path.join(BASE_DIR, 'cache')
 CACHE_DEFAULT_TIMEOUT = 300  # 5 minutes
 
-# Tạo các thư mục cần thiết
-for directory in [os.path.dirname(LOG_FILE), UPLOAD_FOLDER, CACHE_DIR]:
-    os.makedirs(directory, exist_ok=True)
\ No newline at end of file
+
+def ensure_directories():
+    """Tạo các thư mục cần thiết (gọi một lần ở bước khởi tạo ứng dụng)"""
+    for directory in [os.path.dirname(LOG_FILE), os.path.dirname(DB_PATH), UPLOAD_FOLDER, CACHE_DIR]:
+        os.makedirs(directory, exist_ok=True)
@@ -1,14 +1,45 @@
 # File: app/ml/anomaly_detector.py
+import numpy as np
 from sklearn.ensemble import IsolationForest
 import joblib
 
+MODEL_PATH = 'anomaly_model.pkl'
+
 class AnomalyDetector:
-    def __init__(self):
-        self.model = IsolationForest(contamination=0.01)
+    def __init__(self, model=None):
+        self.model = model or IsolationForest(contamination=0.01)
+
+    def train(self, data, path=MODEL_PATH):
+        self.model.fit(np.asarray(data, dtype=np.float64))
+        # Saved uncompressed: compressed pickles cannot be memory-mapped on load
+        joblib.dump(self.model, path)
 
-    def train(self, data):
-        self.model.fit(data)
-        joblib.dump(self.model, 'anomaly_model.pkl')
+    @classmethod
+    def load(cls, path=MODEL_PATH, mmap_mode='r'):
+        # NumPy arrays of the model are mapped read-only from the file instead of being
+        # read into memory, so processes loading the same model share the page cache
+        return cls(joblib.load(path, mmap_mode=mmap_mode))
 
     def predict(self, sample):
-        return self.model.predict([sample])
+        return self.model.predict(np.asarray([sample], dtype=np.float64))
+
+    def predict_many(self, samples):
+        # One call for the whole matrix: 1 = normal, -1 = anomaly
+        return self.model.predict(np.asarray(samples, dtype=np.float64))
+
+    def score_samples(self, samples):
+        # Lower is more abnormal (IsolationForest.score_samples)
+        return self.model.score_samples(np.asarray(samples, dtype=np.float64))
+
+    def detect(self, keys, samples):
+        # Score a whole tick (one row per key) and return [(key, score)] of the anomalous rows.
+        # Rows with missing values are skipped; decision_function < 0 is the same rule as predict() == -1
+        samples = np.asarray(samples, dtype=np.float64)
+        if len(samples) == 0:
+            return []
+        finite = np.flatnonzero(np.isfinite(samples).all(axis=1))
+        if len(finite) == 0:
+            return []
+        scores = self.model.decision_function(samples[finite])
+        flagged = np.flatnonzero(scores < 0)
+        return [(keys[finite[i]], float(scores[i])) for i in flagged]
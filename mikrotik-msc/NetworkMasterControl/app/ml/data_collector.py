@@ -1,12 +1,75 @@
 # File: app/ml/data_collector.py
-from app.snmp.snmp_collector import SNMPMonitor
-
-def collect_training_data():
-    snmp = SNMPMonitor()
-    data = []
-    for device in config['devices']:
-        data.append({
-            'cpu': snmp.get_cpu(device['ip']),
-            'memory': snmp.get_memory(device['ip'])
-        })
-    return data
+import numpy as np
+from app.smnp.snmp_collector import SNMPMonitor
+from app.utils.config_loader import load_config
+
+DEVICE_FEATURES = ('cpu', 'memory')
+INTERFACE_FEATURES = ('rx_bps', 'tx_bps', 'rx_pps', 'tx_pps')
+
+def _first_value(var_binds):
+    # First SNMP varbind as float, NaN when the device did not answer
+    if not var_binds:
+        return np.nan
+    try:
+        return float(var_binds[0][1])
+    except (TypeError, ValueError):
+        return np.nan
+
+def collect_device_features(snmp, devices):
+    # One row per device, columns in DEVICE_FEATURES order
+    matrix = np.full((len(devices), len(DEVICE_FEATURES)), np.nan)
+    for row, device in enumerate(devices):
+        matrix[row, 0] = _first_value(snmp.get_cpu_usage(device['ip']))
+        matrix[row, 1] = _first_value(snmp.get_memory_usage(device['ip']))
+    return matrix
+
+def collect_training_data(config_file='config/settings.yaml', community='public'):
+    config = load_config(config_file)
+    return collect_device_features(SNMPMonitor(community), config['devices'])
+
+class InterfaceFeatureBuilder:
+    # Keeps the last counters of every (device, interface) in flat arrays, so a tick of
+    # the whole fleet becomes one vectorized delta instead of per-interface Python math
+    def __init__(self):
+        self.index = {}
+        self.keys = []
+        self._counters = np.empty((0, len(INTERFACE_FEATURES)))
+        self._times = np.empty(0)
+
+    def _rows(self, keys):
+        rows = np.empty(len(keys), dtype=np.int64)
+        for i, key in enumerate(keys):
+            row = self.index.get(key)
+            if row is None:
+                row = self.index[key] = len(self.keys)
+                self.keys.append(key)
+            rows[i] = row
+        if len(self.keys) > len(self._times):
+            # Grow geometrically; new rows have no previous sample (NaN)
+            size = max(len(self.keys), 2 * len(self._times))
+            counters = np.full((size, len(INTERFACE_FEATURES)), np.nan)
+            counters[:len(self._counters)] = self._counters
+            times = np.full(size, np.nan)
+            times[:len(self._times)] = self._times
+            self._counters, self._times = counters, times
+        return rows
+
+    def update(self, timestamp, samples):
+        # samples: iterable of (device, interface, rx_bytes, tx_bytes, rx_packets, tx_packets)
+        # Returns (keys, matrix) with one row of INTERFACE_FEATURES rates per interface that has
+        # a previous sample; rows with a counter reset or wrap are left out
+        samples = list(samples)
+        if not samples:
+            return [], np.empty((0, len(INTERFACE_FEATURES)))
+        rows = self._rows([(sample[0], sample[1]) for sample in samples])
+        current = np.array([sample[2:] for sample in samples], dtype=np.float64)
+
+        elapsed = timestamp - self._times[rows]
+        delta = current - self._counters[rows]
+        valid = (elapsed > 0) & (delta >= 0).all(axis=1)
+        self._counters[rows] = current
+        self._times[rows] = timestamp
+
+        rates = delta[valid] / elapsed[valid, None]
+        rates[:, :2] *= 8  # bytes -> bits
+        return [self.keys[row] for row in rows[valid]], rates
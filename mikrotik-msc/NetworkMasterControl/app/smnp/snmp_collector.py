@@ -12,7 +12,7 @@ class SNMPMonitor:
                    CommunityData(self.community),
                    UdpTransportTarget((target_ip, 161)),
                    ContextData(),
-                   ObjectType(ObjectIdentity(oid))
+                   ObjectType(ObjectIdentity(oid)))
         )
 
         if error_indication:
@@ -21,4 +21,8 @@ class SNMPMonitor:
         return var_binds
 
     def get_cpu_usage(self, target_ip):
-        return self.get_snmp_data(target_ip, '1.3.6.1.2.1.25.3.3.1.2.1')
\ No newline at end of file
+        return self.get_snmp_data(target_ip, '1.3.6.1.2.1.25.3.3.1.2.1')
+
+    def get_memory_usage(self, target_ip):
+        # hrStorageUsed of the RAM entry (index 65536 on RouterOS)
+        return self.get_snmp_data(target_ip, '1.3.6.1.2.1.25.2.3.1.6.65536')
\ No newline at end of file
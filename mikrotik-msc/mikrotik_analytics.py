@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""
+Lớp phân tích traffic bằng NumPy
+Mẫu của một khoảng thời gian được nạp vào mảng một lần (traffic_data và traffic_blocks nếu có),
+sau đó mọi phép tính (tốc độ từ bộ đếm, gộp theo bucket, trung bình trượt, phân vị, top-N)
+đều chạy vector hóa thay vì lặp từng dòng trong Python.
+"""
+
+import bisect
+import logging
+import time
+
+import numpy as np
+
+from mikrotik_sampling import COUNTER_BITS
+from mikrotik_traffic_store import to_epoch
+
+logger = logging.getLogger("mikrotik_analytics")
+
+# Độ phân giải để đổi epoch sang giờ/ngày địa phương: 15 phút chia hết mọi múi giờ đang dùng
+_LOCAL_RESOLUTION = 900
+
+SAMPLE_DTYPE = np.dtype([
+    ('interface_id', np.int64),
+    ('timestamp', np.int64),
+    ('tx_bytes', np.int64),
+    ('rx_bytes', np.int64),
+    ('tx_kbps', np.float64),
+    ('rx_kbps', np.float64),
+])
+
+
+class TrafficFrame:
+    """Các mẫu đã nạp, sắp xếp theo (interface_id, timestamp), mỗi cột là một mảng NumPy."""
+
+    def __init__(self, samples):
+        order = np.lexsort((samples['timestamp'], samples['interface_id']))
+        self.samples = samples[order]
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, column):
+        return self.samples[column]
+
+    @property
+    def interface_ids(self):
+        """Danh sách interface có mẫu."""
+        return np.unique(self.samples['interface_id'])
+
+    def select(self, interface_id):
+        """Khung con của một interface (khung đã sắp xếp nên chỉ cần cắt lát)."""
+        ids = self.samples['interface_id']
+        left, right = np.searchsorted(ids, [interface_id, interface_id + 1])
+        frame = TrafficFrame.__new__(TrafficFrame)
+        frame.samples = self.samples[left:right]
+        return frame
+
+    def byte_deltas(self):
+        """Số byte truyền giữa hai mẫu liên tiếp của cùng interface (tx, rx), có xử lý tràn/reset bộ đếm."""
+        first = np.ones(len(self.samples), dtype=bool)
+        first[1:] = self.samples['interface_id'][1:] != self.samples['interface_id'][:-1]
+        return (
+            np.where(first, 0, counter_deltas(self.samples['tx_bytes'])),
+            np.where(first, 0, counter_deltas(self.samples['rx_bytes'])),
+        )
+
+
+def load_frame(conn, start, end, interface_ids=None, previous=False):
+    """
+    Nạp mẫu trong [start, end] (datetime hoặc epoch giây) của các interface (mặc định: tất cả).
+    Đọc traffic_data chỉ từ index bao phủ (interface_id, timestamp, ...) và giải nén traffic_blocks nếu có.
+    previous=True: thêm mẫu gần nhất trước start của mỗi interface làm gốc tính phần tăng bộ đếm cho mẫu đầu
+    (người gọi bỏ mẫu đó sau khi tính byte_deltas).
+    """
+    if interface_ids is None:
+        interface_ids = [row[0] for row in conn.execute('SELECT id FROM interfaces ORDER BY id')]
+    start_epoch, end_epoch = to_epoch(start), to_epoch(end)
+    has_blocks = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'traffic_blocks'"
+    ).fetchone() is not None
+
+    # Đọc tuple thô để np.fromiter nạp thẳng vào mảng (kết nối có thể đang dùng sqlite3.Row)
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    parts = []
+    for interface_id in interface_ids:
+        rows = cursor.execute('''
+        SELECT interface_id, timestamp,
+               IFNULL(tx_bytes, 0), IFNULL(rx_bytes, 0), IFNULL(tx_rate_kbps, 0.0), IFNULL(rx_rate_kbps, 0.0)
+        FROM traffic_data
+        WHERE interface_id = ? AND timestamp >= ? AND timestamp <= ?
+        ''', (interface_id, start_epoch, end_epoch))
+        parts.append(np.fromiter(rows, dtype=SAMPLE_DTYPE))
+        if previous:
+            parts.append(_previous_sample(cursor, interface_id, start_epoch, has_blocks))
+        if has_blocks:
+            from mikrotik_block_store import scan
+            samples = scan(conn, interface_id, start_epoch, end_epoch,
+                           ('tx_bytes', 'rx_bytes', 'tx_kbps', 'rx_kbps'))
+            if samples:
+                block = np.array(samples, dtype=np.float64)
+                part = np.empty(len(samples), dtype=SAMPLE_DTYPE)
+                part['interface_id'] = interface_id
+                part['timestamp'] = block[:, 0]
+                part['tx_bytes'] = [sample[1] for sample in samples]
+                part['rx_bytes'] = [sample[2] for sample in samples]
+                part['tx_kbps'] = block[:, 3]
+                part['rx_kbps'] = block[:, 4]
+                parts.append(part)
+    samples = np.concatenate(parts) if parts else np.empty(0, dtype=SAMPLE_DTYPE)
+    return TrafficFrame(samples)
+
+
+def _previous_sample(cursor, interface_id, before, has_blocks):
+    """Mẫu gần nhất trước thời điểm before của interface (mảng 0 hoặc 1 phần tử) trong traffic_data và traffic_blocks."""
+    row = cursor.execute('''
+    SELECT interface_id, timestamp,
+           IFNULL(tx_bytes, 0), IFNULL(rx_bytes, 0), IFNULL(tx_rate_kbps, 0.0), IFNULL(rx_rate_kbps, 0.0)
+    FROM traffic_data
+    WHERE interface_id = ? AND timestamp < ?
+    ORDER BY timestamp DESC LIMIT 1
+    ''', (interface_id, before)).fetchone()
+    if has_blocks:
+        from mikrotik_block_store import decode_block
+        block = cursor.execute('''
+        SELECT data FROM traffic_blocks WHERE interface_id = ? AND start_ts < ?
+        ORDER BY start_ts DESC LIMIT 1
+        ''', (interface_id, before)).fetchone()
+        if block is not None:
+            columns = decode_block(block[0], ('tx_bytes', 'rx_bytes', 'tx_kbps', 'rx_kbps'))
+            # Mẫu trong block theo thứ tự thời gian
+            last = bisect.bisect_left(columns['timestamp'], before) - 1
+            if last >= 0 and (row is None or columns['timestamp'][last] > row[1]):
+                row = (interface_id, columns['timestamp'][last], columns['tx_bytes'][last],
+                       columns['rx_bytes'][last], columns['tx_kbps'][last], columns['rx_kbps'][last])
+    return np.array([row] if row is not None else [], dtype=SAMPLE_DTYPE)
+
+
+def counter_deltas(counters, bits=COUNTER_BITS):
+    """
+    Phần tăng giữa các lần đọc bộ đếm bits bit liên tiếp (phần tử đầu là 0), cùng quy tắc với counter_delta:
+    bộ đếm nhỏ đi chỉ được coi là tràn khi giá trị trước ở nửa trên của miền bits bit, ngược lại là reset.
+    """
+    counters = np.asarray(counters, dtype=np.int64)
+    deltas = np.zeros(len(counters), dtype=np.float64)
+    if len(counters) < 2:
+        return deltas
+    previous, current = counters[:-1].astype(np.float64), counters[1:].astype(np.float64)
+    delta = current - previous
+    result = delta.copy()
+    pending = delta < 0
+    result[pending] = current[pending]  # Mặc định là reset
+    wrap = float(1 << bits)
+    wrapped = wrap - previous + current
+    fits = pending & (previous >= wrap / 2) & (wrapped < wrap / 2)
+    result[fits] = wrapped[fits]
+    deltas[1:] = result
+    return deltas
+
+
+def counter_rates(timestamps, counters, bits=COUNTER_BITS):
+    """Tốc độ "KB/s" (bits/giây chia 1024) giữa các mẫu liên tiếp của bộ đếm bits bit; phần tử đầu là 0."""
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    elapsed = np.diff(timestamps, prepend=timestamps[:1])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rates = counter_deltas(counters, bits) * 8 / elapsed / 1024
+    return np.where(elapsed > 0, rates, 0.0)
+
+
+def resample(timestamps, values, step, how='mean'):
+    """
+    Gộp chuỗi theo bucket step giây (căn theo epoch); trả về (thời điểm bucket, giá trị).
+    how: 'mean', 'max', 'min', 'sum' hoặc 'count'. Chuỗi phải được sắp xếp theo thời gian.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    if len(timestamps) == 0:
+        return timestamps, values
+    buckets = timestamps - timestamps % step
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    counts = np.diff(np.r_[starts, len(values)])
+    if how == 'count':
+        result = counts.astype(np.float64)
+    elif how == 'max':
+        result = np.maximum.reduceat(values, starts)
+    elif how == 'min':
+        result = np.minimum.reduceat(values, starts)
+    else:
+        result = np.add.reduceat(values, starts)
+        if how == 'mean':
+            result = result / counts
+    return buckets[starts], result
+
+
+def resample_percentile(timestamps, values, step, fraction):
+    """
+    Phân vị nearest-rank của từng bucket step giây (như percentile cho mỗi bucket) bằng một lần sắp xếp;
+    trả về (thời điểm bucket, giá trị). Chuỗi phải được sắp xếp theo thời gian.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    if len(timestamps) == 0:
+        return timestamps, values
+    buckets = timestamps - timestamps % step
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    counts = np.diff(np.r_[starts, len(values)])
+    # Sắp xếp giá trị trong từng bucket (bucket đã tăng dần nên vị trí đầu bucket không đổi)
+    ordered = values[np.lexsort((values, buckets))]
+    ranks = np.maximum(np.ceil(fraction * counts).astype(np.int64) - 1, 0)
+    return buckets[starts], ordered[starts + ranks]
+
+
+def rolling_mean(values, window):
+    """Trung bình trượt của window mẫu gần nhất (các phần tử đầu lấy trung bình trên số mẫu hiện có)."""
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) == 0:
+        return values
+    cumulative = np.cumsum(np.r_[0.0, values])
+    upper = np.arange(1, len(values) + 1)
+    lower = np.maximum(upper - window, 0)
+    return (cumulative[upper] - cumulative[lower]) / (upper - lower)
+
+
+def percentile(values, fraction):
+    """Phân vị theo nearest-rank (cùng định nghĩa với mikrotik_traffic_store.percentile), dùng np.partition."""
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) == 0:
+        return 0.0
+    rank = max(0, int(np.ceil(fraction * len(values))) - 1)
+    return float(np.partition(values, rank)[rank])
+
+
+def local_hours(timestamps):
+    """Giờ địa phương (0-23) của từng epoch, có tính giờ mùa hè; chỉ gọi localtime cho mỗi 15 phút khác nhau."""
+    slots, inverse = np.unique(np.asarray(timestamps, dtype=np.int64) // _LOCAL_RESOLUTION, return_inverse=True)
+    hours = np.array([time.localtime(int(slot) * _LOCAL_RESOLUTION).tm_hour for slot in slots], dtype=np.int64)
+    return hours[inverse]
+
+
+def local_dates(timestamps):
+    """Ngày địa phương (chuỗi YYYY-MM-DD) của từng epoch; trả về (các ngày khác nhau, chỉ số ngày của từng mẫu)."""
+    slots, inverse = np.unique(np.asarray(timestamps, dtype=np.int64) // _LOCAL_RESOLUTION, return_inverse=True)
+    labels = np.array([time.strftime('%Y-%m-%d', time.localtime(int(slot) * _LOCAL_RESOLUTION)) for slot in slots])
+    dates, day_index = np.unique(labels, return_inverse=True)
+    return dates, day_index[inverse]
+
+
+def group_stats(keys, tx, rx, size=None):
+    """
+    Thống kê theo nhóm số nguyên keys (0..size-1): số mẫu, trung bình và cao nhất của tx/rx.
+    Trả về dict các mảng độ dài size.
+    """
+    keys = np.asarray(keys, dtype=np.int64)
+    size = size if size is not None else (int(keys.max()) + 1 if len(keys) else 0)
+    counts = np.bincount(keys, minlength=size)
+    result = {'samples': counts}
+    for name, values in (('tx', tx), ('rx', rx)):
+        values = np.asarray(values, dtype=np.float64)
+        sums = np.bincount(keys, weights=values, minlength=size)
+        maxima = np.full(size, -np.inf)
+        np.maximum.at(maxima, keys, values)
+        result[f'avg_{name}'] = np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+        result[f'max_{name}'] = np.where(counts > 0, maxima, np.nan)
+    return result
+
+
+def hourly_profile(frame):
+    """Trung bình và cao nhất của tốc độ theo từng giờ địa phương; trả về danh sách dict theo giờ có dữ liệu."""
+    if len(frame) == 0:
+        return []
+    stats = group_stats(local_hours(frame['timestamp']), frame['tx_kbps'], frame['rx_kbps'], size=24)
+    return [
+        {
+            'hour': f"{hour:02d}",
+            'samples': int(stats['samples'][hour]),
+            'avg_tx_rate': float(stats['avg_tx'][hour]),
+            'avg_rx_rate': float(stats['avg_rx'][hour]),
+            'max_tx_rate': float(stats['max_tx'][hour]),
+            'max_rx_rate': float(stats['max_rx'][hour]),
+        }
+        for hour in np.flatnonzero(stats['samples'])
+    ]
+
+
+def daily_summary(frame):
+    """
+    Thống kê theo (interface, ngày địa phương) từ mẫu gốc: số mẫu, tổng MB, trung bình, cao nhất và p95 tốc độ.
+    Trả về danh sách dict, sắp xếp theo interface rồi theo ngày.
+    """
+    if len(frame) == 0:
+        return []
+    dates, day_index = local_dates(frame['timestamp'])
+    interface_ids, interface_index = np.unique(frame['interface_id'], return_inverse=True)
+    keys = interface_index * len(dates) + day_index
+    size = len(interface_ids) * len(dates)
+    stats = group_stats(keys, frame['tx_kbps'], frame['rx_kbps'], size=size)
+    tx_bytes, rx_bytes = frame.byte_deltas()
+    total_tx = np.bincount(keys, weights=tx_bytes, minlength=size)
+    total_rx = np.bincount(keys, weights=rx_bytes, minlength=size)
+
+    # p95 theo nhóm: sắp xếp ổn định theo nhóm một lần, rồi chọn phần tử theo hạng trong từng đoạn
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    bounds = np.searchsorted(sorted_keys, np.arange(size + 1))
+    p95 = {}
+    for name in ('tx_kbps', 'rx_kbps'):
+        values = frame[name][order]
+        p95[name] = [
+            percentile(values[bounds[key]:bounds[key + 1]], 0.95) if bounds[key + 1] > bounds[key] else 0.0
+            for key in range(size)
+        ]
+
+    result = []
+    for key in np.flatnonzero(stats['samples']):
+        result.append({
+            'interface_id': int(interface_ids[key // len(dates)]),
+            'date': str(dates[key % len(dates)]),
+            'samples': int(stats['samples'][key]),
+            'total_tx_mb': float(total_tx[key] / 1048576.0),
+            'total_rx_mb': float(total_rx[key] / 1048576.0),
+            'avg_tx_kbps': float(stats['avg_tx'][key]),
+            'avg_rx_kbps': float(stats['avg_rx'][key]),
+            'max_tx_kbps': float(stats['max_tx'][key]),
+            'max_rx_kbps': float(stats['max_rx'][key]),
+            'p95_tx_kbps': p95['tx_kbps'][key],
+            'p95_rx_kbps': p95['rx_kbps'][key],
+        })
+    return result
+
+
+def top_interfaces(frame, limit=10, by='total'):
+    """
+    N interface có lưu lượng lớn nhất. by: 'total' (tổng byte tx+rx), 'tx', 'rx' hoặc 'peak' (tốc độ cao nhất).
+    Trả về danh sách (interface_id, giá trị) giảm dần, dùng argpartition thay vì sắp xếp toàn bộ.
+    """
+    if len(frame) == 0:
+        return []
+    interface_ids, index = np.unique(frame['interface_id'], return_inverse=True)
+    if by == 'peak':
+        scores = np.zeros(len(interface_ids))
+        np.maximum.at(scores, index, np.maximum(frame['tx_kbps'], frame['rx_kbps']))
+    else:
+        tx_bytes, rx_bytes = frame.byte_deltas()
+        weights = {'tx': tx_bytes, 'rx': rx_bytes}.get(by, tx_bytes + rx_bytes)
+        scores = np.bincount(index, weights=weights, minlength=len(interface_ids))
+    limit = min(limit, len(scores))
+    best = np.argpartition(-scores, limit - 1)[:limit]
+    best = best[np.argsort(-scores[best])]
+    return [(int(interface_ids[i]), float(scores[i])) for i in best]
+
+
+def downsample(timestamps, tx, rx, max_points):
+    """Giảm chuỗi xuống tối đa khoảng max_points điểm bằng trung bình theo bucket đều nhau."""
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    if len(timestamps) <= max_points:
+        return timestamps, np.asarray(tx, dtype=np.float64), np.asarray(rx, dtype=np.float64)
+    step = max(1, int(np.ceil((timestamps[-1] - timestamps[0] + 1) / max_points)))
+    buckets, tx_mean = resample(timestamps, tx, step)
+    _, rx_mean = resample(timestamps, rx, step)
+    return buckets, tx_mean, rx_mean
+
+
+def envelope(timestamps, low, high=None, start=None, end=None, width=1000):
+    """
+    Giảm chuỗi xuống đường bao min/max theo từng cột pixel: [start, end] được chia thành width cột,
+    mỗi cột có dữ liệu giữ đúng hai điểm là giá trị nhỏ nhất (theo low) và lớn nhất (theo high, mặc định low)
+    theo thứ tự thời gian xuất hiện, nên đường vẽ ra trùng với khi vẽ toàn bộ điểm.
+    Chuỗi phải được sắp xếp theo thời gian; trả về (epoch, giá trị) với tối đa 2 * width điểm.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    low = np.asarray(low, dtype=np.float64)
+    high = low if high is None else np.asarray(high, dtype=np.float64)
+    if len(timestamps) == 0:
+        return timestamps, low
+    start = int(timestamps[0]) if start is None else int(start)
+    end = int(timestamps[-1]) if end is None else int(end)
+    columns = np.clip((timestamps - start) * width // (max(end - start, 0) + 1), 0, width - 1)
+    starts = np.flatnonzero(np.r_[True, columns[1:] != columns[:-1]])
+    counts = np.diff(np.r_[starts, len(timestamps)])
+    minima = np.minimum.reduceat(low, starts)
+    maxima = np.maximum.reduceat(high, starts)
+
+    # Vị trí đầu tiên đạt giá trị nhỏ nhất/lớn nhất trong mỗi cột
+    positions = np.arange(len(timestamps))
+    missing = len(timestamps)
+    min_at = np.minimum.reduceat(np.where(low == np.repeat(minima, counts), positions, missing), starts)
+    max_at = np.minimum.reduceat(np.where(high == np.repeat(maxima, counts), positions, missing), starts)
+
+    min_first = min_at <= max_at
+    order = np.column_stack([np.where(min_first, min_at, max_at), np.where(min_first, max_at, min_at)]).ravel()
+    values = np.column_stack([np.where(min_first, minima, maxima), np.where(min_first, maxima, minima)]).ravel()
+    return timestamps[order], values
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""
+Phát hiện bất thường trực tuyến trên tốc độ traffic của từng interface
+Mỗi chuỗi (interface, hướng TX/RX) chỉ giữ vài số thực: đường nền theo giờ trong ngày (mùa vụ),
+trung bình và phương sai EWMA của phần dư so với đường nền. Mỗi mẫu mới được chấm điểm bằng
+số độ lệch chuẩn so với giá trị kỳ vọng rồi cập nhật trạng thái với chi phí O(1), nên một tiến trình
+theo dõi được hàng chục nghìn chuỗi. Ngưỡng tự thích nghi theo độ dao động của từng chuỗi.
+"""
+
+import math
+import time
+import logging
+import argparse
+import threading
+from array import array
+from datetime import datetime, timedelta
+
+logger = logging.getLogger("mikrotik_anomaly_detector")
+
+DEFAULT_THRESHOLD = 4.0
+
+DIRECTIONS = ('tx', 'rx')
+
+# Số khung của đường nền mùa vụ (giờ trong ngày theo giờ địa phương)
+SEASON_SLOTS = 24
+
+
+class AnomalyEvent:
+    """
+    Sự kiện bất thường: kind='start' khi chuỗi bắt đầu bất thường, 'end' khi trở lại bình thường
+    hoặc khi chuỗi mất mẫu quá max_gap (khi đó value và expected là None).
+    """
+
+    __slots__ = ('kind', 'series', 'device', 'interface', 'direction', 'timestamp', 'value', 'expected',
+                 'score', 'peak_score', 'duration')
+
+    def __init__(self, kind, series, device, interface, direction, timestamp, value, expected, score,
+                 peak_score, duration=0.0):
+        self.kind = kind
+        self.series = series
+        self.device = device
+        self.interface = interface
+        self.direction = direction
+        self.timestamp = timestamp
+        self.value = value
+        self.expected = expected
+        self.score = score
+        self.peak_score = peak_score
+        self.duration = duration
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __str__(self):
+        name = f"{self.device}/{self.interface}" if self.device else str(self.interface)
+        when = datetime.fromtimestamp(self.timestamp).strftime('%Y-%m-%d %H:%M:%S')
+        if self.kind == 'start':
+            return (f"[{when}] Bất thường {self.direction.upper()} trên {name}: {self.value:.2f} KB/s "
+                    f"(kỳ vọng {self.expected:.2f} KB/s, điểm {self.score:.1f})")
+        return (f"[{when}] Hết bất thường {self.direction.upper()} trên {name} sau {self.duration:.0f} giây "
+                f"(điểm cao nhất {self.peak_score:.1f})")
+
+
+class _SeriesState:
+    """Trạng thái O(1) của một chuỗi."""
+
+    __slots__ = ('count', 'last_ts', 'mean', 'var', 'season', 'active', 'streak', 'started', 'peak', 'score')
+
+    def __init__(self, seasonal):
+        self.count = 0
+        self.last_ts = None
+        self.mean = 0.0
+        self.var = 0.0
+        self.season = array('d', [math.nan]) * SEASON_SLOTS if seasonal else None
+        self.active = False
+        self.streak = 0  # Số mẫu liên tiếp vượt ngưỡng
+        self.started = 0.0
+        self.peak = 0.0
+        self.score = 0.0
+
+
+class StreamingAnomalyDetector:
+    """
+    Bộ phát hiện bất thường trực tuyến cho nhiều chuỗi tốc độ, an toàn đa luồng.
+    threshold: số độ lệch chuẩn để coi là bất thường, phải vượt liên tiếp persistence mẫu mới phát sự kiện;
+    hết bất thường khi điểm dưới threshold * clear_ratio.
+    halflife: chu kỳ bán rã (giây) của trung bình/phương sai phần dư.
+    seasonal_halflife: chu kỳ bán rã của đường nền theo giờ, tính trên thời gian có mẫu trong khung giờ đó
+    (3 giờ tương đương khoảng 3 ngày lịch sử). min_std: độ lệch chuẩn tối thiểu (KB/s) để link gần như
+    không tải không bị báo động vì dao động nhỏ. Chuỗi mất mẫu quá max_gap giây được học lại từ đầu.
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, halflife=600, seasonal=True, seasonal_halflife=3 * 3600,
+                 persistence=2, warmup=60, min_std=8.0, max_gap=3600, clear_ratio=0.5, on_event=None):
+        self.threshold = threshold
+        self.clear_threshold = threshold * clear_ratio
+        self.persistence = persistence
+        self.halflife = halflife
+        self.seasonal = seasonal
+        self.seasonal_halflife = seasonal_halflife
+        self.warmup = warmup
+        self.min_std = min_std
+        self.max_gap = max_gap
+        self.on_event = on_event or self._log_event
+        self.events_total = {direction: 0 for direction in DIRECTIONS}
+        self._states = {}  # (series, hướng) -> _SeriesState
+        self._labels = {}  # series -> (thiết bị, interface)
+        self._alphas = {}  # Khoảng cách mẫu (giây) -> (alpha, alpha mùa vụ)
+        self._lock = threading.Lock()
+
+    def series_count(self):
+        """Số chuỗi (interface, hướng) đang được theo dõi."""
+        return len(self._states)
+
+    @staticmethod
+    def _log_event(event):
+        if event.kind == 'start':
+            logger.warning(str(event))
+        else:
+            logger.info(str(event))
+
+    def set_labels(self, series, device, interface):
+        """Gắn tên thiết bị/interface cho chuỗi series (dùng trong sự kiện và metrics)."""
+        with self._lock:
+            self._labels[series] = (device, interface)
+
+    def _alpha(self, elapsed):
+        """Hệ số EWMA cho khoảng cách mẫu elapsed giây (cache theo giây nguyên vì chu kỳ thường cố định)."""
+        key = max(1, int(round(elapsed)))
+        alphas = self._alphas.get(key)
+        if alphas is None:
+            alphas = self._alphas[key] = (
+                1.0 - 0.5 ** (key / self.halflife),
+                1.0 - 0.5 ** (key / self.seasonal_halflife)
+            )
+        return alphas
+
+    def _update(self, series, direction, timestamp, phase, value, events):
+        """Chấm điểm và cập nhật một mẫu của một chuỗi (phase: vị trí trong ngày tính theo giờ, xem _phase)."""
+        key = (series, direction)
+        state = self._states.get(key)
+        if state is None:
+            state = self._states[key] = _SeriesState(self.seasonal)
+
+        elapsed = timestamp - state.last_ts if state.last_ts is not None else None
+        if elapsed is not None and elapsed <= 0:
+            return
+        if elapsed is None or elapsed > self.max_gap:
+            if state.active:
+                # Bất thường đang mở kết thúc tại mẫu cuối trước khi mất mẫu (không có giá trị ở thời điểm đó)
+                events.append(self._event('end', series, direction, state.last_ts, None, None,
+                                          state.score, state.peak, state.last_ts - state.started))
+            # Chuỗi mới hoặc mất mẫu lâu: học lại phần dư (đường nền theo giờ được giữ)
+            state.count = 0
+            state.mean = state.var = 0.0
+            state.active = False
+            state.streak = 0
+            elapsed = self.halflife
+        state.last_ts = timestamp
+        alpha, seasonal_alpha = self._alpha(elapsed)
+
+        # Đường nền nội suy tuyến tính giữa tâm hai khung giờ kề nhau để không bị bậc thang khi sang giờ mới
+        base = 0.0
+        season = state.season
+        if season is not None:
+            slot, weight = phase
+            following = (slot + 1) % SEASON_SLOTS
+            current_base, next_base = season[slot], season[following]
+            if current_base != current_base:  # NaN: lần đầu thấy khung giờ này
+                current_base = season[slot] = value if next_base != next_base else next_base
+            if next_base != next_base:
+                next_base = season[following] = current_base
+            base = current_base + weight * (next_base - current_base)
+        residual = value - base
+
+        if state.count == 0:
+            state.mean = residual
+        std = max(math.sqrt(state.var), self.min_std)
+        score = abs(residual - state.mean) / std
+        warm = state.count >= self.warmup
+
+        if warm:
+            if not state.active:
+                state.streak = state.streak + 1 if score >= self.threshold else 0
+                if state.streak == 1:
+                    state.started = timestamp
+                    state.peak = score
+                else:
+                    state.peak = max(state.peak, score)
+                if state.streak >= self.persistence:
+                    state.active = True
+                    events.append(self._event('start', series, direction, timestamp, value, base + state.mean,
+                                              score, state.peak))
+            else:
+                state.peak = max(state.peak, score)
+                if score < self.clear_threshold:
+                    state.active = False
+                    state.streak = 0
+                    events.append(self._event('end', series, direction, timestamp, value, base + state.mean,
+                                              score, state.peak, timestamp - state.started))
+            # Giới hạn ảnh hưởng của mẫu bất thường lên đường nền
+            limit = self.threshold * std
+            residual = min(max(residual, state.mean - limit), state.mean + limit)
+        state.score = score if warm else 0.0
+        state.count += 1
+
+        diff = residual - state.mean
+        increment = alpha * diff
+        state.mean += increment
+        state.var = (1.0 - alpha) * (state.var + diff * increment)
+        if season is not None:
+            season[slot] += seasonal_alpha * (1.0 - weight) * residual
+            season[following] += seasonal_alpha * weight * residual
+
+    @staticmethod
+    def _phase(timestamp):
+        """(khung giờ, trọng số) của thời điểm theo giờ địa phương; khung k có tâm tại k:30."""
+        local = time.localtime(timestamp)
+        position = (local.tm_hour * 3600 + local.tm_min * 60 + local.tm_sec) / 3600.0 - 0.5
+        slot = math.floor(position)
+        return slot % SEASON_SLOTS, position - slot
+
+    def _event(self, kind, series, direction, timestamp, value, expected, score, peak, duration=0.0):
+        device, interface = self._labels.get(series, (None, series))
+        self.events_total[direction] += 1
+        return AnomalyEvent(kind, series, device, interface, direction, timestamp, value, expected,
+                            round(score, 2), round(peak, 2), duration)
+
+    def observe_batch(self, timestamp, samples):
+        """
+        Đưa các mẫu cùng một mốc thời gian vào bộ phát hiện.
+        timestamp: epoch giây hoặc datetime; samples: iterable (series, tx_kbps, rx_kbps).
+        Trả về danh sách sự kiện mới (cũng được gửi đến on_event).
+        """
+        if isinstance(timestamp, datetime):
+            timestamp = timestamp.timestamp()
+        phase = self._phase(timestamp) if self.seasonal else None
+        events = []
+        with self._lock:
+            for series, tx_kbps, rx_kbps in samples:
+                self._update(series, 'tx', timestamp, phase, tx_kbps, events)
+                self._update(series, 'rx', timestamp, phase, rx_kbps, events)
+        for event in events:
+            try:
+                self.on_event(event)
+            except Exception as e:
+                logger.error(f"Lỗi khi xử lý sự kiện bất thường: {e}")
+        return events
+
+    def observe(self, series, timestamp, tx_kbps, rx_kbps):
+        """Đưa một mẫu của một chuỗi vào bộ phát hiện."""
+        return self.observe_batch(timestamp, ((series, tx_kbps, rx_kbps),))
+
+    def active(self):
+        """Danh sách chuỗi đang bất thường: (series, hướng, điểm hiện tại, điểm cao nhất, thời điểm bắt đầu)."""
+        with self._lock:
+            return [
+                (series, direction, state.score, state.peak, state.started)
+                for (series, direction), state in self._states.items() if state.active
+            ]
+
+    def collect_metrics(self):
+        """Collector metrics Prometheus: số sự kiện và điểm của các chuỗi đang bất thường."""
+        yield ('mikrotik_anomaly_series', 'gauge', 'Số chuỗi traffic đang được theo dõi', [({}, self.series_count())])
+        yield ('mikrotik_anomaly_events_total', 'counter', 'Tổng số sự kiện bất thường (bắt đầu và kết thúc)',
+               [({'direction': direction}, count) for direction, count in self.events_total.items()])
+        samples = []
+        for series, direction, score, _, _ in self.active():
+            device, interface = self._labels.get(series, (None, series))
+            samples.append(({'device': device or '', 'interface': interface, 'direction': direction}, score))
+        yield ('mikrotik_interface_anomaly_score', 'gauge',
+               'Điểm bất thường (số độ lệch chuẩn) của các interface đang bất thường', samples)
+
+
+def replay(conn, start, end, detector):
+    """Chạy lại bộ phát hiện trên dữ liệu đã ghi trong [start, end] (epoch); trả về danh sách sự kiện."""
+    import mikrotik_analytics as analytics
+
+    labels = conn.execute('''
+    SELECT i.id, COALESCE(d.hostname, d.ip_address), i.name
+    FROM interfaces i JOIN devices d ON i.device_id = d.id
+    ''').fetchall()
+    for interface_id, device, interface in labels:
+        detector.set_labels(interface_id, device, interface)
+
+    events = []
+    frame = analytics.load_frame(conn, start, end)
+    for interface_id in frame.interface_ids.tolist():
+        series = frame.select(interface_id)
+        for timestamp, tx_kbps, rx_kbps in zip(series['timestamp'].tolist(), series['tx_kbps'].tolist(),
+                                               series['rx_kbps'].tolist()):
+            events.extend(detector.observe(interface_id, timestamp, tx_kbps, rx_kbps))
+    events.sort(key=lambda event: event.timestamp)
+    return events
+
+
+def main():
+    """Chạy lại bộ phát hiện trên lịch sử trong database để kiểm tra và chỉnh ngưỡng."""
+    from mikrotik_traffic_store import open_connection
+
+    parser = argparse.ArgumentParser(description='Phát hiện bất thường traffic MikroTik trên dữ liệu đã ghi')
+    parser.add_argument('--db', default='mikrotik_traffic.db', help='Tên file database (mặc định: mikrotik_traffic.db)')
+    parser.add_argument('--days', type=int, default=7, help='Số ngày dữ liệu cần chạy lại (mặc định: 7)')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f'Ngưỡng bất thường theo số độ lệch chuẩn (mặc định: {DEFAULT_THRESHOLD})')
+    parser.add_argument('--halflife', type=int, default=600, help='Chu kỳ bán rã của đường nền, giây (mặc định: 600)')
+    parser.add_argument('--no-seasonal', action='store_true', help='Không dùng đường nền theo giờ trong ngày')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    end = datetime.now()
+    start = end - timedelta(days=args.days)
+    detector = StreamingAnomalyDetector(args.threshold, halflife=args.halflife, seasonal=not args.no_seasonal,
+                                        on_event=lambda event: None)
+    conn = open_connection(args.db)
+    try:
+        events = replay(conn, start, end, detector)
+    finally:
+        conn.close()
+
+    for event in events:
+        print(event)
+    print(f"{len(events)} sự kiện trên {detector.series_count()} chuỗi")
+
+
+if __name__ == "__main__":
+    main()
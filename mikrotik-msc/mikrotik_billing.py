@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Báo cáo tính cước theo phân vị 95 (burstable billing)
+Lưu lượng của mỗi interface được gộp thành các bucket 5 phút (tốc độ trung bình = byte trong bucket / 300 giây),
+bỏ 5% bucket cao nhất và lấy bucket kế tiếp làm mức tính cước. Mức của thiết bị (site) chỉ tính trên tổng
+các interface uplink được chỉ định theo từng bucket: cộng mọi interface sẽ đếm cùng một lưu lượng nhiều lần
+(bridge và các port thành viên, VLAN và interface cha, chiều WAN và chiều LAN của cùng một luồng).
+Mỗi interface được nạp và gộp riêng nên bộ nhớ tỉ lệ với số mẫu gốc của một interface trong kỳ
+(cộng các chuỗi bucket của thiết bị), và phân vị được chọn bằng np.partition thay vì sắp xếp toàn bộ.
+"""
+
+import csv
+import io
+import json
+import logging
+from datetime import datetime
+
+import numpy as np
+
+import mikrotik_analytics as analytics
+from mikrotik_traffic_store import to_epoch
+
+logger = logging.getLogger("mikrotik_billing")
+
+BUCKET_SECONDS = 300
+
+CSV_FIELDS = [
+    'scope', 'device', 'interface', 'buckets', 'coverage',
+    'p95_in_mbps', 'p95_out_mbps', 'billable_mbps',
+    'max_in_mbps', 'max_out_mbps', 'avg_in_mbps', 'avg_out_mbps',
+    'total_in_gb', 'total_out_gb'
+]
+
+
+class BucketSeries:
+    """Byte vào/ra của một interface (hoặc một nhóm) trên lưới bucket cố định; present đánh dấu bucket có dữ liệu."""
+
+    def __init__(self, size):
+        self.rx = np.zeros(size)
+        self.tx = np.zeros(size)
+        self.present = np.zeros(size, dtype=bool)
+
+    def add(self, other):
+        """Cộng dồn một chuỗi khác (dùng để tính tổng của thiết bị)."""
+        self.rx += other.rx
+        self.tx += other.tx
+        self.present |= other.present
+
+
+def _rollup_step(conn):
+    """Step của tầng gộp mịn nhất chia hết 5 phút (None nếu chưa bật tầng lưu trữ)."""
+    try:
+        rows = conn.execute('SELECT step FROM retention_tiers WHERE step > 0 ORDER BY step').fetchall()
+    except Exception:
+        return None
+    for (step,) in rows:
+        if BUCKET_SECONDS % step == 0:
+            return step
+    return None
+
+
+def interface_buckets(conn, interface_id, origin, size, rollup_step=None):
+    """
+    Gộp lưu lượng của một interface vào size bucket 5 phút bắt đầu từ origin (epoch, chia hết cho 300).
+    Dùng mẫu gốc; phần đã bị xóa theo thời hạn lưu trữ được lấy từ tầng gộp rollup_step nếu có.
+    """
+    series = BucketSeries(size)
+    end = origin + size * BUCKET_SECONDS
+    frame = analytics.load_frame(conn, origin, end - 1, [interface_id], previous=True)
+    # Mẫu trước origin chỉ làm gốc cho phần tăng của mẫu đầu tiên trong kỳ
+    tx_bytes, rx_bytes = frame.byte_deltas()
+    inside = frame['timestamp'] >= origin
+    timestamps, tx_bytes, rx_bytes = frame['timestamp'][inside], tx_bytes[inside], rx_bytes[inside]
+    raw_start = end
+    if len(timestamps):
+        index = (timestamps - origin) // BUCKET_SECONDS
+        series.tx += np.bincount(index, weights=tx_bytes, minlength=size)[:size]
+        series.rx += np.bincount(index, weights=rx_bytes, minlength=size)[:size]
+        series.present[index] = True
+        raw_start = int(timestamps[0])
+
+    if rollup_step:
+        rows = np.array(conn.execute('''
+        SELECT bucket_ts, tx_bytes, rx_bytes FROM traffic_rollups
+        WHERE interface_id = ? AND step = ? AND bucket_ts >= ? AND bucket_ts < ?
+        ''', (interface_id, rollup_step, origin, raw_start - raw_start % BUCKET_SECONDS)).fetchall(),
+            dtype=np.float64).reshape(-1, 3)
+        if len(rows):
+            index = (rows[:, 0].astype(np.int64) - origin) // BUCKET_SECONDS
+            series.tx += np.bincount(index, weights=rows[:, 1], minlength=size)[:size]
+            series.rx += np.bincount(index, weights=rows[:, 2], minlength=size)[:size]
+            series.present[index] = True
+    return series
+
+
+def summarize(series, fraction=0.95):
+    """Các chỉ số tính cước (Mbps, GB) của một chuỗi bucket."""
+    present = series.present
+    buckets = int(present.sum())
+    # Tốc độ trung bình của bucket theo Mbps (10^6 bit/giây, quy ước tính cước)
+    rx_mbps = series.rx[present] * 8 / BUCKET_SECONDS / 1e6
+    tx_mbps = series.tx[present] * 8 / BUCKET_SECONDS / 1e6
+    p95_in = analytics.percentile(rx_mbps, fraction)
+    p95_out = analytics.percentile(tx_mbps, fraction)
+    return {
+        'buckets': buckets,
+        'coverage': round(buckets / len(present), 4) if len(present) else 0.0,
+        'p95_in_mbps': round(p95_in, 3),
+        'p95_out_mbps': round(p95_out, 3),
+        'billable_mbps': round(max(p95_in, p95_out), 3),
+        'max_in_mbps': round(float(rx_mbps.max()), 3) if buckets else 0.0,
+        'max_out_mbps': round(float(tx_mbps.max()), 3) if buckets else 0.0,
+        'avg_in_mbps': round(float(rx_mbps.mean()), 3) if buckets else 0.0,
+        'avg_out_mbps': round(float(tx_mbps.mean()), 3) if buckets else 0.0,
+        'total_in_gb': round(float(series.rx.sum()) / 1e9, 3),
+        'total_out_gb': round(float(series.tx.sum()) / 1e9, 3),
+    }
+
+
+def billing_report(conn, start, end, interface_ids=None, fraction=0.95, uplink_ids=None):
+    """
+    Báo cáo phân vị của các interface (mặc định: tất cả) và của từng thiết bị trong [start, end).
+    Mức của thiết bị chỉ cộng các interface uplink (uplink_ids) trong số interface được báo cáo;
+    không chỉ định uplink thì không có dòng thiết bị.
+    Trả về dict gồm khoảng thời gian, danh sách interface và danh sách thiết bị.
+    """
+    origin = to_epoch(start)
+    origin -= origin % BUCKET_SECONDS
+    size = max(1, -(-(to_epoch(end) - origin) // BUCKET_SECONDS))
+    rollup_step = _rollup_step(conn)
+
+    query = '''
+    SELECT i.id, i.name, d.id, COALESCE(d.hostname, d.ip_address)
+    FROM interfaces i JOIN devices d ON i.device_id = d.id
+    '''
+    rows = conn.execute(query + ' ORDER BY d.id, i.id').fetchall()
+    if interface_ids:
+        wanted = set(interface_ids)
+        rows = [row for row in rows if row[0] in wanted]
+
+    uplinks = set(uplink_ids or ())
+    if not uplinks:
+        logger.info("Không chỉ định interface uplink, bỏ qua tổng theo thiết bị")
+
+    interfaces = []
+    devices = {}
+    for interface_id, interface_name, device_id, device_name in rows:
+        series = interface_buckets(conn, interface_id, origin, size, rollup_step)
+        if not series.present.any():
+            continue
+        interfaces.append({'scope': 'interface', 'device': device_name, 'interface': interface_name,
+                           **summarize(series, fraction)})
+        if interface_id not in uplinks:
+            continue
+        if device_id not in devices:
+            devices[device_id] = (device_name, BucketSeries(size))
+        devices[device_id][1].add(series)
+
+    return {
+        'start': datetime.fromtimestamp(origin).strftime('%Y-%m-%d %H:%M:%S'),
+        'end': datetime.fromtimestamp(origin + size * BUCKET_SECONDS).strftime('%Y-%m-%d %H:%M:%S'),
+        'bucket_seconds': BUCKET_SECONDS,
+        'percentile': fraction * 100,
+        'interfaces': interfaces,
+        'devices': [
+            {'scope': 'device', 'device': name, 'interface': None, **summarize(series, fraction)}
+            for name, series in devices.values()
+        ],
+    }
+
+
+def format_report(report, fmt='text'):
+    """Chuyển báo cáo sang chuỗi text, JSON hoặc CSV."""
+    if fmt == 'json':
+        return json.dumps(report, indent=2, ensure_ascii=False)
+    rows = report['interfaces'] + report['devices']
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=CSV_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+        return buffer.getvalue()
+
+    from tabulate import tabulate
+    percentile_label = f"p{report['percentile']:g}"
+    table = [
+        [
+            row['device'], row['interface'] or '(tổng)',
+            f"{row['p95_in_mbps']:.3f}", f"{row['p95_out_mbps']:.3f}", f"{row['billable_mbps']:.3f}",
+            f"{row['max_in_mbps']:.3f}", f"{row['max_out_mbps']:.3f}",
+            f"{row['total_in_gb']:.3f}", f"{row['total_out_gb']:.3f}", f"{row['coverage'] * 100:.1f}%"
+        ]
+        for row in rows
+    ]
+    headers = ["Thiết bị", "Interface", f"{percentile_label} vào (Mbps)", f"{percentile_label} ra (Mbps)",
+               "Tính cước (Mbps)", "Cao nhất vào", "Cao nhất ra", "Tổng vào (GB)", "Tổng ra (GB)", "Độ phủ"]
+    title = (f"Báo cáo tính cước {percentile_label} từ {report['start']} đến {report['end']} "
+             f"(bucket {report['bucket_seconds'] // 60} phút)")
+    return title + "\n" + tabulate(table, headers=headers, tablefmt="pretty")
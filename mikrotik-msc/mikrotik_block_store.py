@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+"""
+Lưu trữ traffic dạng block nén theo cột (kiểu Gorilla)
+Mỗi block chứa các mẫu liên tiếp của một interface: timestamp mã hóa delta-of-delta, bộ đếm mã hóa delta,
+tốc độ (số thực) mã hóa XOR với giá trị trước. Block được lưu trong bảng traffic_blocks của cùng database SQLite;
+truy vấn theo khoảng thời gian chỉ giải mã các block (và các cột) cần thiết.
+"""
+
+import logging
+import sqlite3
+import struct
+import threading
+import time
+from array import array
+from mikrotik_traffic_store import (
+    UPSERT_DAILY_STATS_SQL, UPSERT_ROLLUP_SQL, format_date, open_connection, to_epoch
+)
+
+logger = logging.getLogger("mikrotik_block_store")
+
+BLOCK_FORMAT_VERSION = 1
+
+# Thứ tự cột trong block; timestamp là epoch giây
+COLUMNS = ('timestamp', 'tx_bytes', 'rx_bytes', 'tx_packets', 'rx_packets', 'tx_kbps', 'rx_kbps')
+INTEGER_COLUMNS = COLUMNS[1:5]
+FLOAT_COLUMNS = COLUMNS[5:]
+
+# Độ rộng các nhóm giá trị có dấu: giá trị 0 tốn 1 bit, các nhóm sau tốn tiền tố + độ rộng
+TIMESTAMP_WIDTHS = (7, 9, 12, 32, 64)
+COUNTER_WIDTHS = (8, 16, 24, 32, 48, 72)
+
+# Một block không bao giờ dài hơn khoảng này, nhờ đó truy vấn khoảng thời gian chỉ cần index (interface_id, start_ts)
+MAX_BLOCK_SECONDS = 86400
+
+BLOCK_SCHEMA_SQL = (
+    '''
+    CREATE TABLE IF NOT EXISTS traffic_blocks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        interface_id INTEGER NOT NULL,
+        start_ts INTEGER NOT NULL,
+        end_ts INTEGER NOT NULL,
+        samples INTEGER NOT NULL,
+        data BLOB NOT NULL,
+        FOREIGN KEY (interface_id) REFERENCES interfaces (id)
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_traffic_blocks_interface_time ON traffic_blocks (interface_id, start_ts)',
+)
+
+_HEADER = struct.Struct('>BI')  # phiên bản, số mẫu
+_COLUMN_LENGTH = struct.Struct('>I')
+
+
+def init_block_schema(conn):
+    """Tạo bảng traffic_blocks nếu chưa có."""
+    for statement in BLOCK_SCHEMA_SQL:
+        conn.execute(statement)
+    conn.commit()
+
+
+class BitWriter:
+    """Ghi chuỗi bit vào bytearray."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._acc = 0
+        self._bits = 0
+
+    def write(self, value, width):
+        """Ghi width bit thấp của value."""
+        self._acc = (self._acc << width) | (value & ((1 << width) - 1))
+        self._bits += width
+        while self._bits >= 8:
+            self._bits -= 8
+            self._buffer.append((self._acc >> self._bits) & 0xFF)
+        self._acc &= (1 << self._bits) - 1
+
+    def getvalue(self):
+        """Trả về các byte đã ghi (byte cuối được đệm bit 0)."""
+        if self._bits:
+            return bytes(self._buffer) + bytes(((self._acc << (8 - self._bits)) & 0xFF,))
+        return bytes(self._buffer)
+
+
+class BitReader:
+    """Đọc chuỗi bit từ bytes."""
+
+    def __init__(self, data):
+        self._data = data
+        self._pos = 0
+
+    def read(self, width):
+        """Đọc width bit tiếp theo thành số nguyên không dấu."""
+        if width == 0:
+            return 0
+        start = self._pos >> 3
+        end = (self._pos + width + 7) >> 3
+        shift = (end << 3) - self._pos - width
+        self._pos += width
+        return (int.from_bytes(self._data[start:end], 'big') >> shift) & ((1 << width) - 1)
+
+
+def _write_signed(writer, value, widths):
+    """Ghi số nguyên có dấu: '0' cho 0, hoặc tiền tố gồm các bit 1 chọn nhóm rồi giá trị bù hai."""
+    if value == 0:
+        writer.write(0, 1)
+        return
+    last = len(widths) - 1
+    for index, width in enumerate(widths):
+        limit = 1 << (width - 1)
+        if -limit <= value < limit or index == last:
+            if index == last:
+                writer.write((1 << (index + 1)) - 1, index + 1)
+            else:
+                writer.write(((1 << (index + 1)) - 1) << 1, index + 2)
+            writer.write(value, width)
+            return
+
+
+def _read_signed(reader, widths):
+    """Đọc số nguyên có dấu đã ghi bằng _write_signed."""
+    index = -1
+    while index < len(widths) - 1 and reader.read(1):
+        index += 1
+    if index < 0:
+        return 0
+    width = widths[index]
+    value = reader.read(width)
+    return value - (1 << width) if value >> (width - 1) else value
+
+
+def encode_timestamps(values):
+    """Mã hóa timestamp bằng delta-of-delta; mẫu cách đều nhau chỉ tốn 1 bit."""
+    writer = BitWriter()
+    previous = 0
+    previous_delta = 0
+    for value in values:
+        delta = value - previous
+        _write_signed(writer, delta - previous_delta, TIMESTAMP_WIDTHS)
+        previous, previous_delta = value, delta
+    return writer.getvalue()
+
+
+def decode_timestamps(data, count):
+    """Giải mã timestamp đã mã hóa bằng encode_timestamps."""
+    reader = BitReader(data)
+    values = []
+    previous = 0
+    delta = 0
+    for _ in range(count):
+        delta += _read_signed(reader, TIMESTAMP_WIDTHS)
+        previous += delta
+        values.append(previous)
+    return values
+
+
+def encode_counters(values):
+    """Mã hóa bộ đếm bằng delta với giá trị trước."""
+    writer = BitWriter()
+    previous = 0
+    for value in values:
+        _write_signed(writer, value - previous, COUNTER_WIDTHS)
+        previous = value
+    return writer.getvalue()
+
+
+def decode_counters(data, count):
+    """Giải mã bộ đếm đã mã hóa bằng encode_counters."""
+    reader = BitReader(data)
+    values = []
+    previous = 0
+    for _ in range(count):
+        previous += _read_signed(reader, COUNTER_WIDTHS)
+        values.append(previous)
+    return values
+
+
+def encode_floats(values):
+    """Mã hóa số thực bằng XOR với giá trị trước (Gorilla): giá trị lặp lại chỉ tốn 1 bit."""
+    writer = BitWriter()
+    previous = 0
+    leading = -1
+    trailing = 0
+    for bits in array('Q', array('d', values).tobytes()):
+        xor = bits ^ previous
+        previous = bits
+        if xor == 0:
+            writer.write(0, 1)
+            continue
+        lead = min(64 - xor.bit_length(), 31)
+        trail = (xor & -xor).bit_length() - 1
+        if leading >= 0 and lead >= leading and trail >= trailing:
+            # Phần khác nhau nằm trong cửa sổ của giá trị trước: dùng lại leading/trailing
+            writer.write(0b10, 2)
+            writer.write(xor >> trailing, 64 - leading - trailing)
+        else:
+            leading, trailing = lead, trail
+            meaningful = 64 - lead - trail
+            writer.write(0b11, 2)
+            writer.write(lead, 5)
+            writer.write(meaningful - 1, 6)
+            writer.write(xor >> trail, meaningful)
+    return writer.getvalue()
+
+
+def decode_floats(data, count):
+    """Giải mã số thực đã mã hóa bằng encode_floats."""
+    reader = BitReader(data)
+    words = array('Q')
+    previous = 0
+    leading = 0
+    trailing = 0
+    for _ in range(count):
+        if reader.read(1):
+            if reader.read(1):
+                leading = reader.read(5)
+                trailing = 64 - leading - (reader.read(6) + 1)
+            previous ^= reader.read(64 - leading - trailing) << trailing
+        words.append(previous)
+    return array('d', words.tobytes()).tolist()
+
+
+_ENCODERS = dict(
+    [('timestamp', encode_timestamps)]
+    + [(name, encode_counters) for name in INTEGER_COLUMNS]
+    + [(name, encode_floats) for name in FLOAT_COLUMNS]
+)
+_DECODERS = dict(
+    [('timestamp', decode_timestamps)]
+    + [(name, decode_counters) for name in INTEGER_COLUMNS]
+    + [(name, decode_floats) for name in FLOAT_COLUMNS]
+)
+
+
+def encode_block(columns):
+    """Đóng gói {tên cột: danh sách giá trị} thành một block."""
+    count = len(columns['timestamp'])
+    streams = [_ENCODERS[name](columns[name]) for name in COLUMNS]
+    parts = [_HEADER.pack(BLOCK_FORMAT_VERSION, count)]
+    parts.extend(_COLUMN_LENGTH.pack(len(stream)) for stream in streams)
+    parts.extend(streams)
+    return b''.join(parts)
+
+
+def decode_block(data, columns=None):
+    """Giải mã một block thành {tên cột: danh sách}, chỉ giải mã các cột được yêu cầu (timestamp luôn có)."""
+    version, count = _HEADER.unpack_from(data)
+    if version != BLOCK_FORMAT_VERSION:
+        raise ValueError(f"Phiên bản block không hỗ trợ: {version}")
+    offset = _HEADER.size
+    lengths = []
+    for _ in COLUMNS:
+        lengths.append(_COLUMN_LENGTH.unpack_from(data, offset)[0])
+        offset += _COLUMN_LENGTH.size
+
+    wanted = set(columns or COLUMNS) | {'timestamp'}
+    result = {}
+    view = memoryview(data)
+    for name, length in zip(COLUMNS, lengths):
+        if name in wanted:
+            result[name] = _DECODERS[name](bytes(view[offset:offset + length]), count)
+        offset += length
+    return result
+
+
+def scan(conn, interface_id, start, end, columns=None):
+    """
+    Đọc các mẫu của interface trong khoảng [start, end] (epoch giây hoặc datetime), theo thứ tự thời gian.
+    Trả về danh sách tuple (timestamp, các cột được yêu cầu...).
+    """
+    start, end = to_epoch(start), to_epoch(end)
+    columns = [name for name in (columns or COLUMNS) if name != 'timestamp']
+    rows = conn.execute('''
+    SELECT data FROM traffic_blocks
+    WHERE interface_id = ? AND start_ts >= ? AND start_ts <= ? AND end_ts >= ?
+    ORDER BY start_ts, id
+    ''', (interface_id, start - MAX_BLOCK_SECONDS, end, start))
+
+    result = []
+    for (data,) in rows:
+        block = decode_block(data, columns)
+        values = [block['timestamp']] + [block[name] for name in columns]
+        for sample in zip(*values):
+            if start <= sample[0] <= end:
+                result.append(sample)
+    return result
+
+
+class _OpenBlock:
+    """Block đang nhận mẫu của một interface."""
+
+    __slots__ = ('row_id', 'columns', 'dirty')
+
+    def __init__(self):
+        self.row_id = None  # id trong traffic_blocks sau lần checkpoint đầu tiên
+        self.columns = {name: [] for name in COLUMNS}
+        self.dirty = False
+
+
+class BlockWriter:
+    """
+    Bộ ghi traffic theo block, cùng giao diện append/flush/close với TrafficWriter.
+    Block đầy (block_size mẫu hoặc block_seconds giây) được ghi ở lần flush kế tiếp;
+    block đang mở được ghi tạm mỗi checkpoint_interval giây để không mất nhiều dữ liệu khi tiến trình dừng đột ngột.
+    """
+
+    def __init__(self, db_file, block_size=720, block_seconds=7200, flush_interval=1.0,
+                 checkpoint_interval=60, daily_stats=None, rollups=None):
+        self.db_file = db_file
+        self.block_size = block_size
+        self.block_seconds = min(block_seconds, MAX_BLOCK_SECONDS)
+        self.flush_interval = flush_interval
+        self.checkpoint_interval = checkpoint_interval
+        self.daily_stats = daily_stats
+        self.rollups = rollups
+        self.conn = open_connection(db_file)
+        init_block_schema(self.conn)
+        self.written = 0
+        self._open = {}  # interface_id -> _OpenBlock
+        self._sealed = []  # [(interface_id, _OpenBlock)] chờ ghi
+        self._last_checkpoint = time.monotonic()
+        self._lock = threading.Lock()
+        # Các lần flush chạy tuần tự để id của block đang mở luôn được gán trước lần ghi kế tiếp
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._running = True
+        self._thread = threading.Thread(target=self._flush_loop, name='block-writer', daemon=True)
+        self._thread.start()
+
+    def append(self, interface_id, timestamp, tx_bytes, rx_bytes, tx_packets, rx_packets, tx_rate_kbps, rx_rate_kbps):
+        """Thêm một mẫu vào block đang mở của interface."""
+        epoch = to_epoch(timestamp)
+        with self._lock:
+            block = self._open.get(interface_id)
+            if block is not None:
+                timestamps = block.columns['timestamp']
+                # Đóng block khi đầy, quá dài, hoặc thời gian đi lùi (đồng hồ bị chỉnh) để block luôn tăng dần
+                if (len(timestamps) >= self.block_size or epoch - timestamps[0] >= self.block_seconds
+                        or epoch <= timestamps[-1]):
+                    self._sealed.append((interface_id, block))
+                    block = None
+            if block is None:
+                block = self._open[interface_id] = _OpenBlock()
+            for name, value in zip(COLUMNS, (epoch, tx_bytes, rx_bytes, tx_packets, rx_packets,
+                                             float(tx_rate_kbps), float(rx_rate_kbps))):
+                block.columns[name].append(value)
+            block.dirty = True
+            if self.daily_stats is not None:
+                self.daily_stats.add(
+                    interface_id, format_date(timestamp), tx_bytes, rx_bytes, tx_rate_kbps, rx_rate_kbps
+                )
+            if self.rollups is not None:
+                self.rollups.add(interface_id, epoch, tx_bytes, rx_bytes, tx_rate_kbps, rx_rate_kbps)
+            full = len(self._sealed) >= 64
+        if full:
+            self._wakeup.set()
+
+    def flush(self, force_daily=False, checkpoint=False, close_rollups=False):
+        """Ghi các block đã đóng (và block đang mở nếu đến checkpoint) cùng thống kê ngày trong một transaction."""
+        with self._flush_lock:
+            return self._flush(force_daily, checkpoint, close_rollups)
+
+    def _flush(self, force_daily, checkpoint, close_rollups):
+        """Phần thân của flush, gọi khi đã giữ _flush_lock."""
+        now = time.monotonic()
+        checkpoint = checkpoint or now - self._last_checkpoint >= self.checkpoint_interval
+        with self._lock:
+            sealed, self._sealed = self._sealed, []
+            pending = [(interface_id, block, None) for interface_id, block in sealed]
+            if checkpoint:
+                self._last_checkpoint = now
+                for interface_id, block in self._open.items():
+                    if block.dirty:
+                        block.dirty = False
+                        # Chụp lại giá trị hiện tại; block vẫn tiếp tục nhận mẫu
+                        snapshot = _OpenBlock()
+                        snapshot.row_id = block.row_id
+                        snapshot.columns = {name: list(values) for name, values in block.columns.items()}
+                        pending.append((interface_id, snapshot, block))
+            daily_rows = self.daily_stats.take(force_daily) if self.daily_stats is not None else []
+            rollup_rows = self.rollups.take(close_rollups) if self.rollups is not None else []
+        if not pending and not daily_rows and not rollup_rows:
+            return 0
+
+        # Mã hóa ngoài khóa để không chặn append
+        encoded = [
+            (interface_id, block, owner, encode_block(block.columns))
+            for interface_id, block, owner in pending
+        ]
+        samples = 0
+        inserted = []
+        try:
+            with self.conn:
+                for interface_id, block, owner, data in encoded:
+                    timestamps = block.columns['timestamp']
+                    values = (interface_id, timestamps[0], timestamps[-1], len(timestamps), data)
+                    if block.row_id is None:
+                        cursor = self.conn.execute('''
+                        INSERT INTO traffic_blocks (interface_id, start_ts, end_ts, samples, data)
+                        VALUES (?, ?, ?, ?, ?)
+                        ''', values)
+                        block.row_id = cursor.lastrowid
+                        inserted.append(block)
+                    else:
+                        self.conn.execute('''
+                        UPDATE traffic_blocks SET interface_id = ?, start_ts = ?, end_ts = ?, samples = ?, data = ?
+                        WHERE id = ?
+                        ''', values + (block.row_id,))
+                    if owner is None:
+                        samples += len(timestamps)
+                if daily_rows:
+                    self.conn.executemany(UPSERT_DAILY_STATS_SQL, daily_rows)
+                if rollup_rows:
+                    self.conn.executemany(UPSERT_ROLLUP_SQL, rollup_rows)
+        except sqlite3.Error as e:
+            logger.error(f"Lỗi khi ghi {len(encoded)} block traffic: {e}")
+            # Transaction đã rollback nên các id vừa cấp không còn giá trị
+            for block in inserted:
+                block.row_id = None
+            with self._lock:
+                for interface_id, block, owner, _ in encoded:
+                    if owner is None:
+                        self._sealed.append((interface_id, block))
+                    else:
+                        owner.dirty = True
+                if daily_rows:
+                    self.daily_stats.restore(daily_rows)
+                if rollup_rows:
+                    self.rollups.restore(rollup_rows)
+            return 0
+
+        with self._lock:
+            # Block đang mở nhớ id vừa được cấp để các checkpoint sau cập nhật đúng dòng
+            for interface_id, block, owner, _ in encoded:
+                if owner is not None:
+                    owner.row_id = block.row_id
+        self.written += samples
+        return samples
+
+    def _flush_loop(self):
+        """Thread nền flush theo chu kỳ."""
+        while self._running:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def close(self):
+        """Dừng thread nền, ghi mọi block (kể cả block đang mở) và đóng kết nối."""
+        if not self._running:
+            return
+        self._running = False
+        self._wakeup.set()
+        self._thread.join(timeout=self.flush_interval + 5)
+        with self._lock:
+            self._sealed.extend(self._open.items())
+            self._open = {}
+        with self._flush_lock:
+            self._flush(True, True, True)
+            self.conn.close()
+        logger.info(f"Đã ghi block cho tổng cộng {self.written} mẫu traffic vào {self.db_file}")
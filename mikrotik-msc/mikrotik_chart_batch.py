@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Vẽ hàng loạt biểu đồ traffic ra file cho báo cáo định kỳ
+Không cần giao diện: mỗi biểu đồ là một Figure riêng vẽ bằng backend Agg (không qua pyplot),
+chuỗi lịch sử được giảm thành đường bao min/max theo từng cột pixel trước khi vẽ,
+và các biểu đồ của nhiều interface được vẽ song song trong một nhóm tiến trình.
+Mỗi tiến trình mở một kết nối đọc riêng và dùng lại cho mọi biểu đồ được giao.
+"""
+
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+logger = logging.getLogger("mikrotik_chart_batch")
+
+CHART_TYPES = ('history', 'daily', 'hourly')
+
+# Kích thước (inch) giống các lệnh plot tương tác
+FIGURE_SIZES = {
+    'history': (10, 6),
+    'daily': (10, 10),
+    'hourly': (10, 10),
+}
+
+# Analyzer của tiến trình con, tạo một lần trong _init_worker
+_analyzer = None
+
+
+def _init_worker(db_path):
+    """Khởi tạo tiến trình con: chọn backend Agg và mở analyzer trên database."""
+    global _analyzer
+    import matplotlib
+    matplotlib.use('Agg')
+    from mikrotik_db_analyzer import MikroTikDBAnalyzer
+    _analyzer = MikroTikDBAnalyzer(db_path)
+
+
+def render_chart(analyzer, chart_type, interface_id, output_file, hours=24, days=7, date=None, dpi=100):
+    """
+    Vẽ một biểu đồ ra output_file (PNG hoặc SVG theo phần mở rộng) bằng backend Agg.
+    Trả về đường dẫn file, hoặc None nếu interface không có dữ liệu.
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig = Figure(figsize=FIGURE_SIZES[chart_type], dpi=dpi)
+    FigureCanvasAgg(fig)
+    if chart_type == 'history':
+        # Mỗi cột pixel của trục ngang giữ tối đa hai điểm (min và max)
+        drawn = analyzer.draw_traffic_history(fig, interface_id, hours, envelope_width=int(fig.get_figwidth() * dpi))
+        if drawn:
+            fig.tight_layout()
+    elif chart_type == 'daily':
+        drawn = analyzer.draw_daily_stats(fig, interface_id, days)
+    else:
+        drawn = analyzer.draw_hourly_stats(fig, interface_id, date)
+
+    if not drawn:
+        return None
+    fig.savefig(output_file)
+    return output_file
+
+
+def _render_job(chart_type, interface_id, output_file, options):
+    """Chạy trong tiến trình con."""
+    return render_chart(_analyzer, chart_type, interface_id, output_file, **options)
+
+
+def render_charts(db_path, interface_ids, output_dir, chart_types=CHART_TYPES, fmt='png', workers=None, **options):
+    """
+    Vẽ song song mọi cặp (interface, loại biểu đồ) vào output_dir, tên file interface<ID>_<loại>.<fmt>.
+    options: hours, days, date, dpi như render_chart. Trả về danh sách file đã ghi.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = [
+        (chart_type, interface_id, os.path.join(output_dir, f"interface{interface_id}_{chart_type}.{fmt}"))
+        for interface_id in interface_ids
+        for chart_type in chart_types
+    ]
+
+    written = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(db_path,)) as pool:
+        futures = {pool.submit(_render_job, *job, options): job for job in jobs}
+        for future in as_completed(futures):
+            chart_type, interface_id, output_file = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.error(f"Lỗi khi vẽ biểu đồ {chart_type} cho interface {interface_id}: {e}")
+                continue
+            if result:
+                written.append(result)
+            else:
+                logger.info(f"Bỏ qua biểu đồ {chart_type} cho interface {interface_id}: không có dữ liệu")
+    return sorted(written)
@@ -9,8 +9,6 @@ import sys
 import time
 import json
 import logging
-import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation
 from dotenv import load_dotenv
 
 # Thiết lập logging
@@ -125,6 +123,8 @@ class MikroTikChartMonitor:
     
     def setup_chart(self):
         """Thiết lập biểu đồ ban đầu."""
+        import matplotlib.pyplot as plt
+        
         plt.style.use('seaborn-v0_8-darkgrid')
         self.fig, self.ax = plt.subplots(figsize=(12, 6))
         self.fig.suptitle(f'Giám sát Traffic Interface {self.selected_interface} - {self.host}', fontsize=14)
@@ -242,6 +242,10 @@ class MikroTikChartMonitor:
         self.selected_interface = interface_name
         self.interval = interval
         
+        # Chỉ nạp matplotlib khi bắt đầu vẽ biểu đồ để khởi động CLI nhanh hơn
+        import matplotlib.pyplot as plt
+        from matplotlib.animation import FuncAnimation
+        
         # Khởi tạo biểu đồ
         print(f"\n=== GIÁM SÁT TRAFFIC TRÊN {self.selected_interface} ===")
         fig = self.setup_chart()
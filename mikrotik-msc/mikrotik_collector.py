@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Bộ thu thập bộ đếm traffic theo thiết bị
+Mỗi chu kỳ chỉ gửi một lệnh /interface print (kèm .proplist) cho toàn bộ interface của thiết bị,
+nên tải CPU và API của router không phụ thuộc vào số cổng.
+"""
+
+import logging
+import time
+
+from mikrotik_sampling import counter_rate
+
+logger = logging.getLogger("mikrotik_collector")
+
+# Các cột cần lấy từ /interface print
+INTERFACE_PROPLIST = 'name,tx-byte,rx-byte,tx-packet,rx-packet'
+
+
+class InterfaceCollector:
+    """Thu thập bộ đếm của tất cả interface trên một thiết bị bằng một truy vấn mỗi chu kỳ."""
+
+    def __init__(self, api, interface_names=None):
+        """Khởi tạo với API đã kết nối và danh sách interface cần theo dõi (None là tất cả)."""
+        self.api = api
+        self.interface_names = set(interface_names) if interface_names else None
+        self._previous = {}  # name -> (counters, thời điểm monotonic)
+
+    def poll(self):
+        """Gửi một lệnh /interface print và trả về {name: counters} cho các interface được chọn."""
+        rows = self.api.get_resource('/interface').call('print', {'.proplist': INTERFACE_PROPLIST})
+        counters = {}
+        for row in rows:
+            name = row.get('name')
+            if not name or (self.interface_names is not None and name not in self.interface_names):
+                continue
+            counters[name] = {
+                'tx_bytes': int(row.get('tx-byte', 0)),
+                'rx_bytes': int(row.get('rx-byte', 0)),
+                'tx_packets': int(row.get('tx-packet', 0)),
+                'rx_packets': int(row.get('rx-packet', 0))
+            }
+        return counters
+
+    def collect(self):
+        """
+        Đọc bộ đếm và tính tốc độ cho mỗi interface so với lần đọc trước.
+        Trả về {name: sample}; interface mới xuất hiện chỉ có mẫu từ lần đọc thứ hai.
+        """
+        # Lấy mốc giữa lúc gửi và lúc nhận để độ trễ API không dồn vào một phía của khoảng đo
+        started = time.monotonic()
+        counters = self.poll()
+        now = (started + time.monotonic()) / 2
+
+        samples = {}
+        for name, current in counters.items():
+            previous = self._previous.get(name)
+            if previous is None:
+                continue
+            previous_counters, previous_time = previous
+            elapsed = now - previous_time
+            if elapsed <= 0:
+                continue
+
+            # Chia cho thời gian đo thực tế, xử lý tràn và reset bộ đếm
+            tx_kbps = counter_rate(current['tx_bytes'], previous_counters['tx_bytes'], elapsed)
+            rx_kbps = counter_rate(current['rx_bytes'], previous_counters['rx_bytes'], elapsed)
+            samples[name] = dict(current, tx_kbps=tx_kbps, rx_kbps=rx_kbps, elapsed=elapsed)
+
+        self._previous = {name: (current, now) for name, current in counters.items()}
+        return samples
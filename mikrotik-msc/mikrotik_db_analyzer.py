@@ -11,11 +11,14 @@ import sys
 import sqlite3
 import argparse
 import datetime
-import json
+import time
 from tabulate import tabulate
-import matplotlib.pyplot as plt
-from matplotlib.dates import DateFormatter
-import matplotlib.dates as mdates
+
+import numpy as np
+
+import mikrotik_analytics as analytics
+from mikrotik_retention import load_tiers, choose_tier
+from mikrotik_traffic_store import day_bounds, display_timestamp, migrate_timestamps, to_epoch
 
 
 class Colors:
@@ -51,7 +54,18 @@ class MikroTikDBAnalyzer:
             sys.exit(1)
             
         # Kiểm tra cấu trúc cơ sở dữ liệu
-        self._check_database_structure()
+        if self._check_database_structure():
+            # Database cũ lưu timestamp dạng chuỗi: nâng cấp tại chỗ trước khi truy vấn theo epoch
+            try:
+                converted = migrate_timestamps(self.conn)
+                if converted:
+                    print(f"{Colors.GREEN}Đã nâng cấp {converted} bản ghi traffic sang timestamp epoch{Colors.ENDC}")
+            except sqlite3.Error as e:
+                print(f"{Colors.RED}Lỗi khi nâng cấp cơ sở dữ liệu: {e}{Colors.ENDC}")
+                sys.exit(1)
+        
+        # Cấu hình tầng lưu trữ (None nếu logger chưa bật --retention)
+        self.tiers = load_tiers(self.conn)
 
     def _check_database_structure(self):
         """Kiểm tra các bảng cần thiết có tồn tại không."""
@@ -67,6 +81,7 @@ class MikroTikDBAnalyzer:
         if missing_tables:
             print(f"{Colors.WARNING}Cảnh báo: Các bảng sau đang thiếu trong cơ sở dữ liệu: {', '.join(missing_tables)}{Colors.ENDC}")
             print(f"{Colors.WARNING}Cơ sở dữ liệu có thể đang bị hỏng hoặc không được khởi tạo đúng.{Colors.ENDC}")
+        return 'traffic_data' not in missing_tables
 
     def get_device_info(self):
         """Lấy thông tin về các thiết bị được ghi log."""
@@ -90,18 +105,19 @@ class MikroTikDBAnalyzer:
             return []
 
     def get_traffic_data(self, interface_id, start_time=None, end_time=None, limit=100):
-        """Lấy dữ liệu traffic cho một interface cụ thể."""
+        """Lấy dữ liệu traffic cho một interface cụ thể (start_time/end_time: datetime, epoch hoặc 'YYYY-MM-DD HH:MM:SS')."""
         try:
             query = "SELECT * FROM traffic_data WHERE interface_id = ?"
             params = [interface_id]
             
+            # So sánh trực tiếp với cột epoch để dùng được index (interface_id, timestamp)
             if start_time:
                 query += " AND timestamp >= ?"
-                params.append(start_time)
+                params.append(self._epoch(start_time))
                 
             if end_time:
                 query += " AND timestamp <= ?"
-                params.append(end_time)
+                params.append(self._epoch(end_time))
                 
             query += " ORDER BY timestamp DESC LIMIT ?"
             params.append(limit)
@@ -140,6 +156,57 @@ class MikroTikDBAnalyzer:
             print(f"{Colors.RED}Lỗi khi truy vấn bảng daily_stats: {e}{Colors.ENDC}")
             return []
 
+    def get_daily_summary(self, interface_id=None, days=7):
+        """
+        Thống kê theo (interface, ngày) trong days ngày gần nhất, tính vector hóa từ mẫu gốc (có p95).
+        Nếu dữ liệu gốc đã bị xóa theo thời hạn lưu trữ thì đọc từ bảng daily_stats.
+        """
+        end = datetime.datetime.now()
+        start = datetime.datetime.combine(end.date() - datetime.timedelta(days=days - 1), datetime.time())
+        interface_ids = [interface_id] if interface_id else None
+        try:
+            frame = analytics.load_frame(self.conn, start, end, interface_ids)
+            summary = analytics.daily_summary(frame)
+            
+            # Bổ sung những ngày chỉ còn trong daily_stats
+            covered = {(row['interface_id'], row['date']) for row in summary}
+            query = """
+            SELECT interface_id, date, samples, total_tx_mb, total_rx_mb,
+                   avg_tx_kbps, avg_rx_kbps, max_tx_kbps, max_rx_kbps
+            FROM daily_stats
+            WHERE date >= ?
+            """
+            params = [start.strftime('%Y-%m-%d')]
+            if interface_id:
+                query += " AND interface_id = ?"
+                params.append(interface_id)
+            self.cursor.execute(query, params)
+            for row in self.cursor.fetchall():
+                if (row['interface_id'], row['date']) not in covered:
+                    summary.append(dict(row, p95_tx_kbps=None, p95_rx_kbps=None))
+            
+            names = {row['id']: row['name'] for row in self.get_interfaces()}
+            for row in summary:
+                row['interface_name'] = names.get(row['interface_id'], str(row['interface_id']))
+            summary.sort(key=lambda row: (row['date'], -row['interface_id']), reverse=True)
+            return summary
+        except sqlite3.Error as e:
+            print(f"{Colors.RED}Lỗi khi truy vấn thống kê hàng ngày: {e}{Colors.ENDC}")
+            return []
+
+    def get_top_interfaces(self, days=7, limit=10, by='total'):
+        """N interface có lưu lượng lớn nhất trong days ngày gần nhất."""
+        end = datetime.datetime.now()
+        start = end - datetime.timedelta(days=days)
+        try:
+            frame = analytics.load_frame(self.conn, start, end)
+        except sqlite3.Error as e:
+            print(f"{Colors.RED}Lỗi khi truy vấn dữ liệu traffic: {e}{Colors.ENDC}")
+            return []
+        names = {row['id']: row['name'] for row in self.get_interfaces()}
+        return [(names.get(interface_id, str(interface_id)), score)
+                for interface_id, score in analytics.top_interfaces(frame, limit, by)]
+
     def get_traffic_summary(self, days=7):
         """Lấy tổng hợp lưu lượng cho tất cả các interfaces."""
         try:
@@ -149,12 +216,12 @@ class MikroTikDBAnalyzer:
             query = """
             SELECT 
                 i.name as interface_name,
-                SUM(total_tx_bytes) as total_tx_bytes,
-                SUM(total_rx_bytes) as total_rx_bytes,
-                MAX(max_tx_rate) as max_tx_rate,
-                MAX(max_rx_rate) as max_rx_rate,
-                AVG(avg_tx_rate) as avg_tx_rate,
-                AVG(avg_rx_rate) as avg_rx_rate
+                SUM(total_tx_mb) * 1048576 as total_tx_bytes,
+                SUM(total_rx_mb) * 1048576 as total_rx_bytes,
+                MAX(max_tx_kbps) as max_tx_rate,
+                MAX(max_rx_kbps) as max_rx_rate,
+                SUM(avg_tx_kbps * samples) / MAX(SUM(samples), 1) as avg_tx_rate,
+                SUM(avg_rx_kbps * samples) / MAX(SUM(samples), 1) as avg_rx_rate
             FROM daily_stats ds
             JOIN interfaces i ON ds.interface_id = i.id
             WHERE ds.date >= ?
@@ -167,34 +234,77 @@ class MikroTikDBAnalyzer:
             print(f"{Colors.RED}Lỗi khi truy vấn tổng hợp dữ liệu: {e}{Colors.ENDC}")
             return []
 
+    def _rollup_tier_for(self, start_epoch, max_step=None):
+        """Tầng gộp mịn nhất còn dữ liệu từ start_epoch khi dữ liệu gốc đã bị xóa; None nếu vẫn đọc được dữ liệu gốc."""
+        if not self.tiers:
+            return None
+        now = time.time()
+        raw = self.tiers[0]
+        if raw.retention is None or now - raw.retention <= start_epoch:
+            return None
+        for tier in self.tiers[1:]:
+            if max_step and (tier.step > max_step or max_step % tier.step):
+                continue
+            if tier.retention is None or now - tier.retention <= start_epoch:
+                return tier
+        return None
+
+    def get_rate_series(self, interface_id, start, end, max_points=2000):
+        """
+        Chuỗi tốc độ của một interface trong [start, end] (datetime), đọc từ tầng mịn nhất còn dữ liệu
+        và giảm xuống tối đa khoảng max_points điểm. Trả về ((epoch, TX, RX) dạng mảng NumPy, tên tầng).
+        """
+        start_epoch, end_epoch = start.timestamp(), end.timestamp()
+        tier = choose_tier(self.tiers, start_epoch, end_epoch, max_points=max_points) if self.tiers else None
+        if tier is not None and tier.step:
+            self.cursor.execute("""
+            SELECT bucket_ts, avg_tx_kbps, avg_rx_kbps
+            FROM traffic_rollups
+            WHERE interface_id = ? AND step = ? AND bucket_ts >= ? AND bucket_ts <= ?
+            ORDER BY bucket_ts
+            """, (interface_id, tier.step, int(start_epoch) // tier.step * tier.step, int(end_epoch)))
+            rows = np.array(self.cursor.fetchall(), dtype=np.float64).reshape(-1, 3)
+            return (rows[:, 0].astype(np.int64), rows[:, 1], rows[:, 2]), tier.name
+        
+        frame = analytics.load_frame(self.conn, start, end, [interface_id])
+        series = analytics.downsample(frame['timestamp'], frame['tx_kbps'], frame['rx_kbps'], max_points)
+        return series, 'raw'
+
+    @staticmethod
+    def _epoch(value):
+        """Chuyển tham số thời gian (datetime, epoch hoặc chuỗi giờ địa phương) sang epoch giây."""
+        if isinstance(value, str):
+            value = datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+        return to_epoch(value)
+
     def get_traffic_by_hour(self, interface_id, date=None):
         """Lấy dữ liệu traffic theo giờ cho một ngày cụ thể."""
         try:
             if date is None:
                 date = datetime.datetime.now().strftime('%Y-%m-%d')
                 
-            # Tạo timestamp bắt đầu và kết thúc của ngày
-            start_timestamp = f"{date} 00:00:00"
-            end_timestamp = f"{date} 23:59:59"
-            
-            query = """
-            SELECT 
-                strftime('%H', timestamp) as hour,
-                AVG(tx_rate) as avg_tx_rate,
-                AVG(rx_rate) as avg_rx_rate,
-                MAX(tx_rate) as max_tx_rate,
-                MAX(rx_rate) as max_rx_rate
-            FROM traffic_data
-            WHERE 
-                interface_id = ? AND
-                timestamp >= ? AND
-                timestamp <= ?
-            GROUP BY strftime('%H', timestamp)
-            ORDER BY hour
-            """
-            
-            self.cursor.execute(query, (interface_id, start_timestamp, end_timestamp))
-            return self.cursor.fetchall()
+            # Khoảng epoch [đầu ngày, đầu ngày hôm sau) theo giờ địa phương
+            day_start, day_end = day_bounds(date)
+            
+            # Dữ liệu gốc của ngày đã bị xóa: tổng hợp từ tầng gộp có bucket nằm gọn trong một giờ
+            tier = self._rollup_tier_for(day_start, max_step=3600)
+            if tier is not None:
+                self.cursor.execute("""
+                SELECT 
+                    strftime('%H', bucket_ts, 'unixepoch', 'localtime') as hour,
+                    SUM(avg_tx_kbps * samples) / SUM(samples) as avg_tx_rate,
+                    SUM(avg_rx_kbps * samples) / SUM(samples) as avg_rx_rate,
+                    MAX(max_tx_kbps) as max_tx_rate,
+                    MAX(max_rx_kbps) as max_rx_rate
+                FROM traffic_rollups
+                WHERE interface_id = ? AND step = ? AND bucket_ts >= ? AND bucket_ts < ?
+                GROUP BY hour
+                ORDER BY hour
+                """, (interface_id, tier.step, day_start, day_end))
+                return self.cursor.fetchall()
+            
+            frame = analytics.load_frame(self.conn, day_start, day_end - 1, [interface_id])
+            return analytics.hourly_profile(frame)
         except sqlite3.Error as e:
             print(f"{Colors.RED}Lỗi khi truy vấn dữ liệu theo giờ: {e}{Colors.ENDC}")
             return []
@@ -231,14 +341,12 @@ class MikroTikDBAnalyzer:
             print(f"Số bản ghi traffic: {traffic_count}")
             
             if first_log and last_log:
-                print(f"Thời gian bắt đầu: {first_log}")
-                print(f"Thời gian gần nhất: {last_log}")
+                print(f"Thời gian bắt đầu: {display_timestamp(first_log)}")
+                print(f"Thời gian gần nhất: {display_timestamp(last_log)}")
                 
                 # Tính thời gian giám sát
                 try:
-                    first_dt = datetime.datetime.strptime(first_log, '%Y-%m-%d %H:%M:%S')
-                    last_dt = datetime.datetime.strptime(last_log, '%Y-%m-%d %H:%M:%S')
-                    duration = last_dt - first_dt
+                    duration = datetime.timedelta(seconds=last_log - first_log)
                     days, seconds = duration.days, duration.seconds
                     hours = seconds // 3600
                     minutes = (seconds % 3600) // 60
@@ -255,8 +363,8 @@ class MikroTikDBAnalyzer:
                         duration_str += f"{seconds} giây"
                         
                     print(f"Thời gian giám sát: {duration_str}")
-                except ValueError:
-                    # Bỏ qua nếu không thể phân tích chuỗi thời gian
+                except (TypeError, ValueError):
+                    # Bỏ qua nếu giá trị timestamp không hợp lệ
                     pass
             
         except sqlite3.Error as e:
@@ -383,7 +491,7 @@ class MikroTikDBAnalyzer:
 
     def print_daily_stats(self, interface_id=None, days=7):
         """In thống kê hàng ngày cho một hoặc tất cả các interfaces."""
-        stats = self.get_daily_stats(interface_id, days)
+        stats = self.get_daily_summary(interface_id, days)
         
         if not stats:
             if interface_id:
@@ -397,177 +505,265 @@ class MikroTikDBAnalyzer:
         # Chuẩn bị dữ liệu cho bảng
         table_data = []
         for row in stats:
-            # Chuyển byte sang MB hoặc GB
-            tx_total = row['total_tx_bytes']
-            rx_total = row['total_rx_bytes']
+            # Chuyển MB sang GB nếu lớn
+            tx_total = row['total_tx_mb'] or 0
+            rx_total = row['total_rx_mb'] or 0
             
-            if tx_total > 1024 * 1024 * 1024:
-                tx_str = f"{tx_total / (1024 * 1024 * 1024):.2f} GB"
+            if tx_total > 1024:
+                tx_str = f"{tx_total / 1024:.2f} GB"
             else:
-                tx_str = f"{tx_total / (1024 * 1024):.2f} MB"
+                tx_str = f"{tx_total:.2f} MB"
                 
-            if rx_total > 1024 * 1024 * 1024:
-                rx_str = f"{rx_total / (1024 * 1024 * 1024):.2f} GB"
+            if rx_total > 1024:
+                rx_str = f"{rx_total / 1024:.2f} GB"
             else:
-                rx_str = f"{rx_total / (1024 * 1024):.2f} MB"
+                rx_str = f"{rx_total:.2f} MB"
+            
+            # p95 chỉ có khi còn dữ liệu gốc
+            p95_tx = f"{row['p95_tx_kbps']:.2f} KB/s" if row['p95_tx_kbps'] is not None else "-"
+            p95_rx = f"{row['p95_rx_kbps']:.2f} KB/s" if row['p95_rx_kbps'] is not None else "-"
                 
             table_data.append([
                 row['interface_name'],
                 row['date'],
                 tx_str,
                 rx_str,
-                f"{row['max_tx_rate']:.2f} KB/s",
-                f"{row['max_rx_rate']:.2f} KB/s",
-                f"{row['avg_tx_rate']:.2f} KB/s",
-                f"{row['avg_rx_rate']:.2f} KB/s"
+                f"{row['max_tx_kbps']:.2f} KB/s",
+                f"{row['max_rx_kbps']:.2f} KB/s",
+                f"{row['avg_tx_kbps']:.2f} KB/s",
+                f"{row['avg_rx_kbps']:.2f} KB/s",
+                p95_tx,
+                p95_rx
             ])
             
-        headers = ["Interface", "Ngày", "TX Tổng", "RX Tổng", "TX Cao nhất", "RX Cao nhất", "TX Trung bình", "RX Trung bình"]
+        headers = ["Interface", "Ngày", "TX Tổng", "RX Tổng", "TX Cao nhất", "RX Cao nhất", "TX Trung bình", "RX Trung bình",
+                   "TX p95", "RX p95"]
+        print(tabulate(table_data, headers=headers, tablefmt="pretty"))
+
+    def print_top_interfaces(self, days=7, limit=10, by='total'):
+        """In các interface có lưu lượng lớn nhất."""
+        top = self.get_top_interfaces(days, limit, by)
+        
+        if not top:
+            print(f"{Colors.WARNING}Không có dữ liệu traffic nào cho {days} ngày qua.{Colors.ENDC}")
+            return
+        
+        print(f"\n{Colors.HEADER}{Colors.BOLD}=== TOP {len(top)} INTERFACE ({days} NGÀY QUA) ==={Colors.ENDC}")
+        if by == 'peak':
+            table_data = [[rank, name, f"{score:.2f} KB/s"] for rank, (name, score) in enumerate(top, 1)]
+        else:
+            table_data = [[rank, name, f"{score / (1024 * 1024):.2f} MB"] for rank, (name, score) in enumerate(top, 1)]
+        headers = ["#", "Interface", "Tốc độ cao nhất" if by == 'peak' else "Lưu lượng"]
         print(tabulate(table_data, headers=headers, tablefmt="pretty"))
 
+    def print_billing_report(self, month=None, start=None, end=None, interface_ids=None, percentile=95,
+                             fmt='text', output_file=None, uplink_ids=None):
+        """In (hoặc lưu) báo cáo tính cước theo phân vị cho một tháng hoặc một khoảng ngày."""
+        from mikrotik_billing import billing_report, format_report
+        
+        try:
+            if start:
+                start_dt = datetime.datetime.strptime(start, '%Y-%m-%d')
+                end_dt = datetime.datetime.strptime(end, '%Y-%m-%d') if end else datetime.datetime.now()
+            else:
+                month_dt = datetime.datetime.strptime(month, '%Y-%m') if month else datetime.datetime.now()
+                start_dt = month_dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+                end_dt = (start_dt + datetime.timedelta(days=32)).replace(day=1)
+        except ValueError as e:
+            print(f"{Colors.RED}Thời gian không hợp lệ: {e}{Colors.ENDC}")
+            return
+        
+        try:
+            report = billing_report(self.conn, start_dt, end_dt, interface_ids, percentile / 100, uplink_ids)
+        except sqlite3.Error as e:
+            print(f"{Colors.RED}Lỗi khi truy vấn dữ liệu tính cước: {e}{Colors.ENDC}")
+            return
+        
+        if not report['interfaces']:
+            print(f"{Colors.WARNING}Không có dữ liệu traffic nào trong khoảng thời gian này.{Colors.ENDC}")
+            return
+        
+        content = format_report(report, fmt)
+        if output_file:
+            with open(output_file, 'w', encoding='utf-8', newline='') as f:
+                f.write(content)
+            print(f"{Colors.GREEN}Đã lưu báo cáo tính cước vào {output_file}{Colors.ENDC}")
+        else:
+            print(content)
+
+    def _interface_name(self, interface_id):
+        """Tên của interface theo ID."""
+        self.cursor.execute("SELECT name FROM interfaces WHERE id = ?", (interface_id,))
+        return self.cursor.fetchone()['name']
+
+    def get_rate_envelope(self, interface_id, start, end, width):
+        """
+        Đường bao min/max theo từng cột pixel của tốc độ TX/RX trong [start, end] (datetime), với width cột.
+        Dùng tầng gộp thô nhất có step không lớn hơn một pixel (min/max của bucket giữ nguyên đỉnh),
+        nếu không thì dữ liệu gốc. Trả về (((epoch, TX), (epoch, RX)), tên tầng).
+        """
+        start_epoch, end_epoch = int(start.timestamp()), int(end.timestamp())
+        tier = None
+        if self.tiers:
+            now = time.time()
+            pixel_seconds = (end_epoch - start_epoch) / width
+            covering = [tier for tier in self.tiers if tier.retention is None or now - tier.retention <= start_epoch]
+            fitting = [tier for tier in covering if tier.step <= pixel_seconds]
+            tier = fitting[-1] if fitting else (covering[0] if covering else self.tiers[-1])
+        
+        if tier is not None and tier.step:
+            self.cursor.execute("""
+            SELECT bucket_ts, min_tx_kbps, max_tx_kbps, min_rx_kbps, max_rx_kbps
+            FROM traffic_rollups
+            WHERE interface_id = ? AND step = ? AND bucket_ts >= ? AND bucket_ts <= ?
+            ORDER BY bucket_ts
+            """, (interface_id, tier.step, start_epoch // tier.step * tier.step, end_epoch))
+            rows = np.array(self.cursor.fetchall(), dtype=np.float64).reshape(-1, 5)
+            epochs = rows[:, 0].astype(np.int64)
+            tx = analytics.envelope(epochs, rows[:, 1], rows[:, 2], start_epoch, end_epoch, width)
+            rx = analytics.envelope(epochs, rows[:, 3], rows[:, 4], start_epoch, end_epoch, width)
+            return (tx, rx), tier.name
+        
+        frame = analytics.load_frame(self.conn, start_epoch, end_epoch, [interface_id])
+        tx = analytics.envelope(frame['timestamp'], frame['tx_kbps'], start=start_epoch, end=end_epoch, width=width)
+        rx = analytics.envelope(frame['timestamp'], frame['rx_kbps'], start=start_epoch, end=end_epoch, width=width)
+        return (tx, rx), 'raw'
+
+    def draw_traffic_history(self, fig, interface_id, hours=24, envelope_width=None):
+        """
+        Vẽ lịch sử traffic của một interface lên fig; trả về False nếu không có dữ liệu.
+        envelope_width: số cột pixel của biểu đồ để giảm chuỗi thành đường bao min/max (None: trung bình theo bucket).
+        """
+        import matplotlib.dates as mdates
+        
+        # Tính thời gian bắt đầu dựa trên số giờ
+        end_time = datetime.datetime.now()
+        start_time = end_time - datetime.timedelta(hours=hours)
+        
+        # Truy vấn dữ liệu từ tầng lưu trữ phù hợp với khoảng thời gian
+        if envelope_width:
+            ((tx_epochs, tx_rates), (rx_epochs, rx_rates)), tier_name = self.get_rate_envelope(
+                interface_id, start_time, end_time, envelope_width)
+        else:
+            (tx_epochs, tx_rates, rx_rates), tier_name = self.get_rate_series(interface_id, start_time, end_time)
+            rx_epochs = tx_epochs
+        
+        if len(tx_epochs) == 0:
+            return False
+            
+        interface_name = self._interface_name(interface_id)
+        
+        # Tạo biểu đồ
+        ax = fig.add_subplot(1, 1, 1)
+        ax.plot([datetime.datetime.fromtimestamp(int(epoch)) for epoch in tx_epochs], tx_rates,
+                label='TX (KB/s)', color='blue')
+        ax.plot([datetime.datetime.fromtimestamp(int(epoch)) for epoch in rx_epochs], rx_rates,
+                label='RX (KB/s)', color='green')
+        
+        tier_label = '' if tier_name == 'raw' else f', tầng {tier_name}'
+        ax.set_title(f'Lịch sử traffic cho {interface_name} ({hours} giờ qua{tier_label})')
+        ax.set_xlabel('Thời gian')
+        ax.set_ylabel('Tốc độ (KB/s)')
+        ax.grid(True)
+        ax.legend()
+        
+        # Định dạng trục thời gian
+        ax.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
+        if hours > 24:
+            ax.xaxis.set_major_locator(mdates.DayLocator())
+            fig.autofmt_xdate()
+        else:
+            ax.xaxis.set_major_locator(mdates.HourLocator(interval=2))
+        return True
+
     def plot_traffic_history(self, interface_id, hours=24, output_file=None):
         """Vẽ biểu đồ lịch sử traffic cho một interface."""
-        # Tính thời gian bắt đầu dựa trên số giờ
-        start_time = (datetime.datetime.now() - datetime.timedelta(hours=hours)).strftime('%Y-%m-%d %H:%M:%S')
+        # Chỉ nạp matplotlib khi thực sự vẽ biểu đồ
+        import matplotlib.pyplot as plt
         
         try:
-            # Truy vấn dữ liệu
-            query = """
-            SELECT timestamp, tx_rate, rx_rate
-            FROM traffic_data
-            WHERE interface_id = ? AND timestamp >= ?
-            ORDER BY timestamp
-            """
-            
-            self.cursor.execute(query, (interface_id, start_time))
-            data = self.cursor.fetchall()
-            
-            if not data:
+            fig = plt.figure(figsize=(10, 6))
+            if not self.draw_traffic_history(fig, interface_id, hours):
+                plt.close(fig)
                 print(f"{Colors.WARNING}Không có dữ liệu traffic nào cho interface ID {interface_id} trong {hours} giờ qua.{Colors.ENDC}")
                 return
-                
-            # Lấy tên interface
-            self.cursor.execute("SELECT name FROM interfaces WHERE id = ?", (interface_id,))
-            interface_name = self.cursor.fetchone()['name']
-            
-            # Chuẩn bị dữ liệu cho biểu đồ
-            timestamps = []
-            tx_rates = []
-            rx_rates = []
-            
-            for row in data:
-                try:
-                    timestamp = datetime.datetime.strptime(row['timestamp'], '%Y-%m-%d %H:%M:%S')
-                    timestamps.append(timestamp)
-                    tx_rates.append(row['tx_rate'])
-                    rx_rates.append(row['rx_rate'])
-                except ValueError:
-                    continue
-            
-            # Tạo biểu đồ
-            plt.figure(figsize=(10, 6))
-            plt.plot(timestamps, tx_rates, label='TX (KB/s)', color='blue')
-            plt.plot(timestamps, rx_rates, label='RX (KB/s)', color='green')
-            
-            plt.title(f'Lịch sử traffic cho {interface_name} ({hours} giờ qua)')
-            plt.xlabel('Thời gian')
-            plt.ylabel('Tốc độ (KB/s)')
-            plt.grid(True)
-            plt.legend()
-            
-            # Định dạng trục thời gian
-            plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
-            if hours > 24:
-                plt.gca().xaxis.set_major_locator(mdates.DayLocator())
-                plt.gcf().autofmt_xdate()
-            else:
-                plt.gca().xaxis.set_major_locator(mdates.HourLocator(interval=2))
             
             if output_file:
-                plt.savefig(output_file)
+                fig.savefig(output_file)
                 print(f"{Colors.GREEN}Đã lưu biểu đồ vào {output_file}{Colors.ENDC}")
             else:
-                plt.tight_layout()
+                fig.tight_layout()
                 plt.show()
                 
         except sqlite3.Error as e:
             print(f"{Colors.RED}Lỗi khi truy vấn dữ liệu cho biểu đồ: {e}{Colors.ENDC}")
             
+    def draw_daily_stats(self, fig, interface_id, days=7):
+        """Vẽ thống kê hàng ngày của một interface lên fig; trả về False nếu không có dữ liệu."""
+        # Thống kê theo ngày, cũ trước mới sau
+        data = self.get_daily_summary(interface_id, days)[::-1]
+        
+        if not data:
+            return False
+            
+        interface_name = self._interface_name(interface_id)
+        
+        # Chuẩn bị dữ liệu cho biểu đồ
+        dates = [row['date'] for row in data]
+        tx_totals_mb = [row['total_tx_mb'] for row in data]
+        rx_totals_mb = [row['total_rx_mb'] for row in data]
+        avg_tx_rates = [row['avg_tx_kbps'] for row in data]
+        avg_rx_rates = [row['avg_rx_kbps'] for row in data]
+        
+        # Tạo hai biểu đồ: một cho tổng lượng dữ liệu, một cho tốc độ trung bình
+        ax1, ax2 = fig.subplots(2, 1)
+        
+        # Biểu đồ tổng lượng dữ liệu
+        ax1.bar(dates, tx_totals_mb, label='TX (MB)', color='blue', alpha=0.7)
+        ax1.bar(dates, rx_totals_mb, label='RX (MB)', color='green', alpha=0.7)
+        
+        ax1.set_title(f'Tổng lượng dữ liệu hàng ngày cho {interface_name}')
+        ax1.set_xlabel('Ngày')
+        ax1.set_ylabel('Dữ liệu (MB)')
+        ax1.grid(True, axis='y')
+        ax1.legend()
+        
+        # Định dạng trục thời gian cho biểu đồ 1
+        if len(dates) > 10:
+            for label in ax1.xaxis.get_ticklabels():
+                label.set_rotation(45)
+        
+        # Biểu đồ tốc độ trung bình
+        ax2.plot(dates, avg_tx_rates, marker='o', label='TX Trung bình (KB/s)', color='blue')
+        ax2.plot(dates, avg_rx_rates, marker='o', label='RX Trung bình (KB/s)', color='green')
+        
+        ax2.set_title(f'Tốc độ trung bình hàng ngày cho {interface_name}')
+        ax2.set_xlabel('Ngày')
+        ax2.set_ylabel('Tốc độ (KB/s)')
+        ax2.grid(True)
+        ax2.legend()
+        
+        # Định dạng trục thời gian cho biểu đồ 2
+        if len(dates) > 10:
+            for label in ax2.xaxis.get_ticklabels():
+                label.set_rotation(45)
+        
+        fig.tight_layout()
+        return True
+
     def plot_daily_stats(self, interface_id, days=7, output_file=None):
         """Vẽ biểu đồ thống kê hàng ngày cho một interface."""
+        import matplotlib.pyplot as plt
+        
         try:
-            # Truy vấn dữ liệu
-            query = """
-            SELECT date, total_tx_bytes, total_rx_bytes, avg_tx_rate, avg_rx_rate
-            FROM daily_stats
-            WHERE interface_id = ?
-            ORDER BY date
-            LIMIT ?
-            """
-            
-            self.cursor.execute(query, (interface_id, days))
-            data = self.cursor.fetchall()
-            
-            if not data:
+            fig = plt.figure(figsize=(10, 10))
+            if not self.draw_daily_stats(fig, interface_id, days):
+                plt.close(fig)
                 print(f"{Colors.WARNING}Không có dữ liệu thống kê hàng ngày nào cho interface ID {interface_id}.{Colors.ENDC}")
                 return
-                
-            # Lấy tên interface
-            self.cursor.execute("SELECT name FROM interfaces WHERE id = ?", (interface_id,))
-            interface_name = self.cursor.fetchone()['name']
-            
-            # Chuẩn bị dữ liệu cho biểu đồ
-            dates = []
-            tx_totals_mb = []
-            rx_totals_mb = []
-            avg_tx_rates = []
-            avg_rx_rates = []
-            
-            for row in data:
-                dates.append(row['date'])
-                # Chuyển byte sang MB
-                tx_totals_mb.append(row['total_tx_bytes'] / (1024 * 1024))
-                rx_totals_mb.append(row['total_rx_bytes'] / (1024 * 1024))
-                avg_tx_rates.append(row['avg_tx_rate'])
-                avg_rx_rates.append(row['avg_rx_rate'])
-            
-            # Tạo hai biểu đồ: một cho tổng lượng dữ liệu, một cho tốc độ trung bình
-            fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(10, 10))
-            
-            # Biểu đồ tổng lượng dữ liệu
-            ax1.bar(dates, tx_totals_mb, label='TX (MB)', color='blue', alpha=0.7)
-            ax1.bar(dates, rx_totals_mb, label='RX (MB)', color='green', alpha=0.7)
-            
-            ax1.set_title(f'Tổng lượng dữ liệu hàng ngày cho {interface_name}')
-            ax1.set_xlabel('Ngày')
-            ax1.set_ylabel('Dữ liệu (MB)')
-            ax1.grid(True, axis='y')
-            ax1.legend()
-            
-            # Định dạng trục thời gian cho biểu đồ 1
-            if len(dates) > 10:
-                for label in ax1.xaxis.get_ticklabels():
-                    label.set_rotation(45)
-            
-            # Biểu đồ tốc độ trung bình
-            ax2.plot(dates, avg_tx_rates, marker='o', label='TX Trung bình (KB/s)', color='blue')
-            ax2.plot(dates, avg_rx_rates, marker='o', label='RX Trung bình (KB/s)', color='green')
-            
-            ax2.set_title(f'Tốc độ trung bình hàng ngày cho {interface_name}')
-            ax2.set_xlabel('Ngày')
-            ax2.set_ylabel('Tốc độ (KB/s)')
-            ax2.grid(True)
-            ax2.legend()
-            
-            # Định dạng trục thời gian cho biểu đồ 2
-            if len(dates) > 10:
-                for label in ax2.xaxis.get_ticklabels():
-                    label.set_rotation(45)
-            
-            plt.tight_layout()
             
             if output_file:
-                plt.savefig(output_file)
+                fig.savefig(output_file)
                 print(f"{Colors.GREEN}Đã lưu biểu đồ vào {output_file}{Colors.ENDC}")
             else:
                 plt.show()
@@ -575,20 +771,17 @@ class MikroTikDBAnalyzer:
         except sqlite3.Error as e:
             print(f"{Colors.RED}Lỗi khi truy vấn dữ liệu cho biểu đồ: {e}{Colors.ENDC}")
     
-    def plot_hourly_stats(self, interface_id, date=None, output_file=None):
-        """Vẽ biểu đồ thống kê theo giờ cho một ngày cụ thể."""
+    def draw_hourly_stats(self, fig, interface_id, date=None):
+        """Vẽ thống kê theo giờ của một ngày lên fig; trả về False nếu không có dữ liệu."""
         if date is None:
             date = datetime.datetime.now().strftime('%Y-%m-%d')
             
         data = self.get_traffic_by_hour(interface_id, date)
         
         if not data:
-            print(f"{Colors.WARNING}Không có dữ liệu traffic theo giờ nào cho interface ID {interface_id} vào ngày {date}.{Colors.ENDC}")
-            return
+            return False
             
-        # Lấy tên interface
-        self.cursor.execute("SELECT name FROM interfaces WHERE id = ?", (interface_id,))
-        interface_name = self.cursor.fetchone()['name']
+        interface_name = self._interface_name(interface_id)
         
         # Chuẩn bị dữ liệu cho biểu đồ
         hours = []
@@ -605,7 +798,7 @@ class MikroTikDBAnalyzer:
             max_rx_rates.append(row['max_rx_rate'])
         
         # Tạo hai biểu đồ: một cho tốc độ trung bình, một cho tốc độ cao nhất
-        fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(10, 10))
+        ax1, ax2 = fig.subplots(2, 1)
         
         # Biểu đồ tốc độ trung bình
         ax1.plot(hours, avg_tx_rates, marker='o', label='TX Trung bình (KB/s)', color='blue')
@@ -629,96 +822,81 @@ class MikroTikDBAnalyzer:
         ax2.grid(True)
         ax2.legend()
         
-        plt.tight_layout()
+        fig.tight_layout()
+        return True
+
+    def plot_hourly_stats(self, interface_id, date=None, output_file=None):
+        """Vẽ biểu đồ thống kê theo giờ cho một ngày cụ thể."""
+        import matplotlib.pyplot as plt
+        
+        if date is None:
+            date = datetime.datetime.now().strftime('%Y-%m-%d')
+            
+        fig = plt.figure(figsize=(10, 10))
+        if not self.draw_hourly_stats(fig, interface_id, date):
+            plt.close(fig)
+            print(f"{Colors.WARNING}Không có dữ liệu traffic theo giờ nào cho interface ID {interface_id} vào ngày {date}.{Colors.ENDC}")
+            return
         
         if output_file:
-            plt.savefig(output_file)
+            fig.savefig(output_file)
             print(f"{Colors.GREEN}Đã lưu biểu đồ vào {output_file}{Colors.ENDC}")
         else:
             plt.show()
+
+    def render_charts(self, output_dir, interface_ids=None, chart_types=None, fmt='png', workers=None,
+                      hours=24, days=7, date=None, dpi=100):
+        """Vẽ hàng loạt biểu đồ của nhiều interface ra file PNG/SVG bằng backend Agg, song song theo tiến trình."""
+        from mikrotik_chart_batch import CHART_TYPES, render_charts
+        
+        if not interface_ids:
+            interface_ids = [row['id'] for row in self.get_interfaces()]
+        if not interface_ids:
+            print(f"{Colors.WARNING}Không có interface nào trong cơ sở dữ liệu.{Colors.ENDC}")
+            return
+        chart_types = chart_types or CHART_TYPES
+        
+        started = time.time()
+        written = render_charts(self.db_path, interface_ids, output_dir, chart_types, fmt, workers,
+                                hours=hours, days=days, date=date, dpi=dpi)
+        total = len(interface_ids) * len(chart_types)
+        print(f"{Colors.GREEN}Đã vẽ {len(written)}/{total} biểu đồ vào {output_dir} "
+              f"trong {time.time() - started:.1f} giây{Colors.ENDC}")
+        if len(written) < total:
+            print(f"{Colors.WARNING}Bỏ qua {total - len(written)} biểu đồ không có dữ liệu hoặc bị lỗi.{Colors.ENDC}")
     
     def export_data_to_json(self, output_file, days=7):
-        """Xuất dữ liệu sang định dạng JSON."""
+        """Xuất dữ liệu sang định dạng JSON bằng một truy vấn JOIN, ghi dần ra file thay vì dựng cả cấu trúc trong bộ nhớ."""
+        from mikrotik_json_export import export_json
+        
         try:
-            # Lấy thông tin thiết bị
-            devices = self.get_device_info()
+            counts = export_json(self.conn, output_file, days)
             
-            if not devices:
+            if not counts['devices']:
                 print(f"{Colors.WARNING}Không có thiết bị nào trong cơ sở dữ liệu.{Colors.ENDC}")
                 return
-            
-            # Tính thời gian bắt đầu dựa trên số ngày
-            start_time = (datetime.datetime.now() - datetime.timedelta(days=days)).strftime('%Y-%m-%d')
-            
-            # Chuẩn bị cấu trúc dữ liệu
-            export_data = {
-                "devices": [],
-                "generated_at": datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                "period_days": days
-            }
-            
-            for device in devices:
-                device_data = {
-                    "id": device['id'],
-                    "name": device['hostname'],
-                    "model": device['model'],
-                    "address": device['ip_address'],
-                    "version": device['ros_version'],
-                    "interfaces": []
-                }
-                
-                # Lấy interfaces của thiết bị
-                interfaces = self.get_interfaces(device['id'])
-                
-                for interface in interfaces:
-                    # Kiểm tra xem trường active có tồn tại không
-                    is_active = False
-                    if 'active' in interface:
-                        is_active = bool(interface['active'])
-                    
-                    interface_data = {
-                        "id": interface['id'],
-                        "name": interface['name'],
-                        "type": interface['type'],
-                        "active": is_active,
-                        "daily_stats": []
-                    }
-                    
-                    # Lấy thống kê hàng ngày
-                    query = """
-                    SELECT * FROM daily_stats 
-                    WHERE interface_id = ? AND date >= ?
-                    ORDER BY date
-                    """
-                    
-                    self.cursor.execute(query, (interface['id'], start_time))
-                    daily_stats = self.cursor.fetchall()
-                    
-                    for stat in daily_stats:
-                        stat_data = {
-                            "date": stat['date'],
-                            "total_tx_bytes": stat['total_tx_bytes'],
-                            "total_rx_bytes": stat['total_rx_bytes'],
-                            "max_tx_rate": stat['max_tx_rate'],
-                            "max_rx_rate": stat['max_rx_rate'],
-                            "avg_tx_rate": stat['avg_tx_rate'],
-                            "avg_rx_rate": stat['avg_rx_rate']
-                        }
-                        interface_data["daily_stats"].append(stat_data)
-                    
-                    device_data["interfaces"].append(interface_data)
-                
-                export_data["devices"].append(device_data)
-            
-            # Ghi dữ liệu ra file
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(export_data, f, indent=2, ensure_ascii=False)
                 
             print(f"{Colors.GREEN}Đã xuất dữ liệu sang {output_file}{Colors.ENDC}")
             
         except (sqlite3.Error, IOError) as e:
             print(f"{Colors.RED}Lỗi khi xuất dữ liệu: {e}{Colors.ENDC}")
     
+    def export_data_to_parquet(self, output_dir, days=7, fmt='parquet'):
+        """Xuất dữ liệu sang Parquet/Arrow theo từng lô, không nạp toàn bộ vào bộ nhớ."""
+        from mikrotik_parquet_export import export_dataset
+        
+        since = datetime.date.today() - datetime.timedelta(days=days) if days else None
+        try:
+            result = export_dataset(self.db_path, output_dir, fmt=fmt, since=since)
+        except ImportError:
+            print(f"{Colors.RED}Không thể import pyarrow. Chạy: pip install pyarrow{Colors.ENDC}")
+            return
+        except (OSError, sqlite3.Error) as e:
+            print(f"{Colors.RED}Lỗi khi xuất dữ liệu: {e}{Colors.ENDC}")
+            return
+        print(f"{Colors.GREEN}Đã xuất {result['traffic_data']} mẫu traffic và {result['daily_stats']} dòng thống kê "
+              f"vào {output_dir}{Colors.ENDC}")
+
     def close(self):
         """Đóng kết nối cơ sở dữ liệu."""
         if hasattr(self, 'conn') and self.conn:
@@ -753,6 +931,25 @@ def main():
     daily_parser.add_argument('--interface', type=int, help='ID của interface cần hiển thị thống kê')
     daily_parser.add_argument('--days', type=int, default=7, help='Số ngày cần hiển thị (mặc định: 7)')
     
+    # Lệnh liệt kê interface có lưu lượng lớn nhất
+    top_parser = subparsers.add_parser('top', help='Liệt kê interface có lưu lượng lớn nhất')
+    top_parser.add_argument('--days', type=int, default=7, help='Số ngày cần phân tích (mặc định: 7)')
+    top_parser.add_argument('--limit', type=int, default=10, help='Số interface cần hiển thị (mặc định: 10)')
+    top_parser.add_argument('--by', choices=['total', 'tx', 'rx', 'peak'], default='total',
+                            help='Tiêu chí xếp hạng: tổng byte, byte TX, byte RX hoặc tốc độ cao nhất (mặc định: total)')
+    
+    # Lệnh báo cáo tính cước theo phân vị 95
+    billing_parser = subparsers.add_parser('billing', help='Báo cáo tính cước theo phân vị 95 (bucket 5 phút)')
+    billing_parser.add_argument('--month', help='Tháng cần tính cước, định dạng YYYY-MM (mặc định: tháng hiện tại)')
+    billing_parser.add_argument('--start', help='Thời điểm bắt đầu, định dạng YYYY-MM-DD (thay cho --month)')
+    billing_parser.add_argument('--end', help='Thời điểm kết thúc (không bao gồm), định dạng YYYY-MM-DD')
+    billing_parser.add_argument('--interface', type=int, action='append', help='ID interface (có thể lặp lại, mặc định: tất cả)')
+    billing_parser.add_argument('--uplink', type=int, action='append',
+                                help='ID interface uplink được cộng vào tổng của thiết bị (có thể lặp lại, mặc định: không tính tổng)')
+    billing_parser.add_argument('--percentile', type=float, default=95, help='Phân vị tính cước (mặc định: 95)')
+    billing_parser.add_argument('--format', choices=['text', 'json', 'csv'], default='text', help='Định dạng báo cáo (mặc định: text)')
+    billing_parser.add_argument('--output', help='File lưu báo cáo (mặc định: in ra màn hình)')
+    
     # Lệnh vẽ biểu đồ
     plot_parser = subparsers.add_parser('plot', help='Vẽ biểu đồ')
     plot_parser.add_argument('--type', choices=['history', 'daily', 'hourly'], required=True, help='Loại biểu đồ')
@@ -762,10 +959,24 @@ def main():
     plot_parser.add_argument('--date', help='Ngày để hiển thị thống kê theo giờ, định dạng YYYY-MM-DD (chỉ cho loại hourly)')
     plot_parser.add_argument('--output', help='Tên file để lưu biểu đồ (ví dụ: plot.png)')
     
+    # Lệnh vẽ hàng loạt biểu đồ ra file
+    render_parser = subparsers.add_parser('render', help='Vẽ hàng loạt biểu đồ ra file PNG/SVG (không cần giao diện, chạy song song)')
+    render_parser.add_argument('--output-dir', required=True, help='Thư mục lưu biểu đồ')
+    render_parser.add_argument('--interface', type=int, action='append', help='ID interface (có thể lặp lại, mặc định: tất cả)')
+    render_parser.add_argument('--type', choices=['history', 'daily', 'hourly'], action='append',
+                               help='Loại biểu đồ (có thể lặp lại, mặc định: tất cả)')
+    render_parser.add_argument('--format', choices=['png', 'svg'], default='png', help='Định dạng file (mặc định: png)')
+    render_parser.add_argument('--workers', type=int, help='Số tiến trình vẽ song song (mặc định: số CPU)')
+    render_parser.add_argument('--hours', type=int, default=24, help='Số giờ lịch sử cho biểu đồ history (mặc định: 24)')
+    render_parser.add_argument('--days', type=int, default=7, help='Số ngày cho biểu đồ daily (mặc định: 7)')
+    render_parser.add_argument('--date', help='Ngày cho biểu đồ hourly, định dạng YYYY-MM-DD (mặc định: hôm nay)')
+    render_parser.add_argument('--dpi', type=int, default=100, help='Độ phân giải ảnh (mặc định: 100)')
+    
     # Lệnh xuất dữ liệu
     export_parser = subparsers.add_parser('export', help='Xuất dữ liệu')
-    export_parser.add_argument('--format', choices=['json'], default='json', help='Định dạng xuất (mặc định: json)')
-    export_parser.add_argument('--output', required=True, help='Tên file để lưu dữ liệu xuất')
+    export_parser.add_argument('--format', choices=['json', 'parquet', 'arrow'], default='json',
+                               help='Định dạng xuất; parquet/arrow ghi thư mục chia theo thiết bị và ngày (mặc định: json)')
+    export_parser.add_argument('--output', required=True, help='Tên file (json) hoặc thư mục (parquet/arrow) để lưu dữ liệu xuất')
     export_parser.add_argument('--days', type=int, default=7, help='Số ngày dữ liệu cần xuất (mặc định: 7)')
     
     args = parser.parse_args()
@@ -793,6 +1004,13 @@ def main():
         elif args.command == 'daily':
             analyzer.print_daily_stats(args.interface, args.days)
             
+        elif args.command == 'top':
+            analyzer.print_top_interfaces(args.days, args.limit, args.by)
+            
+        elif args.command == 'billing':
+            analyzer.print_billing_report(args.month, args.start, args.end, args.interface,
+                                          args.percentile, args.format, args.output, args.uplink)
+            
         elif args.command == 'plot':
             if args.type == 'history':
                 analyzer.plot_traffic_history(args.interface, args.hours, args.output)
@@ -801,9 +1019,15 @@ def main():
             elif args.type == 'hourly':
                 analyzer.plot_hourly_stats(args.interface, args.date, args.output)
                 
+        elif args.command == 'render':
+            analyzer.render_charts(args.output_dir, args.interface, args.type, args.format, args.workers,
+                                   args.hours, args.days, args.date, args.dpi)
+                
         elif args.command == 'export':
             if args.format == 'json':
                 analyzer.export_data_to_json(args.output, args.days)
+            else:
+                analyzer.export_data_to_parquet(args.output, args.days, args.format)
     
     finally:
         analyzer.close()
@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+"""
+Logger traffic cho nhiều thiết bị MikroTik trong một tiến trình
+Đọc danh sách thiết bị từ sites.json hoặc config/settings.yaml, thu thập song song với số kết nối giới hạn
+và ghi tất cả vào một database (mỗi thiết bị một dòng trong bảng devices).
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from mikrotik_collector import InterfaceCollector
+from mikrotik_sampling import TickScheduler
+from mikrotik_traffic_logger import MikroTikTrafficLogger
+from mikrotik_traffic_store import TrafficWriter, DailyStatsAggregator, RollupAggregator, open_connection, init_schema
+from mikrotik_retention import DEFAULT_RETENTION, RetentionManager, parse_tiers, rollup_steps, save_tiers
+from mikrotik_anomaly_detector import DEFAULT_THRESHOLD, StreamingAnomalyDetector
+
+logger = logging.getLogger("mikrotik_fleet_logger")
+
+
+def load_devices(config_file):
+    """
+    Đọc danh sách thiết bị từ sites.json (khóa "sites") hoặc file YAML (khóa "devices").
+    Trả về danh sách dict có name, host, username, password và interfaces (None là tất cả).
+    """
+    with open(config_file, 'r') as f:
+        if config_file.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                logger.error("Không thể import yaml. Chạy: pip install pyyaml")
+                sys.exit(1)
+            entries = (yaml.safe_load(f) or {}).get('devices', [])
+        else:
+            entries = json.load(f).get('sites', [])
+
+    devices = []
+    for entry in entries:
+        host = entry.get('host') or entry.get('ip')
+        username = entry.get('username')
+        password = entry.get('password')
+        if not host or not username or not password:
+            logger.warning(f"Bỏ qua thiết bị thiếu thông tin kết nối: {entry.get('name') or host}")
+            continue
+        devices.append({
+            'name': entry.get('name') or host,
+            'host': host,
+            'username': username,
+            'password': password,
+            'interfaces': entry.get('interfaces')
+        })
+    return devices
+
+
+class FleetDevice:
+    """Trạng thái thu thập của một thiết bị: kết nối, collector và lịch thử lại."""
+
+    def __init__(self, name, host, username, password, db_file, interfaces=None):
+        self.name = name
+        self.host = host
+        self.interfaces = interfaces
+        # Dùng lại phần kết nối và đăng ký thiết bị/interface của logger một thiết bị
+        self.client = MikroTikTrafficLogger(host, username, password, db_file=db_file, init_db=False)
+        self.collector = None
+        self.interface_ids = {}
+        self.busy = False
+        self.failures = 0
+        self.next_attempt = 0.0
+        self.last_sample = None  # Thời điểm (epoch) của mẫu thành công gần nhất
+        self.last_error = None
+        self.poll_seconds = 0.0
+        self.overruns = 0  # Số tick bị bỏ vì lần thu thập trước chưa xong
+
+    def connect(self):
+        """Kết nối, đăng ký thiết bị và chọn interface cần ghi log."""
+        if not self.client.connect():
+            raise ConnectionError(f"Không thể kết nối đến {self.host}")
+        names = self.interfaces
+        if not names:
+            names = [iface['name'] for iface in self.client.get_interfaces() or []]
+        known = self.client.get_interface_ids()
+        self.interface_ids = {name: known[name] for name in names if name in known}
+        if not self.interface_ids:
+            self.disconnect()
+            raise LookupError(f"Không có interface nào để ghi log trên {self.host}")
+        self.collector = InterfaceCollector(self.client.api, self.interface_ids.keys())
+        logger.info(f"{self.name}: ghi log {len(self.interface_ids)} interface")
+
+    def disconnect(self):
+        """Đóng kết nối hiện tại (nếu có)."""
+        self.collector = None
+        try:
+            self.client.disconnect()
+        except Exception as e:
+            logger.debug(f"{self.name}: lỗi khi ngắt kết nối: {e}")
+        self.client.connection = None
+        self.client.api = None
+
+
+class FleetTrafficLogger:
+    """
+    Thu thập traffic của nhiều thiết bị theo cùng một nhịp tick.
+    Mỗi tick, các thiết bị đến lượt được đưa vào thread pool có kích thước cố định;
+    thiết bị lỗi được thử lại với backoff lũy thừa riêng và không làm chậm các thiết bị khác.
+    """
+
+    def __init__(self, devices, db_file='mikrotik_traffic.db', workers=16, backoff=5.0, max_backoff=300.0,
+                 lag_factor=3, storage='rows', retention=None, anomaly_threshold=None):
+        self.db_file = db_file
+        self.workers = workers
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.lag_factor = lag_factor
+        self.interval = None
+        self.running = False
+        self.tiers = parse_tiers(retention) if retention else None
+
+        # Khởi tạo schema một lần cho cả đội thiết bị
+        conn = open_connection(db_file)
+        init_schema(conn)
+        if self.tiers:
+            save_tiers(conn, self.tiers)
+        conn.close()
+
+        self.devices = [
+            FleetDevice(d['name'], d['host'], d['username'], d['password'], db_file, d.get('interfaces'))
+            for d in devices
+        ]
+        # Một bộ đệm ghi chung: mẫu của mọi thiết bị được ghi trong cùng các transaction
+        rollups = RollupAggregator(rollup_steps(self.tiers)) if self.tiers else None
+        if storage == 'blocks':
+            from mikrotik_block_store import BlockWriter
+            self.writer = BlockWriter(db_file, daily_stats=DailyStatsAggregator(), rollups=rollups)
+        else:
+            self.writer = TrafficWriter(db_file, daily_stats=DailyStatsAggregator(), rollups=rollups)
+        # Một bộ phát hiện bất thường chung cho mọi interface của đội thiết bị (tùy chọn)
+        self.detector = StreamingAnomalyDetector(anomaly_threshold) if anomaly_threshold else None
+        self._lock = threading.Lock()
+
+    def _retry_delay(self, failures):
+        """Thời gian chờ trước lần thử lại sau failures lần lỗi liên tiếp (có jitter)."""
+        delay = min(self.max_backoff, self.backoff * (2 ** (failures - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+    def poll_device(self, device, tick):
+        """Thu thập một thiết bị tại mốc tick (chạy trong thread pool)."""
+        started = time.monotonic()
+        try:
+            if device.collector is None:
+                device.connect()
+                if self.detector:
+                    for interface_name, interface_id in device.interface_ids.items():
+                        self.detector.set_labels(interface_id, device.name, interface_name)
+            samples = device.collector.collect()
+            timestamp = datetime.fromtimestamp(tick)
+            for interface_name, sample in samples.items():
+                self.writer.append(
+                    device.interface_ids[interface_name],
+                    timestamp,
+                    sample['tx_bytes'],
+                    sample['rx_bytes'],
+                    sample['tx_packets'],
+                    sample['rx_packets'],
+                    sample['tx_kbps'],
+                    sample['rx_kbps']
+                )
+            if self.detector:
+                self.detector.observe_batch(tick, [
+                    (device.interface_ids[interface_name], sample['tx_kbps'], sample['rx_kbps'])
+                    for interface_name, sample in samples.items()
+                ])
+            with self._lock:
+                if device.failures:
+                    logger.info(f"{device.name}: đã thu thập lại sau {device.failures} lần lỗi")
+                device.failures = 0
+                device.last_error = None
+                device.last_sample = tick
+        except Exception as e:
+            device.disconnect()
+            with self._lock:
+                device.failures += 1
+                device.last_error = str(e)
+                delay = self._retry_delay(device.failures)
+                device.next_attempt = time.monotonic() + delay
+            logger.warning(f"{device.name}: lỗi thu thập ({e}), thử lại sau {delay:.0f}s")
+        finally:
+            with self._lock:
+                device.poll_seconds = time.monotonic() - started
+                device.busy = False
+
+    def run(self, interval=5, duration=None, status_interval=60):
+        """Chạy vòng thu thập cho đến khi stop() hoặc hết duration giây."""
+        self.interval = interval
+        self.running = True
+        scheduler = TickScheduler(interval)
+        deadline = time.monotonic() + duration if duration else None
+        last_report = time.monotonic()
+        logger.info(f"Bắt đầu ghi log {len(self.devices)} thiết bị với {self.workers} kết nối đồng thời")
+
+        pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='fleet-poll')
+        retention = RetentionManager(self.db_file, self.tiers) if self.tiers else None
+        if retention:
+            retention.start()
+        try:
+            while self.running:
+                tick = scheduler.wait()
+                if tick is None or not self.running:
+                    break
+                now = time.monotonic()
+                if deadline and now >= deadline:
+                    break
+
+                with self._lock:
+                    due = []
+                    for device in self.devices:
+                        if now < device.next_attempt:
+                            continue
+                        if device.busy:
+                            # Lần thu thập trước chưa xong: bỏ tick này thay vì xếp hàng chồng lên
+                            device.overruns += 1
+                            continue
+                        device.busy = True
+                        due.append(device)
+                for device in due:
+                    pool.submit(self.poll_device, device, tick)
+
+                if status_interval and now - last_report >= status_interval:
+                    self.log_lagging()
+                    last_report = now
+        finally:
+            self.running = False
+            if retention:
+                retention.stop()
+            # Bỏ các lần thu thập chưa bắt đầu, chờ các lần đang chạy rồi ghi nốt bộ đệm
+            pool.shutdown(wait=True, cancel_futures=True)
+            for device in self.devices:
+                device.disconnect()
+            self.writer.close()
+
+    def stop(self):
+        """Yêu cầu vòng thu thập dừng ở tick kế tiếp."""
+        self.running = False
+
+    def status(self):
+        """Trạng thái từng thiết bị; thiết bị chậm là thiết bị chưa có mẫu mới sau lag_factor chu kỳ."""
+        now = time.time()
+        monotonic_now = time.monotonic()
+        lag_limit = (self.interval or 0) * self.lag_factor
+        report = []
+        with self._lock:
+            for device in self.devices:
+                lag = now - device.last_sample if device.last_sample else None
+                if device.failures:
+                    state = 'backoff'
+                elif device.collector is None:
+                    state = 'connecting' if self.running else 'stopped'
+                elif lag is not None and lag > lag_limit:
+                    state = 'lagging'
+                else:
+                    state = 'ok'
+                report.append({
+                    'name': device.name,
+                    'host': device.host,
+                    'state': state,
+                    'interfaces': len(device.interface_ids),
+                    'lag_seconds': round(lag, 1) if lag is not None else None,
+                    'poll_seconds': round(device.poll_seconds, 3),
+                    'failures': device.failures,
+                    'overruns': device.overruns,
+                    'retry_in': round(max(0.0, device.next_attempt - monotonic_now), 1) if device.failures else None,
+                    'last_error': device.last_error
+                })
+        return report
+
+    def log_lagging(self):
+        """Ghi log danh sách thiết bị đang chậm hoặc không kết nối được."""
+        report = self.status()
+        lagging = [entry for entry in report if entry['state'] != 'ok']
+        if not lagging:
+            logger.info(f"Tất cả {len(report)} thiết bị đang ghi log đúng chu kỳ")
+            return
+        logger.warning(f"{len(lagging)}/{len(report)} thiết bị chậm hoặc lỗi:")
+        for entry in sorted(lagging, key=lambda e: (e['lag_seconds'] is None, -(e['lag_seconds'] or 0))):
+            lag = f"{entry['lag_seconds']}s" if entry['lag_seconds'] is not None else 'chưa có mẫu'
+            detail = f", lỗi: {entry['last_error']}" if entry['last_error'] else ''
+            logger.warning(f"  - {entry['name']} ({entry['host']}): {entry['state']}, trễ {lag}{detail}")
+
+    def collect_metrics(self):
+        """Collector metrics Prometheus về tình trạng thu thập của từng thiết bị."""
+        report = self.status()
+        labels = [({'device': entry['host'], 'site': entry['name']}, entry) for entry in report]
+        yield ('mikrotik_fleet_device_up', 'gauge', 'Thiết bị đang được thu thập bình thường (1) hay không (0)',
+               [(label, 1 if entry['state'] == 'ok' else 0) for label, entry in labels])
+        yield ('mikrotik_fleet_device_lag_seconds', 'gauge', 'Thời gian kể từ mẫu thành công gần nhất',
+               [(label, entry['lag_seconds']) for label, entry in labels])
+        yield ('mikrotik_fleet_device_poll_seconds', 'gauge', 'Thời gian của lần thu thập gần nhất',
+               [(label, entry['poll_seconds']) for label, entry in labels])
+        yield ('mikrotik_fleet_device_failures', 'gauge', 'Số lần lỗi liên tiếp',
+               [(label, entry['failures']) for label, entry in labels])
+
+
+def main():
+    """Hàm chính để chạy fleet logger."""
+    parser = argparse.ArgumentParser(description='MikroTik Fleet Traffic Logger')
+    parser.add_argument('--config', type=str, default='sites.json',
+                        help='File danh sách thiết bị: sites.json hoặc config/settings.yaml (mặc định: sites.json)')
+    parser.add_argument('--db', type=str, default='mikrotik_traffic.db', help='Tên file database (mặc định: mikrotik_traffic.db)')
+    parser.add_argument('--interval', type=int, default=5, help='Chu kỳ ghi log in giây (mặc định: 5)')
+    parser.add_argument('--workers', type=int, default=16, help='Số thiết bị thu thập đồng thời (mặc định: 16)')
+    parser.add_argument('--duration', type=int, help='Thời gian ghi log (giây), nếu không cung cấp thì ghi đến khi bị dừng')
+    parser.add_argument('--status-interval', type=int, default=60,
+                        help='Chu kỳ ghi log danh sách thiết bị chậm, giây (mặc định: 60, 0 để tắt)')
+    parser.add_argument('--metrics-port', type=int, help='Cổng HTTP phục vụ endpoint /metrics cho Prometheus (mặc định: tắt)')
+    parser.add_argument('--storage', choices=['rows', 'blocks'], default='rows',
+                        help='Cách lưu mẫu: rows (bảng traffic_data) hoặc blocks (block nén theo cột) (mặc định: rows)')
+    parser.add_argument('--retention', nargs='?', const=DEFAULT_RETENTION, metavar='SPEC',
+                        help=f'Bật tầng gộp và xóa dữ liệu hết hạn (bỏ trống: {DEFAULT_RETENTION})')
+    parser.add_argument('--anomaly-threshold', type=float, nargs='?', const=DEFAULT_THRESHOLD, metavar='SIGMA',
+                        help=f'Bật phát hiện bất thường trực tuyến với ngưỡng SIGMA độ lệch chuẩn (bỏ trống: {DEFAULT_THRESHOLD})')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.config):
+        logger.error(f"Không tìm thấy file cấu hình {args.config}")
+        sys.exit(1)
+
+    devices = load_devices(args.config)
+    if not devices:
+        logger.error("Không có thiết bị nào trong file cấu hình")
+        sys.exit(1)
+
+    fleet = FleetTrafficLogger(devices, db_file=args.db, workers=args.workers, storage=args.storage,
+                               retention=args.retention, anomaly_threshold=args.anomaly_threshold)
+
+    # Bật endpoint metrics nếu được yêu cầu
+    if args.metrics_port:
+        from mikrotik_metrics_exporter import MetricsRegistry, start_http_server
+        registry = MetricsRegistry()
+        registry.register(fleet.collect_metrics)
+        if fleet.detector:
+            registry.register(fleet.detector.collect_metrics)
+        start_http_server(registry, args.metrics_port)
+
+    print(f"Đang ghi log {len(devices)} thiết bị với chu kỳ {args.interval} giây vào {args.db}")
+    print("Ấn Ctrl+C để dừng ghi log.")
+    try:
+        fleet.run(interval=args.interval, duration=args.duration, status_interval=args.status_interval)
+    except KeyboardInterrupt:
+        print("\nĐã nhận tín hiệu dừng ghi log.")
+        fleet.stop()
+    finally:
+        print("\n=== TRẠNG THÁI THIẾT BỊ ===")
+        for entry in fleet.status():
+            lag = f"{entry['lag_seconds']}s" if entry['lag_seconds'] is not None else '-'
+            print(f"  - {entry['name']} ({entry['host']}): {entry['state']}, trễ {lag}, lỗi liên tiếp {entry['failures']}")
+
+
+if __name__ == "__main__":
+    print("=== MikroTik Fleet Traffic Logger ===")
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Nén response và xử lý request có điều kiện (ETag / 304) cho các ứng dụng FastAPI
+Module này cung cấp middleware nén gzip/brotli theo Accept-Encoding và ETag mạnh
+"""
+
+import gzip
+import hashlib
+import logging
+from typing import Any, Callable, Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+
+from mikrotik_json import FastJSONResponse
+
+logger = logging.getLogger("mikrotik_http_cache")
+
+# Brotli là tùy chọn, chỉ dùng khi đã cài đặt
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Chỉ nén các response đủ lớn, payload nhỏ nén không có lợi
+MIN_COMPRESS_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Hậu tố ETag theo từng kiểu mã hóa nội dung
+ENCODING_SUFFIXES = {'gzip': '-gz', 'br': '-br'}
+
+
+def make_etag(*parts) -> str:
+    """Tạo strong ETag từ nội dung hoặc các thành phần phiên bản snapshot."""
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        if not isinstance(part, (bytes, bytearray)):
+            part = repr(part).encode('utf-8')
+        digest.update(part)
+        digest.update(b'\x00')
+    return f'"{digest.hexdigest()}"'
+
+
+def _strip_etag(etag: str) -> str:
+    """Bỏ tiền tố weak và hậu tố mã hóa để so sánh ETag."""
+    etag = etag.strip()
+    if etag.startswith('W/'):
+        etag = etag[2:]
+    for suffix in ENCODING_SUFFIXES.values():
+        if etag.endswith(suffix + '"'):
+            return etag[:-len(suffix) - 1] + '"'
+    return etag
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Kiểm tra header If-None-Match có khớp với ETag hiện tại không."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    current = _strip_etag(etag)
+    return any(_strip_etag(candidate) == current for candidate in if_none_match.split(','))
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Chọn kiểu nén tốt nhất mà client chấp nhận (br hoặc gzip)."""
+    if not accept_encoding:
+        return None
+
+    accepted = {}
+    for item in accept_encoding.split(','):
+        token, _, params = item.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[token.strip().lower()] = quality
+
+    wildcard = accepted.get('*', 0.0)
+    candidates = ['br', 'gzip'] if brotli else ['gzip']
+    best = None
+    best_quality = 0.0
+    for encoding in candidates:
+        quality = accepted.get(encoding, wildcard)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    """Nén nội dung theo kiểu mã hóa đã chọn."""
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def conditional_json(request: Request, build: Callable[[], Any], *version_parts) -> Response:
+    """
+    Trả về JSON có ETag tính từ phiên bản snapshot.
+    Nếu client đã có bản mới nhất thì trả về 304 mà không cần dựng lại payload.
+    """
+    etag = make_etag(request.url.path, *version_parts)
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers={'ETag': etag, 'Vary': 'Accept-Encoding'})
+    return FastJSONResponse(content=build(), headers={'ETag': etag})
+
+
+def install(app):
+    """Đăng ký middleware nén và ETag cho ứng dụng FastAPI."""
+
+    @app.middleware("http")
+    async def http_cache_middleware(request: Request, call_next):
+        response = await call_next(request)
+
+        if request.method not in ('GET', 'HEAD') or response.status_code != 200:
+            return response
+        if not response.headers.get('content-type', '').startswith('application/json'):
+            return response
+        if 'content-encoding' in response.headers:
+            return response
+
+        body = b''.join([chunk async for chunk in response.body_iterator])
+        headers = {
+            key: value for key, value in response.headers.items()
+            if key.lower() not in ('content-length', 'etag', 'vary')
+        }
+        vary = response.headers.get('vary')
+        headers['Vary'] = f"{vary}, Accept-Encoding" if vary else 'Accept-Encoding'
+
+        # Route có thể tự đặt ETag từ phiên bản snapshot, nếu không thì băm nội dung
+        etag = response.headers.get('etag') or make_etag(body)
+
+        if etag_matches(request.headers.get('if-none-match'), etag):
+            headers.pop('content-type', None)
+            headers['ETag'] = etag
+            return Response(status_code=304, headers=headers)
+
+        encoding = negotiate_encoding(request.headers.get('accept-encoding'))
+        if encoding and len(body) >= MIN_COMPRESS_SIZE:
+            body = compress(body, encoding)
+            headers['Content-Encoding'] = encoding
+            etag = etag[:-1] + ENCODING_SUFFIXES[encoding] + '"'
+
+        headers['ETag'] = etag
+        return Response(content=body, status_code=response.status_code, headers=headers)
+
+    logger.info("Đã bật nén response và ETag cho các API JSON")
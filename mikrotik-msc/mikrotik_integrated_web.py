@@ -7,8 +7,8 @@ MikroTik Integrated Web Manager
 
 import os
 import sys
-import json
 import time
+import sqlite3
 import logging
 import asyncio
 import threading
@@ -27,7 +27,7 @@ logger = logging.getLogger("mikrotik_integrated_web")
 try:
     import routeros_api
     from fastapi import FastAPI, WebSocket, WebSocketDisconnect, BackgroundTasks, Request, Form, UploadFile, File
-    from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
+    from fastapi.responses import HTMLResponse, RedirectResponse, Response
     from fastapi.staticfiles import StaticFiles
     from fastapi.middleware.cors import CORSMiddleware
     from fastapi.templating import Jinja2Templates
@@ -37,6 +37,14 @@ except ImportError as e:
     logger.info("Chạy: pip install routeros-api fastapi uvicorn websockets jinja2")
     sys.exit(1)
 
+import mikrotik_http_cache
+from mikrotik_json import FastJSONResponse, PayloadCache
+from mikrotik_metrics_exporter import MetricsRegistry, monitor_collector, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from mikrotik_profiling import RequestProfiler, track_router_calls
+from mikrotik_sampling import TickScheduler, counter_rate
+from mikrotik_stats import InterfaceStats
+from mikrotik_timeseries import TimeSeriesQuery
+
 # Import các module quản lý
 try:
     from mikrotik_client_monitor import MikroTikClientMonitor
@@ -65,7 +73,9 @@ class MikroTikMonitor:
         self.api = None
         self.running = False
         self.data_history = {}  # Lịch sử dữ liệu theo interface
+        self.interface_stats = {}  # Thống kê trực tuyến (trung bình, phân vị, EWMA) theo interface
         self.device_info = {}   # Thông tin thiết bị
+        self.version = 0        # Phiên bản snapshot, tăng sau mỗi chu kỳ thu thập
         self.lock = threading.Lock()  # Lock để đồng bộ truy cập vào data
     
     def connect(self):
@@ -192,6 +202,7 @@ class MikroTikMonitor:
             return
         
         self.running = True
+        self.scheduler = TickScheduler(interval)
         self.monitor_thread = threading.Thread(target=self._monitor_loop, args=(interval,))
         self.monitor_thread.daemon = True
         self.monitor_thread.start()
@@ -200,6 +211,8 @@ class MikroTikMonitor:
     def stop_monitoring(self):
         """Dừng giám sát."""
         self.running = False
+        if hasattr(self, 'scheduler'):
+            self.scheduler.stop()
         if hasattr(self, 'monitor_thread'):
             self.monitor_thread.join(timeout=3)
         logger.info("Đã dừng giám sát")
@@ -212,7 +225,10 @@ class MikroTikMonitor:
         last_device_update = 0
         
         while self.running:
-            current_time = time.time()
+            # Chờ đến mốc chu kỳ kế tiếp (căn theo đồng hồ thực, bỏ qua tick đã lỡ)
+            current_time = self.scheduler.wait()
+            if current_time is None or not self.running:
+                break
             
             # Cập nhật thông tin thiết bị mỗi 10 giây
             if current_time - last_device_update >= 10:
@@ -222,10 +238,11 @@ class MikroTikMonitor:
             # Cập nhật dữ liệu traffic cho từng interface
             active_interfaces = self.get_active_interfaces()
             for iface in active_interfaces:
-                self._update_interface_data(iface['name'], interval)
+                self._update_interface_data(iface['name'], current_time)
             
-            # Ngủ đến lần cập nhật tiếp theo
-            time.sleep(interval)
+            # Đánh dấu snapshot mới để các API có thể trả về 304 khi không đổi
+            with self.lock:
+                self.version += 1
     
     def _init_interface_data(self):
         """Khởi tạo dữ liệu cho tất cả các interfaces."""
@@ -241,12 +258,13 @@ class MikroTikMonitor:
                     if traffic_data:
                         self.data_history[name] = {
                             'previous_data': traffic_data,
+                            'previous_time': time.monotonic(),
                             'history': [],
                             'max_history_length': 60  # Giữ 60 điểm dữ liệu
                         }
     
-    def _update_interface_data(self, interface_name, interval):
-        """Cập nhật dữ liệu cho một interface cụ thể."""
+    def _update_interface_data(self, interface_name, timestamp):
+        """Cập nhật dữ liệu cho một interface cụ thể tại mốc lấy mẫu timestamp."""
         if interface_name not in self.data_history:
             # Khởi tạo nếu chưa có
             traffic_data = self.get_interface_traffic(interface_name)
@@ -254,6 +272,7 @@ class MikroTikMonitor:
                 with self.lock:
                     self.data_history[interface_name] = {
                         'previous_data': traffic_data,
+                        'previous_time': time.monotonic(),
                         'history': [],
                         'max_history_length': 60
                     }
@@ -263,30 +282,19 @@ class MikroTikMonitor:
         current_data = self.get_interface_traffic(interface_name)
         if not current_data:
             return
+        now = time.monotonic()
         
         with self.lock:
             previous_data = self.data_history[interface_name]['previous_data']
-            if previous_data:
-                # Tính toán tốc độ dựa trên sự khác biệt
-                tx_bytes = current_data[0] - previous_data[0]
-                rx_bytes = current_data[1] - previous_data[1]
-                
-                # Bytes/giây
-                tx_bytes_per_second = tx_bytes / interval
-                rx_bytes_per_second = rx_bytes / interval
-                
-                # Bits/giây (1 byte = 8 bits)
-                tx_bits_per_second = tx_bytes_per_second * 8
-                rx_bits_per_second = rx_bytes_per_second * 8
-                
-                # Chuyển đổi sang KB/s và MB/s
-                tx_kbps = tx_bits_per_second / 1024
-                rx_kbps = rx_bits_per_second / 1024
+            elapsed = now - self.data_history[interface_name]['previous_time']
+            if previous_data and elapsed > 0:
+                # Tốc độ tính trên thời gian đo thực tế, xử lý tràn và reset bộ đếm
+                tx_kbps = counter_rate(current_data[0], previous_data[0], elapsed)
+                rx_kbps = counter_rate(current_data[1], previous_data[1], elapsed)
                 tx_mbps = tx_kbps / 1024
                 rx_mbps = rx_kbps / 1024
                 
                 # Thêm vào lịch sử
-                timestamp = time.time()
                 self.data_history[interface_name]['history'].append({
                     'timestamp': timestamp,
                     'tx_kbps': tx_kbps,
@@ -299,9 +307,16 @@ class MikroTikMonitor:
                 max_length = self.data_history[interface_name]['max_history_length']
                 if len(self.data_history[interface_name]['history']) > max_length:
                     self.data_history[interface_name]['history'] = self.data_history[interface_name]['history'][-max_length:]
+                
+                # Thống kê từ khi bắt đầu giám sát, bộ nhớ cố định
+                stats = self.interface_stats.get(interface_name)
+                if stats is None:
+                    stats = self.interface_stats[interface_name] = InterfaceStats()
+                stats.add(timestamp, tx_kbps, rx_kbps)
             
             # Cập nhật dữ liệu trước đó
             self.data_history[interface_name]['previous_data'] = current_data
+            self.data_history[interface_name]['previous_time'] = now
     
     def get_current_data(self):
         """Lấy dữ liệu mới nhất về thiết bị và traffic."""
@@ -317,7 +332,8 @@ class MikroTikMonitor:
                     latest = data['history'][-1]
                     result['interfaces'][name] = {
                         'current': latest,
-                        'history': data['history']
+                        'history': data['history'],
+                        'stats': self.interface_stats[name].summary()
                     }
             
             return result
@@ -345,7 +361,7 @@ class ConnectionManager:
 
 
 # Khởi tạo ứng dụng FastAPI
-app = FastAPI(title="MikroTik Integrated Web Manager")
+app = FastAPI(title="MikroTik Integrated Web Manager", default_response_class=FastJSONResponse)
 
 # Thêm CORS middleware
 app.add_middleware(
@@ -356,20 +372,64 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Nén response JSON và hỗ trợ ETag / 304 Not Modified
+mikrotik_http_cache.install(app)
+
 # Khởi tạo connection manager
 manager = ConnectionManager()
 
+# Registry metrics Prometheus, chỉ đọc từ dữ liệu đã thu thập trong bộ nhớ
+metrics_registry = MetricsRegistry()
+
+# Profiler theo yêu cầu, bật qua /api/admin/profile
+request_profiler = RequestProfiler(os.getenv('PROFILE_DIR', 'profiles'))
+# Bearer token bảo vệ các endpoint profiler (như METRICS_TOKEN của ứng dụng Flask)
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN')
+
+# Truy vấn lịch sử traffic từ database của traffic logger
+traffic_series = TimeSeriesQuery(os.getenv('TRAFFIC_DB', 'mikrotik_traffic.db'))
+metrics_registry.register(traffic_series.collect_metrics)
+
+
+@app.middleware("http")
+async def request_metrics_middleware(request: Request, call_next):
+    """Ghi nhận độ trễ và số lần gọi router của mỗi request theo route."""
+    router_calls = track_router_calls()
+    profile = request_profiler.start() if request_profiler.armed else None
+    start_time = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - start_time
+        route_path = getattr(request.scope.get('route'), 'path', 'unmatched')
+        metrics_registry.request_latency.observe(request.method, route_path, status_code, elapsed)
+        metrics_registry.router_calls.observe(request.method, route_path, status_code, router_calls[0])
+        if profile is not None:
+            request_profiler.finish(profile, request.method, route_path, elapsed, router_calls[0])
+
 # Thiết lập thư mục templates
 templates = Jinja2Templates(directory="templates")
 
-# Thiết lập thư mục static
-app.mount("/static", StaticFiles(directory="static"), name="static")
-
-# Tạo thư mục templates và static nếu chưa tồn tại
-os.makedirs("templates", exist_ok=True)
-os.makedirs("static", exist_ok=True)
-os.makedirs("static/css", exist_ok=True)
-os.makedirs("static/js", exist_ok=True)
+# Thiết lập thư mục static (thư mục được tạo ở bước khởi tạo template)
+app.mount("/static", StaticFiles(directory="static", check_dir=False), name="static")
+
+# Các file được sinh bởi create_template_files()
+TEMPLATE_FILES = [
+    "static/css/style.css",
+    "static/js/main.js",
+    "templates/index.html",
+    "templates/monitor.html",
+    "templates/clients.html",
+    "templates/sites.html",
+    "templates/firewall.html",
+    "templates/capsman.html",
+    "templates/backup.html",
+    "templates/vpn.html",
+    "templates/settings.html",
+]
 
 # Biến globals
 site_manager = None    # Site Manager
@@ -381,6 +441,26 @@ capsman_manager = None   # CAPsMAN Manager
 backup_manager = None    # Backup Manager
 vpn_manager = None       # VPN Manager
 
+
+def get_active_monitors():
+    """Lấy danh sách monitor của các site đang kết nối."""
+    if not site_manager:
+        return []
+    return [site.monitor for site in site_manager.sites.values() if site.monitor and site.is_connected()]
+
+
+metrics_registry.register(monitor_collector(get_active_monitors))
+
+
+def record_client_count(kind, count):
+    """Cập nhật gauge số lượng client của site hiện tại."""
+    metrics_registry.set_gauge(
+        'mikrotik_clients',
+        count,
+        labels={'device': mikrotik_monitor.host if mikrotik_monitor else (current_site or ''), 'kind': kind},
+        help_text='Số lượng client theo lần truy vấn gần nhất'
+    )
+
 # Trang HTML Dashboard
 @app.get("/", response_class=HTMLResponse)
 async def get_dashboard(request: Request):
@@ -435,6 +515,10 @@ async def get_settings_page(request: Request):
     """Trả về trang cài đặt."""
     return templates.TemplateResponse("settings.html", {"request": request})
 
+# Payload WebSocket đã mã hóa, dùng chung cho mọi client
+ws_payload_cache = PayloadCache()
+
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     """Endpoint WebSocket để gửi dữ liệu theo thời gian thực."""
@@ -442,12 +526,13 @@ async def websocket_endpoint(websocket: WebSocket):
     try:
         while True:
             if mikrotik_monitor:
-                # Lấy dữ liệu mới nhất
-                data = mikrotik_monitor.get_current_data()
+                # Lấy dữ liệu mới nhất, chỉ mã hóa lại khi monitor có snapshot mới
+                monitor = mikrotik_monitor
+                payload = ws_payload_cache.get((monitor, monitor.version), monitor.get_current_data)
                 
                 # Gửi dữ liệu qua WebSocket
-                if data:
-                    await websocket.send_text(json.dumps(data))
+                if payload:
+                    await websocket.send_text(payload)
             
             # Đợi 1 giây trước khi gửi dữ liệu mới
             await asyncio.sleep(1)
@@ -459,6 +544,34 @@ async def websocket_endpoint(websocket: WebSocket):
         manager.disconnect(websocket)
 
 
+@app.get("/metrics")
+async def get_metrics():
+    """Endpoint metrics cho Prometheus."""
+    return Response(content=metrics_registry.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+def _profile_authorized(request: Request):
+    """Kiểm tra bearer token của endpoint profiler khi có cấu hình PROFILE_TOKEN."""
+    return not PROFILE_TOKEN or request.headers.get('Authorization') == f'Bearer {PROFILE_TOKEN}'
+
+
+@app.get("/api/admin/profile")
+async def api_profile_status(request: Request):
+    """Trạng thái profiler và danh sách file profile đã lưu."""
+    if not _profile_authorized(request):
+        return FastJSONResponse(content={"success": False, "message": "Unauthorized"}, status_code=401)
+    return request_profiler.status()
+
+
+@app.post("/api/admin/profile")
+async def api_profile_arm(request: Request, requests: int = Form(10)):
+    """Bật cProfile cho N request kế tiếp (0 để tắt, tối đa MAX_ARMED_REQUESTS)."""
+    if not _profile_authorized(request):
+        return FastJSONResponse(content={"success": False, "message": "Unauthorized"}, status_code=401)
+    remaining = request_profiler.arm(requests)
+    return {"success": True, "remaining": remaining, "output_dir": request_profiler.output_dir}
+
+
 # API ENDPOINT SITES
 @app.get("/api/sites")
 async def api_get_sites():
@@ -466,10 +579,10 @@ async def api_get_sites():
     global site_manager
     
     if not site_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo Site Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Site Manager"}, status_code=500)
     
     sites = site_manager.get_sites()
-    return JSONResponse(content={"sites": sites})
+    return FastJSONResponse(content={"sites": sites})
 
 @app.post("/api/sites/add")
 async def api_add_site(
@@ -483,13 +596,13 @@ async def api_add_site(
     global site_manager
     
     if not site_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo Site Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Site Manager"}, status_code=500)
     
     result = site_manager.add_site(name, host, username, password, description)
     if result:
-        return JSONResponse(content={"success": True, "message": f"Đã thêm site {name}"})
+        return FastJSONResponse(content={"success": True, "message": f"Đã thêm site {name}"})
     else:
-        return JSONResponse(content={"success": False, "message": "Không thể thêm site"}, status_code=500)
+        return FastJSONResponse(content={"success": False, "message": "Không thể thêm site"}, status_code=500)
 
 @app.post("/api/sites/remove")
 async def api_remove_site(name: str = Form(...)):
@@ -497,13 +610,13 @@ async def api_remove_site(name: str = Form(...)):
     global site_manager
     
     if not site_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo Site Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Site Manager"}, status_code=500)
     
     result = site_manager.remove_site(name)
     if result:
-        return JSONResponse(content={"success": True, "message": f"Đã xóa site {name}"})
+        return FastJSONResponse(content={"success": True, "message": f"Đã xóa site {name}"})
     else:
-        return JSONResponse(content={"success": False, "message": "Không thể xóa site"}, status_code=500)
+        return FastJSONResponse(content={"success": False, "message": "Không thể xóa site"}, status_code=500)
 
 @app.post("/api/sites/connect")
 async def api_connect_site(name: str = Form(...)):
@@ -511,7 +624,7 @@ async def api_connect_site(name: str = Form(...)):
     global site_manager, current_site, mikrotik_monitor, client_monitor, firewall_manager, capsman_manager, backup_manager, vpn_manager
     
     if not site_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo Site Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Site Manager"}, status_code=500)
     
     # Ngắt kết nối site hiện tại nếu có
     if current_site:
@@ -537,9 +650,9 @@ async def api_connect_site(name: str = Form(...)):
         capsman_manager = site.capsman_manager
         backup_manager = site.backup_manager
         
-        return JSONResponse(content={"success": True, "message": f"Đã kết nối đến site {name}"})
+        return FastJSONResponse(content={"success": True, "message": f"Đã kết nối đến site {name}"})
     else:
-        return JSONResponse(content={"success": False, "message": "Không thể kết nối đến site"}, status_code=500)
+        return FastJSONResponse(content={"success": False, "message": "Không thể kết nối đến site"}, status_code=500)
 
 @app.post("/api/sites/disconnect")
 async def api_disconnect_site(name: str = Form(...)):
@@ -547,7 +660,7 @@ async def api_disconnect_site(name: str = Form(...)):
     global site_manager, current_site, mikrotik_monitor, client_monitor, firewall_manager, capsman_manager, backup_manager, vpn_manager
     
     if not site_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo Site Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Site Manager"}, status_code=500)
     
     result = site_manager.disconnect_site(name)
     
@@ -562,42 +675,72 @@ async def api_disconnect_site(name: str = Form(...)):
         vpn_manager = None
         
     if result:
-        return JSONResponse(content={"success": True, "message": f"Đã ngắt kết nối khỏi site {name}"})
+        return FastJSONResponse(content={"success": True, "message": f"Đã ngắt kết nối khỏi site {name}"})
     else:
-        return JSONResponse(content={"success": False, "message": "Không thể ngắt kết nối khỏi site"}, status_code=500)
+        return FastJSONResponse(content={"success": False, "message": "Không thể ngắt kết nối khỏi site"}, status_code=500)
 
 # API ENDPOINTS DEVICE INFO
 @app.get("/api/device-info")
-async def get_device_info():
+async def get_device_info(request: Request):
     """API endpoint để lấy thông tin thiết bị."""
     if not mikrotik_monitor:
-        return JSONResponse(content={"error": "Chưa kết nối đến thiết bị"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa kết nối đến thiết bị"}, status_code=500)
     
-    device_info = mikrotik_monitor.device_info
-    return JSONResponse(content=device_info)
+    monitor = mikrotik_monitor
+    return mikrotik_http_cache.conditional_json(
+        request, lambda: monitor.device_info, monitor.host, monitor.version
+    )
 
 
 @app.get("/api/interfaces")
 async def get_interfaces():
     """API endpoint để lấy danh sách interfaces."""
     if not mikrotik_monitor:
-        return JSONResponse(content={"error": "Chưa kết nối đến thiết bị"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa kết nối đến thiết bị"}, status_code=500)
     
     interfaces = mikrotik_monitor.get_interfaces()
-    return JSONResponse(content=interfaces)
+    return FastJSONResponse(content=interfaces)
 
 
 @app.get("/api/traffic/{interface_name}")
-async def get_interface_traffic(interface_name: str):
+async def get_interface_traffic(interface_name: str, request: Request):
     """API endpoint để lấy dữ liệu traffic của một interface cụ thể."""
     if not mikrotik_monitor:
-        return JSONResponse(content={"error": "Chưa kết nối đến thiết bị"}, status_code=500)
-    
-    with mikrotik_monitor.lock:
-        if interface_name in mikrotik_monitor.data_history:
-            return JSONResponse(content=mikrotik_monitor.data_history[interface_name])
+        return FastJSONResponse(content={"error": "Chưa kết nối đến thiết bị"}, status_code=500)
+    
+    monitor = mikrotik_monitor
+    with monitor.lock:
+        if interface_name in monitor.data_history:
+            # ETag theo phiên bản snapshot, chỉ dựng lại payload khi có dữ liệu mới
+            return mikrotik_http_cache.conditional_json(
+                request, lambda: monitor.data_history[interface_name], monitor.host, monitor.version
+            )
         else:
-            return JSONResponse(content={"error": f"Không tìm thấy interface {interface_name}"}, status_code=404)
+            return FastJSONResponse(content={"error": f"Không tìm thấy interface {interface_name}"}, status_code=404)
+
+
+@app.get("/api/traffic/{device}/{interface}")
+async def get_traffic_series(device: str, interface: str, request: Request):
+    """
+    API endpoint chuỗi traffic đã gộp từ database của traffic logger.
+    Tham số: from, to (epoch, ngày giờ ISO hoặc khoảng lùi như -7d; mặc định 24 giờ gần nhất),
+    step (giây hoặc 5m, 1h; mặc định tự chọn) và agg (avg, min, max, p95, sum).
+    """
+    params = request.query_params
+    try:
+        version, payload = await asyncio.to_thread(
+            traffic_series.query, device, interface,
+            params.get('from'), params.get('to'), params.get('step'), params.get('agg', 'avg')
+        )
+    except ValueError as e:
+        return FastJSONResponse(content={"error": str(e)}, status_code=400)
+    except LookupError as e:
+        return FastJSONResponse(content={"error": str(e)}, status_code=404)
+    except sqlite3.Error as e:
+        logger.error(f"Lỗi khi truy vấn database traffic: {e}")
+        return FastJSONResponse(content={"error": f"Lỗi khi truy vấn database traffic: {e}"}, status_code=500)
+    # Kết quả được cache theo cửa sổ, ETag theo phiên bản cache để trình duyệt nhận 304 khi tải lại
+    return mikrotik_http_cache.conditional_json(request, lambda: payload, *version)
 
 
 # CLIENTS API ENDPOINTS
@@ -607,10 +750,11 @@ async def get_clients():
     global client_monitor
     
     if not client_monitor:
-        return JSONResponse(content={"error": "Chưa khởi tạo Client Monitor"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Client Monitor"}, status_code=500)
     
     clients = client_monitor.get_all_clients()
-    return JSONResponse(content={"clients": clients})
+    record_client_count('all', len(clients or []))
+    return FastJSONResponse(content={"clients": clients})
 
 
 @app.get("/api/clients/wireless")
@@ -619,10 +763,11 @@ async def get_wireless_clients():
     global client_monitor
     
     if not client_monitor:
-        return JSONResponse(content={"error": "Chưa khởi tạo Client Monitor"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Client Monitor"}, status_code=500)
     
     clients = client_monitor.get_wireless_clients()
-    return JSONResponse(content={"clients": clients})
+    record_client_count('wireless', len(clients or []))
+    return FastJSONResponse(content={"clients": clients})
 
 
 @app.get("/api/clients/dhcp")
@@ -631,10 +776,11 @@ async def get_dhcp_leases():
     global client_monitor
     
     if not client_monitor:
-        return JSONResponse(content={"error": "Chưa khởi tạo Client Monitor"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Client Monitor"}, status_code=500)
     
     leases = client_monitor.get_dhcp_leases()
-    return JSONResponse(content={"leases": leases})
+    record_client_count('dhcp', len(leases or []))
+    return FastJSONResponse(content={"leases": leases})
 
 
 @app.get("/api/clients/blocked")
@@ -643,10 +789,10 @@ async def get_blocked_clients():
     global client_monitor
     
     if not client_monitor:
-        return JSONResponse(content={"error": "Chưa khởi tạo Client Monitor"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Client Monitor"}, status_code=500)
     
     blocked = client_monitor.get_blocked_clients()
-    return JSONResponse(content={"blocked": blocked})
+    return FastJSONResponse(content={"blocked": blocked})
 
 
 @app.post("/api/clients/block")
@@ -655,16 +801,16 @@ async def block_client(ip: str = Form(None), mac: str = Form(None), comment: str
     global client_monitor
     
     if not client_monitor:
-        return JSONResponse(content={"error": "Chưa khởi tạo Client Monitor"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Client Monitor"}, status_code=500)
     
     if not ip and not mac:
-        return JSONResponse(content={"error": "Phải cung cấp IP hoặc MAC address"}, status_code=400)
+        return FastJSONResponse(content={"error": "Phải cung cấp IP hoặc MAC address"}, status_code=400)
     
     result = client_monitor.block_client(ip, mac, comment)
     if result:
-        return JSONResponse(content={"success": True, "message": f"Đã block client {ip or mac}"})
+        return FastJSONResponse(content={"success": True, "message": f"Đã block client {ip or mac}"})
     else:
-        return JSONResponse(content={"success": False, "message": "Không thể block client"}, status_code=500)
+        return FastJSONResponse(content={"success": False, "message": "Không thể block client"}, status_code=500)
 
 
 @app.post("/api/clients/unblock")
@@ -673,16 +819,16 @@ async def unblock_client(ip: str = Form(None), mac: str = Form(None)):
     global client_monitor
     
     if not client_monitor:
-        return JSONResponse(content={"error": "Chưa khởi tạo Client Monitor"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Client Monitor"}, status_code=500)
     
     if not ip and not mac:
-        return JSONResponse(content={"error": "Phải cung cấp IP hoặc MAC address"}, status_code=400)
+        return FastJSONResponse(content={"error": "Phải cung cấp IP hoặc MAC address"}, status_code=400)
     
     result = client_monitor.unblock_client(ip, mac)
     if result:
-        return JSONResponse(content={"success": True, "message": f"Đã unblock client {ip or mac}"})
+        return FastJSONResponse(content={"success": True, "message": f"Đã unblock client {ip or mac}"})
     else:
-        return JSONResponse(content={"success": False, "message": "Không thể unblock client"}, status_code=500)
+        return FastJSONResponse(content={"success": False, "message": "Không thể unblock client"}, status_code=500)
 
 
 # FIREWALL API ENDPOINTS
@@ -692,10 +838,10 @@ async def get_filter_rules():
     global firewall_manager
     
     if not firewall_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo Firewall Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Firewall Manager"}, status_code=500)
     
     rules = firewall_manager.get_filter_rules()
-    return JSONResponse(content={"rules": rules})
+    return FastJSONResponse(content={"rules": rules})
 
 
 @app.get("/api/firewall/nat")
@@ -704,10 +850,10 @@ async def get_nat_rules():
     global firewall_manager
     
     if not firewall_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo Firewall Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Firewall Manager"}, status_code=500)
     
     rules = firewall_manager.get_nat_rules()
-    return JSONResponse(content={"rules": rules})
+    return FastJSONResponse(content={"rules": rules})
 
 
 @app.get("/api/firewall/address-list")
@@ -716,10 +862,10 @@ async def get_address_lists():
     global firewall_manager
     
     if not firewall_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo Firewall Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Firewall Manager"}, status_code=500)
     
     lists = firewall_manager.get_address_lists()
-    return JSONResponse(content={"lists": lists})
+    return FastJSONResponse(content={"lists": lists})
 
 
 @app.post("/api/firewall/filter/add")
@@ -738,7 +884,7 @@ async def add_filter_rule(
     global firewall_manager
     
     if not firewall_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo Firewall Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Firewall Manager"}, status_code=500)
     
     result = firewall_manager.add_filter_rule(
         chain=chain,
@@ -753,9 +899,9 @@ async def add_filter_rule(
     )
     
     if result:
-        return JSONResponse(content={"success": True, "message": "Đã thêm filter rule"})
+        return FastJSONResponse(content={"success": True, "message": "Đã thêm filter rule"})
     else:
-        return JSONResponse(content={"success": False, "message": "Không thể thêm filter rule"}, status_code=500)
+        return FastJSONResponse(content={"success": False, "message": "Không thể thêm filter rule"}, status_code=500)
 
 
 @app.post("/api/firewall/port-forward/add")
@@ -771,7 +917,7 @@ async def add_port_forward(
     global firewall_manager
     
     if not firewall_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo Firewall Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Firewall Manager"}, status_code=500)
     
     result = firewall_manager.add_port_forward(
         dst_port=dst_port,
@@ -783,9 +929,9 @@ async def add_port_forward(
     )
     
     if result:
-        return JSONResponse(content={"success": True, "message": "Đã thêm port forward rule"})
+        return FastJSONResponse(content={"success": True, "message": "Đã thêm port forward rule"})
     else:
-        return JSONResponse(content={"success": False, "message": "Không thể thêm port forward rule"}, status_code=500)
+        return FastJSONResponse(content={"success": False, "message": "Không thể thêm port forward rule"}, status_code=500)
 
 
 @app.post("/api/firewall/rule/remove")
@@ -794,14 +940,14 @@ async def remove_firewall_rule(rule_type: str = Form(...), rule_id: str = Form(.
     global firewall_manager
     
     if not firewall_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo Firewall Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Firewall Manager"}, status_code=500)
     
     result = firewall_manager.remove_firewall_rule(rule_type, rule_id)
     
     if result:
-        return JSONResponse(content={"success": True, "message": f"Đã xóa {rule_type} rule với ID {rule_id}"})
+        return FastJSONResponse(content={"success": True, "message": f"Đã xóa {rule_type} rule với ID {rule_id}"})
     else:
-        return JSONResponse(content={"success": False, "message": "Không thể xóa rule"}, status_code=500)
+        return FastJSONResponse(content={"success": False, "message": "Không thể xóa rule"}, status_code=500)
 
 
 # CAPSMAN API ENDPOINTS
@@ -811,10 +957,10 @@ async def get_capsman_status():
     global capsman_manager
     
     if not capsman_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo CAPsMAN Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo CAPsMAN Manager"}, status_code=500)
     
     enabled = capsman_manager.check_capsman_enabled()
-    return JSONResponse(content={"enabled": enabled})
+    return FastJSONResponse(content={"enabled": enabled})
 
 
 @app.post("/api/capsman/enable")
@@ -823,15 +969,15 @@ async def enable_capsman(enabled: bool = Form(True)):
     global capsman_manager
     
     if not capsman_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo CAPsMAN Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo CAPsMAN Manager"}, status_code=500)
     
     result = capsman_manager.enable_capsman(enabled)
     
     if result:
         status = "bật" if enabled else "tắt"
-        return JSONResponse(content={"success": True, "message": f"Đã {status} CAPsMAN"})
+        return FastJSONResponse(content={"success": True, "message": f"Đã {status} CAPsMAN"})
     else:
-        return JSONResponse(content={"success": False, "message": f"Không thể {'bật' if enabled else 'tắt'} CAPsMAN"}, status_code=500)
+        return FastJSONResponse(content={"success": False, "message": f"Không thể {'bật' if enabled else 'tắt'} CAPsMAN"}, status_code=500)
 
 
 @app.get("/api/capsman/profiles")
@@ -840,10 +986,10 @@ async def get_configuration_profiles():
     global capsman_manager
     
     if not capsman_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo CAPsMAN Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo CAPsMAN Manager"}, status_code=500)
     
     profiles = capsman_manager.get_configuration_profiles()
-    return JSONResponse(content={"profiles": profiles})
+    return FastJSONResponse(content={"profiles": profiles})
 
 
 @app.get("/api/capsman/aps")
@@ -852,10 +998,10 @@ async def get_access_points():
     global capsman_manager
     
     if not capsman_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo CAPsMAN Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo CAPsMAN Manager"}, status_code=500)
     
     aps = capsman_manager.get_access_points()
-    return JSONResponse(content={"access_points": aps})
+    return FastJSONResponse(content={"access_points": aps})
 
 
 @app.post("/api/capsman/profile/add")
@@ -870,14 +1016,14 @@ async def add_configuration_profile(
     global capsman_manager
     
     if not capsman_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo CAPsMAN Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo CAPsMAN Manager"}, status_code=500)
     
     result = capsman_manager.add_configuration_profile(name, ssid, security, passphrase, datapath)
     
     if result:
-        return JSONResponse(content={"success": True, "message": f"Đã thêm configuration profile {name}"})
+        return FastJSONResponse(content={"success": True, "message": f"Đã thêm configuration profile {name}"})
     else:
-        return JSONResponse(content={"success": False, "message": "Không thể thêm configuration profile"}, status_code=500)
+        return FastJSONResponse(content={"success": False, "message": "Không thể thêm configuration profile"}, status_code=500)
 
 
 @app.post("/api/capsman/ap/reboot")
@@ -886,14 +1032,14 @@ async def reboot_access_point(mac: str = Form(...)):
     global capsman_manager
     
     if not capsman_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo CAPsMAN Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo CAPsMAN Manager"}, status_code=500)
     
     result = capsman_manager.reboot_access_point(mac)
     
     if result:
-        return JSONResponse(content={"success": True, "message": f"Đã gửi lệnh khởi động lại Access Point {mac}"})
+        return FastJSONResponse(content={"success": True, "message": f"Đã gửi lệnh khởi động lại Access Point {mac}"})
     else:
-        return JSONResponse(content={"success": False, "message": "Không thể khởi động lại Access Point"}, status_code=500)
+        return FastJSONResponse(content={"success": False, "message": "Không thể khởi động lại Access Point"}, status_code=500)
 
 
 # BACKUP API ENDPOINTS
@@ -903,10 +1049,10 @@ async def list_backups():
     global backup_manager
     
     if not backup_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo Backup Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Backup Manager"}, status_code=500)
     
     backups = backup_manager.list_backups()
-    return JSONResponse(content={"backups": backups})
+    return FastJSONResponse(content={"backups": backups})
 
 
 @app.get("/api/backup/exports")
@@ -915,10 +1061,10 @@ async def list_exports():
     global backup_manager
     
     if not backup_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo Backup Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Backup Manager"}, status_code=500)
     
     exports = backup_manager.list_exports()
-    return JSONResponse(content={"exports": exports})
+    return FastJSONResponse(content={"exports": exports})
 
 
 @app.post("/api/backup/create")
@@ -927,14 +1073,14 @@ async def create_backup(name: str = Form(None), include_sensitive: bool = Form(F
     global backup_manager
     
     if not backup_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo Backup Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Backup Manager"}, status_code=500)
     
     result = backup_manager.create_backup(name, include_sensitive)
     
     if result:
-        return JSONResponse(content={"success": True, "message": "Đã tạo backup thành công"})
+        return FastJSONResponse(content={"success": True, "message": "Đã tạo backup thành công"})
     else:
-        return JSONResponse(content={"success": False, "message": "Không thể tạo backup"}, status_code=500)
+        return FastJSONResponse(content={"success": False, "message": "Không thể tạo backup"}, status_code=500)
 
 
 @app.post("/api/backup/export")
@@ -947,14 +1093,14 @@ async def create_export(
     global backup_manager
     
     if not backup_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo Backup Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Backup Manager"}, status_code=500)
     
     result = backup_manager.create_export(name, compact, include_sensitive)
     
     if result:
-        return JSONResponse(content={"success": True, "message": "Đã xuất cấu hình thành công"})
+        return FastJSONResponse(content={"success": True, "message": "Đã xuất cấu hình thành công"})
     else:
-        return JSONResponse(content={"success": False, "message": "Không thể xuất cấu hình"}, status_code=500)
+        return FastJSONResponse(content={"success": False, "message": "Không thể xuất cấu hình"}, status_code=500)
 
 
 @app.post("/api/backup/restore")
@@ -963,14 +1109,14 @@ async def restore_backup(file: str = Form(...)):
     global backup_manager
     
     if not backup_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo Backup Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Backup Manager"}, status_code=500)
     
     result = backup_manager.restore_backup(file)
     
     if result:
-        return JSONResponse(content={"success": True, "message": "Đã gửi lệnh khôi phục backup thành công"})
+        return FastJSONResponse(content={"success": True, "message": "Đã gửi lệnh khôi phục backup thành công"})
     else:
-        return JSONResponse(content={"success": False, "message": "Không thể khôi phục từ backup"}, status_code=500)
+        return FastJSONResponse(content={"success": False, "message": "Không thể khôi phục từ backup"}, status_code=500)
 
 
 @app.post("/api/backup/upload")
@@ -979,7 +1125,7 @@ async def upload_backup(backup_file: UploadFile = File(...)):
     global backup_manager
     
     if not backup_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo Backup Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Backup Manager"}, status_code=500)
     
     # Lưu file tạm thời
     temp_file_path = os.path.join(backup_manager.backup_dir, backup_file.filename)
@@ -991,9 +1137,9 @@ async def upload_backup(backup_file: UploadFile = File(...)):
     result = backup_manager.upload_backup(temp_file_path)
     
     if result:
-        return JSONResponse(content={"success": True, "message": f"Đã tải lên file {backup_file.filename} thành công"})
+        return FastJSONResponse(content={"success": True, "message": f"Đã tải lên file {backup_file.filename} thành công"})
     else:
-        return JSONResponse(content={"success": False, "message": "Không thể tải lên file backup"}, status_code=500)
+        return FastJSONResponse(content={"success": False, "message": "Không thể tải lên file backup"}, status_code=500)
 
 
 # API Endpoints cho VPN
@@ -1001,7 +1147,7 @@ async def upload_backup(backup_file: UploadFile = File(...)):
 async def get_vpn_overview():
     """API endpoint để lấy tổng quan về VPN."""
     if not vpn_manager:
-        return JSONResponse(content={"error": "VPN Manager chưa được khởi tạo"}, status_code=500)
+        return FastJSONResponse(content={"error": "VPN Manager chưa được khởi tạo"}, status_code=500)
     
     try:
         # Lấy thông tin từ các hàm khác nhau
@@ -1043,10 +1189,10 @@ async def get_vpn_overview():
             }
         }
         
-        return JSONResponse(content=response)
+        return FastJSONResponse(content=response)
     except Exception as e:
         logger.error(f"Lỗi khi lấy thông tin VPN: {e}")
-        return JSONResponse(content={"error": f"Lỗi khi lấy thông tin VPN: {e}"}, status_code=500)
+        return FastJSONResponse(content={"error": f"Lỗi khi lấy thông tin VPN: {e}"}, status_code=500)
 
 @app.post("/api/vpn/add-user")
 async def add_vpn_user(
@@ -1060,7 +1206,7 @@ async def add_vpn_user(
 ):
     """API endpoint để thêm PPP user."""
     if not vpn_manager:
-        return JSONResponse(content={"error": "VPN Manager chưa được khởi tạo"}, status_code=500)
+        return FastJSONResponse(content={"error": "VPN Manager chưa được khởi tạo"}, status_code=500)
     
     try:
         vpn_manager.add_ppp_user(
@@ -1073,10 +1219,10 @@ async def add_vpn_user(
             comment=comment
         )
         
-        return JSONResponse(content={"success": True, "message": f"Đã thêm PPP user {name}"})
+        return FastJSONResponse(content={"success": True, "message": f"Đã thêm PPP user {name}"})
     except Exception as e:
         logger.error(f"Lỗi khi thêm PPP user: {e}")
-        return JSONResponse(content={"error": f"Lỗi khi thêm PPP user: {e}"}, status_code=500)
+        return FastJSONResponse(content={"error": f"Lỗi khi thêm PPP user: {e}"}, status_code=500)
 
 
 @app.on_event("startup")
@@ -1088,8 +1234,8 @@ async def startup_event():
     site_manager = SiteManager()
     logger.info(f"Đã khởi tạo Site Manager")
     
-    # Tạo file templates
-    create_template_files()
+    # Chỉ tạo file templates ở lần chạy đầu tiên
+    ensure_template_files()
 
 
 @app.on_event("shutdown")
@@ -1102,9 +1248,24 @@ async def shutdown_event():
         site_manager.disconnect_site(current_site)
         logger.info(f"Đã ngắt kết nối từ site {current_site}")
         
+    traffic_series.close()
     logger.info("Đã ngắt kết nối từ thiết bị MikroTik")
 
 
+def ensure_template_files(force=False):
+    """Tạo các file template nếu còn thiếu, hoặc tạo lại khi force=True."""
+    missing = [path for path in TEMPLATE_FILES if not os.path.exists(path)]
+    if not force and not missing:
+        return False
+    
+    for directory in ("templates", "static/css", "static/js"):
+        os.makedirs(directory, exist_ok=True)
+    
+    create_template_files()
+    logger.info(f"Đã tạo {len(TEMPLATE_FILES)} file template và static")
+    return True
+
+
 def create_template_files():
     """Tạo các file template mặc định."""
     # Tạo file CSS
@@ -2615,8 +2776,19 @@ def main():
     parser = argparse.ArgumentParser(description='MikroTik Integrated Web Manager')
     parser.add_argument('--host', type=str, default='0.0.0.0', help='Host to bind (default: 0.0.0.0)')
     parser.add_argument('--port', type=int, default=5000, help='Port to bind (default: 5000)')
+    parser.add_argument('--init-templates', action='store_true', help='Tạo lại các file template và static rồi thoát')
+    parser.add_argument('--db', type=str, default=None,
+                        help='Database của traffic logger cho /api/traffic/{device}/{interface} (mặc định: biến TRAFFIC_DB hoặc mikrotik_traffic.db)')
     args = parser.parse_args()
     
+    if args.db:
+        traffic_series.db_file = args.db
+    
+    if args.init_templates:
+        ensure_template_files(force=True)
+        print("Đã tạo lại các file template và static")
+        return
+    
     print(f"=== MikroTik Integrated Web Manager ===")
     print(f"Server đang chạy tại http://{args.host}:{args.port}")
     
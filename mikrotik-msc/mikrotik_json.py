@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Bộ mã hóa JSON nhanh cho API và WebSocket
+Dùng orjson nếu đã cài đặt, nếu không thì quay về module json chuẩn.
+Cả hai backend đều hỗ trợ datetime, date, set, Decimal và các kiểu numpy.
+"""
+
+import datetime
+import decimal
+import json
+import logging
+import os
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+logger = logging.getLogger("mikrotik_json")
+
+# orjson là tùy chọn, chỉ dùng khi đã cài đặt
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Cho phép ép dùng backend chuẩn qua biến môi trường JSON_BACKEND=json
+BACKEND = 'orjson' if orjson and os.getenv('JSON_BACKEND', 'orjson') != 'json' else 'json'
+
+if orjson:
+    _ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def default(obj: Any) -> Any:
+    """Chuyển các kiểu không chuẩn JSON thành kiểu cơ bản."""
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, bytes):
+        return obj.decode('utf-8', errors='replace')
+    # Mảng và số numpy (kiểm tra theo thuộc tính để không phải import numpy)
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    if hasattr(obj, 'item'):
+        return obj.item()
+    raise TypeError(f"Kiểu {type(obj).__name__} không thể chuyển thành JSON")
+
+
+def dumps(obj: Any) -> bytes:
+    """Mã hóa đối tượng thành JSON dạng bytes UTF-8."""
+    if BACKEND == 'orjson':
+        return orjson.dumps(obj, default=default, option=_ORJSON_OPTIONS)
+    return json.dumps(obj, default=default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def dumps_text(obj: Any) -> str:
+    """Mã hóa đối tượng thành chuỗi JSON (dùng cho WebSocket send_text)."""
+    if BACKEND == 'orjson':
+        return orjson.dumps(obj, default=default, option=_ORJSON_OPTIONS).decode('utf-8')
+    return json.dumps(obj, default=default, ensure_ascii=False, separators=(',', ':'))
+
+
+class PayloadCache:
+    """
+    Cache chuỗi JSON đã mã hóa theo khóa phiên bản snapshot.
+    Nhiều client WebSocket nhận cùng một payload nên chỉ mã hóa một lần cho mỗi phiên bản.
+    """
+
+    def __init__(self):
+        self._key = None
+        self._payload = None
+
+    def get(self, key, build):
+        """Trả về payload cho khóa key, gọi build() và mã hóa lại khi khóa thay đổi."""
+        if self._key is None or key != self._key:
+            data = build()
+            self._payload = dumps_text(data) if data else None
+            self._key = key
+        return self._payload
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse dùng bộ mã hóa nhanh thay cho json.dumps mặc định của Starlette."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+logger.debug(f"Backend JSON: {BACKEND}")
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Xuất thiết bị, interface và thống kê hàng ngày sang JSON theo luồng
+Toàn bộ dữ liệu được đọc bằng một câu truy vấn JOIN đã sắp xếp theo (thiết bị, interface, ngày)
+và ghi dần ra file khi duyệt kết quả, nên số truy vấn không đổi và bộ nhớ không phụ thuộc
+số interface. Cấu trúc file giống hệt bản json.dump(indent=2) trước đây.
+"""
+
+import os
+import json
+import logging
+from datetime import datetime, timedelta
+
+logger = logging.getLogger("mikrotik_json_export")
+
+
+class JsonStreamWriter:
+    """
+    Ghi JSON tăng dần ra stream: mở/đóng object và mảng lồng nhau, giá trị lá mã hóa bằng module json.
+    Với cùng indent, kết quả giống json.dump của cả cấu trúc.
+    """
+
+    def __init__(self, stream, indent=None):
+        self.stream = stream
+        self.indent = indent
+        self._stack = []  # Mỗi mức: [ký tự đóng, đã có phần tử chưa]
+        self._encode = json.JSONEncoder(ensure_ascii=False).encode
+
+    def _newline(self, depth):
+        if self.indent is not None:
+            self.stream.write('\n' + ' ' * (self.indent * depth))
+
+    def _item(self, key):
+        """Ghi dấu phân cách và khóa (nếu đang ở trong object) trước một phần tử."""
+        if not self._stack:
+            return
+        level = self._stack[-1]
+        if level[1]:
+            self.stream.write(',' if self.indent is not None else ', ')
+        level[1] = True
+        self._newline(len(self._stack))
+        if key is not None:
+            self.stream.write(self._encode(key) + ': ')
+
+    def begin_object(self, key=None):
+        self._item(key)
+        self.stream.write('{')
+        self._stack.append(['}', False])
+
+    def begin_array(self, key=None):
+        self._item(key)
+        self.stream.write('[')
+        self._stack.append([']', False])
+
+    def value(self, obj, key=None):
+        """Ghi một giá trị hoàn chỉnh; dict và list được ghi từng phần tử để giữ đúng thụt lề."""
+        if self.indent is not None and isinstance(obj, (dict, list)):
+            # json.dumps có indent dùng bộ mã hóa thuần Python, chậm hơn nhiều so với mã hóa từng giá trị lá
+            if isinstance(obj, dict):
+                self.begin_object(key)
+                for item_key, item in obj.items():
+                    self.value(item, item_key)
+            else:
+                self.begin_array(key)
+                for item in obj:
+                    self.value(item)
+            self.end()
+            return
+        self._item(key)
+        self.stream.write(self._encode(obj))
+
+    def end(self):
+        """Đóng object hoặc mảng đang mở."""
+        closer, has_items = self._stack.pop()
+        if has_items:
+            self._newline(len(self._stack))
+        self.stream.write(closer)
+
+    def end_to(self, depth):
+        """Đóng các mức lồng nhau cho đến khi chỉ còn depth mức."""
+        while len(self._stack) > depth:
+            self.end()
+
+
+# Mức lồng nhau trong file: gốc > devices > thiết bị > interfaces > interface > daily_stats
+_DEVICES_DEPTH = 2
+_INTERFACES_DEPTH = 4
+
+
+def export_json(conn, output_file, days=7, indent=2):
+    """
+    Xuất dữ liệu days ngày gần nhất ra output_file (ghi vào file tạm rồi đổi tên).
+    Trả về số thiết bị, interface và dòng thống kê đã ghi; không tạo file nếu chưa có thiết bị nào.
+    """
+    start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+
+    # Database cũ có thể có cột active trong bảng interfaces
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(interfaces)')}
+    active = 'i.active' if 'active' in columns else '0'
+
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    cursor.execute(f'''
+    SELECT
+        d.id, d.hostname, d.model, d.ip_address, d.ros_version,
+        i.id, i.name, i.type, {active},
+        ds.date, ds.total_tx_mb, ds.total_rx_mb, ds.max_tx_kbps, ds.max_rx_kbps, ds.avg_tx_kbps, ds.avg_rx_kbps
+    FROM devices d
+    LEFT JOIN interfaces i ON i.device_id = d.id
+    LEFT JOIN daily_stats ds ON ds.interface_id = i.id AND ds.date >= ?
+    ORDER BY d.id, i.id, ds.date
+    ''', (start_date,))
+
+    counts = {'devices': 0, 'interfaces': 0, 'daily_stats': 0}
+    temp_file = output_file + '.tmp'
+    try:
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            writer = JsonStreamWriter(f, indent)
+            writer.begin_object()
+            writer.begin_array('devices')
+
+            current_device = current_interface = None
+            for (device_id, hostname, model, address, version, interface_id, name, interface_type, is_active,
+                 date, total_tx_mb, total_rx_mb, max_tx, max_rx, avg_tx, avg_rx) in cursor:
+                if device_id != current_device:
+                    writer.end_to(_DEVICES_DEPTH)
+                    writer.begin_object()
+                    writer.value(device_id, 'id')
+                    writer.value(hostname, 'name')
+                    writer.value(model, 'model')
+                    writer.value(address, 'address')
+                    writer.value(version, 'version')
+                    writer.begin_array('interfaces')
+                    current_device, current_interface = device_id, None
+                    counts['devices'] += 1
+
+                if interface_id is not None and interface_id != current_interface:
+                    writer.end_to(_INTERFACES_DEPTH)
+                    writer.begin_object()
+                    writer.value(interface_id, 'id')
+                    writer.value(name, 'name')
+                    writer.value(interface_type, 'type')
+                    writer.value(bool(is_active), 'active')
+                    writer.begin_array('daily_stats')
+                    current_interface = interface_id
+                    counts['interfaces'] += 1
+
+                if date is not None:
+                    writer.value({
+                        "date": date,
+                        "total_tx_bytes": int((total_tx_mb or 0) * 1048576),
+                        "total_rx_bytes": int((total_rx_mb or 0) * 1048576),
+                        "max_tx_rate": max_tx,
+                        "max_rx_rate": max_rx,
+                        "avg_tx_rate": avg_tx,
+                        "avg_rx_rate": avg_rx
+                    })
+                    counts['daily_stats'] += 1
+
+            writer.end_to(1)
+            writer.value(datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'generated_at')
+            writer.value(days, 'period_days')
+            writer.end()
+
+        if counts['devices']:
+            os.replace(temp_file, output_file)
+            logger.info(f"Đã xuất {counts['devices']} thiết bị, {counts['interfaces']} interface "
+                        f"và {counts['daily_stats']} dòng thống kê vào {output_file}")
+    finally:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+    return counts
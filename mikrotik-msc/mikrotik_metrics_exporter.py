@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Xuất metrics dạng Prometheus cho các ứng dụng giám sát MikroTik
+Module này chỉ đọc trạng thái đã được thu thập trong bộ nhớ, một lần scrape không gọi đến router
+"""
+
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from mikrotik_stats import collect_stats_metrics
+
+logger = logging.getLogger("mikrotik_metrics_exporter")
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Các mốc histogram độ trễ request (giây)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Các mốc histogram số lần gọi API router trong một request
+ROUTER_CALL_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+def _escape(value):
+    """Escape giá trị label theo định dạng text của Prometheus."""
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    """Chuyển dict labels thành chuỗi {k="v",...}."""
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+class LatencyHistogram:
+    """Histogram theo (method, route, status), an toàn đa luồng."""
+
+    def __init__(self, name='http_request_duration_seconds', buckets=DEFAULT_BUCKETS,
+                 help_text='Độ trễ xử lý request HTTP theo route'):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self._bounds = [repr(float(bound)) for bound in self.buckets]
+        self._series = {}  # (method, route, status) -> [bucket_counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, method, route, status, seconds):
+        """Ghi nhận một giá trị quan sát của request (độ trễ, số lần gọi router...)."""
+        key = (method, route, str(status))
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    def snapshot(self):
+        """Sao chép trạng thái hiện tại để render mà không giữ lock lâu."""
+        with self._lock:
+            return {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+
+    def render(self, lines):
+        """Thêm các dòng metrics của histogram vào danh sách lines."""
+        lines.append(f'# HELP {self.name} {self.help_text}')
+        lines.append(f'# TYPE {self.name} histogram')
+        for (method, route, status), (counts, total, count) in sorted(self.snapshot().items()):
+            base = f'method="{_escape(method)}",route="{_escape(route)}",status="{status}"'
+            cumulative = 0
+            for bound, bucket_count in zip(self._bounds, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{base},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{base},le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{{base}}} {total}')
+            lines.append(f'{self.name}_count{{{base}}} {count}')
+
+
+class MetricsRegistry:
+    """
+    Tập hợp các nguồn metrics.
+    Mỗi collector là một hàm trả về các bộ (name, type, help, samples),
+    với samples là danh sách (labels, value).
+    """
+
+    def __init__(self):
+        self.request_latency = LatencyHistogram()
+        self.router_calls = LatencyHistogram(
+            'http_request_router_calls', ROUTER_CALL_BUCKETS, 'Số lần gọi API router trong một request theo route'
+        )
+        self._collectors = []
+        self._gauges = {}  # name -> (help, {labels_tuple: value})
+        self._lock = threading.Lock()
+
+    def register(self, collector):
+        """Đăng ký một collector."""
+        self._collectors.append(collector)
+        return collector
+
+    def set_gauge(self, name, value, labels=None, help_text=''):
+        """Đặt giá trị cho một gauge được cập nhật từ bên ngoài."""
+        key = tuple(sorted((labels or {}).items()))
+        with self._lock:
+            family = self._gauges.get(name)
+            if family is None:
+                family = self._gauges[name] = (help_text, {})
+            family[1][key] = value
+
+    def render(self):
+        """Render toàn bộ metrics theo định dạng text của Prometheus."""
+        families = {}  # name -> [type, help, lines]
+
+        def add_family(name, metric_type, help_text, samples):
+            family = families.get(name)
+            if family is None:
+                family = families[name] = [metric_type, help_text, []]
+            family_lines = family[2]
+            for labels, value in samples:
+                if value is None:
+                    continue
+                family_lines.append(f'{name}{_format_labels(labels)} {value}')
+
+        with self._lock:
+            gauges = [(name, help_text, dict(values)) for name, (help_text, values) in self._gauges.items()]
+        for name, help_text, values in gauges:
+            add_family(name, 'gauge', help_text, ((dict(key), value) for key, value in values.items()))
+
+        for collector in self._collectors:
+            try:
+                for name, metric_type, help_text, samples in collector():
+                    add_family(name, metric_type, help_text, samples)
+            except Exception as e:
+                logger.error(f"Lỗi khi thu thập metrics: {e}")
+
+        lines = []
+        for name, (metric_type, help_text, family_lines) in families.items():
+            if help_text:
+                lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            lines.extend(family_lines)
+        self.request_latency.render(lines)
+        self.router_calls.render(lines)
+        lines.append('')
+        return '\n'.join(lines)
+
+
+def monitor_collector(get_monitors):
+    """
+    Collector cho các đối tượng MikroTikMonitor.
+    get_monitors() trả về danh sách monitor đang chạy; chỉ đọc data_history và device_info.
+    """
+    def collect():
+        tx_total, rx_total, tx_rate, rx_rate = [], [], [], []
+        cpu, memory_free, memory_total, hdd_free, hdd_total = [], [], [], [], []
+        interface_stats = []
+
+        for monitor in get_monitors():
+            with monitor.lock:
+                device_info = dict(monitor.device_info)
+                interfaces = [
+                    (name, data.get('previous_data'), data['history'][-1] if data['history'] else None)
+                    for name, data in monitor.data_history.items()
+                ]
+                interface_stats.extend(
+                    ({'device': monitor.host, 'interface': name}, stats)
+                    for name, stats in getattr(monitor, 'interface_stats', {}).items()
+                )
+
+            device = {'device': monitor.host}
+            for name, counters, latest in interfaces:
+                labels = {'device': monitor.host, 'interface': name}
+                if counters:
+                    tx_total.append((labels, counters[0]))
+                    rx_total.append((labels, counters[1]))
+                if latest:
+                    # tx_kbps được tính theo bit/1024 nên nhân lại 1024 để ra bit/s
+                    tx_rate.append((labels, latest['tx_kbps'] * 1024))
+                    rx_rate.append((labels, latest['rx_kbps'] * 1024))
+
+            if device_info:
+                cpu.append((device, device_info.get('cpu_load')))
+                memory_free.append((device, device_info.get('free_memory', 0) * 1048576))
+                memory_total.append((device, device_info.get('total_memory', 0) * 1048576))
+                hdd_free.append((device, device_info.get('free_hdd', 0) * 1048576))
+                hdd_total.append((device, device_info.get('total_hdd', 0) * 1048576))
+
+        yield 'mikrotik_interface_tx_bytes_total', 'counter', 'Tổng số byte đã gửi của interface', tx_total
+        yield 'mikrotik_interface_rx_bytes_total', 'counter', 'Tổng số byte đã nhận của interface', rx_total
+        yield 'mikrotik_interface_tx_bits_per_second', 'gauge', 'Tốc độ gửi hiện tại của interface', tx_rate
+        yield 'mikrotik_interface_rx_bits_per_second', 'gauge', 'Tốc độ nhận hiện tại của interface', rx_rate
+        yield 'mikrotik_cpu_load_percent', 'gauge', 'Tải CPU của thiết bị', cpu
+        yield 'mikrotik_memory_free_bytes', 'gauge', 'Bộ nhớ còn trống của thiết bị', memory_free
+        yield 'mikrotik_memory_total_bytes', 'gauge', 'Tổng bộ nhớ của thiết bị', memory_total
+        yield 'mikrotik_hdd_free_bytes', 'gauge', 'Dung lượng lưu trữ còn trống', hdd_free
+        yield 'mikrotik_hdd_total_bytes', 'gauge', 'Tổng dung lượng lưu trữ', hdd_total
+        yield from collect_stats_metrics(interface_stats)
+
+    return collect
+
+
+def start_http_server(registry, port, addr='0.0.0.0'):
+    """Chạy HTTP server phục vụ /metrics trong một thread nền."""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    server = ThreadingHTTPServer((addr, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logger.info(f"Đã bật endpoint metrics tại http://{addr}:{port}/metrics")
+    return server
@@ -13,6 +13,9 @@ import threading
 from tabulate import tabulate
 from dotenv import load_dotenv
 
+from mikrotik_sampling import TickScheduler, counter_rate
+from mikrotik_stats import InterfaceStats
+
 # Thiết lập logging
 logging.basicConfig(
     level=logging.INFO,
@@ -130,18 +133,22 @@ class MikroTikMultiInterfaceMonitor:
         # Khởi tạo dữ liệu cho interface này
         with self.lock:
             self.interfaces_data[interface_name] = {
-                'history': [],
+                'stats': InterfaceStats(),  # Thống kê trực tuyến, bộ nhớ cố định
                 'previous_values': None,
-                'avg_tx': 0,
-                'avg_rx': 0,
-                'max_tx': 0,
-                'max_rx': 0,
-                'samples': 0
+                'previous_time': None
             }
         
+        # Các thread của mọi interface cùng lấy mẫu tại một mốc thời gian
+        scheduler = TickScheduler(interval)
+        
         while self.running:
+            tick = scheduler.wait()
+            if tick is None or not self.running:
+                break
+            
             # Lấy dữ liệu traffic hiện tại
             traffic_data = self.get_interface_traffic(interface_name)
+            now = time.monotonic()
             
             if traffic_data:
                 current_tx, current_rx = traffic_data
@@ -149,54 +156,20 @@ class MikroTikMultiInterfaceMonitor:
                 # Nếu đã có dữ liệu trước đó, tính toán tốc độ
                 with self.lock:
                     previous_values = self.interfaces_data[interface_name]['previous_values']
+                    previous_time = self.interfaces_data[interface_name]['previous_time']
                     
-                    if previous_values:
-                        # Tính toán tốc độ dựa trên sự khác biệt
-                        tx_bytes = current_tx - previous_values[0]
-                        rx_bytes = current_rx - previous_values[1]
-                        
-                        # Bytes/giây
-                        tx_bytes_per_second = tx_bytes / interval
-                        rx_bytes_per_second = rx_bytes / interval
-                        
-                        # Bits/giây (1 byte = 8 bits)
-                        tx_bits_per_second = tx_bytes_per_second * 8
-                        rx_bits_per_second = rx_bytes_per_second * 8
-                        
-                        # Chuyển đổi sang KB/s
-                        tx_kbps = tx_bits_per_second / 1024
-                        rx_kbps = rx_bits_per_second / 1024
+                    if previous_values and now > previous_time:
+                        # Tốc độ KB/s trên thời gian đo thực tế, xử lý tràn và reset bộ đếm
+                        elapsed = now - previous_time
+                        tx_kbps = counter_rate(current_tx, previous_values[0], elapsed)
+                        rx_kbps = counter_rate(current_rx, previous_values[1], elapsed)
                         
-                        # Cập nhật dữ liệu
-                        self.interfaces_data[interface_name]['history'].append({
-                            'time': time.time(),
-                            'tx_kbps': tx_kbps,
-                            'rx_kbps': rx_kbps
-                        })
-                        
-                        # Giới hạn kích thước lịch sử
-                        if len(self.interfaces_data[interface_name]['history']) > 100:
-                            self.interfaces_data[interface_name]['history'] = self.interfaces_data[interface_name]['history'][-100:]
-                        
-                        # Cập nhật thống kê
-                        self.interfaces_data[interface_name]['samples'] += 1
-                        current_avg_tx = self.interfaces_data[interface_name]['avg_tx']
-                        current_avg_rx = self.interfaces_data[interface_name]['avg_rx']
-                        samples = self.interfaces_data[interface_name]['samples']
-                        
-                        # Tính trung bình cập nhật
-                        self.interfaces_data[interface_name]['avg_tx'] = (current_avg_tx * (samples - 1) + tx_kbps) / samples
-                        self.interfaces_data[interface_name]['avg_rx'] = (current_avg_rx * (samples - 1) + rx_kbps) / samples
-                        
-                        # Cập nhật giá trị lớn nhất
-                        self.interfaces_data[interface_name]['max_tx'] = max(self.interfaces_data[interface_name]['max_tx'], tx_kbps)
-                        self.interfaces_data[interface_name]['max_rx'] = max(self.interfaces_data[interface_name]['max_rx'], rx_kbps)
+                        # Cập nhật thống kê (trung bình, phương sai, phân vị, EWMA)
+                        self.interfaces_data[interface_name]['stats'].add(tick, tx_kbps, rx_kbps)
                     
                     # Lưu giá trị hiện tại cho lần sau
                     self.interfaces_data[interface_name]['previous_values'] = (current_tx, current_rx)
-            
-            # Ngủ đến lần cập nhật tiếp theo
-            time.sleep(interval)
+                    self.interfaces_data[interface_name]['previous_time'] = now
         
         logger.info(f"Đã dừng giám sát interface {interface_name}")
     
@@ -215,24 +188,19 @@ class MikroTikMultiInterfaceMonitor:
                 with self.lock:
                     table_data = []
                     for interface_name, data in self.interfaces_data.items():
-                        if data['samples'] > 0:
-                            latest_tx = 0
-                            latest_rx = 0
-                            
-                            # Lấy giá trị mới nhất nếu có
-                            if data['history']:
-                                latest = data['history'][-1]
-                                latest_tx = latest['tx_kbps']
-                                latest_rx = latest['rx_kbps']
-                            
+                        summary = data['stats'].summary()
+                        tx, rx = summary['tx'], summary['rx']
+                        if tx['count'] > 0:
                             table_data.append([
                                 interface_name,
-                                f"{latest_tx:.2f} KB/s",
-                                f"{latest_rx:.2f} KB/s",
-                                f"{data['avg_tx']:.2f} KB/s",
-                                f"{data['avg_rx']:.2f} KB/s",
-                                f"{data['max_tx']:.2f} KB/s",
-                                f"{data['max_rx']:.2f} KB/s"
+                                f"{tx['last']:.2f} KB/s",
+                                f"{rx['last']:.2f} KB/s",
+                                f"{tx['mean']:.2f} KB/s",
+                                f"{rx['mean']:.2f} KB/s",
+                                f"{tx['p95']:.2f} KB/s",
+                                f"{rx['p95']:.2f} KB/s",
+                                f"{tx['max']:.2f} KB/s",
+                                f"{rx['max']:.2f} KB/s"
                             ])
                 
                 # Hiển thị bảng
@@ -243,6 +211,7 @@ class MikroTikMultiInterfaceMonitor:
                     # Tạo header cho bảng
                     headers = ["Interface", "TX Hiện tại", "RX Hiện tại", 
                               "TX Trung bình", "RX Trung bình", 
+                              "TX p95", "RX p95",
                               "TX Lớn nhất", "RX Lớn nhất"]
                     
                     # In bảng
@@ -330,13 +299,15 @@ class MikroTikMultiInterfaceMonitor:
         
         with self.lock:
             for interface_name, data in self.interfaces_data.items():
-                if data['samples'] > 0:
+                summary = data['stats'].summary()
+                if summary['tx']['count'] > 0:
                     print(f"\nInterface: {interface_name}")
-                    print(f"Số mẫu đã thu thập: {data['samples']}")
-                    print(f"TX trung bình: {data['avg_tx']:.2f} KB/s ({data['avg_tx']/1024:.4f} MB/s)")
-                    print(f"RX trung bình: {data['avg_rx']:.2f} KB/s ({data['avg_rx']/1024:.4f} MB/s)")
-                    print(f"TX lớn nhất: {data['max_tx']:.2f} KB/s ({data['max_tx']/1024:.4f} MB/s)")
-                    print(f"RX lớn nhất: {data['max_rx']:.2f} KB/s ({data['max_rx']/1024:.4f} MB/s)")
+                    print(f"Số mẫu đã thu thập: {summary['tx']['count']}")
+                    for direction, values in (('TX', summary['tx']), ('RX', summary['rx'])):
+                        print(f"{direction} trung bình: {values['mean']:.2f} KB/s ({values['mean']/1024:.4f} MB/s), "
+                              f"độ lệch chuẩn: {values['std']:.2f} KB/s")
+                        print(f"{direction} p50/p95/p99: {values['p50']:.2f} / {values['p95']:.2f} / {values['p99']:.2f} KB/s")
+                        print(f"{direction} lớn nhất: {values['max']:.2f} KB/s ({values['max']/1024:.4f} MB/s)")
         
         # Lưu báo cáo vào file
         self.save_report_to_file()
@@ -357,15 +328,17 @@ class MikroTikMultiInterfaceMonitor:
             
             with self.lock:
                 for interface_name, data in self.interfaces_data.items():
-                    if data['samples'] > 0:
+                    summary = data['stats'].summary()
+                    if summary['tx']['count'] > 0:
                         report['interfaces'][interface_name] = {
-                            'samples': data['samples'],
-                            'avg_tx_kbps': data['avg_tx'],
-                            'avg_rx_kbps': data['avg_rx'],
-                            'max_tx_kbps': data['max_tx'],
-                            'max_rx_kbps': data['max_rx'],
-                            # Chỉ lưu 50 mẫu gần nhất để file không quá lớn
-                            'history': data['history'][-50:] if data['history'] else []
+                            'samples': summary['tx']['count'],
+                            'avg_tx_kbps': summary['tx']['mean'],
+                            'avg_rx_kbps': summary['rx']['mean'],
+                            'max_tx_kbps': summary['tx']['max'],
+                            'max_rx_kbps': summary['rx']['max'],
+                            # Thống kê đầy đủ (độ lệch chuẩn, p50/p95/p99, EWMA) thay cho danh sách mẫu
+                            'tx': summary['tx'],
+                            'rx': summary['rx']
                         }
             
             # Lưu báo cáo vào file
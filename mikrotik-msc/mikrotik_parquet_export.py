@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""
+Xuất lịch sử traffic sang Parquet hoặc Arrow IPC để phân tích offline
+Dữ liệu được đọc theo từng lô bằng keyset (interface_id, timestamp, id) trên chỉ mục sẵn có
+và ghi ngay ra file, nên bộ nhớ dùng không phụ thuộc số dòng cần xuất.
+Kết quả chia thư mục theo kiểu Hive: traffic_data/device=<id>-<thiết bị>/date=<ngày>/part-0.parquet
+và daily_stats/device=<id>-<thiết bị>/part-0.parquet, đọc trực tiếp được bằng pandas, DuckDB, Spark...
+"""
+
+import os
+import re
+import sys
+import logging
+import argparse
+from datetime import datetime, timedelta
+
+from mikrotik_traffic_store import open_connection, format_date, day_bounds
+
+logger = logging.getLogger("mikrotik_parquet_export")
+
+DEFAULT_CHUNK_SIZE = 50000
+
+FORMATS = ('parquet', 'arrow')
+
+_EXTENSIONS = {'parquet': '.parquet', 'arrow': '.arrow'}
+
+
+def _require_pyarrow():
+    """Nạp pyarrow khi thực sự xuất dữ liệu (thư viện tùy chọn)."""
+    try:
+        import pyarrow
+        return pyarrow
+    except ImportError:
+        logger.error("Không thể import pyarrow. Chạy: pip install pyarrow")
+        raise
+
+
+def traffic_schema(pa):
+    """Schema của bảng traffic_data khi xuất (thời gian lưu dạng UTC; thiết bị và ngày nằm trong tên thư mục)."""
+    return pa.schema([
+        ('interface', pa.string()),
+        ('interface_id', pa.int64()),
+        ('timestamp', pa.timestamp('s', tz='UTC')),
+        ('tx_bytes', pa.int64()),
+        ('rx_bytes', pa.int64()),
+        ('tx_packets', pa.int64()),
+        ('rx_packets', pa.int64()),
+        ('tx_rate_kbps', pa.float64()),
+        ('rx_rate_kbps', pa.float64()),
+    ])
+
+
+def daily_stats_schema(pa):
+    """Schema của bảng daily_stats khi xuất."""
+    return pa.schema([
+        ('interface', pa.string()),
+        ('interface_id', pa.int64()),
+        ('date', pa.date32()),
+        ('samples', pa.int64()),
+        ('avg_tx_kbps', pa.float64()),
+        ('avg_rx_kbps', pa.float64()),
+        ('max_tx_kbps', pa.float64()),
+        ('max_rx_kbps', pa.float64()),
+        ('total_tx_mb', pa.float64()),
+        ('total_rx_mb', pa.float64()),
+    ])
+
+
+def partition_label(value):
+    """Chuẩn hóa tên thiết bị thành tên thư mục an toàn."""
+    return re.sub(r'[^0-9A-Za-z._-]+', '_', str(value)).strip('_') or 'unknown'
+
+
+class _PartitionWriter:
+    """Ghi một partition theo từng RecordBatch; file chỉ được tạo khi có dòng đầu tiên."""
+
+    def __init__(self, pa, path, schema, fmt, compression):
+        self.pa = pa
+        self.path = path
+        self.schema = schema
+        self.format = fmt
+        self.compression = compression
+        self.rows = 0
+        self._writer = None
+        self._sink = None
+
+    def _open(self):
+        """Tạo thư mục và writer; ghi vào file tạm để không để lại file hỏng khi bị dừng giữa chừng."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = self.path + '.tmp'
+        if self.format == 'parquet':
+            import pyarrow.parquet as pq
+            self._writer = pq.ParquetWriter(temp_path, self.schema, compression=self.compression)
+        else:
+            self._sink = self.pa.OSFile(temp_path, 'wb')
+            options = self.pa.ipc.IpcWriteOptions(compression=self.compression)
+            self._writer = self.pa.ipc.new_file(self._sink, self.schema, options=options)
+
+    def write(self, columns):
+        """Ghi một lô cột (dict tên cột -> list giá trị)."""
+        batch = self.pa.RecordBatch.from_pydict(columns, schema=self.schema)
+        if batch.num_rows == 0:
+            return
+        if self._writer is None:
+            self._open()
+        self._writer.write_batch(batch)
+        self.rows += batch.num_rows
+
+    def close(self):
+        """Đóng writer và đổi file tạm thành file chính thức."""
+        if self._writer is None:
+            return
+        self._writer.close()
+        if self._sink is not None:
+            self._sink.close()
+        os.replace(self.path + '.tmp', self.path)
+        self._writer = None
+
+    def abort(self):
+        """Bỏ file tạm khi xuất lỗi."""
+        if self._writer is None:
+            return
+        try:
+            self._writer.close()
+            if self._sink is not None:
+                self._sink.close()
+        finally:
+            os.remove(self.path + '.tmp')
+            self._writer = None
+
+
+class TrafficExporter:
+    """Xuất traffic_data (và traffic_blocks nếu có) cùng daily_stats theo partition thiết bị/ngày."""
+
+    def __init__(self, db_file, output_dir, fmt='parquet', chunk_size=DEFAULT_CHUNK_SIZE, compression='zstd'):
+        if fmt not in FORMATS:
+            raise ValueError(f"Định dạng không hỗ trợ: {fmt}")
+        self.pa = _require_pyarrow()
+        self.db_file = db_file
+        self.output_dir = output_dir
+        self.format = fmt
+        self.chunk_size = chunk_size
+        self.compression = compression
+        self.conn = open_connection(db_file)
+        self.has_blocks = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'traffic_blocks'"
+        ).fetchone() is not None
+
+    def close(self):
+        """Đóng kết nối database."""
+        self.conn.close()
+
+    def _writer(self, table, device_label, schema, date=None):
+        """Tạo writer cho một partition."""
+        parts = [self.output_dir, table, f"device={device_label}"]
+        if date is not None:
+            parts.append(f"date={date}")
+        path = os.path.join(*parts, 'part-0' + _EXTENSIONS[self.format])
+        return _PartitionWriter(self.pa, path, schema, self.format, self.compression)
+
+    def devices(self, device_id=None):
+        """
+        Danh sách (id, nhãn partition, danh sách (interface_id, tên interface)).
+        Nhãn gồm ID thiết bị và hostname (hoặc IP) vì nhiều router có thể cùng identity mặc định "MikroTik".
+        """
+        query = 'SELECT id, hostname, ip_address FROM devices'
+        params = ()
+        if device_id is not None:
+            query += ' WHERE id = ?'
+            params = (device_id,)
+        result = []
+        for dev_id, hostname, ip_address in self.conn.execute(query + ' ORDER BY id', params).fetchall():
+            interfaces = self.conn.execute(
+                'SELECT id, name FROM interfaces WHERE device_id = ? ORDER BY id', (dev_id,)
+            ).fetchall()
+            name = hostname or ip_address
+            label = partition_label(f"{dev_id}-{name}" if name else dev_id)
+            result.append((dev_id, label, interfaces))
+        return result
+
+    def _time_range(self, interfaces):
+        """Khoảng ngày (date) có dữ liệu của các interface, dùng MIN/MAX trên chỉ mục."""
+        first = last = None
+        for interface_id, _ in interfaces:
+            low, high = self.conn.execute(
+                'SELECT MIN(timestamp), MAX(timestamp) FROM traffic_data WHERE interface_id = ?', (interface_id,)
+            ).fetchone()
+            bounds = [value for value in (low, high) if value is not None]
+            if self.has_blocks:
+                low, high = self.conn.execute(
+                    'SELECT MIN(start_ts), MAX(end_ts) FROM traffic_blocks WHERE interface_id = ?', (interface_id,)
+                ).fetchone()
+                bounds += [value for value in (low, high) if value is not None]
+            for value in bounds:
+                first = value if first is None or value < first else first
+                last = value if last is None or value > last else last
+        if first is None:
+            return None, None
+        return datetime.fromtimestamp(first).date(), datetime.fromtimestamp(last).date()
+
+    def _traffic_chunks(self, interface_id, day_start, day_end):
+        """Đọc traffic_data của một interface trong một ngày theo từng lô keyset (timestamp, id)."""
+        last_timestamp, last_id = day_start, -1
+        while True:
+            rows = self.conn.execute('''
+            SELECT id, timestamp, tx_bytes, rx_bytes, tx_packets, rx_packets, tx_rate_kbps, rx_rate_kbps
+            FROM traffic_data
+            WHERE interface_id = ? AND timestamp < ? AND (timestamp, id) > (?, ?)
+            ORDER BY timestamp, id
+            LIMIT ?
+            ''', (interface_id, day_end, last_timestamp, last_id, self.chunk_size)).fetchall()
+            if not rows:
+                return
+            yield [row[1:] for row in rows]
+            if len(rows) < self.chunk_size:
+                return
+            last_id, last_timestamp = rows[-1][0], rows[-1][1]
+
+    def _block_chunks(self, interface_id, day_start, day_end):
+        """Đọc mẫu lưu trong traffic_blocks của một interface trong một ngày (tối đa một ngày mỗi lần giải nén)."""
+        from mikrotik_block_store import COLUMNS, scan
+        samples = scan(self.conn, interface_id, day_start, day_end - 1, COLUMNS)
+        for offset in range(0, len(samples), self.chunk_size):
+            yield samples[offset:offset + self.chunk_size]
+
+    def export_traffic(self, device_label, interfaces, since=None, until=None):
+        """Xuất traffic của một thiết bị, mỗi ngày một file; trả về số dòng đã ghi."""
+        first, last = self._time_range(interfaces)
+        if first is None:
+            return 0
+        first = max(first, since) if since else first
+        last = min(last, until) if until else last
+
+        total = 0
+        schema = traffic_schema(self.pa)
+        day = first
+        while day <= last:
+            day_start, day_end = day_bounds(day)
+            writer = self._writer('traffic_data', device_label, schema, format_date(day))
+            try:
+                for interface_id, interface_name in interfaces:
+                    sources = [self._traffic_chunks(interface_id, day_start, day_end)]
+                    if self.has_blocks:
+                        sources.append(self._block_chunks(interface_id, day_start, day_end))
+                    for source in sources:
+                        for rows in source:
+                            columns = list(zip(*rows))
+                            writer.write({
+                                'interface': [interface_name] * len(rows),
+                                'interface_id': [interface_id] * len(rows),
+                                'timestamp': columns[0],
+                                'tx_bytes': columns[1],
+                                'rx_bytes': columns[2],
+                                'tx_packets': columns[3],
+                                'rx_packets': columns[4],
+                                'tx_rate_kbps': columns[5],
+                                'rx_rate_kbps': columns[6],
+                            })
+            except BaseException:
+                writer.abort()
+                raise
+            writer.close()
+            if writer.rows:
+                logger.info(f"Đã xuất {writer.rows} mẫu vào {writer.path}")
+            total += writer.rows
+            day += timedelta(days=1)
+        return total
+
+    def export_daily_stats(self, device_label, interfaces, since=None, until=None):
+        """Xuất daily_stats của một thiết bị theo từng lô keyset (interface_id, date); trả về số dòng đã ghi."""
+        writer = self._writer('daily_stats', device_label, daily_stats_schema(self.pa))
+        names = dict(interfaces)
+        ids = list(names)
+        if not ids:
+            return 0
+        placeholders = ','.join('?' * len(ids))
+        last_interface, last_date = -1, ''
+        try:
+            while True:
+                rows = self.conn.execute(f'''
+                SELECT interface_id, date, samples, avg_tx_kbps, avg_rx_kbps, max_tx_kbps, max_rx_kbps,
+                       total_tx_mb, total_rx_mb
+                FROM daily_stats
+                WHERE interface_id IN ({placeholders}) AND date >= ? AND date <= ? AND (interface_id, date) > (?, ?)
+                ORDER BY interface_id, date
+                LIMIT ?
+                ''', (*ids, format_date(since) if since else '', format_date(until) if until else '9999-12-31',
+                      last_interface, last_date, self.chunk_size)).fetchall()
+                if not rows:
+                    break
+                columns = list(zip(*rows))
+                writer.write({
+                    'interface': [names[interface_id] for interface_id in columns[0]],
+                    'interface_id': columns[0],
+                    'date': [datetime.strptime(value, '%Y-%m-%d').date() for value in columns[1]],
+                    'samples': columns[2],
+                    'avg_tx_kbps': columns[3],
+                    'avg_rx_kbps': columns[4],
+                    'max_tx_kbps': columns[5],
+                    'max_rx_kbps': columns[6],
+                    'total_tx_mb': columns[7],
+                    'total_rx_mb': columns[8],
+                })
+                if len(rows) < self.chunk_size:
+                    break
+                last_interface, last_date = rows[-1][0], rows[-1][1]
+        except BaseException:
+            writer.abort()
+            raise
+        writer.close()
+        return writer.rows
+
+    def export(self, device_id=None, since=None, until=None):
+        """Xuất toàn bộ (hoặc một thiết bị); since/until là date. Trả về {bảng: số dòng}."""
+        result = {'traffic_data': 0, 'daily_stats': 0}
+        for _, device_label, interfaces in self.devices(device_id):
+            result['traffic_data'] += self.export_traffic(device_label, interfaces, since, until)
+            result['daily_stats'] += self.export_daily_stats(device_label, interfaces, since, until)
+        logger.info(f"Đã xuất {result['traffic_data']} mẫu traffic và {result['daily_stats']} dòng thống kê "
+                    f"vào {self.output_dir}")
+        return result
+
+
+def export_dataset(db_file, output_dir, fmt='parquet', device_id=None, since=None, until=None,
+                   chunk_size=DEFAULT_CHUNK_SIZE):
+    """Xuất dữ liệu traffic của db_file vào thư mục output_dir."""
+    exporter = TrafficExporter(db_file, output_dir, fmt=fmt, chunk_size=chunk_size)
+    try:
+        return exporter.export(device_id=device_id, since=since, until=until)
+    finally:
+        exporter.close()
+
+
+def _parse_date(value):
+    """Đọc ngày dạng YYYY-MM-DD cho argparse."""
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def main():
+    """Hàm chính để xuất dữ liệu."""
+    parser = argparse.ArgumentParser(description='Xuất lịch sử traffic MikroTik sang Parquet/Arrow')
+    parser.add_argument('--db', default='mikrotik_traffic.db', help='Tên file database (mặc định: mikrotik_traffic.db)')
+    parser.add_argument('--output', required=True, help='Thư mục lưu dữ liệu xuất')
+    parser.add_argument('--format', choices=FORMATS, default='parquet', help='Định dạng xuất (mặc định: parquet)')
+    parser.add_argument('--device', type=int, help='Chỉ xuất thiết bị có ID này')
+    parser.add_argument('--since', type=_parse_date, help='Ngày bắt đầu, định dạng YYYY-MM-DD')
+    parser.add_argument('--until', type=_parse_date, help='Ngày kết thúc (bao gồm), định dạng YYYY-MM-DD')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f'Số dòng mỗi lô đọc/ghi (mặc định: {DEFAULT_CHUNK_SIZE})')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        logger.error(f"Không tìm thấy file cơ sở dữ liệu {args.db}")
+        sys.exit(1)
+
+    try:
+        result = export_dataset(args.db, args.output, args.format, args.device, args.since, args.until,
+                                args.chunk_size)
+    except ImportError:
+        sys.exit(1)
+    print(f"Đã xuất {result['traffic_data']} mẫu traffic và {result['daily_stats']} dòng thống kê vào {args.output}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    main()
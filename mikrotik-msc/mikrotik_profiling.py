@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Profiling theo request cho các ứng dụng FastAPI giám sát MikroTik
+Module này đếm số lần gọi API router trong mỗi request và chạy cProfile theo yêu cầu cho N request kế tiếp
+Khi không bật profiling, chi phí cho mỗi request chỉ là một lần kiểm tra cờ
+"""
+
+import contextvars
+import cProfile
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger("mikrotik_profiling")
+
+# Các phương thức của resource routeros_api thực sự gửi lệnh đến router
+ROUTER_CALL_METHODS = frozenset({'get', 'detailed_get', 'add', 'set', 'remove', 'call'})
+
+# Số request tối đa cho một lần bật profiling và số file .prof được giữ lại (file cũ nhất bị xóa trước)
+MAX_ARMED_REQUESTS = 1000
+MAX_PROFILE_FILES = 200
+
+# Bộ đếm số lần gọi router của request hiện tại (None khi không ở trong request)
+_router_calls = contextvars.ContextVar('router_calls', default=None)
+
+
+def track_router_calls():
+    """Bắt đầu đếm số lần gọi router cho request hiện tại, trả về bộ đếm dạng [count]."""
+    counter = [0]
+    _router_calls.set(counter)
+    return counter
+
+
+def count_router_call():
+    """Tăng bộ đếm gọi router nếu đang ở trong một request."""
+    counter = _router_calls.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+class _CountingResource:
+    """Bọc resource routeros_api để đếm các lệnh gửi đến router."""
+
+    __slots__ = ('_resource',)
+
+    def __init__(self, resource):
+        self._resource = resource
+
+    def __getattr__(self, name):
+        attr = getattr(self._resource, name)
+        if name not in ROUTER_CALL_METHODS:
+            return attr
+
+        def counted(*args, **kwargs):
+            count_router_call()
+            return attr(*args, **kwargs)
+        return counted
+
+
+class _CountingApi:
+    """Bọc đối tượng api của routeros_api, các resource trả về đều được đếm."""
+
+    __slots__ = ('_api',)
+
+    def __init__(self, api):
+        self._api = api
+
+    def get_resource(self, *args, **kwargs):
+        return _CountingResource(self._api.get_resource(*args, **kwargs))
+
+    def get_binary_resource(self, *args, **kwargs):
+        return _CountingResource(self._api.get_binary_resource(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._api, name)
+
+
+def instrument_api(api):
+    """Bọc api để đếm số lần gọi router theo request; trả về nguyên api nếu là None hoặc đã được bọc."""
+    if api is None or isinstance(api, _CountingApi):
+        return api
+    return _CountingApi(api)
+
+
+class RequestProfiler:
+    """
+    Chạy cProfile cho N request kế tiếp và ghi kết quả ra thư mục output_dir.
+    Mỗi lần chỉ profile một request, vì cProfile không cho phép nhiều profiler cùng chạy
+    và trong ứng dụng async profile sẽ bao gồm cả các coroutine chạy xen kẽ trên event loop.
+    """
+
+    def __init__(self, output_dir='profiles', max_files=MAX_PROFILE_FILES):
+        self.output_dir = output_dir
+        self.max_files = max_files
+        self.remaining = 0
+        self._busy = False
+        self._lock = threading.Lock()
+
+    @property
+    def armed(self):
+        """Kiểm tra nhanh còn request nào cần profile không."""
+        return self.remaining > 0
+
+    def arm(self, requests):
+        """Bật profiling cho `requests` request kế tiếp (0 để tắt, tối đa MAX_ARMED_REQUESTS)."""
+        with self._lock:
+            self.remaining = min(max(0, int(requests)), MAX_ARMED_REQUESTS)
+        logger.info(f"Profiling được bật cho {self.remaining} request kế tiếp, lưu tại {self.output_dir}")
+        return self.remaining
+
+    def start(self):
+        """Bắt đầu profile request hiện tại, trả về None nếu không được chọn."""
+        with self._lock:
+            if self.remaining <= 0 or self._busy:
+                return None
+            self.remaining -= 1
+            self._busy = True
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:
+            # Một profiler khác đang chạy trên thread này
+            logger.warning(f"Không thể bật cProfile: {e}")
+            with self._lock:
+                self._busy = False
+            return None
+        return profile
+
+    def finish(self, profile, method, route, elapsed, router_calls=0):
+        """Dừng profile và ghi file .prof, trả về đường dẫn file."""
+        profile.disable()
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            slug = re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_') or 'root'
+            now = time.time()
+            stamp = time.strftime('%Y%m%d_%H%M%S', time.localtime(now))
+            filename = f"{stamp}_{int(now * 1000) % 1000:03d}_{method}_{slug}.prof"
+            path = os.path.join(self.output_dir, filename)
+            profile.dump_stats(path)
+            logger.info(f"Đã lưu profile {method} {route} ({elapsed * 1000:.1f} ms, {router_calls} lần gọi router) vào {path}")
+            self._prune_files()
+            return path
+        except Exception as e:
+            logger.error(f"Lỗi khi lưu profile: {e}")
+            return None
+        finally:
+            with self._lock:
+                self._busy = False
+
+    def _prune_files(self):
+        """Xóa các file profile cũ nhất khi số file vượt max_files (tên file bắt đầu bằng thời điểm ghi)."""
+        files = sorted(name for name in os.listdir(self.output_dir) if name.endswith('.prof'))
+        for name in files[:max(0, len(files) - self.max_files)]:
+            try:
+                os.remove(os.path.join(self.output_dir, name))
+            except OSError as e:
+                logger.warning(f"Không thể xóa profile cũ {name}: {e}")
+
+    def list_profiles(self, limit=50):
+        """Liệt kê các file profile mới nhất."""
+        if not os.path.isdir(self.output_dir):
+            return []
+        files = sorted(
+            (name for name in os.listdir(self.output_dir) if name.endswith('.prof')),
+            reverse=True
+        )
+        return files[:limit]
+
+    def status(self):
+        """Trạng thái profiler cho endpoint quản trị."""
+        return {
+            'remaining': self.remaining,
+            'busy': self._busy,
+            'output_dir': self.output_dir,
+            'profiles': self.list_profiles()
+        }
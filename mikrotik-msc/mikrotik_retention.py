@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Tầng lưu trữ và thời hạn giữ dữ liệu traffic
+Dữ liệu gốc chỉ giữ trong thời gian ngắn, các tầng gộp (ví dụ 1 phút, 1 giờ) giữ lâu hơn.
+Tầng gộp được logger tạo dần khi ghi (RollupAggregator), phần dữ liệu hết hạn được xóa theo từng lô nhỏ
+để không giữ khóa ghi lâu.
+"""
+
+import logging
+import math
+import threading
+import time
+from mikrotik_traffic_store import REPLACE_ROLLUP_SQL, RollupAggregator, open_connection
+
+logger = logging.getLogger("mikrotik_retention")
+
+DEFAULT_RETENTION = 'raw=48h,1m=30d,1h=forever'
+
+_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+
+def parse_duration(text):
+    """Chuyển '90s', '15m', '48h', '30d', '2w' sang số giây; 'forever' trả về None. ValueError nếu sai định dạng."""
+    text = text.strip().lower()
+    if not text:
+        raise ValueError("Khoảng thời gian không được để trống")
+    if text in ('forever', 'inf', 'none'):
+        return None
+    if text[-1] in _UNITS:
+        return int(float(text[:-1]) * _UNITS[text[-1]])
+    return int(text)
+
+
+class RetentionTier:
+    """Một tầng lưu trữ: step giây mỗi điểm (0 là dữ liệu gốc) và thời hạn giữ (None là vĩnh viễn)."""
+
+    def __init__(self, name, step, retention):
+        self.name = name
+        self.step = step
+        self.retention = retention
+
+    def __repr__(self):
+        return f"RetentionTier({self.name!r}, step={self.step}, retention={self.retention})"
+
+
+def parse_tiers(spec=DEFAULT_RETENTION):
+    """Đọc cấu hình dạng 'raw=48h,1m=30d,1h=forever' thành danh sách tầng theo step tăng dần."""
+    tiers = []
+    for part in spec.split(','):
+        name, _, retention = part.partition('=')
+        name = name.strip()
+        step = 0 if name == 'raw' else parse_duration(name)
+        tiers.append(RetentionTier(name, step, parse_duration(retention or 'forever')))
+    tiers.sort(key=lambda tier: tier.step)
+    if not tiers or tiers[0].step != 0:
+        tiers.insert(0, RetentionTier('raw', 0, None))
+    return tiers
+
+
+def rollup_steps(tiers):
+    """Các step cần gộp khi ghi."""
+    return [tier.step for tier in tiers if tier.step]
+
+
+def save_tiers(conn, tiers):
+    """Ghi cấu hình tầng vào database để công cụ phân tích dùng lại."""
+    with conn:
+        conn.execute('DELETE FROM retention_tiers')
+        conn.executemany(
+            'INSERT INTO retention_tiers (step, name, retention_seconds) VALUES (?, ?, ?)',
+            [(tier.step, tier.name, tier.retention) for tier in tiers]
+        )
+
+
+def load_tiers(conn):
+    """Đọc cấu hình tầng từ database; trả về None nếu logger chưa bật tầng lưu trữ."""
+    try:
+        rows = conn.execute('SELECT name, step, retention_seconds FROM retention_tiers ORDER BY step').fetchall()
+    except Exception:
+        return None
+    return [RetentionTier(name, step, retention) for name, step, retention in rows] or None
+
+
+def choose_tier(tiers, start, end, now=None, max_points=2000, raw_interval=5):
+    """
+    Chọn tầng mịn nhất còn giữ dữ liệu từ start (epoch giây) mà số điểm trong [start, end] không vượt max_points.
+    Nếu không tầng nào đủ, dùng tầng thô nhất còn giữ dữ liệu.
+    """
+    now = now or time.time()
+    covering = [tier for tier in tiers if tier.retention is None or now - tier.retention <= start]
+    if not covering:
+        return tiers[-1]
+    for tier in covering:
+        if (end - start) / (tier.step or raw_interval) <= max_points:
+            return tier
+    return covering[-1]
+
+
+def _raw_samples(conn, interface_id, start, end, has_blocks):
+    """Mẫu gốc (traffic_data và traffic_blocks) trong [start, end) theo thứ tự thời gian."""
+    samples = conn.execute('''
+    SELECT timestamp, IFNULL(tx_bytes, 0), IFNULL(rx_bytes, 0), IFNULL(tx_rate_kbps, 0.0), IFNULL(rx_rate_kbps, 0.0)
+    FROM traffic_data
+    WHERE interface_id = ? AND timestamp >= ? AND timestamp < ?
+    ''', (interface_id, start, end)).fetchall()
+    if has_blocks:
+        from mikrotik_block_store import scan
+        samples.extend(scan(conn, interface_id, start, end - 1, ('tx_bytes', 'rx_bytes', 'tx_kbps', 'rx_kbps')))
+    samples.sort(key=lambda sample: sample[0])
+    return samples
+
+
+def rollup_boundary(steps, cutoff):
+    """Mốc xóa dữ liệu gốc: cutoff làm tròn xuống bội số chung của các step, để không xóa dở một bucket nào."""
+    return cutoff - cutoff % math.lcm(*steps) if steps else cutoff
+
+
+def backfill_rollups(conn, interface_id, steps, until_ts, window=86400):
+    """
+    Đối chiếu dữ liệu gốc (traffic_data và traffic_blocks) trước until_ts với traffic_rollups trước khi xóa:
+    bucket có mẫu gốc nhưng chưa có rollup, hoặc rollup có ít mẫu hơn dữ liệu gốc (logger chạy không bật tầng
+    lưu trữ, hoặc bị dừng đột ngột khi bucket còn trong bộ nhớ), được tính lại từ dữ liệu gốc và thay hẳn dòng cũ.
+    until_ts phải là mốc từ rollup_boundary. Đọc theo từng cửa sổ khoảng window giây. Trả về số bucket đã tính lại.
+    """
+    if not steps:
+        return 0
+    has_blocks = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'traffic_blocks'"
+    ).fetchone() is not None
+    first = conn.execute(
+        'SELECT MIN(timestamp) FROM traffic_data WHERE interface_id = ?', (interface_id,)
+    ).fetchone()[0]
+    if has_blocks:
+        block_start = conn.execute(
+            'SELECT MIN(start_ts) FROM traffic_blocks WHERE interface_id = ?', (interface_id,)
+        ).fetchone()[0]
+        if block_start is not None and (first is None or block_start < first):
+            first = block_start
+    if first is None or first >= until_ts:
+        return 0
+
+    # Cửa sổ là bội số chung của các step nên mỗi bucket nằm gọn trong một cửa sổ
+    period = math.lcm(*steps)
+    window = max(period, window - window % period)
+    aggregator = RollupAggregator(steps)
+    repaired = 0
+    start = first - first % period
+    while start < until_ts:
+        end = min(start + window, until_ts)
+        counts = {}
+        for epoch, tx_bytes, rx_bytes, tx_kbps, rx_kbps in _raw_samples(conn, interface_id, start, end, has_blocks):
+            aggregator.add(interface_id, epoch, tx_bytes, rx_bytes, tx_kbps, rx_kbps)
+            for step in steps:
+                key = (step, epoch - epoch % step)
+                counts[key] = counts.get(key, 0) + 1
+        rows = aggregator.take(force=True)
+        if counts:
+            rolled = {
+                (step, bucket_ts): samples
+                for step, bucket_ts, samples in conn.execute('''
+                SELECT step, bucket_ts, samples FROM traffic_rollups
+                WHERE interface_id = ? AND bucket_ts >= ? AND bucket_ts < ?
+                ''', (interface_id, start, end))
+            }
+            missing = [row for row in rows if rolled.get((row[1], row[2]), 0) < counts[(row[1], row[2])]]
+            if missing:
+                with conn:
+                    conn.executemany(REPLACE_ROLLUP_SQL, missing)
+                repaired += len(missing)
+        start = end
+    if repaired:
+        logger.info(f"Đã tính lại {repaired} bucket rollup thiếu của interface {interface_id} từ dữ liệu gốc")
+    return repaired
+
+
+class RetentionManager:
+    """Xóa dữ liệu hết hạn của từng tầng theo lô nhỏ, chạy định kỳ trong thread nền."""
+
+    def __init__(self, db_file, tiers, batch_size=2000, pause=0.05):
+        self.db_file = db_file
+        self.tiers = tiers
+        self.batch_size = batch_size
+        self.pause = pause  # Nghỉ giữa các lô để writer chen vào
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _delete_batches(self, conn, sql, params):
+        """Lặp một câu DELETE giới hạn batch_size dòng, mỗi lô một transaction."""
+        deleted = 0
+        while not self._stop.is_set():
+            with conn:
+                count = conn.execute(sql, params).rowcount
+            deleted += count
+            if count < self.batch_size:
+                break
+            time.sleep(self.pause)
+        return deleted
+
+    def prune_once(self, now=None):
+        """Xóa dữ liệu hết hạn của mọi tầng; trả về {tên tầng: số dòng đã xóa}."""
+        now = int(now or time.time())
+        steps = rollup_steps(self.tiers)
+        conn = open_connection(self.db_file)
+        try:
+            interface_ids = [row[0] for row in conn.execute('SELECT id FROM interfaces')]
+            has_blocks = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'traffic_blocks'"
+            ).fetchone()
+            result = {}
+            for tier in self.tiers:
+                if tier.retention is None:
+                    continue
+                cutoff = now - tier.retention
+                deleted = 0
+                for interface_id in interface_ids:
+                    if self._stop.is_set():
+                        break
+                    if tier.step:
+                        deleted += self._prune_rollups(conn, interface_id, tier.step, cutoff)
+                        continue
+                    # Chỉ xóa sau khi mọi bucket trước mốc đã có rollup đầy đủ
+                    limit = rollup_boundary(steps, cutoff)
+                    backfill_rollups(conn, interface_id, steps, limit)
+                    deleted += self._delete_batches(conn, '''
+                    DELETE FROM traffic_data WHERE id IN (
+                        SELECT id FROM traffic_data WHERE interface_id = ? AND timestamp < ? LIMIT ?
+                    )
+                    ''', (interface_id, limit, self.batch_size))
+                    if has_blocks:
+                        deleted += self._delete_batches(conn, '''
+                        DELETE FROM traffic_blocks WHERE id IN (
+                            SELECT id FROM traffic_blocks WHERE interface_id = ? AND start_ts < ? AND end_ts < ? LIMIT ?
+                        )
+                        ''', (interface_id, limit, limit, self.batch_size))
+                result[tier.name] = deleted
+                if deleted:
+                    logger.info(f"Đã xóa {deleted} dòng hết hạn của tầng {tier.name}")
+            return result
+        finally:
+            conn.close()
+
+    def _prune_rollups(self, conn, interface_id, step, cutoff):
+        """Xóa bucket cũ hơn cutoff theo từng khoảng batch_size bucket (dùng khóa chính, không quét bảng)."""
+        first = conn.execute(
+            'SELECT MIN(bucket_ts) FROM traffic_rollups WHERE interface_id = ? AND step = ?',
+            (interface_id, step)
+        ).fetchone()[0]
+        deleted = 0
+        window = step * self.batch_size
+        while first is not None and first < cutoff and not self._stop.is_set():
+            upper = min(first + window, cutoff)
+            with conn:
+                deleted += conn.execute('''
+                DELETE FROM traffic_rollups WHERE interface_id = ? AND step = ? AND bucket_ts >= ? AND bucket_ts < ?
+                ''', (interface_id, step, first, upper)).rowcount
+            first = upper
+            time.sleep(self.pause)
+        return deleted
+
+    def _run(self, interval):
+        """Vòng lặp nền gọi prune_once mỗi interval giây."""
+        while not self._stop.wait(interval):
+            try:
+                self.prune_once()
+            except Exception as e:
+                logger.error(f"Lỗi khi xóa dữ liệu hết hạn: {e}")
+
+    def start(self, interval=600):
+        """Chạy việc xóa dữ liệu hết hạn định kỳ trong thread nền."""
+        self._thread = threading.Thread(target=self._run, args=(interval,), name='retention', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Dừng thread nền (lô đang xóa dở sẽ dừng sau transaction hiện tại)."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Đồng hồ lấy mẫu dùng chung cho các vòng lặp giám sát
+Tick được căn theo mốc đồng hồ thực (bội số của chu kỳ) nhưng được hẹn giờ bằng time.monotonic(),
+nên mẫu của các thiết bị khác nhau rơi vào cùng mốc thời gian và không bị trôi khi một lần đọc chậm.
+"""
+
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger("mikrotik_sampling")
+
+# Độ rộng (bit) bộ đếm byte của interface: API RouterOS luôn trả bộ đếm 64 bit.
+# Nguồn dùng bộ đếm 32 bit (ví dụ SNMP Counter32) phải truyền bits=32 khi tính phần tăng.
+COUNTER_BITS = 64
+
+# Đồng hồ thực lệch khỏi đồng hồ monotonic quá ngưỡng này (giây) thì căn lại mốc tick
+CLOCK_STEP_THRESHOLD = 1.0
+
+
+class TickScheduler:
+    """
+    Phát các tick cách đều nhau interval giây, căn theo bội số của interval trên đồng hồ thực.
+    Nếu một chu kỳ xử lý quá lâu, các tick đã lỡ bị bỏ qua thay vì chạy dồn liên tiếp.
+    """
+
+    def __init__(self, interval, align=True, stop_event=None):
+        """Khởi tạo với chu kỳ (giây); align=False thì tick đầu tiên chạy ngay."""
+        if interval <= 0:
+            raise ValueError("interval phải lớn hơn 0")
+        self.interval = interval
+        self.align = align
+        self.skipped = 0
+        self._stop = stop_event or threading.Event()
+        self._anchor(first=True)
+
+    def _anchor(self, first=False):
+        """Gắn mốc tick trên đồng hồ thực với thời điểm tương ứng trên đồng hồ monotonic."""
+        wall = time.time()
+        monotonic = time.monotonic()
+        if self.align:
+            origin = math.ceil(wall / self.interval) * self.interval
+        elif first:
+            origin = wall
+        else:
+            # Giữ nguyên nhịp tick cũ, chỉ dịch theo đồng hồ thực mới
+            origin = wall + (self._next_monotonic() - monotonic)
+        self._offset = wall - monotonic
+        self._origin_wall = origin
+        self._origin_monotonic = monotonic + (origin - wall)
+        self._index = 0
+
+    def _next_monotonic(self):
+        """Thời điểm monotonic của tick kế tiếp."""
+        return self._origin_monotonic + self._index * self.interval
+
+    def wait(self):
+        """Chờ đến tick kế tiếp; trả về thời điểm của tick (epoch giây) hoặc None nếu đã dừng."""
+        if self._stop.is_set():
+            return None
+
+        # Đồng hồ thực bị chỉnh (NTP, đổi giờ tay): căn lại để tick vẫn trùng mốc với thiết bị khác
+        if abs(time.time() - time.monotonic() - self._offset) > CLOCK_STEP_THRESHOLD:
+            logger.info("Đồng hồ hệ thống thay đổi, căn lại mốc lấy mẫu")
+            self._anchor()
+
+        deadline = self._next_monotonic()
+        now = time.monotonic()
+        lateness = now - deadline
+        if lateness > self.interval / 2:
+            # Đã lỡ tick: nhảy tới tick kế tiếp trong tương lai
+            missed = int(lateness // self.interval) + 1
+            self._index += missed
+            self.skipped += missed
+            deadline = self._next_monotonic()
+            logger.debug(f"Bỏ qua {missed} tick do chu kỳ trước xử lý quá lâu")
+
+        remaining = deadline - now
+        if remaining > 0 and self._stop.wait(remaining):
+            return None
+
+        tick = self._origin_wall + self._index * self.interval
+        self._index += 1
+        return tick
+
+    def stop(self):
+        """Dừng bộ hẹn giờ, đánh thức lời gọi wait() đang chờ."""
+        self._stop.set()
+
+    def __iter__(self):
+        """Lặp qua các tick cho đến khi stop() được gọi."""
+        while True:
+            tick = self.wait()
+            if tick is None:
+                return
+            yield tick
+
+
+def counter_delta(current, previous, bits=COUNTER_BITS):
+    """
+    Phần tăng của bộ đếm bits bit giữa hai lần đọc.
+    Độ rộng bộ đếm phải biết trước, không đoán từ giá trị: bộ đếm nhỏ đi chỉ được coi là tràn khi giá trị trước
+    nằm ở nửa trên của miền bits bit và phần tăng sau khi cộng vòng nhỏ hơn nửa vòng; ngược lại là reset
+    (thiết bị khởi động lại, reset counter) và giá trị hiện tại chính là phần tăng.
+    """
+    if current >= previous:
+        return current - previous
+    wrap = 1 << bits
+    if previous >= wrap // 2:
+        delta = wrap - previous + current
+        if delta < wrap // 2:
+            return delta
+    return current
+
+
+def counter_rate(current, previous, elapsed, bits=COUNTER_BITS):
+    """Tốc độ theo "KB/s" của các công cụ khác (bits/giây chia 1024) tính trên thời gian đo thực tế."""
+    if elapsed <= 0:
+        return 0.0
+    return counter_delta(current, previous, bits) * 8 / elapsed / 1024
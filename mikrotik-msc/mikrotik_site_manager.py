@@ -36,6 +36,8 @@ try:
 except ImportError as e:
     logger.warning(f"Không thể import một số module: {e}")
 
+from mikrotik_profiling import instrument_api
+
 
 class Site:
     """Lớp đại diện cho một site (thiết bị MikroTik)."""
@@ -71,6 +73,7 @@ class Site:
             self.monitor = MikroTikMonitor(self.host, self.username, self.password)
             api = self.monitor.connect()
             if api:
+                self.monitor.api = instrument_api(self.monitor.api)
                 self._connected = True
                 self.status = "online"
                 self.last_seen = datetime.now()
@@ -89,18 +92,22 @@ class Site:
                 if 'MikroTikClientMonitor' in globals():
                     self.client_monitor = MikroTikClientMonitor(self.host, self.username, self.password)
                     self.client_monitor.connect()
+                    self.client_monitor.api = instrument_api(self.client_monitor.api)
                 
                 if 'MikroTikFirewallManager' in globals():
                     self.firewall_manager = MikroTikFirewallManager(self.host, self.username, self.password)
                     self.firewall_manager.connect()
+                    self.firewall_manager.api = instrument_api(self.firewall_manager.api)
                 
                 if 'MikroTikCAPsMANManager' in globals():
                     self.capsman_manager = MikroTikCAPsMANManager(self.host, self.username, self.password)
                     self.capsman_manager.connect()
+                    self.capsman_manager.api = instrument_api(self.capsman_manager.api)
                 
                 if 'MikroTikBackupManager' in globals():
                     self.backup_manager = MikroTikBackupManager(self.host, self.username, self.password)
                     self.backup_manager.connect()
+                    self.backup_manager.api = instrument_api(self.backup_manager.api)
                     
                 logger.info(f"Đã kết nối đến site {self.name} ({self.host})")
                 return True
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Thống kê trực tuyến theo interface với bộ nhớ cố định
+Mỗi chuỗi tốc độ giữ trung bình và phương sai theo Welford, min/max, một t-digest để ước lượng
+p50/p95/p99 và các trung bình trượt hàm mũ (EWMA) theo thời gian, thay vì lưu danh sách mẫu.
+Các đối tượng gộp được với nhau (nhiều khoảng thời gian, nhiều interface hoặc thiết bị),
+được dùng chung bởi monitor nhiều interface, MikroTikMonitor của các ứng dụng web và traffic logger.
+"""
+
+import math
+import threading
+from array import array
+
+# Độ nén của t-digest: số centroid tối đa khoảng COMPRESSION, sai số phân vị đuôi cỡ 0.1%
+COMPRESSION = 100
+
+# Các EWMA theo thời gian: tên -> chu kỳ bán rã (giây), như load average 1/5/15 phút
+EWMA_HALFLIVES = (('1m', 60), ('5m', 300), ('15m', 900))
+
+QUANTILES = (('p50', 0.5), ('p95', 0.95), ('p99', 0.99))
+
+
+class TDigest:
+    """
+    t-digest dạng gộp (merging digest) với hàm tỉ lệ k1: mẫu mới vào bộ đệm, khi đầy thì được sắp xếp
+    và gộp cùng các centroid hiện có. Số centroid bị chặn theo compression nên bộ nhớ không đổi.
+    """
+
+    __slots__ = ('compression', 'means', 'weights', '_buffer', '_buffer_weights', '_buffer_size',
+                 'count', 'min', 'max')
+
+    def __init__(self, compression=COMPRESSION):
+        self.compression = compression
+        self.means = array('d')
+        self.weights = array('d')
+        self._buffer = array('d')
+        self._buffer_weights = array('d')
+        self._buffer_size = 5 * compression
+        self.count = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value, weight=1.0):
+        self._buffer.append(value)
+        self._buffer_weights.append(weight)
+        self.count += weight
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if len(self._buffer) >= self._buffer_size:
+            self._compress()
+
+    def merge(self, other):
+        """Gộp các centroid và mẫu đang chờ của digest khác vào digest này."""
+        self._buffer.extend(other.means)
+        self._buffer_weights.extend(other.weights)
+        self._buffer.extend(other._buffer)
+        self._buffer_weights.extend(other._buffer_weights)
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+
+    def _k_limit(self, q):
+        """Phân vị lớn nhất mà centroid bắt đầu tại q được phép phủ tới (tăng k1 thêm 1)."""
+        k = self.compression / (2 * math.pi) * math.asin(2 * q - 1) + 1
+        if k >= self.compression / 4:
+            return 1.0
+        return (math.sin(k * 2 * math.pi / self.compression) + 1) / 2
+
+    def _compress(self):
+        if not self._buffer:
+            return
+        items = sorted(zip(list(self.means) + list(self._buffer), list(self.weights) + list(self._buffer_weights)))
+        self._buffer = array('d')
+        self._buffer_weights = array('d')
+        total = self.count
+        means = array('d')
+        weights = array('d')
+
+        mean, weight = items[0]
+        merged = 0.0
+        limit = self._k_limit(0.0)
+        for item_mean, item_weight in items[1:]:
+            if (merged + weight + item_weight) / total <= limit:
+                weight += item_weight
+                mean += (item_mean - mean) * item_weight / weight
+            else:
+                means.append(mean)
+                weights.append(weight)
+                merged += weight
+                limit = self._k_limit(merged / total)
+                mean, weight = item_mean, item_weight
+        means.append(mean)
+        weights.append(weight)
+        self.means, self.weights = means, weights
+
+    def quantile(self, q):
+        """Ước lượng phân vị q (0..1) bằng nội suy giữa tâm các centroid; 0.0 nếu chưa có mẫu."""
+        self._compress()
+        if not self.means:
+            return 0.0
+        if len(self.means) == 1:
+            return self.means[0]
+        means, weights = self.means, self.weights
+        target = q * self.count
+
+        # Phần đầu: nội suy giữa min và tâm centroid đầu tiên
+        if target < weights[0] / 2:
+            return self.min + (means[0] - self.min) * target / (weights[0] / 2)
+        cumulative = 0.0
+        for i in range(len(means) - 1):
+            center = cumulative + weights[i] / 2
+            next_center = cumulative + weights[i] + weights[i + 1] / 2
+            if target <= next_center:
+                return means[i] + (means[i + 1] - means[i]) * (target - center) / (next_center - center)
+            cumulative += weights[i]
+
+        # Phần cuối: nội suy giữa tâm centroid cuối cùng và max
+        last = weights[-1] / 2
+        return means[-1] + (self.max - means[-1]) * min(1.0, (target - (self.count - last)) / last)
+
+
+class StreamingStats:
+    """
+    Thống kê một chuỗi giá trị theo thời gian: số mẫu, giá trị mới nhất, trung bình và phương sai (Welford),
+    min/max, phân vị (t-digest) và EWMA theo thời gian thực với các chu kỳ bán rã trong EWMA_HALFLIVES.
+    """
+
+    __slots__ = ('count', 'mean', '_m2', 'min', 'max', 'last', 'last_time', 'digest', 'ewma')
+
+    def __init__(self, compression=COMPRESSION):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.last = 0.0
+        self.last_time = None
+        self.digest = TDigest(compression)
+        self.ewma = array('d', [0.0] * len(EWMA_HALFLIVES))
+
+    def add(self, value, timestamp):
+        """Thêm một mẫu tại timestamp (giây, tăng dần)."""
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.digest.add(value)
+
+        if self.last_time is None:
+            for i in range(len(self.ewma)):
+                self.ewma[i] = value
+        elif timestamp > self.last_time:
+            elapsed = timestamp - self.last_time
+            for i, (_, halflife) in enumerate(EWMA_HALFLIVES):
+                self.ewma[i] += (value - self.ewma[i]) * (1 - 2 ** (-elapsed / halflife))
+        self.last = value
+        self.last_time = timestamp
+
+    def merge(self, other):
+        """
+        Gộp thống kê của other (khoảng thời gian khác hoặc chuỗi khác) vào đối tượng này.
+        Phân phối được gộp chính xác (Chan et al. cho phương sai); EWMA và giá trị mới nhất là trạng thái
+        hiện tại nên lấy theo chuỗi có mẫu sau cùng.
+        """
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.mean, self._m2 = other.mean, other._m2
+        else:
+            count = self.count + other.count
+            delta = other.mean - self.mean
+            self._m2 += other._m2 + delta * delta * self.count * other.count / count
+            self.mean += delta * other.count / count
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.digest.merge(other.digest)
+        if self.last_time is None or (other.last_time is not None and other.last_time > self.last_time):
+            self.last, self.last_time = other.last, other.last_time
+            self.ewma = array('d', other.ewma)
+
+    @property
+    def variance(self):
+        """Phương sai mẫu (0.0 khi có ít hơn hai mẫu)."""
+        return self._m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    def quantile(self, q):
+        return self.digest.quantile(q)
+
+    def summary(self):
+        """Các chỉ số dạng dict (dùng cho JSON, báo cáo và metrics)."""
+        if self.count == 0:
+            return {'count': 0}
+        result = {
+            'count': self.count,
+            'last': self.last,
+            'mean': self.mean,
+            'std': self.std,
+            'min': self.min,
+            'max': self.max,
+        }
+        for name, q in QUANTILES:
+            result[name] = self.quantile(q)
+        result['ewma'] = {name: self.ewma[i] for i, (name, _) in enumerate(EWMA_HALFLIVES)}
+        return result
+
+
+class InterfaceStats:
+    """Thống kê tốc độ TX/RX (KB/s) của một interface; an toàn khi thread thu thập và thread đọc chạy song song."""
+
+    def __init__(self, compression=COMPRESSION):
+        self.tx = StreamingStats(compression)
+        self.rx = StreamingStats(compression)
+        self._lock = threading.Lock()
+
+    def add(self, timestamp, tx_kbps, rx_kbps):
+        with self._lock:
+            self.tx.add(tx_kbps, timestamp)
+            self.rx.add(rx_kbps, timestamp)
+
+    def merge(self, other):
+        """Gộp thống kê của interface (hoặc khoảng thời gian) khác vào đối tượng này."""
+        with other._lock:
+            tx, rx = _copy(other.tx), _copy(other.rx)
+        with self._lock:
+            self.tx.merge(tx)
+            self.rx.merge(rx)
+
+    @property
+    def count(self):
+        return self.tx.count
+
+    def summary(self):
+        """{'tx': {...}, 'rx': {...}} theo StreamingStats.summary."""
+        with self._lock:
+            return {'tx': self.tx.summary(), 'rx': self.rx.summary()}
+
+
+def _copy(stats):
+    """Bản sao độc lập của một StreamingStats (để gộp mà không giữ khóa của đối tượng nguồn)."""
+    copy = StreamingStats(stats.digest.compression)
+    copy.merge(stats)
+    return copy
+
+
+def collect_stats_metrics(entries):
+    """
+    Các họ metrics Prometheus từ thống kê interface: entries là danh sách (labels, InterfaceStats).
+    Tốc độ được đổi sang bit/s như các metrics tốc độ hiện có.
+    """
+    quantiles = {'tx': [], 'rx': []}
+    averages = {'tx': [], 'rx': []}
+    for labels, stats in entries:
+        summary = stats.summary()
+        for direction in ('tx', 'rx'):
+            values = summary[direction]
+            if not values['count']:
+                continue
+            for name, q in QUANTILES:
+                quantiles[direction].append(({**labels, 'quantile': str(q)}, values[name] * 1024))
+            for name, value in values['ewma'].items():
+                averages[direction].append(({**labels, 'window': name}, value * 1024))
+
+    for direction, label in (('tx', 'gửi'), ('rx', 'nhận')):
+        yield (f'mikrotik_interface_{direction}_bits_per_second_quantile', 'gauge',
+               f'Phân vị tốc độ {label} của interface từ khi bắt đầu giám sát (ước lượng t-digest)', quantiles[direction])
+        yield (f'mikrotik_interface_{direction}_bits_per_second_ewma', 'gauge',
+               f'Tốc độ {label} trung bình trượt hàm mũ của interface theo cửa sổ', averages[direction])
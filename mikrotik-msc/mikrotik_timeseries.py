@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Truy vấn chuỗi thời gian traffic từ database của logger cho các ứng dụng web
+Mỗi truy vấn gộp dữ liệu theo bucket step giây (căn theo epoch) với hàm gộp avg, min, max, p95 hoặc sum:
+tầng rollup được gộp ngay trong SQLite, dữ liệu gốc được gộp vector hóa bằng mikrotik_analytics.
+Số điểm trả về luôn bị chặn bởi max_points (step được tăng khi cần), và kết quả được cache theo cửa sổ
+đã căn theo step nên các lần tải lại biểu đồ tuần/tháng không phải truy vấn lại.
+"""
+
+import logging
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+
+import mikrotik_analytics as analytics
+from mikrotik_retention import load_tiers, parse_duration
+
+logger = logging.getLogger("mikrotik_timeseries")
+
+AGGREGATIONS = ('avg', 'min', 'max', 'p95', 'sum')
+DEFAULT_WINDOW = 24 * 3600
+MAX_POINTS = 2000
+
+# Các step tự chọn khi không chỉ định, để cửa sổ cache ổn định giữa các lần tải
+NICE_STEPS = (5, 10, 15, 30, 60, 120, 300, 600, 900, 1800, 3600, 7200, 10800, 21600, 43200, 86400, 604800)
+
+# Cửa sổ kết thúc trước now - SETTLE_SECONDS được coi là đã đủ dữ liệu (đã flush và đóng bucket rollup),
+# cache vĩnh viễn; cửa sổ còn đang nhận dữ liệu chỉ cache LIVE_TTL giây
+SETTLE_SECONDS = 180
+LIVE_TTL = 10
+
+# Biểu thức gộp trên traffic_rollups theo hàm gộp, {d} là tx hoặc rx.
+# p95 của nhiều bucket không gộp chính xác được nên lấy giá trị lớn nhất (chính xác khi step bằng step của tầng)
+_ROLLUP_EXPRESSIONS = {
+    'avg': 'SUM(avg_{d}_kbps * samples) / SUM(samples)',
+    'min': 'MIN(min_{d}_kbps)',
+    'max': 'MAX(max_{d}_kbps)',
+    'p95': 'MAX(p95_{d}_kbps)',
+    'sum': 'SUM({d}_bytes)',
+}
+
+
+def parse_time(value, now=None):
+    """
+    Đọc tham số thời gian: epoch giây, 'now', khoảng lùi so với hiện tại ('-7d', '-90m')
+    hoặc ngày giờ địa phương dạng ISO ('2024-05-01', '2024-05-01 08:00:00').
+    """
+    now = time.time() if now is None else now
+    if isinstance(value, (int, float)):
+        return int(value)
+    text = value.strip()
+    if text == 'now':
+        return int(now)
+    if text.startswith('-'):
+        return int(now) - parse_duration(text[1:])
+    try:
+        return int(float(text))
+    except ValueError:
+        pass
+    try:
+        return int(datetime.fromisoformat(text).timestamp())
+    except ValueError:
+        raise ValueError(f"Thời gian không hợp lệ: {value}")
+
+
+def choose_step(start, end, step=None, max_points=MAX_POINTS):
+    """Step của truy vấn: step yêu cầu (hoặc step đẹp nhỏ nhất) nhưng không để số bucket vượt max_points."""
+    minimum = max(1, math.ceil((end - start) / max_points))
+    if step is None:
+        return next((nice for nice in NICE_STEPS if nice >= minimum), minimum)
+    return max(int(step), minimum)
+
+
+def choose_source(tiers, start, step, now=None):
+    """
+    Chọn tầng đọc dữ liệu cho bucket step giây bắt đầu từ start: tầng thô nhất còn giữ dữ liệu từ start
+    có step không lớn hơn step. Trả về (tầng, step); step được làm tròn lên bội số của step tầng
+    để mỗi bucket rollup nằm gọn trong một bucket kết quả.
+    """
+    now = time.time() if now is None else now
+    covering = [tier for tier in tiers if tier.retention is None or now - tier.retention <= start] or tiers[-1:]
+    usable = [tier for tier in covering if tier.step <= step]
+    tier = usable[-1] if usable else covering[0]
+    if tier.step and step % tier.step:
+        step += tier.step - step % tier.step
+    return tier, step
+
+
+class TimeSeriesQuery:
+    """
+    Truy vấn chuỗi tốc độ/lưu lượng của một interface theo (thiết bị, interface) từ database của logger.
+    Dùng một kết nối chỉ đọc chung cho mọi thread; kết quả được cache LRU theo cửa sổ đã căn step.
+    """
+
+    def __init__(self, db_file, max_points=MAX_POINTS, cache_size=256):
+        self.db_file = db_file
+        self.max_points = max_points
+        self.cache_size = cache_size
+        self._conn = None
+        self._lock = threading.Lock()
+        self._interfaces = {}
+        self._cache = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def _connection(self):
+        if self._conn is None:
+            # mode=ro: không tạo file rỗng khi logger chưa chạy
+            self._conn = sqlite3.connect(f"file:{self.db_file}?mode=ro", uri=True, check_same_thread=False)
+        return self._conn
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def resolve_interface(self, device, interface):
+        """ID interface theo tên thiết bị (hostname, địa chỉ IP hoặc ID) và tên interface; LookupError nếu không có."""
+        key = (device, interface)
+        interface_id = self._interfaces.get(key)
+        if interface_id is None:
+            row = self._connection().execute('''
+            SELECT i.id FROM interfaces i JOIN devices d ON i.device_id = d.id
+            WHERE (d.hostname = ? OR d.ip_address = ? OR CAST(d.id AS TEXT) = ?) AND i.name = ?
+            ORDER BY i.id LIMIT 1
+            ''', (device, device, device, interface)).fetchone()
+            if row is None:
+                raise LookupError(f"Không tìm thấy interface {interface} của thiết bị {device}")
+            interface_id = self._interfaces[key] = row[0]
+        return interface_id
+
+    def query(self, device, interface, start=None, end=None, step=None, agg='avg', now=None):
+        """
+        Chuỗi của interface trong [start, end) gộp theo bucket step giây bằng hàm gộp agg.
+        start/end/step nhận cùng định dạng như tham số URL (mặc định: 24 giờ gần nhất, step tự chọn).
+        Trả về (phiên bản, payload); payload gồm các mảng timestamps, tx, rx (kbps, hoặc byte với agg='sum'),
+        bucket không có mẫu bị bỏ qua. ValueError nếu tham số sai, LookupError nếu không có interface.
+        """
+        if agg not in AGGREGATIONS:
+            raise ValueError(f"Hàm gộp không hợp lệ: {agg} (hỗ trợ: {', '.join(AGGREGATIONS)})")
+        now = time.time() if now is None else now
+        end = parse_time(end, now) if end is not None else int(now)
+        start = parse_time(start, now) if start is not None else end - DEFAULT_WINDOW
+        if start >= end:
+            raise ValueError("Thời điểm bắt đầu phải trước thời điểm kết thúc")
+        if isinstance(step, str):
+            step = parse_duration(step)
+        if step is not None and step <= 0:
+            raise ValueError("step phải lớn hơn 0")
+
+        with self._lock:
+            interface_id = self.resolve_interface(device, interface)
+            requested = step
+            step = choose_step(start, end, step, self.max_points)
+            tier = None
+            tiers = load_tiers(self._connection())
+            while True:
+                if tiers:
+                    tier, step = choose_source(tiers, start, step, now)
+                # Căn cửa sổ theo step: mọi yêu cầu trong cùng bucket dùng chung một mục cache
+                aligned_start = start - start % step
+                aligned_end = end + -end % step
+                if (aligned_end - aligned_start) // step <= self.max_points:
+                    break
+                # Cửa sổ sau khi căn có thể thêm một bucket: chọn lại step theo cửa sổ đã căn
+                step = choose_step(aligned_start, aligned_end, requested and step, self.max_points)
+            start, end = aligned_start, aligned_end
+
+            key = (interface_id, start, end, step, agg)
+            cached = self._cache.get(key)
+            if cached is not None and (cached[0] is None or cached[0] > now):
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                return cached[1], cached[2]
+
+            self.cache_misses += 1
+            started = time.perf_counter()
+            if tier is not None and tier.step:
+                timestamps, tx, rx = self._rollup_series(interface_id, tier.step, start, end, step, agg)
+            else:
+                timestamps, tx, rx = self._raw_series(interface_id, start, end, step, agg)
+            payload = {
+                'device': device,
+                'interface': interface,
+                'from': start,
+                'to': end,
+                'step': step,
+                'agg': agg,
+                'unit': 'bytes' if agg == 'sum' else 'kbps',
+                'source': tier.name if tier is not None else 'raw',
+                'timestamps': timestamps.tolist(),
+                'tx': tx.tolist(),
+                'rx': rx.tolist(),
+            }
+            logger.debug(f"Truy vấn {device}/{interface} [{start}, {end}) step={step} agg={agg} "
+                         f"({payload['source']}): {len(timestamps)} điểm trong {time.perf_counter() - started:.3f}s")
+
+            expires = None if end <= now - SETTLE_SECONDS else now + LIVE_TTL
+            version = key + (now,)
+            self._cache[key] = (expires, version, payload)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return version, payload
+
+    def _rollup_series(self, interface_id, tier_step, start, end, step, agg):
+        """Gộp bucket của tầng rollup thành bucket step giây ngay trong SQLite."""
+        tx_expression = _ROLLUP_EXPRESSIONS[agg].format(d='tx')
+        rx_expression = _ROLLUP_EXPRESSIONS[agg].format(d='rx')
+        cursor = self._connection().execute(f'''
+        SELECT bucket_ts - bucket_ts % ? AS bucket, {tx_expression}, {rx_expression}
+        FROM traffic_rollups
+        WHERE interface_id = ? AND step = ? AND bucket_ts >= ? AND bucket_ts < ?
+        GROUP BY bucket
+        ORDER BY bucket
+        ''', (step, interface_id, tier_step, start, end))
+        rows = np.array(cursor.fetchall(), dtype=np.float64).reshape(-1, 3)
+        return rows[:, 0].astype(np.int64), rows[:, 1], rows[:, 2]
+
+    def _raw_series(self, interface_id, start, end, step, agg):
+        """Gộp dữ liệu gốc theo bucket step giây bằng các phép tính vector hóa."""
+        frame = analytics.load_frame(self._connection(), start, end - 1, [interface_id], previous=agg == 'sum')
+        timestamps = frame['timestamp']
+        if agg == 'sum':
+            # Mẫu trước start chỉ làm gốc cho phần tăng của mẫu đầu tiên trong cửa sổ
+            tx, rx = frame.byte_deltas()
+            inside = timestamps >= start
+            timestamps, tx, rx = timestamps[inside], tx[inside], rx[inside]
+            buckets, tx = analytics.resample(timestamps, tx, step, 'sum')
+            _, rx = analytics.resample(timestamps, rx, step, 'sum')
+        elif agg == 'p95':
+            buckets, tx = analytics.resample_percentile(timestamps, frame['tx_kbps'], step, 0.95)
+            _, rx = analytics.resample_percentile(timestamps, frame['rx_kbps'], step, 0.95)
+        else:
+            how = 'mean' if agg == 'avg' else agg
+            buckets, tx = analytics.resample(timestamps, frame['tx_kbps'], step, how)
+            _, rx = analytics.resample(timestamps, frame['rx_kbps'], step, how)
+        return buckets, tx, rx
+
+    def collect_metrics(self):
+        """Collector metrics Prometheus: số lần trúng/trượt cache truy vấn chuỗi thời gian."""
+        yield ('mikrotik_timeseries_cache_requests_total', 'counter', 'Số truy vấn chuỗi thời gian theo kết quả cache',
+               [({'result': 'hit'}, self.cache_hits), ({'result': 'miss'}, self.cache_misses)])
+        yield ('mikrotik_timeseries_cache_entries', 'gauge', 'Số cửa sổ đang được cache', [({}, len(self._cache))])
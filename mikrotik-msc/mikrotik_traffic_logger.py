@@ -32,87 +32,54 @@ except ImportError:
     logger.error("Không thể import routeros_api. Chạy: pip install routeros-api")
     sys.exit(1)
 
+from mikrotik_collector import InterfaceCollector
+from mikrotik_sampling import TickScheduler
+from mikrotik_traffic_store import (
+    TrafficWriter, DailyStatsAggregator, RollupAggregator, open_connection, init_schema, rebuild_daily_stats,
+    format_date, display_timestamp
+)
+from mikrotik_retention import DEFAULT_RETENTION, RetentionManager, parse_tiers, rollup_steps, save_tiers
+from mikrotik_anomaly_detector import DEFAULT_THRESHOLD, StreamingAnomalyDetector
+from mikrotik_stats import InterfaceStats, collect_stats_metrics
+
 
 class MikroTikTrafficLogger:
     """Lớp thu thập và lưu trữ dữ liệu traffic từ MikroTik."""
     
-    def __init__(self, host, username, password, db_file='mikrotik_traffic.db'):
-        """Khởi tạo với thông tin kết nối và database."""
+    def __init__(self, host, username, password, db_file='mikrotik_traffic.db', init_db=True, storage='rows',
+                 retention=None, anomaly_threshold=None):
+        """
+        Khởi tạo với thông tin kết nối và database (init_db=False khi database đã được khởi tạo).
+        storage='blocks' lưu mẫu vào bảng traffic_blocks nén theo cột thay vì traffic_data.
+        retention (ví dụ 'raw=48h,1m=30d,1h=forever') bật các tầng gộp và xóa dữ liệu hết hạn.
+        anomaly_threshold (số độ lệch chuẩn) bật phát hiện bất thường trực tuyến trên các mẫu thu thập.
+        """
         self.host = host
         self.username = username
         self.password = password
         self.connection = None
         self.api = None
         self.db_file = db_file
+        self.storage = storage
+        self.tiers = parse_tiers(retention) if retention else None
         self.running = False
         self.interfaces_data = {}  # Dữ liệu về mỗi interface
+        self.interface_stats = {}  # Thống kê tốc độ trực tuyến (trung bình, phân vị, EWMA) theo interface
+        self.writer = None  # Bộ đệm ghi traffic_data, tạo khi có mẫu đầu tiên
+        self.detector = StreamingAnomalyDetector(anomaly_threshold) if anomaly_threshold else None
         
         # Tạo cơ sở dữ liệu nếu chưa tồn tại
-        self.init_database()
+        if init_db:
+            self.init_database()
     
     def init_database(self):
         """Khởi tạo cơ sở dữ liệu SQLite."""
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            # Tạo bảng lưu trữ thông tin thiết bị
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS devices (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                hostname TEXT,
-                ip_address TEXT,
-                model TEXT,
-                ros_version TEXT,
-                last_seen TIMESTAMP
-            )
-            ''')
-            
-            # Tạo bảng lưu trữ thông tin interface
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS interfaces (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                device_id INTEGER,
-                name TEXT,
-                type TEXT,
-                mac_address TEXT,
-                FOREIGN KEY (device_id) REFERENCES devices (id)
-            )
-            ''')
-            
-            # Tạo bảng lưu trữ dữ liệu traffic
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS traffic_data (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                interface_id INTEGER,
-                timestamp TIMESTAMP,
-                tx_bytes BIGINT,
-                rx_bytes BIGINT,
-                tx_packets INTEGER,
-                rx_packets INTEGER,
-                tx_rate_kbps REAL,
-                rx_rate_kbps REAL,
-                FOREIGN KEY (interface_id) REFERENCES interfaces (id)
-            )
-            ''')
-            
-            # Tạo bảng lưu trữ thống kê hàng ngày
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS daily_stats (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                interface_id INTEGER,
-                date DATE,
-                avg_tx_kbps REAL,
-                avg_rx_kbps REAL,
-                max_tx_kbps REAL,
-                max_rx_kbps REAL,
-                total_tx_mb REAL,
-                total_rx_mb REAL,
-                FOREIGN KEY (interface_id) REFERENCES interfaces (id)
-            )
-            ''')
-            
-            conn.commit()
+            # Bật WAL (được lưu trong file database) để ghi theo lô không chặn các truy vấn đọc
+            conn = open_connection(self.db_file)
+            init_schema(conn)
+            if self.tiers:
+                save_tiers(conn, self.tiers)
             conn.close()
             logger.info(f"Đã khởi tạo cơ sở dữ liệu {self.db_file}")
         
@@ -270,7 +237,27 @@ class MikroTikTrafficLogger:
         except Exception as e:
             logger.error(f"Lỗi khi lấy ID interface: {e}")
             return None
-    
+
+    def get_interface_ids(self):
+        """Lấy {tên interface: ID} của thiết bị bằng một truy vấn."""
+        try:
+            conn = sqlite3.connect(self.db_file)
+            cursor = conn.cursor()
+
+            cursor.execute('''
+            SELECT i.name, i.id FROM interfaces i
+            JOIN devices d ON i.device_id = d.id
+            WHERE d.ip_address = ?
+            ''', (self.host,))
+
+            result = dict(cursor.fetchall())
+            conn.close()
+            return result
+
+        except Exception as e:
+            logger.error(f"Lỗi khi lấy ID interface: {e}")
+            return {}
+
     def get_interfaces(self):
         """Lấy danh sách interfaces đang hoạt động."""
         if not self.api:
@@ -324,172 +311,164 @@ class MikroTikTrafficLogger:
             logger.error(f"Lỗi khi lấy dữ liệu traffic cho {interface_name}: {e}")
             return None
     
-    def monitor_interface(self, interface_name, interval=5):
-        """Thread function để giám sát và ghi log một interface cụ thể."""
-        logger.info(f"Bắt đầu ghi log traffic cho interface {interface_name}")
-        
-        # Lấy interface_id
-        interface_id = self.get_interface_id(interface_name)
-        if not interface_id:
-            logger.error(f"Không thể giám sát {interface_name}: không tìm thấy trong database")
-            return
+    def collect_loop(self, interface_names, interval=5):
+        """Thread thu thập: mỗi chu kỳ một truy vấn cho toàn bộ interface rồi ghi log từng interface."""
+        # Lấy interface_id một lần cho mỗi interface
+        interface_ids = {}
+        for interface_name in interface_names:
+            interface_id = self.get_interface_id(interface_name)
+            if interface_id:
+                interface_ids[interface_name] = interface_id
+            else:
+                logger.error(f"Không thể giám sát {interface_name}: không tìm thấy trong database")
         
-        # Khởi tạo giá trị trước đó
-        previous_data = self.get_interface_traffic(interface_name)
-        if not previous_data:
-            logger.error(f"Không thể đọc dữ liệu traffic cho {interface_name}")
+        if not interface_ids:
+            logger.error("Không có interface nào để ghi log")
             return
         
-        last_save_time = datetime.now()
+        logger.info(f"Bắt đầu ghi log traffic cho {len(interface_ids)} interface")
+        if self.detector:
+            for interface_name, interface_id in interface_ids.items():
+                self.detector.set_labels(interface_id, self.host, interface_name)
+        collector = InterfaceCollector(self.api, interface_ids.keys())
+        scheduler = TickScheduler(interval)
         
         while self.running:
-            current_time = datetime.now()
-            
-            # Lấy dữ liệu traffic hiện tại
-            current_data = self.get_interface_traffic(interface_name)
-            
-            if current_data and previous_data:
-                # Tính toán tốc độ dựa trên sự khác biệt
-                tx_bytes = current_data['tx_bytes'] - previous_data['tx_bytes']
-                rx_bytes = current_data['rx_bytes'] - previous_data['rx_bytes']
-                tx_packets = current_data['tx_packets'] - previous_data['tx_packets']
-                rx_packets = current_data['rx_packets'] - previous_data['rx_packets']
-                
-                # Bytes/giây
-                tx_bytes_per_second = tx_bytes / interval
-                rx_bytes_per_second = rx_bytes / interval
-                
-                # Bits/giây (1 byte = 8 bits)
-                tx_bits_per_second = tx_bytes_per_second * 8
-                rx_bits_per_second = rx_bytes_per_second * 8
-                
-                # Chuyển đổi sang KB/s
-                tx_kbps = tx_bits_per_second / 1024
-                rx_kbps = rx_bits_per_second / 1024
+            # Chờ đến mốc chu kỳ kế tiếp; mọi thiết bị ghi mẫu cùng mốc thời gian
+            tick = scheduler.wait()
+            if tick is None or not self.running:
+                break
+            current_time = datetime.fromtimestamp(tick)
+            
+            # Một truy vấn /interface print cho tất cả interface
+            try:
+                samples = collector.collect()
+            except Exception as e:
+                logger.error(f"Lỗi khi lấy dữ liệu traffic: {e}")
+                samples = {}
+            
+            for interface_name, sample in samples.items():
+                interface_id = interface_ids[interface_name]
                 
                 # Lưu vào cơ sở dữ liệu
                 self.store_traffic_data(
-                    interface_id, 
+                    interface_id,
                     current_time,
-                    current_data['tx_bytes'],
-                    current_data['rx_bytes'],
-                    current_data['tx_packets'],
-                    current_data['rx_packets'],
-                    tx_kbps,
-                    rx_kbps
+                    sample['tx_bytes'],
+                    sample['rx_bytes'],
+                    sample['tx_packets'],
+                    sample['rx_packets'],
+                    sample['tx_kbps'],
+                    sample['rx_kbps']
                 )
                 
-                # In thông tin debug
-                logger.debug(f"{interface_name}: TX: {tx_kbps:.2f} KB/s, RX: {rx_kbps:.2f} KB/s")
+                # Giữ mẫu mới nhất trong bộ nhớ cho endpoint metrics
+                self.interfaces_data[interface_name] = {
+                    'tx_bytes': sample['tx_bytes'],
+                    'rx_bytes': sample['rx_bytes'],
+                    'tx_packets': sample['tx_packets'],
+                    'rx_packets': sample['rx_packets'],
+                    'tx_kbps': sample['tx_kbps'],
+                    'rx_kbps': sample['rx_kbps'],
+                    'timestamp': current_time.timestamp()
+                }
+                stats = self.interface_stats.get(interface_name)
+                if stats is None:
+                    stats = self.interface_stats[interface_name] = InterfaceStats()
+                stats.add(tick, sample['tx_kbps'], sample['rx_kbps'])
                 
-                # Cập nhật thống kê hàng ngày mỗi 15 phút
-                if (current_time - last_save_time).total_seconds() >= 900:  # 15 phút
-                    self.update_daily_stats(interface_id, current_time.date())
-                    last_save_time = current_time
-            
-            # Lưu giá trị hiện tại cho lần sau
-            previous_data = current_data
-            
-            # Ngủ đến lần cập nhật tiếp theo
-            time.sleep(interval)
+                # In thông tin debug
+                logger.debug(f"{interface_name}: TX: {sample['tx_kbps']:.2f} KB/s, RX: {sample['rx_kbps']:.2f} KB/s")
+            
+            # Chấm điểm bất thường cho cả tick một lần
+            if self.detector and samples:
+                self.detector.observe_batch(tick, [
+                    (interface_ids[interface_name], sample['tx_kbps'], sample['rx_kbps'])
+                    for interface_name, sample in samples.items()
+                ])
         
-        logger.info(f"Đã dừng ghi log traffic cho interface {interface_name}")
+        logger.info("Đã dừng ghi log traffic")
     
     def store_traffic_data(self, interface_id, timestamp, tx_bytes, rx_bytes, tx_packets, rx_packets, tx_rate_kbps, rx_rate_kbps):
-        """Lưu dữ liệu traffic vào cơ sở dữ liệu."""
+        """Đưa dữ liệu traffic vào bộ đệm ghi, được ghi xuống database theo lô."""
+        if self.writer is None:
+            # Thống kê hàng ngày được cộng dồn theo từng mẫu và upsert mỗi phút; các tầng gộp được tạo cùng lúc
+            rollups = RollupAggregator(rollup_steps(self.tiers)) if self.tiers else None
+            if self.storage == 'blocks':
+                from mikrotik_block_store import BlockWriter
+                self.writer = BlockWriter(self.db_file, daily_stats=DailyStatsAggregator(), rollups=rollups)
+            else:
+                self.writer = TrafficWriter(self.db_file, daily_stats=DailyStatsAggregator(), rollups=rollups)
+        self.writer.append(
+            interface_id, timestamp, tx_bytes, rx_bytes, tx_packets, rx_packets, tx_rate_kbps, rx_rate_kbps
+        )
+    
+    def close_writer(self):
+        """Ghi nốt bộ đệm và đóng kết nối ghi."""
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+    
+    def update_daily_stats(self, interface_id, date):
+        """Tính lại thống kê một ngày từ traffic_data (thống kê thường ngày được cập nhật tăng dần khi ghi)."""
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
+            date_str = format_date(date)
             
-            cursor.execute('''
-            INSERT INTO traffic_data 
-            (interface_id, timestamp, tx_bytes, rx_bytes, tx_packets, rx_packets, tx_rate_kbps, rx_rate_kbps)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                interface_id, 
-                timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-                tx_bytes,
-                rx_bytes,
-                tx_packets,
-                rx_packets,
-                tx_rate_kbps,
-                rx_rate_kbps
-            ))
+            # Ghi nốt bộ đệm để dữ liệu tính lại là đầy đủ
+            if self.writer:
+                self.writer.flush(force_daily=True)
             
-            conn.commit()
+            conn = open_connection(self.db_file)
+            with conn:
+                rebuilt = rebuild_daily_stats(conn, interface_id, date_str)
             conn.close()
+            if rebuilt:
+                logger.info(f"Đã tính lại thống kê ngày {date_str} cho interface {interface_id}")
+            return rebuilt
             
         except Exception as e:
-            logger.error(f"Lỗi khi lưu dữ liệu traffic: {e}")
+            logger.error(f"Lỗi khi cập nhật thống kê hàng ngày: {e}")
+            return False
     
-    def update_daily_stats(self, interface_id, date):
-        """Cập nhật thống kê hàng ngày."""
+    def rebuild_all_daily_stats(self, days=None):
+        """Backfill daily_stats cho mọi interface của thiết bị trong `days` ngày gần nhất (None là toàn bộ)."""
         try:
-            # Chuyển đổi ngày thành string format
-            date_str = date.strftime('%Y-%m-%d')
-            
             conn = sqlite3.connect(self.db_file)
             cursor = conn.cursor()
-            
-            # Lấy dữ liệu traffic trong ngày
             cursor.execute('''
-            SELECT 
-                AVG(tx_rate_kbps), 
-                AVG(rx_rate_kbps),
-                MAX(tx_rate_kbps),
-                MAX(rx_rate_kbps),
-                (MAX(tx_bytes) - MIN(tx_bytes)) / 1048576.0, -- Đổi thành MB
-                (MAX(rx_bytes) - MIN(rx_bytes)) / 1048576.0  -- Đổi thành MB
-            FROM traffic_data
-            WHERE interface_id = ? AND date(timestamp) = ?
-            ''', (interface_id, date_str))
-            
-            result = cursor.fetchone()
+            SELECT i.id FROM interfaces i
+            JOIN devices d ON i.device_id = d.id
+            WHERE d.ip_address = ?
+            ''', (self.host,))
+            interface_ids = [row[0] for row in cursor.fetchall()]
             
-            if result and result[0] is not None:
-                avg_tx_kbps, avg_rx_kbps, max_tx_kbps, max_rx_kbps, total_tx_mb, total_rx_mb = result
-                
-                # Kiểm tra xem đã có thống kê cho ngày này chưa
-                cursor.execute('''
-                SELECT id FROM daily_stats
-                WHERE interface_id = ? AND date = ?
-                ''', (interface_id, date_str))
-                
-                existing_stat = cursor.fetchone()
+            rebuilt = 0
+            for interface_id in interface_ids:
+                # MIN/MAX theo interface được trả lời trực tiếp từ index (interface_id, timestamp)
+                cursor.execute(
+                    "SELECT MIN(timestamp), MAX(timestamp) FROM traffic_data WHERE interface_id = ?",
+                    (interface_id,)
+                )
+                first, last = cursor.fetchone()
+                if not first:
+                    continue
                 
-                if existing_stat:
-                    # Cập nhật thống kê hiện có
-                    cursor.execute('''
-                    UPDATE daily_stats
-                    SET avg_tx_kbps = ?, avg_rx_kbps = ?, 
-                        max_tx_kbps = ?, max_rx_kbps = ?,
-                        total_tx_mb = ?, total_rx_mb = ?
-                    WHERE interface_id = ? AND date = ?
-                    ''', (
-                        avg_tx_kbps, avg_rx_kbps, 
-                        max_tx_kbps, max_rx_kbps,
-                        total_tx_mb, total_rx_mb,
-                        interface_id, date_str
-                    ))
-                else:
-                    # Thêm thống kê mới
-                    cursor.execute('''
-                    INSERT INTO daily_stats
-                    (interface_id, date, avg_tx_kbps, avg_rx_kbps, max_tx_kbps, max_rx_kbps, total_tx_mb, total_rx_mb)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', (
-                        interface_id, date_str, 
-                        avg_tx_kbps, avg_rx_kbps, 
-                        max_tx_kbps, max_rx_kbps,
-                        total_tx_mb, total_rx_mb
-                    ))
+                day = datetime.fromtimestamp(first).date()
+                last_day = datetime.fromtimestamp(last).date()
+                if days:
+                    day = max(day, last_day - timedelta(days=days - 1))
+                while day <= last_day:
+                    if self.update_daily_stats(interface_id, day):
+                        rebuilt += 1
+                    day += timedelta(days=1)
             
-            conn.commit()
             conn.close()
-            logger.info(f"Đã cập nhật thống kê ngày {date_str} cho interface {interface_id}")
-            
+            logger.info(f"Đã tính lại {rebuilt} dòng thống kê hàng ngày")
+            return rebuilt
+        
         except Exception as e:
-            logger.error(f"Lỗi khi cập nhật thống kê hàng ngày: {e}")
+            logger.error(f"Lỗi khi tính lại thống kê hàng ngày: {e}")
+            return 0
     
     def start_logging(self, interface_names=None, interval=5, duration=None):
         """Bắt đầu ghi log nhiều interface."""
@@ -517,16 +496,19 @@ class MikroTikTrafficLogger:
         # Bắt đầu giám sát
         self.running = True
         
-        # Tạo thread cho mỗi interface
-        threads = []
-        for interface_name in interface_names:
-            thread = threading.Thread(
-                target=self.monitor_interface,
-                args=(interface_name, interval),
-                daemon=True  # Thread sẽ tự động kết thúc khi chương trình chính kết thúc
-            )
-            thread.start()
-            threads.append(thread)
+        # Xóa dữ liệu hết hạn định kỳ theo các tầng lưu trữ
+        retention = None
+        if self.tiers:
+            retention = RetentionManager(self.db_file, self.tiers)
+            retention.start()
+        
+        # Một thread thu thập cho cả thiết bị, không phụ thuộc số interface
+        thread = threading.Thread(
+            target=self.collect_loop,
+            args=(interface_names, interval),
+            daemon=True  # Thread sẽ tự động kết thúc khi chương trình chính kết thúc
+        )
+        thread.start()
         
         print(f"\n=== ĐÃ BẮT ĐẦU GHI LOG TRAFFIC ===")
         print(f"Đang ghi log cho {len(interface_names)} interface(s) với chu kỳ {interval} giây")
@@ -546,18 +528,45 @@ class MikroTikTrafficLogger:
         except KeyboardInterrupt:
             print("\nĐã nhận tín hiệu dừng ghi log.")
         finally:
-            # Dừng tất cả các thread
+            # Dừng thread thu thập
             self.running = False
+            if retention:
+                retention.stop()
             
-            # Chờ cho tất cả các thread kết thúc (với timeout)
-            for thread in threads:
-                thread.join(timeout=1)
+            # Chờ thread kết thúc (với timeout) rồi ghi nốt dữ liệu còn trong bộ đệm
+            thread.join(timeout=interval + 1)
+            self.close_writer()
             
             print("\n=== THỐNG KÊ GHI LOG ===")
             self.print_logging_stats()
     
+    def collect_metrics(self):
+        """Collector metrics Prometheus từ các mẫu mới nhất trong bộ nhớ."""
+        samples = list(self.interfaces_data.items())
+        families = [
+            ('mikrotik_interface_tx_bytes_total', 'counter', 'Tổng số byte đã gửi của interface', 'tx_bytes', 1),
+            ('mikrotik_interface_rx_bytes_total', 'counter', 'Tổng số byte đã nhận của interface', 'rx_bytes', 1),
+            ('mikrotik_interface_tx_packets_total', 'counter', 'Tổng số packet đã gửi của interface', 'tx_packets', 1),
+            ('mikrotik_interface_rx_packets_total', 'counter', 'Tổng số packet đã nhận của interface', 'rx_packets', 1),
+            ('mikrotik_interface_tx_bits_per_second', 'gauge', 'Tốc độ gửi hiện tại của interface', 'tx_kbps', 1024),
+            ('mikrotik_interface_rx_bits_per_second', 'gauge', 'Tốc độ nhận hiện tại của interface', 'rx_kbps', 1024),
+            ('mikrotik_interface_last_sample_timestamp_seconds', 'gauge', 'Thời điểm lấy mẫu gần nhất', 'timestamp', 1),
+        ]
+        for name, metric_type, help_text, field, scale in families:
+            yield name, metric_type, help_text, [
+                ({'device': self.host, 'interface': interface_name}, sample[field] * scale)
+                for interface_name, sample in samples
+            ]
+        yield from collect_stats_metrics([
+            ({'device': self.host, 'interface': interface_name}, stats)
+            for interface_name, stats in list(self.interface_stats.items())
+        ])
+    
     def print_logging_stats(self):
         """In thông tin thống kê về dữ liệu đã ghi log."""
+        if self.storage == 'blocks':
+            self.print_block_stats()
+            return
         try:
             conn = sqlite3.connect(self.db_file)
             cursor = conn.cursor()
@@ -584,8 +593,8 @@ class MikroTikTrafficLogger:
             # In thống kê
             print(f"Tổng số mẫu đã ghi: {total_samples}")
             if min_time and max_time:
-                print(f"Thời gian bắt đầu: {min_time}")
-                print(f"Thời gian kết thúc: {max_time}")
+                print(f"Thời gian bắt đầu: {display_timestamp(min_time)}")
+                print(f"Thời gian kết thúc: {display_timestamp(max_time)}")
             
             print("\nThống kê theo interface:")
             for name, count, avg_tx, avg_rx in interface_stats:
@@ -597,6 +606,37 @@ class MikroTikTrafficLogger:
         except Exception as e:
             logger.error(f"Lỗi khi in thống kê ghi log: {e}")
     
+    def print_block_stats(self):
+        """In thông tin thống kê về các block traffic đã ghi."""
+        try:
+            conn = sqlite3.connect(self.db_file)
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+            SELECT i.name, COUNT(*), SUM(b.samples), SUM(LENGTH(b.data)), MIN(b.start_ts), MAX(b.end_ts)
+            FROM traffic_blocks b
+            JOIN interfaces i ON b.interface_id = i.id
+            GROUP BY b.interface_id
+            ''')
+            block_stats = cursor.fetchall()
+            conn.close()
+            
+            total_samples = sum(row[2] for row in block_stats)
+            total_bytes = sum(row[3] for row in block_stats)
+            print(f"Tổng số mẫu đã ghi: {total_samples} ({total_bytes / 1024:.1f} KB dữ liệu block)")
+            if block_stats:
+                print(f"Thời gian bắt đầu: {datetime.fromtimestamp(min(row[4] for row in block_stats))}")
+                print(f"Thời gian kết thúc: {datetime.fromtimestamp(max(row[5] for row in block_stats))}")
+            
+            print("\nThống kê theo interface:")
+            for name, blocks, samples, size, _, _ in block_stats:
+                print(f"  - {name}: {samples} mẫu trong {blocks} block, {size / max(samples, 1):.1f} byte/mẫu")
+            
+            print(f"\nDữ liệu được lưu trong: {self.db_file} (bảng traffic_blocks)")
+            
+        except Exception as e:
+            logger.error(f"Lỗi khi in thống kê ghi log: {e}")
+    
     def generate_report(self, days=1, output_format='text'):
         """Tạo báo cáo từ dữ liệu đã ghi log."""
         try:
@@ -763,6 +803,16 @@ def main():
     parser.add_argument('--db', type=str, default='mikrotik_traffic.db', help='Tên file database (mặc định: mikrotik_traffic.db)')
     parser.add_argument('--json', action='store_true', help='Xuất báo cáo dạng JSON thay vì text')
     parser.add_argument('--duration', type=int, help='Thời gian ghi log (giây), nếu không cung cấp thì ghi đến khi bị dừng')
+    parser.add_argument('--rebuild-daily-stats', type=int, nargs='?', const=0, metavar='DAYS',
+                        help='Tính lại daily_stats từ traffic_data cho DAYS ngày gần nhất (bỏ trống: toàn bộ)')
+    parser.add_argument('--metrics-port', type=int, help='Cổng HTTP phục vụ endpoint /metrics cho Prometheus (mặc định: tắt)')
+    parser.add_argument('--storage', choices=['rows', 'blocks'], default='rows',
+                        help='Cách lưu mẫu: rows (bảng traffic_data) hoặc blocks (block nén theo cột) (mặc định: rows)')
+    parser.add_argument('--retention', nargs='?', const=DEFAULT_RETENTION, metavar='SPEC',
+                        help=f'Bật tầng gộp và xóa dữ liệu hết hạn (bỏ trống: {DEFAULT_RETENTION}); '
+                             'không kèm --log/--report thì chỉ xóa dữ liệu hết hạn một lần')
+    parser.add_argument('--anomaly-threshold', type=float, nargs='?', const=DEFAULT_THRESHOLD, metavar='SIGMA',
+                        help=f'Bật phát hiện bất thường trực tuyến với ngưỡng SIGMA độ lệch chuẩn (bỏ trống: {DEFAULT_THRESHOLD})')
     args = parser.parse_args()
     
     # Lấy thông tin kết nối từ biến môi trường
@@ -776,7 +826,22 @@ def main():
         sys.exit(1)
     
     # Tạo đối tượng logger
-    traffic_logger = MikroTikTrafficLogger(host, username, password, db_file=args.db)
+    traffic_logger = MikroTikTrafficLogger(
+        host, username, password, db_file=args.db, storage=args.storage, retention=args.retention,
+        anomaly_threshold=args.anomaly_threshold
+    )
+    
+    # Backfill thống kê hàng ngày không cần kết nối đến thiết bị
+    if args.rebuild_daily_stats is not None:
+        traffic_logger.rebuild_all_daily_stats(days=args.rebuild_daily_stats or None)
+        if not args.log and not args.report:
+            return
+    
+    # Xóa dữ liệu hết hạn một lần, không cần kết nối đến thiết bị
+    if args.retention and not args.log and not args.report:
+        for tier, deleted in RetentionManager(args.db, traffic_logger.tiers).prune_once().items():
+            print(f"Tầng {tier}: đã xóa {deleted} dòng hết hạn")
+        return
     
     # Nếu chỉ tạo báo cáo thì không cần kết nối
     if args.report and not args.log:
@@ -789,6 +854,15 @@ def main():
     if not api:
         sys.exit(1)
     
+    # Bật endpoint metrics nếu được yêu cầu
+    if args.metrics_port:
+        from mikrotik_metrics_exporter import MetricsRegistry, start_http_server
+        registry = MetricsRegistry()
+        registry.register(traffic_logger.collect_metrics)
+        if traffic_logger.detector:
+            registry.register(traffic_logger.detector.collect_metrics)
+        start_http_server(registry, args.metrics_port)
+    
     try:
         if args.log:
             # Bắt đầu ghi log
@@ -0,0 +1,577 @@
+#!/usr/bin/env python3
+"""
+Lưu trữ dữ liệu traffic theo kiểu write-behind
+Các mẫu được gom vào bộ đệm và ghi thành từng transaction executemany trên một kết nối SQLite (WAL) dùng lâu dài.
+"""
+
+import logging
+import math
+import sqlite3
+import threading
+import time
+from array import array
+from datetime import datetime, timedelta
+
+from mikrotik_sampling import counter_delta
+
+logger = logging.getLogger("mikrotik_traffic_store")
+
+# traffic_data.timestamp là epoch giây (INTEGER); daily_stats.date là ngày theo giờ địa phương
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'  # Chỉ dùng khi hiển thị
+DATE_FORMAT = '%Y-%m-%d'
+
+# Phiên bản schema lưu trong PRAGMA user_version
+# 1: traffic_data.timestamp chuyển từ chuỗi giờ địa phương sang epoch giây
+SCHEMA_VERSION = 1
+
+# Index bao phủ các cột mà truy vấn theo khoảng thời gian cần đọc, không phải tra lại bảng
+TRAFFIC_INDEX_SQL = '''
+CREATE INDEX IF NOT EXISTS idx_traffic_data_covering
+ON traffic_data (interface_id, timestamp, tx_bytes, rx_bytes, tx_rate_kbps, rx_rate_kbps)
+'''
+
+INSERT_TRAFFIC_SQL = '''
+INSERT INTO traffic_data
+(interface_id, timestamp, tx_bytes, rx_bytes, tx_packets, rx_packets, tx_rate_kbps, rx_rate_kbps)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+# Gộp phần thống kê mới vào dòng daily_stats hiện có; mọi biểu thức SET đọc giá trị cũ của dòng
+UPSERT_DAILY_STATS_SQL = '''
+INSERT INTO daily_stats
+(interface_id, date, samples, avg_tx_kbps, avg_rx_kbps, max_tx_kbps, max_rx_kbps, total_tx_mb, total_rx_mb)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(interface_id, date) DO UPDATE SET
+    samples = COALESCE(samples, 0) + excluded.samples,
+    avg_tx_kbps = (COALESCE(avg_tx_kbps, 0) * COALESCE(samples, 0) + excluded.avg_tx_kbps * excluded.samples)
+                  / (COALESCE(samples, 0) + excluded.samples),
+    avg_rx_kbps = (COALESCE(avg_rx_kbps, 0) * COALESCE(samples, 0) + excluded.avg_rx_kbps * excluded.samples)
+                  / (COALESCE(samples, 0) + excluded.samples),
+    max_tx_kbps = MAX(COALESCE(max_tx_kbps, 0), excluded.max_tx_kbps),
+    max_rx_kbps = MAX(COALESCE(max_rx_kbps, 0), excluded.max_rx_kbps),
+    total_tx_mb = COALESCE(total_tx_mb, 0) + excluded.total_tx_mb,
+    total_rx_mb = COALESCE(total_rx_mb, 0) + excluded.total_rx_mb
+'''
+
+
+# Gộp bucket mới vào bucket đã có (ví dụ bucket dở dang ghi trước khi logger khởi động lại);
+# p95 của hai phần không gộp chính xác được nên lấy giá trị lớn hơn
+UPSERT_ROLLUP_SQL = '''
+INSERT INTO traffic_rollups
+(interface_id, step, bucket_ts, samples,
+ min_tx_kbps, max_tx_kbps, avg_tx_kbps, p95_tx_kbps,
+ min_rx_kbps, max_rx_kbps, avg_rx_kbps, p95_rx_kbps,
+ tx_bytes, rx_bytes)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(interface_id, step, bucket_ts) DO UPDATE SET
+    samples = samples + excluded.samples,
+    min_tx_kbps = MIN(min_tx_kbps, excluded.min_tx_kbps),
+    max_tx_kbps = MAX(max_tx_kbps, excluded.max_tx_kbps),
+    avg_tx_kbps = (avg_tx_kbps * samples + excluded.avg_tx_kbps * excluded.samples) / (samples + excluded.samples),
+    p95_tx_kbps = MAX(p95_tx_kbps, excluded.p95_tx_kbps),
+    min_rx_kbps = MIN(min_rx_kbps, excluded.min_rx_kbps),
+    max_rx_kbps = MAX(max_rx_kbps, excluded.max_rx_kbps),
+    avg_rx_kbps = (avg_rx_kbps * samples + excluded.avg_rx_kbps * excluded.samples) / (samples + excluded.samples),
+    p95_rx_kbps = MAX(p95_rx_kbps, excluded.p95_rx_kbps),
+    tx_bytes = tx_bytes + excluded.tx_bytes,
+    rx_bytes = rx_bytes + excluded.rx_bytes
+'''
+
+# Thay hẳn bucket bằng bucket tính lại từ toàn bộ dữ liệu gốc (khi rollup thiếu hoặc chỉ có một phần)
+REPLACE_ROLLUP_SQL = '''
+INSERT OR REPLACE INTO traffic_rollups
+(interface_id, step, bucket_ts, samples,
+ min_tx_kbps, max_tx_kbps, avg_tx_kbps, p95_tx_kbps,
+ min_rx_kbps, max_rx_kbps, avg_rx_kbps, p95_rx_kbps,
+ tx_bytes, rx_bytes)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+SCHEMA_SQL = [
+    '''
+    CREATE TABLE IF NOT EXISTS devices (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        hostname TEXT,
+        ip_address TEXT,
+        model TEXT,
+        ros_version TEXT,
+        last_seen TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS interfaces (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        device_id INTEGER,
+        name TEXT,
+        type TEXT,
+        mac_address TEXT,
+        FOREIGN KEY (device_id) REFERENCES devices (id)
+    )
+    ''',
+    # Duyệt interface theo thiết bị (theo thứ tự id) mà không cần sắp xếp tạm, ví dụ khi xuất JSON
+    'CREATE INDEX IF NOT EXISTS idx_interfaces_device ON interfaces (device_id)',
+    '''
+    CREATE TABLE IF NOT EXISTS traffic_data (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        interface_id INTEGER,
+        timestamp INTEGER,
+        tx_bytes BIGINT,
+        rx_bytes BIGINT,
+        tx_packets INTEGER,
+        rx_packets INTEGER,
+        tx_rate_kbps REAL,
+        rx_rate_kbps REAL,
+        FOREIGN KEY (interface_id) REFERENCES interfaces (id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS daily_stats (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        interface_id INTEGER,
+        date DATE,
+        avg_tx_kbps REAL,
+        avg_rx_kbps REAL,
+        max_tx_kbps REAL,
+        max_rx_kbps REAL,
+        total_tx_mb REAL,
+        total_rx_mb REAL,
+        samples INTEGER DEFAULT 0,
+        FOREIGN KEY (interface_id) REFERENCES interfaces (id)
+    )
+    ''',
+    # Dữ liệu gộp theo bucket step giây (bucket_ts là epoch giây, chia hết cho step)
+    '''
+    CREATE TABLE IF NOT EXISTS traffic_rollups (
+        interface_id INTEGER NOT NULL,
+        step INTEGER NOT NULL,
+        bucket_ts INTEGER NOT NULL,
+        samples INTEGER NOT NULL,
+        min_tx_kbps REAL,
+        max_tx_kbps REAL,
+        avg_tx_kbps REAL,
+        p95_tx_kbps REAL,
+        min_rx_kbps REAL,
+        max_rx_kbps REAL,
+        avg_rx_kbps REAL,
+        p95_rx_kbps REAL,
+        tx_bytes INTEGER,
+        rx_bytes INTEGER,
+        PRIMARY KEY (interface_id, step, bucket_ts)
+    ) WITHOUT ROWID
+    ''',
+    # Cấu hình tầng lưu trữ do logger ghi lại để công cụ phân tích chọn đúng tầng (step 0 là dữ liệu gốc)
+    '''
+    CREATE TABLE IF NOT EXISTS retention_tiers (
+        step INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        retention_seconds INTEGER
+    )
+    ''',
+]
+
+
+def init_schema(conn):
+    """Tạo bảng, index và nâng cấp daily_stats của database cũ cho việc cập nhật tăng dần."""
+    for statement in SCHEMA_SQL:
+        conn.execute(statement)
+    migrate_timestamps(conn)
+
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(daily_stats)')}
+    if 'samples' not in columns:
+        conn.execute('ALTER TABLE daily_stats ADD COLUMN samples INTEGER DEFAULT 0')
+
+    index_exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_daily_stats_interface_date'"
+    ).fetchone()
+    if not index_exists:
+        # Upsert cần khóa duy nhất (interface_id, date); bỏ các dòng trùng cũ, giữ dòng mới nhất
+        conn.execute('''
+        DELETE FROM daily_stats WHERE id NOT IN (
+            SELECT MAX(id) FROM daily_stats GROUP BY interface_id, date
+        )
+        ''')
+        conn.execute('CREATE UNIQUE INDEX idx_daily_stats_interface_date ON daily_stats (interface_id, date)')
+
+    # Dòng cũ chưa có số mẫu: đếm lại theo khoảng epoch của ngày để dùng index
+    conn.execute('''
+    UPDATE daily_stats SET samples = (
+        SELECT COUNT(*) FROM traffic_data t
+        WHERE t.interface_id = daily_stats.interface_id
+          AND t.timestamp >= CAST(strftime('%s', daily_stats.date, 'utc') AS INTEGER)
+          AND t.timestamp < CAST(strftime('%s', daily_stats.date, '+1 day', 'utc') AS INTEGER)
+    )
+    WHERE samples IS NULL OR samples = 0
+    ''')
+    conn.commit()
+
+
+def migrate_timestamps(conn, batch_size=50000):
+    """
+    Nâng cấp database cũ: chuyển traffic_data.timestamp từ chuỗi giờ địa phương sang epoch giây ngay trên bảng,
+    theo từng khoảng id (mỗi khoảng một transaction) nên dừng giữa chừng vẫn chạy tiếp được ở lần sau.
+    Trả về số dòng đã chuyển.
+    """
+    if conn.execute('PRAGMA user_version').fetchone()[0] >= SCHEMA_VERSION:
+        conn.execute(TRAFFIC_INDEX_SQL)
+        return 0
+
+    converted = 0
+    if conn.execute("SELECT 1 FROM traffic_data WHERE typeof(timestamp) = 'text' LIMIT 1").fetchone():
+        logger.info("Đang chuyển traffic_data.timestamp sang epoch giây...")
+        # Bỏ index trong lúc chuyển và tạo lại một lần ở cuối, nhanh hơn cập nhật index theo từng dòng
+        conn.execute('DROP INDEX IF EXISTS idx_traffic_data_interface_time')
+        conn.execute('DROP INDEX IF EXISTS idx_traffic_data_covering')
+        conn.commit()
+        low = (conn.execute('SELECT MIN(id) FROM traffic_data').fetchone()[0] or 1) - 1
+        while True:
+            last_id = conn.execute('SELECT MAX(id) FROM traffic_data').fetchone()[0] or 0
+            if low >= last_id:
+                break
+            with conn:
+                converted += conn.execute('''
+                UPDATE traffic_data SET timestamp = CAST(strftime('%s', timestamp, 'utc') AS INTEGER)
+                WHERE id > ? AND id <= ? AND typeof(timestamp) = 'text'
+                ''', (low, low + batch_size)).rowcount
+            low += batch_size
+            logger.debug(f"Đã chuyển {converted} dòng (đến id {min(low, last_id)}/{last_id})")
+        logger.info(f"Đã chuyển {converted} dòng traffic_data sang epoch giây")
+
+    conn.execute(TRAFFIC_INDEX_SQL)
+    conn.execute('DROP INDEX IF EXISTS idx_traffic_data_interface_time')
+    conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+    conn.commit()
+    return converted
+
+
+def day_bounds(date):
+    """Khoảng epoch [đầu ngày, đầu ngày hôm sau) theo giờ địa phương của một ngày (date hoặc chuỗi YYYY-MM-DD)."""
+    if isinstance(date, str):
+        date = datetime.strptime(date, DATE_FORMAT).date()
+    start = datetime.combine(date, datetime.min.time())
+    return to_epoch(start), to_epoch(start + timedelta(days=1))
+
+
+def rebuild_daily_stats(conn, interface_id, date):
+    """
+    Tính lại thống kê một ngày từ traffic_data (dùng cho backfill).
+    Lọc theo khoảng epoch [ngày, ngày + 1) nên dùng được index (interface_id, timestamp).
+    """
+    row = conn.execute('''
+    SELECT
+        COUNT(*),
+        AVG(tx_rate_kbps),
+        AVG(rx_rate_kbps),
+        MAX(tx_rate_kbps),
+        MAX(rx_rate_kbps),
+        SUM(CASE WHEN tx_delta < 0 THEN tx_bytes ELSE tx_delta END) / 1048576.0,
+        SUM(CASE WHEN rx_delta < 0 THEN rx_bytes ELSE rx_delta END) / 1048576.0
+    FROM (
+        SELECT
+            tx_rate_kbps, rx_rate_kbps, tx_bytes, rx_bytes,
+            tx_bytes - LAG(tx_bytes) OVER (ORDER BY timestamp) AS tx_delta,
+            rx_bytes - LAG(rx_bytes) OVER (ORDER BY timestamp) AS rx_delta
+        FROM traffic_data
+        WHERE interface_id = ? AND timestamp >= ? AND timestamp < ?
+    )
+    ''', (interface_id, *day_bounds(date))).fetchone()
+
+    if not row or not row[0]:
+        return False
+
+    samples, avg_tx, avg_rx, max_tx, max_rx, total_tx_mb, total_rx_mb = row
+    conn.execute('''
+    INSERT INTO daily_stats
+    (interface_id, date, samples, avg_tx_kbps, avg_rx_kbps, max_tx_kbps, max_rx_kbps, total_tx_mb, total_rx_mb)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(interface_id, date) DO UPDATE SET
+        samples = excluded.samples,
+        avg_tx_kbps = excluded.avg_tx_kbps,
+        avg_rx_kbps = excluded.avg_rx_kbps,
+        max_tx_kbps = excluded.max_tx_kbps,
+        max_rx_kbps = excluded.max_rx_kbps,
+        total_tx_mb = excluded.total_tx_mb,
+        total_rx_mb = excluded.total_rx_mb
+    ''', (interface_id, date, samples, avg_tx, avg_rx, max_tx, max_rx, total_tx_mb or 0.0, total_rx_mb or 0.0))
+    return True
+
+
+def format_timestamp(value):
+    """Chuyển thời điểm lấy mẫu sang giá trị lưu trong cột timestamp (epoch giây)."""
+    return to_epoch(value)
+
+
+def display_timestamp(epoch):
+    """Chuỗi giờ địa phương của một giá trị cột timestamp, dùng khi in báo cáo."""
+    return datetime.fromtimestamp(epoch).strftime(TIMESTAMP_FORMAT)
+
+
+def format_date(value):
+    """Chuyển ngày lấy mẫu sang giá trị lưu trong cột daily_stats.date."""
+    return value.strftime(DATE_FORMAT)
+
+
+def to_epoch(value):
+    """Chuyển thời điểm lấy mẫu (datetime hoặc epoch) sang epoch giây."""
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    return int(value)
+
+
+def percentile(values, fraction):
+    """Phân vị theo nearest-rank của một dãy số (ví dụ fraction=0.95 cho p95)."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class _RollupBucket:
+    """Các mẫu của một interface trong một bucket đang mở."""
+
+    __slots__ = ('start', 'tx', 'rx', 'tx_bytes', 'rx_bytes')
+
+    def __init__(self, start):
+        self.start = start
+        self.tx = array('d')
+        self.rx = array('d')
+        self.tx_bytes = 0
+        self.rx_bytes = 0
+
+    def row(self, interface_id, step):
+        """Dòng traffic_rollups của bucket."""
+        samples = len(self.tx)
+        return (
+            interface_id, step, self.start, samples,
+            min(self.tx), max(self.tx), sum(self.tx) / samples, percentile(self.tx, 0.95),
+            min(self.rx), max(self.rx), sum(self.rx) / samples, percentile(self.rx, 0.95),
+            self.tx_bytes, self.rx_bytes
+        )
+
+
+class RollupAggregator:
+    """
+    Gộp mẫu theo các bucket step giây (ví dụ 60 và 3600) ngay khi ghi.
+    Bucket được đóng khi có mẫu thuộc bucket sau, hoặc khi interface ngừng gửi mẫu quá idle_grace giây.
+    """
+
+    def __init__(self, steps=(60, 3600), idle_grace=60):
+        self.steps = tuple(steps)
+        self.idle_grace = idle_grace
+        self._open = {}  # (interface_id, step) -> _RollupBucket
+        self._ready = []  # Các dòng của bucket đã đóng, chờ ghi
+        self._last_counters = {}  # interface_id -> (tx_bytes, rx_bytes)
+
+    def add(self, interface_id, epoch, tx_bytes, rx_bytes, tx_kbps, rx_kbps):
+        """Cộng một mẫu (thời điểm epoch giây) vào bucket của từng step."""
+        previous = self._last_counters.get(interface_id)
+        self._last_counters[interface_id] = (tx_bytes, rx_bytes)
+        tx_delta = counter_delta(tx_bytes, previous[0]) if previous else 0
+        rx_delta = counter_delta(rx_bytes, previous[1]) if previous else 0
+
+        for step in self.steps:
+            start = epoch - epoch % step
+            key = (interface_id, step)
+            bucket = self._open.get(key)
+            if bucket is None or bucket.start != start:
+                if bucket is not None:
+                    self._ready.append(bucket.row(interface_id, step))
+                bucket = self._open[key] = _RollupBucket(start)
+            bucket.tx.append(tx_kbps)
+            bucket.rx.append(rx_kbps)
+            bucket.tx_bytes += tx_delta
+            bucket.rx_bytes += rx_delta
+
+    def take(self, force=False):
+        """Lấy các dòng bucket đã đóng; force=True đóng luôn mọi bucket đang mở (khi dừng logger)."""
+        now = time.time()
+        for key, bucket in list(self._open.items()):
+            interface_id, step = key
+            if force or bucket.start + step + self.idle_grace <= now:
+                self._ready.append(bucket.row(interface_id, step))
+                del self._open[key]
+        ready, self._ready = self._ready, []
+        return ready
+
+    def restore(self, rows):
+        """Trả lại các dòng chưa ghi được để ghi ở lần sau (upsert gộp nếu bucket đã có)."""
+        self._ready[:0] = rows
+
+
+class DailyStatsAggregator:
+    """
+    Thống kê theo (interface, ngày) cập nhật O(1) cho mỗi mẫu.
+    Chỉ giữ phần thống kê phát sinh từ lần ghi trước; khi ghi, phần này được gộp vào dòng daily_stats hiện có.
+    """
+
+    def __init__(self, write_interval=60):
+        self.write_interval = write_interval
+        self._pending = {}  # (interface_id, date) -> [samples, sum_tx, sum_rx, max_tx, max_rx, tx_bytes, rx_bytes]
+        self._last_counters = {}  # interface_id -> (tx_bytes, rx_bytes)
+        self._last_write = time.monotonic()
+
+    def add(self, interface_id, date, tx_bytes, rx_bytes, tx_kbps, rx_kbps):
+        """Cộng một mẫu vào thống kê của ngày date."""
+        previous = self._last_counters.get(interface_id)
+        self._last_counters[interface_id] = (tx_bytes, rx_bytes)
+        tx_delta = counter_delta(tx_bytes, previous[0]) if previous else 0
+        rx_delta = counter_delta(rx_bytes, previous[1]) if previous else 0
+
+        entry = self._pending.get((interface_id, date))
+        if entry is None:
+            self._pending[(interface_id, date)] = [1, tx_kbps, rx_kbps, tx_kbps, rx_kbps, tx_delta, rx_delta]
+            return
+        entry[0] += 1
+        entry[1] += tx_kbps
+        entry[2] += rx_kbps
+        if tx_kbps > entry[3]:
+            entry[3] = tx_kbps
+        if rx_kbps > entry[4]:
+            entry[4] = rx_kbps
+        entry[5] += tx_delta
+        entry[6] += rx_delta
+
+    def take(self, force=False):
+        """Lấy các dòng cần upsert nếu đã đến chu kỳ ghi (hoặc force), đồng thời xóa phần đang chờ."""
+        if not self._pending or (not force and time.monotonic() - self._last_write < self.write_interval):
+            return []
+        pending, self._pending = self._pending, {}
+        self._last_write = time.monotonic()
+        return [
+            (
+                interface_id, date, samples,
+                sum_tx / samples, sum_rx / samples, max_tx, max_rx,
+                tx_bytes / 1048576.0, rx_bytes / 1048576.0
+            )
+            for (interface_id, date), (samples, sum_tx, sum_rx, max_tx, max_rx, tx_bytes, rx_bytes) in pending.items()
+        ]
+
+    def restore(self, rows):
+        """Trả lại các dòng chưa ghi được để gộp vào lần ghi sau."""
+        for interface_id, date, samples, avg_tx, avg_rx, max_tx, max_rx, total_tx_mb, total_rx_mb in rows:
+            entry = self._pending.setdefault((interface_id, date), [0, 0.0, 0.0, 0.0, 0.0, 0, 0])
+            entry[0] += samples
+            entry[1] += avg_tx * samples
+            entry[2] += avg_rx * samples
+            entry[3] = max(entry[3], max_tx)
+            entry[4] = max(entry[4], max_rx)
+            entry[5] += total_tx_mb * 1048576.0
+            entry[6] += total_rx_mb * 1048576.0
+
+
+def open_connection(db_file):
+    """Mở kết nối SQLite ở chế độ WAL, dùng được từ nhiều thread."""
+    conn = sqlite3.connect(db_file, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    # WAL + NORMAL: không fsync mỗi commit, vẫn an toàn khi tiến trình bị dừng đột ngột
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+class TrafficWriter:
+    """
+    Bộ đệm ghi traffic_data, flush định kỳ hoặc khi đủ max_batch mẫu.
+    Nếu có daily_stats, thống kê ngày được cập nhật theo từng mẫu và upsert trong cùng transaction.
+    Khi database không ghi được (bị khóa, hết dung lượng), bộ đệm giữ tối đa max_buffer mẫu;
+    các mẫu cũ nhất vượt quá giới hạn bị bỏ và được đếm trong dropped.
+    """
+
+    def __init__(self, db_file, flush_interval=1.0, max_batch=5000, daily_stats=None, rollups=None,
+                 max_buffer=200000):
+        self.db_file = db_file
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_buffer = max(max_buffer, max_batch)
+        self.daily_stats = daily_stats
+        self.rollups = rollups
+        self.conn = open_connection(db_file)
+        self.written = 0
+        self.dropped = 0
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._running = True
+        self._thread = threading.Thread(target=self._flush_loop, name='traffic-writer', daemon=True)
+        self._thread.start()
+
+    def append(self, interface_id, timestamp, tx_bytes, rx_bytes, tx_packets, rx_packets, tx_rate_kbps, rx_rate_kbps):
+        """Thêm một mẫu vào bộ đệm (không chạm đến đĩa)."""
+        row = (
+            interface_id, format_timestamp(timestamp),
+            tx_bytes, rx_bytes, tx_packets, rx_packets, tx_rate_kbps, rx_rate_kbps
+        )
+        with self._lock:
+            self._buffer.append(row)
+            if self.daily_stats is not None:
+                self.daily_stats.add(
+                    interface_id, format_date(timestamp), tx_bytes, rx_bytes, tx_rate_kbps, rx_rate_kbps
+                )
+            if self.rollups is not None:
+                self.rollups.add(interface_id, to_epoch(timestamp), tx_bytes, rx_bytes, tx_rate_kbps, rx_rate_kbps)
+            # Cắt theo từng lô max_batch để không phải xóa đầu danh sách ở mỗi lần append
+            if len(self._buffer) > self.max_buffer + self.max_batch:
+                self._drop_oldest()
+            # Chỉ đánh thức khi vừa đủ lô; khi database lỗi bộ đệm lớn hơn và được thử lại theo chu kỳ flush
+            full = len(self._buffer) == self.max_batch
+        if full:
+            self._wakeup.set()
+
+    def _drop_oldest(self):
+        """Bỏ các mẫu cũ nhất vượt quá max_buffer (gọi khi đang giữ _lock)."""
+        excess = len(self._buffer) - self.max_buffer
+        if excess > 0:
+            del self._buffer[:excess]
+            self.dropped += excess
+            logger.warning(f"Bộ đệm traffic vượt {self.max_buffer} mẫu do không ghi được database, "
+                           f"đã bỏ {excess} mẫu cũ nhất (tổng cộng {self.dropped})")
+
+    def flush(self, force_daily=False, close_rollups=False):
+        """Ghi toàn bộ bộ đệm (và thống kê ngày nếu đến chu kỳ) trong một transaction."""
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+            daily_rows = self.daily_stats.take(force_daily) if self.daily_stats is not None else []
+            rollup_rows = self.rollups.take(close_rollups) if self.rollups is not None else []
+        if not rows and not daily_rows and not rollup_rows:
+            return 0
+        with self._db_lock:
+            try:
+                with self.conn:
+                    self.conn.executemany(INSERT_TRAFFIC_SQL, rows)
+                    if daily_rows:
+                        self.conn.executemany(UPSERT_DAILY_STATS_SQL, daily_rows)
+                    if rollup_rows:
+                        self.conn.executemany(UPSERT_ROLLUP_SQL, rollup_rows)
+            except sqlite3.Error as e:
+                logger.error(f"Lỗi khi ghi {len(rows)} mẫu traffic: {e}")
+                # Giữ lại các mẫu để thử lại ở lần flush sau
+                with self._lock:
+                    self._buffer[:0] = rows
+                    self._drop_oldest()
+                    if daily_rows:
+                        self.daily_stats.restore(daily_rows)
+                    if rollup_rows:
+                        self.rollups.restore(rollup_rows)
+                return 0
+        self.written += len(rows)
+        return len(rows)
+
+    def _flush_loop(self):
+        """Thread nền flush bộ đệm theo chu kỳ."""
+        while self._running:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def close(self):
+        """Dừng thread nền, ghi nốt bộ đệm và đóng kết nối."""
+        if not self._running:
+            return
+        self._running = False
+        self._wakeup.set()
+        self._thread.join(timeout=self.flush_interval + 5)
+        self.flush(force_daily=True, close_rollups=True)
+        with self._db_lock:
+            self.conn.close()
+        logger.info(f"Đã ghi tổng cộng {self.written} mẫu traffic vào {self.db_file}")
+        if self.dropped:
+            logger.warning(f"Đã bỏ {self.dropped} mẫu traffic do không ghi được database")
@@ -6,8 +6,8 @@ MikroTik Web Monitor
 
 import os
 import sys
-import json
 import time
+import sqlite3
 import logging
 import asyncio
 import threading
@@ -26,7 +26,7 @@ logger = logging.getLogger("mikrotik_web_monitor")
 try:
     import routeros_api
     from fastapi import FastAPI, WebSocket, WebSocketDisconnect, BackgroundTasks, Request, Form, UploadFile, File
-    from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
+    from fastapi.responses import HTMLResponse, RedirectResponse
     from fastapi.staticfiles import StaticFiles
     from fastapi.middleware.cors import CORSMiddleware
     from fastapi.templating import Jinja2Templates
@@ -36,6 +36,11 @@ except ImportError as e:
     logger.info("Chạy: pip install routeros-api fastapi uvicorn websockets jinja2")
     sys.exit(1)
 
+from mikrotik_json import FastJSONResponse, PayloadCache
+from mikrotik_sampling import TickScheduler, counter_rate
+from mikrotik_stats import InterfaceStats
+from mikrotik_timeseries import TimeSeriesQuery
+
 # Import các module quản lý
 try:
     from mikrotik_client_monitor import MikroTikClientMonitor
@@ -63,7 +68,9 @@ class MikroTikMonitor:
         self.api = None
         self.running = False
         self.data_history = {}  # Lịch sử dữ liệu theo interface
+        self.interface_stats = {}  # Thống kê trực tuyến (trung bình, phân vị, EWMA) theo interface
         self.device_info = {}   # Thông tin thiết bị
+        self.version = 0        # Phiên bản snapshot, tăng sau mỗi chu kỳ thu thập
         self.lock = threading.Lock()  # Lock để đồng bộ truy cập vào data
     
     def connect(self):
@@ -190,6 +197,7 @@ class MikroTikMonitor:
             return
         
         self.running = True
+        self.scheduler = TickScheduler(interval)
         self.monitor_thread = threading.Thread(target=self._monitor_loop, args=(interval,))
         self.monitor_thread.daemon = True
         self.monitor_thread.start()
@@ -198,6 +206,8 @@ class MikroTikMonitor:
     def stop_monitoring(self):
         """Dừng giám sát."""
         self.running = False
+        if hasattr(self, 'scheduler'):
+            self.scheduler.stop()
         if hasattr(self, 'monitor_thread'):
             self.monitor_thread.join(timeout=3)
         logger.info("Đã dừng giám sát")
@@ -210,7 +220,10 @@ class MikroTikMonitor:
         last_device_update = 0
         
         while self.running:
-            current_time = time.time()
+            # Chờ đến mốc chu kỳ kế tiếp (căn theo đồng hồ thực, bỏ qua tick đã lỡ)
+            current_time = self.scheduler.wait()
+            if current_time is None or not self.running:
+                break
             
             # Cập nhật thông tin thiết bị mỗi 10 giây
             if current_time - last_device_update >= 10:
@@ -220,10 +233,11 @@ class MikroTikMonitor:
             # Cập nhật dữ liệu traffic cho từng interface
             active_interfaces = self.get_active_interfaces()
             for iface in active_interfaces:
-                self._update_interface_data(iface['name'], interval)
+                self._update_interface_data(iface['name'], current_time)
             
-            # Ngủ đến lần cập nhật tiếp theo
-            time.sleep(interval)
+            # Đánh dấu snapshot mới để các API có thể trả về 304 khi không đổi
+            with self.lock:
+                self.version += 1
     
     def _init_interface_data(self):
         """Khởi tạo dữ liệu cho tất cả các interfaces."""
@@ -239,12 +253,13 @@ class MikroTikMonitor:
                     if traffic_data:
                         self.data_history[name] = {
                             'previous_data': traffic_data,
+                            'previous_time': time.monotonic(),
                             'history': [],
                             'max_history_length': 60  # Giữ 60 điểm dữ liệu
                         }
     
-    def _update_interface_data(self, interface_name, interval):
-        """Cập nhật dữ liệu cho một interface cụ thể."""
+    def _update_interface_data(self, interface_name, timestamp):
+        """Cập nhật dữ liệu cho một interface cụ thể tại mốc lấy mẫu timestamp."""
         if interface_name not in self.data_history:
             # Khởi tạo nếu chưa có
             traffic_data = self.get_interface_traffic(interface_name)
@@ -252,6 +267,7 @@ class MikroTikMonitor:
                 with self.lock:
                     self.data_history[interface_name] = {
                         'previous_data': traffic_data,
+                        'previous_time': time.monotonic(),
                         'history': [],
                         'max_history_length': 60
                     }
@@ -261,30 +277,19 @@ class MikroTikMonitor:
         current_data = self.get_interface_traffic(interface_name)
         if not current_data:
             return
+        now = time.monotonic()
         
         with self.lock:
             previous_data = self.data_history[interface_name]['previous_data']
-            if previous_data:
-                # Tính toán tốc độ dựa trên sự khác biệt
-                tx_bytes = current_data[0] - previous_data[0]
-                rx_bytes = current_data[1] - previous_data[1]
-                
-                # Bytes/giây
-                tx_bytes_per_second = tx_bytes / interval
-                rx_bytes_per_second = rx_bytes / interval
-                
-                # Bits/giây (1 byte = 8 bits)
-                tx_bits_per_second = tx_bytes_per_second * 8
-                rx_bits_per_second = rx_bytes_per_second * 8
-                
-                # Chuyển đổi sang KB/s và MB/s
-                tx_kbps = tx_bits_per_second / 1024
-                rx_kbps = rx_bits_per_second / 1024
+            elapsed = now - self.data_history[interface_name]['previous_time']
+            if previous_data and elapsed > 0:
+                # Tốc độ tính trên thời gian đo thực tế, xử lý tràn và reset bộ đếm
+                tx_kbps = counter_rate(current_data[0], previous_data[0], elapsed)
+                rx_kbps = counter_rate(current_data[1], previous_data[1], elapsed)
                 tx_mbps = tx_kbps / 1024
                 rx_mbps = rx_kbps / 1024
                 
                 # Thêm vào lịch sử
-                timestamp = time.time()
                 self.data_history[interface_name]['history'].append({
                     'timestamp': timestamp,
                     'tx_kbps': tx_kbps,
@@ -297,9 +302,16 @@ class MikroTikMonitor:
                 max_length = self.data_history[interface_name]['max_history_length']
                 if len(self.data_history[interface_name]['history']) > max_length:
                     self.data_history[interface_name]['history'] = self.data_history[interface_name]['history'][-max_length:]
+                
+                # Thống kê từ khi bắt đầu giám sát, bộ nhớ cố định
+                stats = self.interface_stats.get(interface_name)
+                if stats is None:
+                    stats = self.interface_stats[interface_name] = InterfaceStats()
+                stats.add(timestamp, tx_kbps, rx_kbps)
             
             # Cập nhật dữ liệu trước đó
             self.data_history[interface_name]['previous_data'] = current_data
+            self.data_history[interface_name]['previous_time'] = now
     
     def get_current_data(self):
         """Lấy dữ liệu mới nhất về thiết bị và traffic."""
@@ -315,7 +327,8 @@ class MikroTikMonitor:
                     latest = data['history'][-1]
                     result['interfaces'][name] = {
                         'current': latest,
-                        'history': data['history']
+                        'history': data['history'],
+                        'stats': self.interface_stats[name].summary()
                     }
             
             return result
@@ -343,7 +356,7 @@ class ConnectionManager:
 
 
 # Khởi tạo ứng dụng FastAPI
-app = FastAPI(title="MikroTik Web Monitor")
+app = FastAPI(title="MikroTik Web Monitor", default_response_class=FastJSONResponse)
 
 # Thêm CORS middleware
 app.add_middleware(
@@ -357,6 +370,9 @@ app.add_middleware(
 # Khởi tạo connection manager
 manager = ConnectionManager()
 
+# Truy vấn lịch sử traffic từ database của traffic logger
+traffic_series = TimeSeriesQuery(os.getenv('TRAFFIC_DB', 'mikrotik_traffic.db'))
+
 # Biến globals
 mikrotik_monitor = None  # Monitor chính
 client_monitor = None    # Client Monitor
@@ -743,6 +759,10 @@ async def get_html():
     return html
 
 
+# Payload WebSocket đã mã hóa, dùng chung cho mọi client
+ws_payload_cache = PayloadCache()
+
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     """Endpoint WebSocket để gửi dữ liệu theo thời gian thực."""
@@ -750,12 +770,13 @@ async def websocket_endpoint(websocket: WebSocket):
     try:
         while True:
             if mikrotik_monitor:
-                # Lấy dữ liệu mới nhất
-                data = mikrotik_monitor.get_current_data()
+                # Lấy dữ liệu mới nhất, chỉ mã hóa lại khi monitor có snapshot mới
+                monitor = mikrotik_monitor
+                payload = ws_payload_cache.get((monitor, monitor.version), monitor.get_current_data)
                 
                 # Gửi dữ liệu qua WebSocket
-                if data:
-                    await websocket.send_text(json.dumps(data))
+                if payload:
+                    await websocket.send_text(payload)
             
             # Đợi 1 giây trước khi gửi dữ liệu mới
             await asyncio.sleep(1)
@@ -771,33 +792,56 @@ async def websocket_endpoint(websocket: WebSocket):
 async def get_device_info():
     """API endpoint để lấy thông tin thiết bị."""
     if not mikrotik_monitor:
-        return JSONResponse(content={"error": "Chưa kết nối đến thiết bị"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa kết nối đến thiết bị"}, status_code=500)
     
     device_info = mikrotik_monitor.device_info
-    return JSONResponse(content=device_info)
+    return FastJSONResponse(content=device_info)
 
 
 @app.get("/api/interfaces")
 async def get_interfaces():
     """API endpoint để lấy danh sách interfaces."""
     if not mikrotik_monitor:
-        return JSONResponse(content={"error": "Chưa kết nối đến thiết bị"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa kết nối đến thiết bị"}, status_code=500)
     
     interfaces = mikrotik_monitor.get_interfaces()
-    return JSONResponse(content=interfaces)
+    return FastJSONResponse(content=interfaces)
 
 
 @app.get("/api/traffic/{interface_name}")
 async def get_interface_traffic(interface_name: str):
     """API endpoint để lấy dữ liệu traffic của một interface cụ thể."""
     if not mikrotik_monitor:
-        return JSONResponse(content={"error": "Chưa kết nối đến thiết bị"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa kết nối đến thiết bị"}, status_code=500)
     
     with mikrotik_monitor.lock:
         if interface_name in mikrotik_monitor.data_history:
-            return JSONResponse(content=mikrotik_monitor.data_history[interface_name])
+            return FastJSONResponse(content=mikrotik_monitor.data_history[interface_name])
         else:
-            return JSONResponse(content={"error": f"Không tìm thấy interface {interface_name}"}, status_code=404)
+            return FastJSONResponse(content={"error": f"Không tìm thấy interface {interface_name}"}, status_code=404)
+
+
+@app.get("/api/traffic/{device}/{interface}")
+async def get_traffic_series(device: str, interface: str, request: Request):
+    """
+    API endpoint chuỗi traffic đã gộp từ database của traffic logger.
+    Tham số: from, to (epoch, ngày giờ ISO hoặc khoảng lùi như -7d; mặc định 24 giờ gần nhất),
+    step (giây hoặc 5m, 1h; mặc định tự chọn) và agg (avg, min, max, p95, sum).
+    """
+    params = request.query_params
+    try:
+        version, payload = await asyncio.to_thread(
+            traffic_series.query, device, interface,
+            params.get('from'), params.get('to'), params.get('step'), params.get('agg', 'avg')
+        )
+    except ValueError as e:
+        return FastJSONResponse(content={"error": str(e)}, status_code=400)
+    except LookupError as e:
+        return FastJSONResponse(content={"error": str(e)}, status_code=404)
+    except sqlite3.Error as e:
+        logger.error(f"Lỗi khi truy vấn database traffic: {e}")
+        return FastJSONResponse(content={"error": f"Lỗi khi truy vấn database traffic: {e}"}, status_code=500)
+    return FastJSONResponse(content=payload)
 
 
 # CLIENTS API ENDPOINTS
@@ -807,10 +851,10 @@ async def get_clients():
     global client_monitor
     
     if not client_monitor:
-        return JSONResponse(content={"error": "Chưa khởi tạo Client Monitor"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Client Monitor"}, status_code=500)
     
     clients = client_monitor.get_all_clients()
-    return JSONResponse(content={"clients": clients})
+    return FastJSONResponse(content={"clients": clients})
 
 
 @app.get("/api/clients/wireless")
@@ -819,10 +863,10 @@ async def get_wireless_clients():
     global client_monitor
     
     if not client_monitor:
-        return JSONResponse(content={"error": "Chưa khởi tạo Client Monitor"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Client Monitor"}, status_code=500)
     
     clients = client_monitor.get_wireless_clients()
-    return JSONResponse(content={"clients": clients})
+    return FastJSONResponse(content={"clients": clients})
 
 
 @app.get("/api/clients/dhcp")
@@ -831,10 +875,10 @@ async def get_dhcp_leases():
     global client_monitor
     
     if not client_monitor:
-        return JSONResponse(content={"error": "Chưa khởi tạo Client Monitor"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Client Monitor"}, status_code=500)
     
     leases = client_monitor.get_dhcp_leases()
-    return JSONResponse(content={"leases": leases})
+    return FastJSONResponse(content={"leases": leases})
 
 
 @app.get("/api/clients/blocked")
@@ -843,10 +887,10 @@ async def get_blocked_clients():
     global client_monitor
     
     if not client_monitor:
-        return JSONResponse(content={"error": "Chưa khởi tạo Client Monitor"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Client Monitor"}, status_code=500)
     
     blocked = client_monitor.get_blocked_clients()
-    return JSONResponse(content={"blocked": blocked})
+    return FastJSONResponse(content={"blocked": blocked})
 
 
 @app.post("/api/clients/block")
@@ -855,16 +899,16 @@ async def block_client(ip: str = Form(None), mac: str = Form(None), comment: str
     global client_monitor
     
     if not client_monitor:
-        return JSONResponse(content={"error": "Chưa khởi tạo Client Monitor"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Client Monitor"}, status_code=500)
     
     if not ip and not mac:
-        return JSONResponse(content={"error": "Phải cung cấp IP hoặc MAC address"}, status_code=400)
+        return FastJSONResponse(content={"error": "Phải cung cấp IP hoặc MAC address"}, status_code=400)
     
     result = client_monitor.block_client(ip, mac, comment)
     if result:
-        return JSONResponse(content={"success": True, "message": f"Đã block client {ip or mac}"})
+        return FastJSONResponse(content={"success": True, "message": f"Đã block client {ip or mac}"})
     else:
-        return JSONResponse(content={"success": False, "message": "Không thể block client"}, status_code=500)
+        return FastJSONResponse(content={"success": False, "message": "Không thể block client"}, status_code=500)
 
 
 @app.post("/api/clients/unblock")
@@ -873,16 +917,16 @@ async def unblock_client(ip: str = Form(None), mac: str = Form(None)):
     global client_monitor
     
     if not client_monitor:
-        return JSONResponse(content={"error": "Chưa khởi tạo Client Monitor"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Client Monitor"}, status_code=500)
     
     if not ip and not mac:
-        return JSONResponse(content={"error": "Phải cung cấp IP hoặc MAC address"}, status_code=400)
+        return FastJSONResponse(content={"error": "Phải cung cấp IP hoặc MAC address"}, status_code=400)
     
     result = client_monitor.unblock_client(ip, mac)
     if result:
-        return JSONResponse(content={"success": True, "message": f"Đã unblock client {ip or mac}"})
+        return FastJSONResponse(content={"success": True, "message": f"Đã unblock client {ip or mac}"})
     else:
-        return JSONResponse(content={"success": False, "message": "Không thể unblock client"}, status_code=500)
+        return FastJSONResponse(content={"success": False, "message": "Không thể unblock client"}, status_code=500)
 
 
 # FIREWALL API ENDPOINTS
@@ -892,10 +936,10 @@ async def get_filter_rules():
     global firewall_manager
     
     if not firewall_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo Firewall Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Firewall Manager"}, status_code=500)
     
     rules = firewall_manager.get_filter_rules()
-    return JSONResponse(content={"rules": rules})
+    return FastJSONResponse(content={"rules": rules})
 
 
 @app.get("/api/firewall/nat")
@@ -904,10 +948,10 @@ async def get_nat_rules():
     global firewall_manager
     
     if not firewall_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo Firewall Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Firewall Manager"}, status_code=500)
     
     rules = firewall_manager.get_nat_rules()
-    return JSONResponse(content={"rules": rules})
+    return FastJSONResponse(content={"rules": rules})
 
 
 @app.get("/api/firewall/address-list")
@@ -916,10 +960,10 @@ async def get_address_lists():
     global firewall_manager
     
     if not firewall_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo Firewall Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Firewall Manager"}, status_code=500)
     
     lists = firewall_manager.get_address_lists()
-    return JSONResponse(content={"lists": lists})
+    return FastJSONResponse(content={"lists": lists})
 
 
 @app.post("/api/firewall/filter/add")
@@ -938,7 +982,7 @@ async def add_filter_rule(
     global firewall_manager
     
     if not firewall_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo Firewall Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Firewall Manager"}, status_code=500)
     
     result = firewall_manager.add_filter_rule(
         chain=chain,
@@ -953,9 +997,9 @@ async def add_filter_rule(
     )
     
     if result:
-        return JSONResponse(content={"success": True, "message": "Đã thêm filter rule"})
+        return FastJSONResponse(content={"success": True, "message": "Đã thêm filter rule"})
     else:
-        return JSONResponse(content={"success": False, "message": "Không thể thêm filter rule"}, status_code=500)
+        return FastJSONResponse(content={"success": False, "message": "Không thể thêm filter rule"}, status_code=500)
 
 
 @app.post("/api/firewall/port-forward/add")
@@ -971,7 +1015,7 @@ async def add_port_forward(
     global firewall_manager
     
     if not firewall_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo Firewall Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Firewall Manager"}, status_code=500)
     
     result = firewall_manager.add_port_forward(
         dst_port=dst_port,
@@ -983,9 +1027,9 @@ async def add_port_forward(
     )
     
     if result:
-        return JSONResponse(content={"success": True, "message": "Đã thêm port forward rule"})
+        return FastJSONResponse(content={"success": True, "message": "Đã thêm port forward rule"})
     else:
-        return JSONResponse(content={"success": False, "message": "Không thể thêm port forward rule"}, status_code=500)
+        return FastJSONResponse(content={"success": False, "message": "Không thể thêm port forward rule"}, status_code=500)
 
 
 @app.post("/api/firewall/rule/remove")
@@ -994,14 +1038,14 @@ async def remove_firewall_rule(rule_type: str = Form(...), rule_id: str = Form(.
     global firewall_manager
     
     if not firewall_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo Firewall Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Firewall Manager"}, status_code=500)
     
     result = firewall_manager.remove_firewall_rule(rule_type, rule_id)
     
     if result:
-        return JSONResponse(content={"success": True, "message": f"Đã xóa {rule_type} rule với ID {rule_id}"})
+        return FastJSONResponse(content={"success": True, "message": f"Đã xóa {rule_type} rule với ID {rule_id}"})
     else:
-        return JSONResponse(content={"success": False, "message": "Không thể xóa rule"}, status_code=500)
+        return FastJSONResponse(content={"success": False, "message": "Không thể xóa rule"}, status_code=500)
 
 
 # CAPSMAN API ENDPOINTS
@@ -1011,10 +1055,10 @@ async def get_capsman_status():
     global capsman_manager
     
     if not capsman_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo CAPsMAN Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo CAPsMAN Manager"}, status_code=500)
     
     enabled = capsman_manager.check_capsman_enabled()
-    return JSONResponse(content={"enabled": enabled})
+    return FastJSONResponse(content={"enabled": enabled})
 
 
 @app.post("/api/capsman/enable")
@@ -1023,15 +1067,15 @@ async def enable_capsman(enabled: bool = Form(True)):
     global capsman_manager
     
     if not capsman_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo CAPsMAN Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo CAPsMAN Manager"}, status_code=500)
     
     result = capsman_manager.enable_capsman(enabled)
     
     if result:
         status = "bật" if enabled else "tắt"
-        return JSONResponse(content={"success": True, "message": f"Đã {status} CAPsMAN"})
+        return FastJSONResponse(content={"success": True, "message": f"Đã {status} CAPsMAN"})
     else:
-        return JSONResponse(content={"success": False, "message": f"Không thể {'bật' if enabled else 'tắt'} CAPsMAN"}, status_code=500)
+        return FastJSONResponse(content={"success": False, "message": f"Không thể {'bật' if enabled else 'tắt'} CAPsMAN"}, status_code=500)
 
 
 @app.get("/api/capsman/profiles")
@@ -1040,10 +1084,10 @@ async def get_configuration_profiles():
     global capsman_manager
     
     if not capsman_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo CAPsMAN Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo CAPsMAN Manager"}, status_code=500)
     
     profiles = capsman_manager.get_configuration_profiles()
-    return JSONResponse(content={"profiles": profiles})
+    return FastJSONResponse(content={"profiles": profiles})
 
 
 @app.get("/api/capsman/aps")
@@ -1052,10 +1096,10 @@ async def get_access_points():
     global capsman_manager
     
     if not capsman_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo CAPsMAN Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo CAPsMAN Manager"}, status_code=500)
     
     aps = capsman_manager.get_access_points()
-    return JSONResponse(content={"access_points": aps})
+    return FastJSONResponse(content={"access_points": aps})
 
 
 @app.post("/api/capsman/profile/add")
@@ -1070,14 +1114,14 @@ async def add_configuration_profile(
     global capsman_manager
     
     if not capsman_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo CAPsMAN Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo CAPsMAN Manager"}, status_code=500)
     
     result = capsman_manager.add_configuration_profile(name, ssid, security, passphrase, datapath)
     
     if result:
-        return JSONResponse(content={"success": True, "message": f"Đã thêm configuration profile {name}"})
+        return FastJSONResponse(content={"success": True, "message": f"Đã thêm configuration profile {name}"})
     else:
-        return JSONResponse(content={"success": False, "message": "Không thể thêm configuration profile"}, status_code=500)
+        return FastJSONResponse(content={"success": False, "message": "Không thể thêm configuration profile"}, status_code=500)
 
 
 @app.post("/api/capsman/ap/reboot")
@@ -1086,14 +1130,14 @@ async def reboot_access_point(mac: str = Form(...)):
     global capsman_manager
     
     if not capsman_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo CAPsMAN Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo CAPsMAN Manager"}, status_code=500)
     
     result = capsman_manager.reboot_access_point(mac)
     
     if result:
-        return JSONResponse(content={"success": True, "message": f"Đã gửi lệnh khởi động lại Access Point {mac}"})
+        return FastJSONResponse(content={"success": True, "message": f"Đã gửi lệnh khởi động lại Access Point {mac}"})
     else:
-        return JSONResponse(content={"success": False, "message": "Không thể khởi động lại Access Point"}, status_code=500)
+        return FastJSONResponse(content={"success": False, "message": "Không thể khởi động lại Access Point"}, status_code=500)
 
 
 # BACKUP API ENDPOINTS
@@ -1103,10 +1147,10 @@ async def list_backups():
     global backup_manager
     
     if not backup_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo Backup Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Backup Manager"}, status_code=500)
     
     backups = backup_manager.list_backups()
-    return JSONResponse(content={"backups": backups})
+    return FastJSONResponse(content={"backups": backups})
 
 
 @app.get("/api/backup/exports")
@@ -1115,10 +1159,10 @@ async def list_exports():
     global backup_manager
     
     if not backup_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo Backup Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Backup Manager"}, status_code=500)
     
     exports = backup_manager.list_exports()
-    return JSONResponse(content={"exports": exports})
+    return FastJSONResponse(content={"exports": exports})
 
 
 @app.post("/api/backup/create")
@@ -1127,14 +1171,14 @@ async def create_backup(name: str = Form(None), include_sensitive: bool = Form(F
     global backup_manager
     
     if not backup_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo Backup Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Backup Manager"}, status_code=500)
     
     result = backup_manager.create_backup(name, include_sensitive)
     
     if result:
-        return JSONResponse(content={"success": True, "message": "Đã tạo backup thành công"})
+        return FastJSONResponse(content={"success": True, "message": "Đã tạo backup thành công"})
     else:
-        return JSONResponse(content={"success": False, "message": "Không thể tạo backup"}, status_code=500)
+        return FastJSONResponse(content={"success": False, "message": "Không thể tạo backup"}, status_code=500)
 
 
 @app.post("/api/backup/export")
@@ -1147,14 +1191,14 @@ async def create_export(
     global backup_manager
     
     if not backup_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo Backup Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Backup Manager"}, status_code=500)
     
     result = backup_manager.create_export(name, compact, include_sensitive)
     
     if result:
-        return JSONResponse(content={"success": True, "message": "Đã xuất cấu hình thành công"})
+        return FastJSONResponse(content={"success": True, "message": "Đã xuất cấu hình thành công"})
     else:
-        return JSONResponse(content={"success": False, "message": "Không thể xuất cấu hình"}, status_code=500)
+        return FastJSONResponse(content={"success": False, "message": "Không thể xuất cấu hình"}, status_code=500)
 
 
 @app.post("/api/backup/restore")
@@ -1163,14 +1207,14 @@ async def restore_backup(file: str = Form(...)):
     global backup_manager
     
     if not backup_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo Backup Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Backup Manager"}, status_code=500)
     
     result = backup_manager.restore_backup(file)
     
     if result:
-        return JSONResponse(content={"success": True, "message": "Đã gửi lệnh khôi phục backup thành công"})
+        return FastJSONResponse(content={"success": True, "message": "Đã gửi lệnh khôi phục backup thành công"})
     else:
-        return JSONResponse(content={"success": False, "message": "Không thể khôi phục từ backup"}, status_code=500)
+        return FastJSONResponse(content={"success": False, "message": "Không thể khôi phục từ backup"}, status_code=500)
 
 
 @app.post("/api/backup/upload")
@@ -1179,7 +1223,7 @@ async def upload_backup(backup_file: UploadFile = File(...)):
     global backup_manager
     
     if not backup_manager:
-        return JSONResponse(content={"error": "Chưa khởi tạo Backup Manager"}, status_code=500)
+        return FastJSONResponse(content={"error": "Chưa khởi tạo Backup Manager"}, status_code=500)
     
     # Lưu file tạm thời
     temp_file_path = os.path.join(backup_manager.backup_dir, backup_file.filename)
@@ -1191,9 +1235,9 @@ async def upload_backup(backup_file: UploadFile = File(...)):
     result = backup_manager.upload_backup(temp_file_path)
     
     if result:
-        return JSONResponse(content={"success": True, "message": f"Đã tải lên file {backup_file.filename} thành công"})
+        return FastJSONResponse(content={"success": True, "message": f"Đã tải lên file {backup_file.filename} thành công"})
     else:
-        return JSONResponse(content={"success": False, "message": "Không thể tải lên file backup"}, status_code=500)
+        return FastJSONResponse(content={"success": False, "message": "Không thể tải lên file backup"}, status_code=500)
 
 
 @app.on_event("startup")
@@ -1313,6 +1357,7 @@ async def shutdown_event():
         vpn_manager.disconnect()
         logger.info("Đã ngắt kết nối VPN Manager")
         
+    traffic_series.close()
     logger.info("Đã ngắt kết nối từ thiết bị MikroTik")
 
 
@@ -1321,7 +1366,7 @@ async def shutdown_event():
 async def get_vpn_overview():
     """API endpoint để lấy tổng quan về VPN."""
     if not vpn_manager:
-        return JSONResponse(content={"error": "VPN Manager chưa được khởi tạo"}, status_code=500)
+        return FastJSONResponse(content={"error": "VPN Manager chưa được khởi tạo"}, status_code=500)
     
     try:
         # Lấy thông tin từ các hàm khác nhau
@@ -1363,62 +1408,62 @@ async def get_vpn_overview():
             }
         }
         
-        return JSONResponse(content=response)
+        return FastJSONResponse(content=response)
     except Exception as e:
         logger.error(f"Lỗi khi lấy thông tin VPN: {e}")
-        return JSONResponse(content={"error": f"Lỗi khi lấy thông tin VPN: {e}"}, status_code=500)
+        return FastJSONResponse(content={"error": f"Lỗi khi lấy thông tin VPN: {e}"}, status_code=500)
 
 @app.get("/api/vpn/ipsec/peers")
 async def get_vpn_ipsec_peers():
     """API endpoint để lấy danh sách IPSec peers."""
     if not vpn_manager:
-        return JSONResponse(content={"error": "VPN Manager chưa được khởi tạo"}, status_code=500)
+        return FastJSONResponse(content={"error": "VPN Manager chưa được khởi tạo"}, status_code=500)
     
     try:
         peers = vpn_manager.get_ipsec_peers()
-        return JSONResponse(content=peers)
+        return FastJSONResponse(content=peers)
     except Exception as e:
         logger.error(f"Lỗi khi lấy danh sách IPSec peers: {e}")
-        return JSONResponse(content={"error": f"Lỗi khi lấy danh sách IPSec peers: {e}"}, status_code=500)
+        return FastJSONResponse(content={"error": f"Lỗi khi lấy danh sách IPSec peers: {e}"}, status_code=500)
 
 @app.get("/api/vpn/ovpn/servers")
 async def get_vpn_ovpn_servers():
     """API endpoint để lấy danh sách OpenVPN servers."""
     if not vpn_manager:
-        return JSONResponse(content={"error": "VPN Manager chưa được khởi tạo"}, status_code=500)
+        return FastJSONResponse(content={"error": "VPN Manager chưa được khởi tạo"}, status_code=500)
     
     try:
         servers = vpn_manager.get_ovpn_servers()
-        return JSONResponse(content=servers)
+        return FastJSONResponse(content=servers)
     except Exception as e:
         logger.error(f"Lỗi khi lấy danh sách OpenVPN servers: {e}")
-        return JSONResponse(content={"error": f"Lỗi khi lấy danh sách OpenVPN servers: {e}"}, status_code=500)
+        return FastJSONResponse(content={"error": f"Lỗi khi lấy danh sách OpenVPN servers: {e}"}, status_code=500)
 
 @app.get("/api/vpn/ppp/users")
 async def get_vpn_ppp_users():
     """API endpoint để lấy danh sách PPP users."""
     if not vpn_manager:
-        return JSONResponse(content={"error": "VPN Manager chưa được khởi tạo"}, status_code=500)
+        return FastJSONResponse(content={"error": "VPN Manager chưa được khởi tạo"}, status_code=500)
     
     try:
         users = vpn_manager.get_ppp_secrets()
-        return JSONResponse(content=users)
+        return FastJSONResponse(content=users)
     except Exception as e:
         logger.error(f"Lỗi khi lấy danh sách PPP users: {e}")
-        return JSONResponse(content={"error": f"Lỗi khi lấy danh sách PPP users: {e}"}, status_code=500)
+        return FastJSONResponse(content={"error": f"Lỗi khi lấy danh sách PPP users: {e}"}, status_code=500)
 
 @app.get("/api/vpn/active-connections")
 async def get_vpn_active_connections():
     """API endpoint để lấy danh sách các kết nối VPN đang hoạt động."""
     if not vpn_manager:
-        return JSONResponse(content={"error": "VPN Manager chưa được khởi tạo"}, status_code=500)
+        return FastJSONResponse(content={"error": "VPN Manager chưa được khởi tạo"}, status_code=500)
     
     try:
         connections = vpn_manager.get_active_connections()
-        return JSONResponse(content=connections)
+        return FastJSONResponse(content=connections)
     except Exception as e:
         logger.error(f"Lỗi khi lấy danh sách kết nối VPN đang hoạt động: {e}")
-        return JSONResponse(content={"error": f"Lỗi khi lấy danh sách kết nối VPN đang hoạt động: {e}"}, status_code=500)
+        return FastJSONResponse(content={"error": f"Lỗi khi lấy danh sách kết nối VPN đang hoạt động: {e}"}, status_code=500)
 
 @app.post("/api/vpn/add-user")
 async def add_vpn_user(
@@ -1432,7 +1477,7 @@ async def add_vpn_user(
 ):
     """API endpoint để thêm PPP user."""
     if not vpn_manager:
-        return JSONResponse(content={"error": "VPN Manager chưa được khởi tạo"}, status_code=500)
+        return FastJSONResponse(content={"error": "VPN Manager chưa được khởi tạo"}, status_code=500)
     
     try:
         vpn_manager.add_ppp_user(
@@ -1445,36 +1490,36 @@ async def add_vpn_user(
             comment=comment
         )
         
-        return JSONResponse(content={"success": True, "message": f"Đã thêm PPP user {name}"})
+        return FastJSONResponse(content={"success": True, "message": f"Đã thêm PPP user {name}"})
     except Exception as e:
         logger.error(f"Lỗi khi thêm PPP user: {e}")
-        return JSONResponse(content={"error": f"Lỗi khi thêm PPP user: {e}"}, status_code=500)
+        return FastJSONResponse(content={"error": f"Lỗi khi thêm PPP user: {e}"}, status_code=500)
 
 @app.post("/api/vpn/remove-user")
 async def remove_vpn_user(name: str = Form(...)):
     """API endpoint để xóa PPP user."""
     if not vpn_manager:
-        return JSONResponse(content={"error": "VPN Manager chưa được khởi tạo"}, status_code=500)
+        return FastJSONResponse(content={"error": "VPN Manager chưa được khởi tạo"}, status_code=500)
     
     try:
         vpn_manager.remove_ppp_user(name=name)
-        return JSONResponse(content={"success": True, "message": f"Đã xóa PPP user {name}"})
+        return FastJSONResponse(content={"success": True, "message": f"Đã xóa PPP user {name}"})
     except Exception as e:
         logger.error(f"Lỗi khi xóa PPP user: {e}")
-        return JSONResponse(content={"error": f"Lỗi khi xóa PPP user: {e}"}, status_code=500)
+        return FastJSONResponse(content={"error": f"Lỗi khi xóa PPP user: {e}"}, status_code=500)
 
 @app.post("/api/vpn/disconnect")
 async def disconnect_vpn_connection(id: str = Form(...)):
     """API endpoint để ngắt kết nối VPN đang hoạt động."""
     if not vpn_manager:
-        return JSONResponse(content={"error": "VPN Manager chưa được khởi tạo"}, status_code=500)
+        return FastJSONResponse(content={"error": "VPN Manager chưa được khởi tạo"}, status_code=500)
     
     try:
         vpn_manager.disconnect_active_connection(id=id)
-        return JSONResponse(content={"success": True, "message": f"Đã ngắt kết nối VPN có ID {id}"})
+        return FastJSONResponse(content={"success": True, "message": f"Đã ngắt kết nối VPN có ID {id}"})
     except Exception as e:
         logger.error(f"Lỗi khi ngắt kết nối VPN: {e}")
-        return JSONResponse(content={"error": f"Lỗi khi ngắt kết nối VPN: {e}"}, status_code=500)
+        return FastJSONResponse(content={"error": f"Lỗi khi ngắt kết nối VPN: {e}"}, status_code=500)
 
 @app.post("/api/vpn/setup-ipsec-site")
 async def setup_ipsec_site(
@@ -1486,7 +1531,7 @@ async def setup_ipsec_site(
 ):
     """API endpoint để thiết lập IPSec site-to-site."""
     if not vpn_manager:
-        return JSONResponse(content={"error": "VPN Manager chưa được khởi tạo"}, status_code=500)
+        return FastJSONResponse(content={"error": "VPN Manager chưa được khởi tạo"}, status_code=500)
     
     try:
         vpn_manager.setup_ipsec_site_to_site(
@@ -1497,13 +1542,13 @@ async def setup_ipsec_site(
             local_gateway=local_gateway
         )
         
-        return JSONResponse(content={
+        return FastJSONResponse(content={
             "success": True, 
             "message": f"Đã thiết lập IPSec site-to-site VPN đến {remote_gateway}"
         })
     except Exception as e:
         logger.error(f"Lỗi khi thiết lập IPSec site-to-site: {e}")
-        return JSONResponse(content={"error": f"Lỗi khi thiết lập IPSec site-to-site: {e}"}, status_code=500)
+        return FastJSONResponse(content={"error": f"Lỗi khi thiết lập IPSec site-to-site: {e}"}, status_code=500)
 
 @app.post("/api/vpn/setup-ovpn-server")
 async def setup_ovpn_server(
@@ -1515,7 +1560,7 @@ async def setup_ovpn_server(
 ):
     """API endpoint để thiết lập OpenVPN server."""
     if not vpn_manager:
-        return JSONResponse(content={"error": "VPN Manager chưa được khởi tạo"}, status_code=500)
+        return FastJSONResponse(content={"error": "VPN Manager chưa được khởi tạo"}, status_code=500)
     
     try:
         vpn_manager.setup_ovpn_server(
@@ -1526,13 +1571,13 @@ async def setup_ovpn_server(
             cipher=cipher
         )
         
-        return JSONResponse(content={
+        return FastJSONResponse(content={
             "success": True, 
             "message": f"Đã thiết lập OpenVPN server {name} trên cổng {port}"
         })
     except Exception as e:
         logger.error(f"Lỗi khi thiết lập OpenVPN server: {e}")
-        return JSONResponse(content={"error": f"Lỗi khi thiết lập OpenVPN server: {e}"}, status_code=500)
+        return FastJSONResponse(content={"error": f"Lỗi khi thiết lập OpenVPN server: {e}"}, status_code=500)
 
 
 def main():
@@ -1540,8 +1585,13 @@ def main():
     parser = argparse.ArgumentParser(description='MikroTik Web Monitor')
     parser.add_argument('--host', type=str, default='0.0.0.0', help='Host to bind (default: 0.0.0.0)')
     parser.add_argument('--port', type=int, default=5000, help='Port to bind (default: 5000)')
+    parser.add_argument('--db', type=str, default=None,
+                        help='Database của traffic logger cho /api/traffic/{device}/{interface} (mặc định: biến TRAFFIC_DB hoặc mikrotik_traffic.db)')
     args = parser.parse_args()
     
+    if args.db:
+        traffic_series.db_file = args.db
+    
     print(f"=== MikroTik Web Monitor ===")
     print(f"Server đang chạy tại http://{args.host}:{args.port}")
     
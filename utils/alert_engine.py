@@ -0,0 +1,233 @@
+"""
+Module chống trùng lặp, giới hạn tần suất và gộp cảnh báo
+"""
+
+import logging
+import threading
+import time
+from array import array
+
+# Khởi tạo logger
+logger = logging.getLogger(__name__)
+
+# Các bit trong cột flags
+_INITIALIZED = 0x01
+_ACTIVE = 0x02
+
+# Tiền tố khóa ô token bucket, để không trùng với khóa cảnh báo (device, type, subject)
+_BUCKET = "bucket"
+
+
+class AlertStateTable:
+    """
+    Bảng trạng thái cảnh báo dạng open addressing trên các mảng kiểu cố định.
+    Mỗi khóa chỉ tốn khoảng 33 byte nên có thể theo dõi hàng triệu khóa.
+    """
+
+    def __init__(self, capacity=1024):
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        """Cấp phát các cột với dung lượng cho trước (lũy thừa của 2)"""
+        self.capacity = capacity
+        self.size = 0
+        self.keys = array('q', bytes(8 * capacity))  # 0 nghĩa là ô trống
+        self.last_sent = array('d', bytes(8 * capacity))
+        self.last_seen = array('d', bytes(8 * capacity))
+        self.tokens = array('f', bytes(4 * capacity))
+        self.suppressed = array('I', bytes(4 * capacity))
+        self.flags = array('B', bytes(capacity))
+
+    def find(self, key_hash, create=True):
+        """Trả về chỉ số ô của khóa, tạo ô mới nếu chưa có (hoặc -1 khi create=False)"""
+        key_hash = key_hash or 1
+        mask = self.capacity - 1
+        index = key_hash & mask
+        keys = self.keys
+        while True:
+            current = keys[index]
+            if current == key_hash:
+                return index
+            if current == 0:
+                if not create:
+                    return -1
+                if (self.size + 1) * 10 > self.capacity * 7:
+                    self._rebuild(self.capacity * 2)
+                    return self.find(key_hash)
+                keys[index] = key_hash
+                self.size += 1
+                return index
+            index = (index + 1) & mask
+
+    def _rebuild(self, capacity, keep=None):
+        """Sao chép các ô còn dùng sang bảng mới với dung lượng capacity"""
+        old = (self.keys, self.last_sent, self.last_seen, self.tokens, self.suppressed, self.flags)
+        self._allocate(capacity)
+        for index, key_hash in enumerate(old[0]):
+            if key_hash == 0 or (keep is not None and not keep(index)):
+                continue
+            new_index = self.find(key_hash)
+            self.last_sent[new_index] = old[1][index]
+            self.last_seen[new_index] = old[2][index]
+            self.tokens[new_index] = old[3][index]
+            self.suppressed[new_index] = old[4][index]
+            self.flags[new_index] = old[5][index]
+
+    def prune(self, older_than):
+        """Xóa các khóa không có sự kiện nào kể từ thời điểm older_than"""
+        before = self.size
+        last_seen = self.last_seen
+        suppressed = self.suppressed
+        capacity = self.capacity
+        while capacity > 1024 and (before * 10) < capacity * 2:
+            capacity //= 2
+        self._rebuild(capacity, keep=lambda index: last_seen[index] >= older_than or suppressed[index] > 0)
+        return before - self.size
+
+    def memory_bytes(self):
+        """Dung lượng bộ nhớ của các cột"""
+        return sum(column.itemsize * len(column) for column in (
+            self.keys, self.last_sent, self.last_seen, self.tokens, self.suppressed, self.flags
+        ))
+
+
+class AlertEngine:
+    """
+    Quyết định có gửi một cảnh báo hay không.
+    Cảnh báo được định danh bởi (device, type, subject); mỗi khóa có cooldown riêng,
+    mỗi cặp (device, type) có token bucket, các cảnh báo bị chặn được gộp vào bản tổng hợp định kỳ.
+    """
+
+    def __init__(self, cooldown=300, bucket_burst=5, bucket_rate=10 / 3600, summary_interval=300,
+                 idle_ttl=86400, emit_summary=None, clock=time.time):
+        self.cooldown = cooldown
+        self.bucket_burst = bucket_burst
+        self.bucket_rate = bucket_rate
+        self.summary_interval = summary_interval
+        self.idle_ttl = idle_ttl
+        self.emit_summary = emit_summary
+        self.clock = clock
+        self.table = AlertStateTable()
+        # Chỉ các khóa đang có cảnh báo bị gộp mới giữ nhãn và nội dung gần nhất
+        self._pending = {}
+        self._timer = None
+        self._last_prune = clock()
+        self._lock = threading.Lock()
+
+    def evaluate(self, device, alert_type, subject, message):
+        """Trả về nội dung cần gửi, hoặc None nếu cảnh báo bị chặn"""
+        with self._lock:
+            key = (device, alert_type, subject)
+            index = self._touch(key)
+            return self._admit(key, index, message)
+
+    def evaluate_state(self, device, alert_type, subject, active, message):
+        """Cảnh báo theo trạng thái: chỉ gửi khi trạng thái thay đổi (ví dụ online/offline)"""
+        with self._lock:
+            key = (device, alert_type, subject)
+            index = self._touch(key)
+            flags = self.table.flags[index]
+            if flags & _INITIALIZED and bool(flags & _ACTIVE) == bool(active):
+                return None
+            self.table.flags[index] = _INITIALIZED | (_ACTIVE if active else 0)
+            return self._admit(key, index, message)
+
+    def evaluate_level(self, device, alert_type, subject, value, threshold, hysteresis, message):
+        """
+        Cảnh báo theo ngưỡng có trễ: kích hoạt khi value >= threshold,
+        chỉ hết cảnh báo khi value <= threshold - hysteresis.
+        Trong thời gian đang cảnh báo, chỉ nhắc lại sau mỗi chu kỳ cooldown.
+        """
+        with self._lock:
+            key = (device, alert_type, subject)
+            index = self._touch(key)
+            if value >= threshold:
+                if not self.table.flags[index] & _ACTIVE:
+                    # Vượt ngưỡng lại sau khi đã hết cảnh báo: sự cố mới, không tính cooldown của lần trước
+                    self.table.flags[index] = _INITIALIZED | _ACTIVE
+                    self.table.last_sent[index] = 0
+                return self._admit(key, index, message)
+            if value <= threshold - hysteresis:
+                self.table.flags[index] = _INITIALIZED
+            return None
+
+    def _touch(self, key):
+        """Lấy ô trạng thái của khóa và cập nhật thời điểm có sự kiện"""
+        index = self.table.find(hash(key))
+        self.table.last_seen[index] = self.clock()
+        return index
+
+    def _admit(self, key, index, message):
+        """Áp dụng cooldown và token bucket, gộp cảnh báo bị chặn"""
+        table = self.table
+        now = self.clock()
+        if table.last_sent[index] and now - table.last_sent[index] < self.cooldown:
+            return self._suppress(key, index, message)
+
+        # Token bucket chung cho mọi subject của cùng (device, type)
+        bucket = table.find(hash((_BUCKET, key[0], key[1])))
+        if not table.flags[bucket] & _INITIALIZED:
+            table.flags[bucket] = _INITIALIZED
+            table.tokens[bucket] = self.bucket_burst
+        else:
+            elapsed = now - table.last_seen[bucket]
+            table.tokens[bucket] = min(self.bucket_burst, table.tokens[bucket] + elapsed * self.bucket_rate)
+        table.last_seen[bucket] = now
+        if table.tokens[bucket] < 1:
+            # Tìm lại ô vì bảng có thể đã được mở rộng khi tạo bucket
+            return self._suppress(key, table.find(hash(key)), message)
+        table.tokens[bucket] -= 1
+
+        index = table.find(hash(key))
+        table.last_sent[index] = now
+        coalesced = table.suppressed[index]
+        table.suppressed[index] = 0
+        self._pending.pop(key, None)
+        if coalesced:
+            message = f"{message}\n\n(Đã gộp {coalesced} cảnh báo lặp lại trước đó)"
+        return message
+
+    def _suppress(self, key, index, message):
+        """Đếm cảnh báo bị chặn và lên lịch gửi bản tổng hợp"""
+        self.table.suppressed[index] += 1
+        self._pending[key] = message
+        if self._timer is None and self.emit_summary:
+            self._timer = threading.Timer(self.summary_interval, self.flush_summary)
+            self._timer.daemon = True
+            self._timer.start()
+        return None
+
+    def flush_summary(self):
+        """Gửi một bản tổng hợp cho tất cả cảnh báo đã bị gộp"""
+        with self._lock:
+            self._timer = None
+            pending, self._pending = self._pending, {}
+            lines = []
+            for key, message in pending.items():
+                index = self.table.find(hash(key), create=False)
+                if index < 0 or not self.table.suppressed[index]:
+                    continue
+                count = self.table.suppressed[index]
+                self.table.suppressed[index] = 0
+                device, alert_type, subject = key
+                label = ' / '.join(str(part) for part in (device, alert_type, subject) if part)
+                lines.append(f"- {label}: {count} cảnh báo, gần nhất: {message.strip()}")
+
+            now = self.clock()
+            if now - self._last_prune >= self.idle_ttl:
+                removed = self.table.prune(now - self.idle_ttl)
+                self._last_prune = now
+                logger.debug(f"Đã xóa {removed} khóa cảnh báo không còn hoạt động")
+
+        if lines and self.emit_summary:
+            self.emit_summary(f"Tổng hợp {len(lines)} nhóm cảnh báo bị gộp", '\n'.join(lines))
+
+    def stats(self):
+        """Thống kê số khóa và bộ nhớ đang dùng"""
+        with self._lock:
+            return {
+                'keys': self.table.size,
+                'capacity': self.table.capacity,
+                'memory_bytes': self.table.memory_bytes(),
+                'pending_summary': len(self._pending)
+            }
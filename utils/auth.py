@@ -3,7 +3,6 @@ Module xác thực và phân quyền người dùng
 """
 
 import jwt
-import bcrypt
 import datetime
 from functools import wraps
 from flask import request, jsonify, session, redirect, url_for
@@ -18,12 +17,14 @@ PERMISSIONS = {
 
 def hash_password(password):
     """Băm mật khẩu sử dụng bcrypt"""
+    import bcrypt
     salt = bcrypt.gensalt()
     hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
     return hashed.decode('utf-8')
 
 def check_password(password, hashed_password):
     """Kiểm tra mật khẩu"""
+    import bcrypt
     return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
 
 def generate_token(user_id, username, role):
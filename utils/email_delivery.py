@@ -0,0 +1,118 @@
+"""
+Module phiên SMTP dùng lại và gom email cảnh báo theo chu kỳ
+"""
+
+import datetime
+import logging
+import smtplib
+import threading
+import time
+
+# Khởi tạo logger
+logger = logging.getLogger(__name__)
+
+# Các lỗi cho thấy kết nối SMTP đã hỏng và cần kết nối lại
+_CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+
+class SMTPSession:
+    """Phiên SMTP dùng lại giữa các lần gửi, tự kết nối lại khi bị ngắt"""
+
+    def __init__(self, host, port, username, password, timeout=10, idle_check=60):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        # Sau khoảng thời gian rảnh này sẽ gửi NOOP để kiểm tra kết nối trước khi dùng lại
+        self.idle_check = idle_check
+        self._server = None
+        self._last_used = 0.0
+
+    def _connect(self):
+        """Mở kết nối, STARTTLS và đăng nhập"""
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            server.starttls()
+            server.login(self.username, self.password)
+        except Exception:
+            server.close()
+            raise
+        self._server = server
+        self._last_used = time.monotonic()
+        logger.debug(f"Đã mở phiên SMTP đến {self.host}:{self.port}")
+
+    def close(self):
+        """Đóng phiên SMTP hiện tại"""
+        server, self._server = self._server, None
+        if server is None:
+            return
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+    def _is_alive(self):
+        """Kiểm tra kết nối còn dùng được không"""
+        if self._server is None:
+            return False
+        if time.monotonic() - self._last_used < self.idle_check:
+            return True
+        try:
+            return self._server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def send(self, msg):
+        """Gửi email, kết nối lại và gửi lại một lần nếu phiên đã bị ngắt"""
+        if not self._is_alive():
+            self.close()
+            self._connect()
+        try:
+            self._server.send_message(msg)
+        except _CONNECTION_ERRORS as e:
+            logger.info(f"Phiên SMTP bị ngắt ({str(e)}), đang kết nối lại")
+            self.close()
+            self._connect()
+            self._server.send_message(msg)
+        except Exception:
+            # Trạng thái phiên không còn chắc chắn, lần gửi sau sẽ mở phiên mới
+            self.close()
+            raise
+        self._last_used = time.monotonic()
+
+
+class EmailDigest:
+    """Gom các cảnh báo email theo người nhận trong một cửa sổ thời gian"""
+
+    def __init__(self, window, send_digest):
+        self.window = window
+        self._send_digest = send_digest
+        self._pending = {}
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def add(self, recipients, subject, message):
+        """Thêm cảnh báo vào bản tổng hợp của từng người nhận"""
+        entry = (datetime.datetime.now(), subject, message)
+        with self._lock:
+            for recipient in recipients:
+                self._pending.setdefault(recipient, []).append(entry)
+            if self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        return True
+
+    def flush(self):
+        """Gửi bản tổng hợp cho tất cả người nhận đang chờ"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+        for recipient, entries in pending.items():
+            try:
+                self._send_digest(recipient, entries)
+            except Exception as e:
+                logger.error(f"Lỗi khi gửi email tổng hợp đến {recipient}: {str(e)}")
@@ -0,0 +1,140 @@
+"""
+Module nén response và xử lý request có điều kiện (ETag / 304)
+"""
+
+import gzip
+import hashlib
+import logging
+from typing import Optional
+
+from flask import request
+
+# Khởi tạo logger
+logger = logging.getLogger(__name__)
+
+# Brotli là tùy chọn, chỉ dùng khi đã cài đặt
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Chỉ nén các response đủ lớn, payload nhỏ nén không có lợi
+MIN_COMPRESS_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+COMPRESSIBLE_MIMETYPES = {'application/json'}
+
+# Hậu tố ETag theo từng kiểu mã hóa nội dung
+_ENCODING_SUFFIXES = {'gzip': '-gz', 'br': '-br'}
+
+
+def make_etag(*parts) -> str:
+    """Tạo strong ETag từ nội dung hoặc các thành phần phiên bản snapshot"""
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        if not isinstance(part, (bytes, bytearray)):
+            part = repr(part).encode('utf-8')
+        digest.update(part)
+        digest.update(b'\x00')
+    return f'"{digest.hexdigest()}"'
+
+
+def _strip_etag(etag: str) -> str:
+    """Bỏ tiền tố weak và hậu tố mã hóa để so sánh ETag"""
+    etag = etag.strip()
+    if etag.startswith('W/'):
+        etag = etag[2:]
+    for suffix in _ENCODING_SUFFIXES.values():
+        if etag.endswith(suffix + '"'):
+            return etag[:-len(suffix) - 1] + '"'
+    return etag
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Kiểm tra header If-None-Match có khớp với ETag hiện tại không"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    current = _strip_etag(etag)
+    return any(_strip_etag(candidate) == current for candidate in if_none_match.split(','))
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Chọn kiểu nén tốt nhất mà client chấp nhận (br hoặc gzip)"""
+    if not accept_encoding:
+        return None
+
+    accepted = {}
+    for item in accept_encoding.split(','):
+        token, _, params = item.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[token.strip().lower()] = quality
+
+    wildcard = accepted.get('*', 0.0)
+    candidates = ['br', 'gzip'] if brotli else ['gzip']
+    best = None
+    best_quality = 0.0
+    for encoding in candidates:
+        quality = accepted.get(encoding, wildcard)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    """Nén nội dung theo kiểu mã hóa đã chọn"""
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def _add_vary(response, value):
+    """Thêm giá trị vào header Vary nếu chưa có"""
+    vary = {item.strip().lower() for item in response.headers.get('Vary', '').split(',') if item.strip()}
+    if value.lower() not in vary:
+        response.headers.add('Vary', value)
+
+
+def process_response(response):
+    """Gắn ETag, xử lý 304 và nén response JSON"""
+    if request.method not in ('GET', 'HEAD'):
+        return response
+    if response.status_code != 200 or response.direct_passthrough:
+        return response
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES or 'Content-Encoding' in response.headers:
+        return response
+
+    body = response.get_data()
+
+    # Route có thể tự đặt ETag từ phiên bản snapshot, nếu không thì băm nội dung
+    etag = response.headers.get('ETag') or make_etag(body)
+    _add_vary(response, 'Accept-Encoding')
+
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        response.status_code = 304
+        response.set_data(b'')
+        response.headers['ETag'] = etag
+        response.headers.pop('Content-Type', None)
+        return response
+
+    encoding = negotiate_encoding(request.headers.get('Accept-Encoding'))
+    if encoding and len(body) >= MIN_COMPRESS_SIZE:
+        response.set_data(compress(body, encoding))
+        response.headers['Content-Encoding'] = encoding
+        etag = etag[:-1] + _ENCODING_SUFFIXES[encoding] + '"'
+
+    response.headers['ETag'] = etag
+    return response
+
+
+def init_app(app):
+    """Đăng ký xử lý nén và ETag cho ứng dụng Flask"""
+    app.after_request(process_response)
+    logger.debug("Đã bật nén response và ETag cho các API JSON")
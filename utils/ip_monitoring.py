@@ -14,11 +14,11 @@ logger = logging.getLogger(__name__)
 
 # Kết nối đến cơ sở dữ liệu
 DB_PATH = 'data/ip_monitoring.db'
-os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
 
 def init_database():
-    """Khởi tạo cơ sở dữ liệu"""
+    """Khởi tạo cơ sở dữ liệu (được gọi một lần ở bước khởi tạo ứng dụng)"""
     try:
+        os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
         conn = sqlite3.connect(DB_PATH)
         cursor = conn.cursor()
         
@@ -284,7 +284,4 @@ def monitor_ip_status():
             time.sleep(60)
         except Exception as e:
             logger.error(f"Lỗi trong quá trình giám sát IP: {str(e)}")
-            time.sleep(60)  # Nghỉ 60 giây trước khi thử lại
-
-# Khởi tạo cơ sở dữ liệu khi import module
-init_database()
\ No newline at end of file
+            time.sleep(60)  # Nghỉ 60 giây trước khi thử lại
\ No newline at end of file
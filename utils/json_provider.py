@@ -0,0 +1,79 @@
+"""
+Module mã hóa JSON nhanh cho ứng dụng Flask
+"""
+
+import datetime
+import decimal
+import json
+import logging
+import os
+
+from flask.json.provider import DefaultJSONProvider
+
+# Khởi tạo logger
+logger = logging.getLogger(__name__)
+
+# orjson là tùy chọn, chỉ dùng khi đã cài đặt
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Cho phép ép dùng backend chuẩn qua biến môi trường JSON_BACKEND=json
+BACKEND = 'orjson' if orjson and os.getenv('JSON_BACKEND', 'orjson') != 'json' else 'json'
+
+if orjson:
+    _ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def default(obj):
+    """Chuyển các kiểu không chuẩn JSON thành kiểu cơ bản"""
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, bytes):
+        return obj.decode('utf-8', errors='replace')
+    # Mảng và số numpy (kiểm tra theo thuộc tính để không phải import numpy)
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    if hasattr(obj, 'item'):
+        return obj.item()
+    raise TypeError(f"Kiểu {type(obj).__name__} không thể chuyển thành JSON")
+
+
+def dumps(obj) -> bytes:
+    """Mã hóa đối tượng thành JSON dạng bytes UTF-8"""
+    if BACKEND == 'orjson':
+        return orjson.dumps(obj, default=default, option=_ORJSON_OPTIONS)
+    return json.dumps(obj, default=default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """JSON provider dùng orjson cho jsonify, giữ bộ giải mã chuẩn của Flask"""
+
+    def dumps(self, obj, **kwargs):
+        # Các tham số riêng của json chuẩn (indent, sort_keys...) vẫn đi qua encoder mặc định
+        if kwargs or BACKEND != 'orjson':
+            kwargs.setdefault('default', default)
+            return json.dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=default, option=_ORJSON_OPTIONS).decode('utf-8')
+
+    def response(self, *args, **kwargs):
+        """Tạo response JSON trực tiếp từ bytes, không qua chuỗi trung gian"""
+        if args and kwargs:
+            raise TypeError('jsonify() behavior undefined when passed both args and kwargs')
+        if len(args) == 1:
+            obj = args[0]
+        else:
+            obj = args or kwargs or None
+        return self._app.response_class(dumps(obj), mimetype=self.mimetype)
+
+
+def init_app(app):
+    """Dùng bộ mã hóa JSON nhanh cho jsonify của ứng dụng Flask"""
+    app.json_provider_class = FastJSONProvider
+    app.json = FastJSONProvider(app)
+    logger.debug(f"Backend JSON: {BACKEND}")
@@ -0,0 +1,115 @@
+"""
+Module xuất metrics dạng Prometheus cho ứng dụng Flask
+"""
+
+import bisect
+import logging
+import threading
+import time
+
+from flask import request, g
+
+from utils import ip_monitoring
+
+# Khởi tạo logger
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Các mốc histogram độ trễ request (giây)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Các mốc histogram số lần kết nối router trong một request
+ROUTER_CALL_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+def _escape(value):
+    """Escape giá trị label theo định dạng text của Prometheus"""
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class LatencyHistogram:
+    """Histogram theo (method, route, status)"""
+
+    def __init__(self, name='http_request_duration_seconds', buckets=DEFAULT_BUCKETS,
+                 help_text='Độ trễ xử lý request HTTP theo route'):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self._bounds = [repr(float(bound)) for bound in self.buckets]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, method, route, status, seconds):
+        """Ghi nhận một giá trị quan sát của request (độ trễ, số lần gọi router...)"""
+        key = (method, route, str(status))
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    def render(self, lines):
+        """Thêm các dòng metrics của histogram vào danh sách lines"""
+        with self._lock:
+            snapshot = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+
+        lines.append(f'# HELP {self.name} {self.help_text}')
+        lines.append(f'# TYPE {self.name} histogram')
+        for (method, route, status), (counts, total, count) in sorted(snapshot.items()):
+            base = f'method="{_escape(method)}",route="{_escape(route)}",status="{status}"'
+            cumulative = 0
+            for bound, bucket_count in zip(self._bounds, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{base},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{base},le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{{base}}} {total}')
+            lines.append(f'{self.name}_count{{{base}}} {count}')
+
+
+request_latency = LatencyHistogram()
+router_calls = LatencyHistogram(
+    'http_request_router_calls', ROUTER_CALL_BUCKETS, 'Số lần kết nối router trong một request theo route'
+)
+
+
+def _start_timer():
+    """Đánh dấu thời điểm bắt đầu request"""
+    g.request_start_time = time.perf_counter()
+
+
+def _record_latency(response):
+    """Ghi nhận độ trễ request theo route"""
+    start_time = g.pop('request_start_time', None)
+    if start_time is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        request_latency.observe(request.method, route, response.status_code, time.perf_counter() - start_time)
+        router_calls.observe(request.method, route, response.status_code, g.get('router_calls', 0))
+    return response
+
+
+def render():
+    """Render metrics theo định dạng text của Prometheus"""
+    lines = []
+
+    # Thống kê giám sát IP được lấy từ cơ sở dữ liệu cục bộ, không truy vấn router
+    stats = ip_monitoring.get_monitoring_stats()
+    lines.append('# HELP mikrotik_msc_monitored_ips Số IP đang được giám sát theo trạng thái')
+    lines.append('# TYPE mikrotik_msc_monitored_ips gauge')
+    lines.append(f'mikrotik_msc_monitored_ips{{status="active"}} {stats["active_ips"]}')
+    lines.append(f'mikrotik_msc_monitored_ips{{status="inactive"}} {stats["inactive_ips"]}')
+    lines.append(f'mikrotik_msc_monitored_ips{{status="all"}} {stats["total_monitored"]}')
+
+    request_latency.render(lines)
+    router_calls.render(lines)
+    lines.append('')
+    return '\n'.join(lines)
+
+
+def init_app(app):
+    """Đăng ký đo độ trễ request cho ứng dụng Flask"""
+    app.before_request(_start_timer)
+    app.after_request(_record_latency)
@@ -8,6 +8,8 @@ import logging
 import datetime
 from typing import Optional, Dict, List, Any, Tuple
 
+from utils import profiling
+
 # Khởi tạo logger
 logger = logging.getLogger(__name__)
 
@@ -22,6 +24,9 @@ def get_mikrotik_connection():
         username = os.getenv('MIKROTIK_USERNAME', 'admin')
         password = os.getenv('MIKROTIK_PASSWORD', '')
         
+        # Mỗi lần gọi mở một kết nối mới, được đếm vào số lần gọi router của request
+        profiling.count_router_call()
+        
         # Kết nối đến thiết bị
         api = connect(
             username=username,
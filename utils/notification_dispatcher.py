@@ -0,0 +1,214 @@
+"""
+Module điều phối gửi thông báo bất đồng bộ
+"""
+
+import atexit
+import heapq
+import itertools
+import logging
+import queue
+import random
+import threading
+import time
+
+# Khởi tạo logger
+logger = logging.getLogger(__name__)
+
+
+class Channel:
+    """Cấu hình của một kênh gửi thông báo"""
+
+    def __init__(self, name, send, concurrency=2, max_retries=3, backoff=2.0, max_backoff=60.0, queue_size=1000,
+                 configured=None):
+        self.name = name
+        self.send = send
+        # Hàm kiểm tra kênh đã được cấu hình chưa; thiếu cấu hình là lỗi vĩnh viễn, không thử lại
+        self.configured = configured
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self._counter_lock = threading.Lock()
+
+    def count(self, outcome):
+        """Tăng bộ đếm sent/failed/dropped (được gọi từ nhiều worker)"""
+        with self._counter_lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def counters(self):
+        """Giá trị hiện tại của các bộ đếm"""
+        with self._counter_lock:
+            return {'sent': self.sent, 'failed': self.failed, 'dropped': self.dropped}
+
+    def retry_delay(self, attempt):
+        """Thời gian chờ trước lần thử lại thứ attempt (backoff lũy thừa có jitter)"""
+        delay = min(self.max_backoff, self.backoff * (2 ** attempt))
+        return delay * random.uniform(0.5, 1.0)
+
+
+class NotificationDispatcher:
+    """
+    Hàng đợi thông báo với worker pool riêng cho từng kênh.
+    Số worker của mỗi kênh chính là giới hạn gửi đồng thời của kênh đó;
+    lần gửi thất bại được đưa vào lịch thử lại với backoff lũy thừa.
+    """
+
+    def __init__(self):
+        self.channels = {}
+        self._retry_heap = []
+        self._retry_cond = threading.Condition()
+        self._sequence = itertools.count()
+        self._threads = []
+        self._shutdown_hooks = []
+        self._started = False
+        self._stopping = False
+        self._lock = threading.Lock()
+        atexit.register(self.shutdown)
+
+    def register_channel(self, name, send, **options):
+        """Đăng ký kênh gửi thông báo"""
+        if self._started:
+            raise RuntimeError('Không thể đăng ký kênh sau khi dispatcher đã chạy')
+        self.channels[name] = Channel(name, send, **options)
+
+    def add_shutdown_hook(self, hook):
+        """Đăng ký hàm được gọi trước khi dispatcher dừng (ví dụ gửi nốt email tổng hợp)"""
+        self._shutdown_hooks.append(hook)
+
+    def start(self):
+        """Khởi động các worker (được gọi tự động ở lần submit đầu tiên)"""
+        with self._lock:
+            if self._started:
+                return
+            for channel in self.channels.values():
+                for index in range(channel.concurrency):
+                    thread = threading.Thread(
+                        target=self._worker, args=(channel,), name=f'notify-{channel.name}-{index}', daemon=True
+                    )
+                    thread.start()
+                    self._threads.append(thread)
+            thread = threading.Thread(target=self._retry_loop, name='notify-retry', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+            self._started = True
+        logger.debug(f"Đã khởi động dispatcher thông báo với {len(self._threads)} thread")
+
+    def submit(self, channel_name, *args, **kwargs):
+        """Đưa một thông báo vào hàng đợi, trả về ngay lập tức"""
+        channel = self.channels.get(channel_name)
+        if channel is None:
+            logger.error(f"Kênh thông báo không tồn tại: {channel_name}")
+            return False
+        if not self._started:
+            self.start()
+        try:
+            channel.queue.put_nowait((args, kwargs, 0))
+            return True
+        except queue.Full:
+            channel.count('dropped')
+            logger.error(f"Hàng đợi kênh {channel_name} đã đầy, bỏ qua thông báo")
+            return False
+
+    def _worker(self, channel):
+        """Vòng lặp worker của một kênh"""
+        while True:
+            job = channel.queue.get()
+            try:
+                if job is None:
+                    return
+                self._deliver(channel, *job)
+            finally:
+                channel.queue.task_done()
+
+    def _deliver(self, channel, args, kwargs, attempt):
+        """Gửi một thông báo và lên lịch thử lại nếu thất bại"""
+        if channel.configured is not None and not channel.configured():
+            channel.count('failed')
+            logger.error(f"Kênh {channel.name} chưa được cấu hình, bỏ qua thông báo")
+            return
+
+        try:
+            success = channel.send(*args, **kwargs)
+        except Exception as e:
+            logger.error(f"Lỗi khi gửi thông báo qua {channel.name}: {str(e)}")
+            success = False
+
+        if success:
+            channel.count('sent')
+            return
+
+        if attempt < channel.max_retries and not self._stopping:
+            delay = channel.retry_delay(attempt)
+            logger.warning(f"Gửi thông báo qua {channel.name} thất bại, thử lại sau {delay:.1f}s (lần {attempt + 1})")
+            with self._retry_cond:
+                heapq.heappush(
+                    self._retry_heap,
+                    (time.monotonic() + delay, next(self._sequence), channel, (args, kwargs, attempt + 1))
+                )
+                self._retry_cond.notify()
+        else:
+            channel.count('failed')
+            logger.error(f"Bỏ qua thông báo qua {channel.name} sau {attempt + 1} lần thử")
+
+    def _retry_loop(self):
+        """Chuyển các thông báo đến hạn thử lại về hàng đợi của kênh"""
+        with self._retry_cond:
+            while not self._stopping:
+                if not self._retry_heap:
+                    self._retry_cond.wait()
+                    continue
+                wait = self._retry_heap[0][0] - time.monotonic()
+                if wait > 0:
+                    self._retry_cond.wait(wait)
+                    continue
+                _, _, channel, job = heapq.heappop(self._retry_heap)
+                try:
+                    channel.queue.put_nowait(job)
+                except queue.Full:
+                    channel.count('dropped')
+                    logger.error(f"Hàng đợi kênh {channel.name} đã đầy, bỏ qua thông báo thử lại")
+
+    def shutdown(self, timeout=5.0):
+        """Chờ gửi nốt các thông báo trong hàng đợi rồi dừng worker"""
+        if self._stopping:
+            return
+        for hook in self._shutdown_hooks:
+            try:
+                hook()
+            except Exception as e:
+                logger.error(f"Lỗi khi chạy hook dừng dispatcher: {str(e)}")
+        if not self._started:
+            return
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and any(channel.queue.unfinished_tasks for channel in self.channels.values()):
+            time.sleep(0.05)
+
+        self._stopping = True
+        with self._retry_cond:
+            pending_retries = len(self._retry_heap)
+            self._retry_cond.notify_all()
+        for channel in self.channels.values():
+            for _ in range(channel.concurrency):
+                try:
+                    channel.queue.put_nowait(None)
+                except queue.Full:
+                    pass
+        if pending_retries:
+            logger.warning(f"Bỏ qua {pending_retries} thông báo đang chờ thử lại khi dừng dispatcher")
+
+    def stats(self):
+        """Thống kê hàng đợi và kết quả gửi của từng kênh"""
+        with self._retry_cond:
+            pending_retries = len(self._retry_heap)
+        return {
+            'pending_retries': pending_retries,
+            'channels': {
+                name: {'queued': channel.queue.qsize(), **channel.counters()}
+                for name, channel in self.channels.items()
+            }
+        }
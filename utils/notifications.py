@@ -5,34 +5,71 @@ Module quản lý thông báo
 import os
 import json
 import logging
-import smtplib
-import requests
+import html
 import datetime
+import threading
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from twilio.rest import Client
-from twilio.base.exceptions import TwilioRestException
+
+from utils.alert_engine import AlertEngine
+from utils.email_delivery import SMTPSession, EmailDigest
+from utils.notification_dispatcher import NotificationDispatcher
 
 # Khởi tạo logger
 logger = logging.getLogger(__name__)
 
-# Khởi tạo Twilio client
+# Thời gian chờ tối đa cho mỗi lần gửi (giây) và số lần thử lại khi gửi thất bại
+NOTIFICATION_TIMEOUT = float(os.getenv('NOTIFICATION_TIMEOUT', 10))
+NOTIFICATION_MAX_RETRIES = int(os.getenv('NOTIFICATION_MAX_RETRIES', 3))
+
+# Gom email cảnh báo trong cửa sổ này (giây) thành một email cho mỗi người nhận, 0 để tắt
+EMAIL_DIGEST_WINDOW = int(os.getenv('EMAIL_DIGEST_WINDOW', 0))
+
+# Cấu hình chống bão cảnh báo: cooldown mỗi khóa, token bucket mỗi (thiết bị, loại), chu kỳ tổng hợp
+ALERT_COOLDOWN = int(os.getenv('ALERT_COOLDOWN', 300))
+ALERT_BURST = int(os.getenv('ALERT_BURST', 5))
+ALERT_RATE_PER_HOUR = float(os.getenv('ALERT_RATE_PER_HOUR', 10))
+ALERT_SUMMARY_INTERVAL = int(os.getenv('ALERT_SUMMARY_INTERVAL', 300))
+# Mức tài nguyên phải giảm xuống dưới ngưỡng bao nhiêu điểm phần trăm thì mới hết cảnh báo
+RESOURCE_HYSTERESIS = float(os.getenv('RESOURCE_HYSTERESIS', 5))
+
+# Cấu hình Twilio
 TWILIO_ACCOUNT_SID = os.getenv('TWILIO_ACCOUNT_SID')
 TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN')
 TWILIO_PHONE_NUMBER = os.getenv('TWILIO_PHONE_NUMBER')
 
+# Twilio client được tạo ở lần gửi SMS đầu tiên
 twilio_client = None
-if TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN:
-    twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+_twilio_lock = threading.Lock()
+
+def get_twilio_client():
+    """Lấy Twilio client, chỉ import thư viện twilio khi cần"""
+    global twilio_client
+    if twilio_client is None and TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN:
+        with _twilio_lock:
+            if twilio_client is None:
+                from twilio.rest import Client
+                from twilio.http.http_client import TwilioHttpClient
+                twilio_client = Client(
+                    TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN,
+                    http_client=TwilioHttpClient(timeout=NOTIFICATION_TIMEOUT)
+                )
+    return twilio_client
+
+def sms_configured():
+    """Đã có thông tin tài khoản Twilio chưa"""
+    return bool(TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN)
 
 def send_sms_notification(phone_number, message):
     """Gửi thông báo qua SMS sử dụng Twilio"""
-    if not twilio_client:
+    client = get_twilio_client()
+    if not client:
         logger.error("Chưa cấu hình Twilio")
         return False
     
+    from twilio.base.exceptions import TwilioRestException
     try:
-        message = twilio_client.messages.create(
+        message = client.messages.create(
             body=message,
             from_=TWILIO_PHONE_NUMBER,
             to=phone_number
@@ -43,6 +80,23 @@ def send_sms_notification(phone_number, message):
         logger.error(f"Lỗi khi gửi SMS: {str(e)}")
         return False
 
+# Mỗi worker gửi email giữ một phiên SMTP riêng
+_smtp_local = threading.local()
+
+def get_smtp_session(smtp_server, smtp_port, smtp_username, smtp_password):
+    """Lấy phiên SMTP của thread hiện tại, tạo mới nếu chưa có hoặc cấu hình đã đổi"""
+    session = getattr(_smtp_local, 'session', None)
+    settings = (smtp_server, smtp_port, smtp_username, smtp_password)
+    if session is None or (session.host, session.port, session.username, session.password) != settings:
+        if session is not None:
+            session.close()
+        session = _smtp_local.session = SMTPSession(*settings, timeout=NOTIFICATION_TIMEOUT)
+    return session
+
+def smtp_configured():
+    """Đã có tài khoản SMTP chưa (máy chủ và cổng có giá trị mặc định)"""
+    return bool(os.getenv('SMTP_USERNAME') and os.getenv('SMTP_PASSWORD'))
+
 def send_email_notification(subject, message, recipients=None):
     """Gửi thông báo qua email"""
     if not recipients:
@@ -66,11 +120,8 @@ def send_email_notification(subject, message, recipients=None):
         msg['To'] = ', '.join(recipients)
         msg.attach(MIMEText(message, 'html'))
         
-        # Gửi email
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            server.starttls()
-            server.login(smtp_username, smtp_password)
-            server.send_message(msg)
+        # Gửi email qua phiên SMTP dùng lại, tự kết nối lại khi phiên bị ngắt
+        get_smtp_session(smtp_server, smtp_port, smtp_username, smtp_password).send(msg)
         
         logger.info(f"Đã gửi email đến {recipients}")
         return True
@@ -78,6 +129,10 @@ def send_email_notification(subject, message, recipients=None):
         logger.error(f"Lỗi khi gửi email: {str(e)}")
         return False
 
+def slack_configured():
+    """Đã có Slack webhook chưa"""
+    return bool(os.getenv('SLACK_WEBHOOK_URL'))
+
 def send_slack_notification(title, message):
     """Gửi thông báo qua Slack webhook"""
     slack_webhook_url = os.getenv('SLACK_WEBHOOK_URL')
@@ -85,12 +140,13 @@ def send_slack_notification(title, message):
         logger.error("Chưa cấu hình Slack webhook")
         return False
     
+    import requests
     try:
         payload = {
             "text": f"*{title}*\n{message}",
             "mrkdwn": True
         }
-        response = requests.post(slack_webhook_url, json=payload)
+        response = requests.post(slack_webhook_url, json=payload, timeout=NOTIFICATION_TIMEOUT)
         response.raise_for_status()
         
         logger.info("Đã gửi thông báo đến Slack")
@@ -99,8 +155,40 @@ def send_slack_notification(title, message):
         logger.error(f"Lỗi khi gửi thông báo đến Slack: {str(e)}")
         return False
 
+# Dispatcher gửi thông báo nền, mỗi kênh có worker pool và giới hạn đồng thời riêng
+dispatcher = NotificationDispatcher()
+dispatcher.register_channel(
+    'email', send_email_notification, configured=smtp_configured,
+    concurrency=int(os.getenv('NOTIFICATION_EMAIL_WORKERS', 2)), max_retries=NOTIFICATION_MAX_RETRIES
+)
+dispatcher.register_channel(
+    'slack', send_slack_notification, configured=slack_configured,
+    concurrency=int(os.getenv('NOTIFICATION_SLACK_WORKERS', 2)), max_retries=NOTIFICATION_MAX_RETRIES
+)
+dispatcher.register_channel(
+    'sms', send_sms_notification, configured=sms_configured,
+    concurrency=int(os.getenv('NOTIFICATION_SMS_WORKERS', 4)), max_retries=NOTIFICATION_MAX_RETRIES
+)
+
+def send_email_digest(recipient, entries):
+    """Gửi một email tổng hợp các cảnh báo trong cửa sổ digest cho một người nhận"""
+    if len(entries) == 1:
+        _, subject, message = entries[0]
+        return dispatcher.submit('email', subject, message, [recipient])
+    
+    subject = f"Tổng hợp {len(entries)} cảnh báo MikroTik MSC"
+    sections = [
+        f"<h3>{html.escape(title)}</h3><p>{created.strftime('%Y-%m-%d %H:%M:%S')}</p><pre>{html.escape(message)}</pre>"
+        for created, title, message in entries
+    ]
+    return dispatcher.submit('email', subject, '<hr>'.join(sections), [recipient])
+
+email_digest = EmailDigest(EMAIL_DIGEST_WINDOW, send_email_digest) if EMAIL_DIGEST_WINDOW > 0 else None
+if email_digest:
+    dispatcher.add_shutdown_hook(email_digest.flush)
+
 def send_system_notification(title, message, level='info', notify_email=True, notify_slack=True, notify_sms=False, phone_numbers=None):
-    """Gửi thông báo hệ thống"""
+    """Gửi thông báo hệ thống qua hàng đợi, trả về ngay sau khi đã đưa vào hàng đợi"""
     # Log thông báo
     log_func = getattr(logger, level, logger.info)
     log_func(f"{title}: {message}")
@@ -108,24 +196,36 @@ def send_system_notification(title, message, level='info', notify_email=True, no
     # Tạo nội dung thông báo
     notification_text = f"{title}\n\n{message}\n\nThời gian: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
     
-    # Gửi thông báo qua các kênh
+    # Đưa thông báo vào hàng đợi của các kênh
     results = []
     
     if notify_email:
-        email_success = send_email_notification(title, notification_text)
-        results.append(('email', email_success))
+        if email_digest:
+            results.append(('email', email_digest.add([os.getenv('DEFAULT_ADMIN_EMAIL')], title, notification_text)))
+        else:
+            results.append(('email', dispatcher.submit('email', title, notification_text)))
     
     if notify_slack:
-        slack_success = send_slack_notification(title, message)
-        results.append(('slack', slack_success))
+        results.append(('slack', dispatcher.submit('slack', title, message)))
     
     if notify_sms and phone_numbers:
         for phone in phone_numbers:
-            sms_success = send_sms_notification(phone, notification_text)
-            results.append(('sms', sms_success))
+            results.append(('sms', dispatcher.submit('sms', phone, notification_text)))
     
     return all(success for _, success in results)
 
+def send_alert_summary(title, message):
+    """Gửi bản tổng hợp các cảnh báo đã bị gộp"""
+    return send_system_notification(title=title, message=message, level='warning')
+
+alert_engine = AlertEngine(
+    cooldown=ALERT_COOLDOWN,
+    bucket_burst=ALERT_BURST,
+    bucket_rate=ALERT_RATE_PER_HOUR / 3600,
+    summary_interval=ALERT_SUMMARY_INTERVAL,
+    emit_summary=send_alert_summary
+)
+
 def notify_device_connection_status(device_name, status, ip_address=None):
     """Thông báo về trạng thái kết nối thiết bị"""
     title = f"Trạng thái thiết bị: {device_name}"
@@ -137,6 +237,11 @@ def notify_device_connection_status(device_name, status, ip_address=None):
     level = 'warning' if status.lower() == 'offline' else 'info'
     notify_sms = status.lower() == 'offline'  # Chỉ gửi SMS khi thiết bị offline
     
+    # Chỉ thông báo khi trạng thái thay đổi, link chập chờn được gộp vào bản tổng hợp
+    message = alert_engine.evaluate_state(device_name, 'connection', '', status.lower() == 'offline', message)
+    if message is None:
+        return True
+    
     return send_system_notification(
         title=title,
         message=message,
@@ -149,6 +254,13 @@ def notify_high_resource_usage(device_name, resource_type, value, threshold):
     title = f"Cảnh báo tài nguyên: {device_name}"
     message = f"Thiết bị {device_name} có mức sử dụng {resource_type} cao: {value}% (ngưỡng: {threshold}%)"
     
+    # Có thể gọi với mọi giá trị đo được: chỉ cảnh báo khi vượt ngưỡng, hết cảnh báo khi giảm đủ sâu
+    message = alert_engine.evaluate_level(
+        device_name, 'resource', resource_type, value, threshold, RESOURCE_HYSTERESIS, message
+    )
+    if message is None:
+        return True
+    
     return send_system_notification(
         title=title,
         message=message,
@@ -167,6 +279,10 @@ def notify_new_client_connected(client_name, client_ip, client_mac, interface):
     - Interface: {interface}
     """
     
+    message = alert_engine.evaluate(interface, 'new_client', client_mac, message)
+    if message is None:
+        return True
+    
     return send_system_notification(
         title=title,
         message=message,
@@ -180,6 +296,10 @@ def notify_firewall_block(ip_address, reason=None):
     if reason:
         message += f"\nLý do: {reason}"
     
+    message = alert_engine.evaluate('firewall', 'block', ip_address, message)
+    if message is None:
+        return True
+    
     return send_system_notification(
         title=title,
         message=message,
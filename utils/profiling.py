@@ -0,0 +1,132 @@
+"""
+Module profiling theo request cho ứng dụng Flask
+"""
+
+import cProfile
+import logging
+import os
+import re
+import threading
+import time
+
+from flask import request, g, has_app_context
+
+# Khởi tạo logger
+logger = logging.getLogger(__name__)
+
+# Số request tối đa cho một lần bật profiling và số file .prof được giữ lại (file cũ nhất bị xóa trước)
+MAX_ARMED_REQUESTS = 1000
+MAX_PROFILE_FILES = 200
+
+
+def count_router_call():
+    """Tăng bộ đếm kết nối router của request hiện tại"""
+    if has_app_context():
+        g.router_calls = g.get('router_calls', 0) + 1
+
+
+class RequestProfiler:
+    """Chạy cProfile cho N request kế tiếp, mỗi lần một request"""
+
+    def __init__(self, output_dir='profiles', max_files=MAX_PROFILE_FILES):
+        self.output_dir = output_dir
+        self.max_files = max_files
+        self.remaining = 0
+        self._busy = False
+        self._lock = threading.Lock()
+
+    def arm(self, requests):
+        """Bật profiling cho N request kế tiếp (0 để tắt, tối đa MAX_ARMED_REQUESTS)"""
+        with self._lock:
+            self.remaining = min(max(0, int(requests)), MAX_ARMED_REQUESTS)
+        logger.info(f"Profiling được bật cho {self.remaining} request kế tiếp, lưu tại {self.output_dir}")
+        return self.remaining
+
+    def start(self):
+        """Bắt đầu profile request hiện tại, trả về None nếu không được chọn"""
+        with self._lock:
+            if self.remaining <= 0 or self._busy:
+                return None
+            self.remaining -= 1
+            self._busy = True
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:
+            # Một profiler khác đang chạy
+            logger.warning(f"Không thể bật cProfile: {str(e)}")
+            with self._lock:
+                self._busy = False
+            return None
+        return profile
+
+    def finish(self, profile, method, route, elapsed, router_calls=0):
+        """Dừng profile và ghi file .prof"""
+        profile.disable()
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            slug = re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_') or 'root'
+            now = time.time()
+            stamp = time.strftime('%Y%m%d_%H%M%S', time.localtime(now))
+            path = os.path.join(self.output_dir, f"{stamp}_{int(now * 1000) % 1000:03d}_{method}_{slug}.prof")
+            profile.dump_stats(path)
+            logger.info(f"Đã lưu profile {method} {route} ({elapsed * 1000:.1f} ms, {router_calls} lần kết nối router) vào {path}")
+            self._prune_files()
+            return path
+        except Exception as e:
+            logger.error(f"Lỗi khi lưu profile: {str(e)}")
+            return None
+        finally:
+            with self._lock:
+                self._busy = False
+
+    def _prune_files(self):
+        """Xóa các file profile cũ nhất khi số file vượt max_files (tên file bắt đầu bằng thời điểm ghi)"""
+        files = sorted(name for name in os.listdir(self.output_dir) if name.endswith('.prof'))
+        for name in files[:max(0, len(files) - self.max_files)]:
+            try:
+                os.remove(os.path.join(self.output_dir, name))
+            except OSError as e:
+                logger.warning(f"Không thể xóa profile cũ {name}: {str(e)}")
+
+    def status(self):
+        """Trạng thái profiler và danh sách file profile mới nhất"""
+        profiles = []
+        if os.path.isdir(self.output_dir):
+            profiles = sorted((name for name in os.listdir(self.output_dir) if name.endswith('.prof')), reverse=True)[:50]
+        return {
+            'remaining': self.remaining,
+            'busy': self._busy,
+            'output_dir': self.output_dir,
+            'profiles': profiles
+        }
+
+
+profiler = RequestProfiler()
+
+
+def _start_profile():
+    """Bật cProfile nếu profiling đang được yêu cầu"""
+    # Khi không bật profiling chỉ tốn một lần so sánh
+    if profiler.remaining > 0:
+        profile = profiler.start()
+        if profile is not None:
+            g.profile = profile
+            g.profile_start_time = time.perf_counter()
+
+
+def _finish_profile(exc):
+    """Dừng cProfile và lưu kết quả khi request kết thúc"""
+    profile = g.pop('profile', None)
+    if profile is not None:
+        elapsed = time.perf_counter() - g.pop('profile_start_time', time.perf_counter())
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        profiler.finish(profile, request.method, route, elapsed, g.get('router_calls', 0))
+
+
+def init_app(app, output_dir=None):
+    """Đăng ký profiling theo request cho ứng dụng Flask"""
+    if output_dir:
+        profiler.output_dir = output_dir
+    app.before_request(_start_profile)
+    app.teardown_request(_finish_profile)